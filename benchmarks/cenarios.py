@@ -0,0 +1,104 @@
+"""Cenários dos benchmarks: ambientes, coortes, payloads do SUAP e respostas do Moodle de tamanho configurável."""
+
+import json
+
+from cohort.models import Cohort, Enrolment, MoodleUser, Role
+from integrador.cassette import Cassette
+from integrador.models import Ambiente
+from integrador.moodle_mock import LocalSuapHTTPMock
+
+# Regras de coorte, da mais barata à mais cara (a última percorre todos os alunos do diário).
+REGRAS = {
+    "simples": "curso['codigo'] == '15806'",
+    "composta": (
+        "campus['sigla'] == 'ZL' and curso['codigo'] in ['15806', '15807', '15808']"
+        " and componente['sigla'] =~ '^COMP.*' and diario['situacao'] != 'Fechado'"
+    ),
+    "alunos": "[aluno for aluno in alunos if aluno['situacao'] == 'ativo' and aluno['polo']['id'] == 1].length > 0",
+}
+
+
+def criar_ambientes(quantidade: int) -> list[Ambiente]:
+    """Cria `quantidade` ambientes; só o último é selecionado pelo payload, o pior caso da seleção."""
+    return [
+        Ambiente.objects.create(
+            nome=f"Ambiente {i}",
+            url=f"https://moodle{i}.benchmark",
+            ordem=i,
+            expressao_seletora=f"campus['sigla'] == '{'ZL' if i == quantidade else f'C{i}'}'",
+            local_suap_token=LocalSuapHTTPMock.TEST_TOKEN,
+            local_suap_active=True,
+            tool_sga_active=False,
+        )
+        for i in range(1, quantidade + 1)
+    ]
+
+
+def criar_coortes(quantidade: int, vinculos: int, regra: str) -> None:
+    """Cria `quantidade` coortes, todas elegíveis pela `regra`, cada uma com `vinculos` colaboradores."""
+    if not quantidade:
+        return
+    role = Role.objects.create(name="Coordenador", shortname="teachercoordenadorcurso", active=True)
+    usuarios = MoodleUser.objects.bulk_create(
+        MoodleUser(fullname=f"Colaborador {i}", email=f"colaborador{i}@benchmark", login=f"colab{i}", active=True)
+        for i in range(vinculos)
+    )
+    for i in range(quantidade):
+        cohort = Cohort.objects.create(
+            name=f"ZL.Coorte.{i}", idnumber=f"coorte{i}", role=role, rule_diario=REGRAS[regra], active=True
+        )
+        Enrolment.objects.bulk_create(Enrolment(cohort=cohort, user=usuario) for usuario in usuarios)
+
+
+def payload(alunos: int) -> dict:
+    return {
+        "campus": {"id": 1, "sigla": "ZL", "descricao": "CAMPUS AVANÇADO NATAL-ZONA LESTE"},
+        "curso": {"id": 10, "codigo": "15806", "nome": "Tecnologia em Gestão Ambiental"},
+        "turma": {"id": 2, "codigo": "20261.1.15806.1E"},
+        "componente": {"id": 5, "sigla": "COMP.0001", "descricao": "Componente"},
+        "diario": {"id": 456, "sigla": "COMP.0001", "situacao": "Aberto"},
+        "polo": {"id": 1, "nome": "Polo Natal"},
+        "professores": [
+            {"id": i, "nome": f"Professor {i}", "email": f"prof{i}@benchmark", "login": f"{100000 + i}"}
+            for i in range(3)
+        ],
+        "alunos": [
+            {
+                "id": i,
+                "nome": f"Aluno {i}",
+                "email": f"aluno{i}@benchmark",
+                "email_secundario": f"aluno{i}@pessoal.benchmark",
+                "matricula": f"2026{i:07d}",
+                "situacao": "ativo",
+                "polo": {"id": 1 + i % 3, "nome": "Polo"},
+                "programa": None,
+            }
+            for i in range(alunos)
+        ],
+    }
+
+
+def gravar_cassete_notas(caminho: str, alunos: int, diario_id: int = 456, etapas: int = 4) -> None:
+    """Cassete com a resposta do `sync_down_grades` para um diário de `alunos` alunos, `etapas` notas cada."""
+    resposta = {
+        "notas": [
+            {
+                "matricula": f"2026{i:07d}",
+                "etapa": etapa,
+                "nota": round((i * 7 + etapa * 3) % 101 / 10, 1),
+                "diario_id": diario_id,
+            }
+            for i in range(alunos)
+            for etapa in range(1, etapas + 1)
+        ],
+        "url": f"https://moodle.benchmark/course/view.php?id={diario_id}",
+        "url_sala_coordenacao": "https://moodle.benchmark/course/view.php?id=2",
+    }
+    cassette = Cassette(str(caminho), mode="record")
+    cassette.add(
+        "GET",
+        f"https://moodle.benchmark/local/suap/api/index.php?sync_down_grades&diario_id={diario_id}",
+        content=json.dumps(resposta).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    cassette.close()
@@ -0,0 +1,193 @@
+"""
+Fixtures da suíte de benchmarks do `sync_up_enrolments`.
+
+O Moodle é o `LocalSuapHTTPMock`, ligado no lugar do `urlopen` de `integrador.utils`: o JSON enviado ao Moodle é
+serializado e a resposta é lida como numa chamada real, só não há rede. Com `--cassette`, as respostas vêm de um
+cassete gravado de um Moodle real (`integrador.cassette`), também sem rede.
+"""
+
+import io
+import json
+import statistics
+import tracemalloc
+import urllib.error
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from integrador.cassette import Cassette
+from integrador.models import Solicitacao
+from integrador.moodle_mock import LocalSuapHTTPMock
+
+SUAP_INTEGRADOR_KEY = "benchmark"
+
+
+class _MockResponse(io.BytesIO):
+    def __init__(self, response):
+        super().__init__(response.content)
+        self.status = response.status_code
+
+    def __enter__(self):
+        return self
+
+
+def _urlopen(mock: LocalSuapHTTPMock):
+    def urlopen(req, timeout=None):
+        jsonbody = json.loads(req.data) if req.data else None
+        response = mock.request(req.get_method(), req.full_url, jsonbody=jsonbody, headers=dict(req.header_items()))
+        if not response.ok:
+            raise urllib.error.HTTPError(
+                req.full_url, response.status_code, response.reason, response.headers, io.BytesIO(response.content)
+            )
+        return _MockResponse(response)
+
+    return urlopen
+
+
+@pytest.fixture(autouse=True)
+def moodle(request):
+    caminho = request.config.getoption("cassette")
+    if caminho:
+        with Cassette(caminho, timing=request.config.getoption("cassette_timing")) as cassette:
+            yield cassette
+    else:
+        with patch("integrador.utils.urllib.request.urlopen", side_effect=_urlopen(LocalSuapHTTPMock())):
+            yield None
+
+
+@pytest.fixture(autouse=True)
+def integrador_key(settings):
+    settings.SUAP_INTEGRADOR_KEY = SUAP_INTEGRADOR_KEY
+
+
+class Chamada:
+    """Uma chamada à API do integrador, com as medições feitas fora do tempo do benchmark."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def enviar(self):
+        raise NotImplementedError
+
+    def __call__(self):
+        response = self.enviar()
+        assert response.status_code == 200, response.content  # noqa: S101
+        return response
+
+    def medir(self) -> dict:
+        """Uma execução com contagem de consultas e pico de memória (o tracemalloc deixa o código mais lento)."""
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as consultas:
+                self()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {"consultas": len(consultas), "memoria_pico_kb": round(pico / 1024, 1)}
+
+
+class SyncUp(Chamada):
+    """Envia um payload ao `/api/enviar_diarios/`."""
+
+    def __init__(self, client, dados: dict):
+        super().__init__(client)
+        self.body = json.dumps(dados)
+
+    def enviar(self):
+        return self.client.post(
+            "/api/enviar_diarios/",
+            data=self.body,
+            content_type="application/json",
+            HTTP_AUTHENTICATION=f"Token {SUAP_INTEGRADOR_KEY}",
+        )
+
+
+class SyncDown(Chamada):
+    """Baixa as notas de um diário pelo `/api/baixar_notas/`."""
+
+    def __init__(self, client, campus_sigla: str, diario_id: int):
+        super().__init__(client)
+        self.params = {"campus_sigla": campus_sigla, "diario_id": diario_id}
+
+    def enviar(self):
+        return self.client.get("/api/baixar_notas/", self.params, HTTP_AUTHENTICATION=f"Token {SUAP_INTEGRADOR_KEY}")
+
+
+def tempos_por_etapa(solicitacoes) -> dict[str, float]:
+    """Mediana, em ms, de cada etapa gravada nas solicitações."""
+    por_etapa = {}
+    for tempos in solicitacoes.exclude(tempos=None).values_list("tempos", flat=True):
+        for etapa, duracao in tempos.items():
+            por_etapa.setdefault(etapa, []).append(duracao)
+    return {etapa: round(statistics.median(duracoes), 2) for etapa, duracoes in por_etapa.items()}
+
+
+def _ultimo_baseline(config) -> dict:
+    storage = config.getoption("benchmark_storage").removeprefix("file://")
+    salvos = sorted(Path(storage).glob("*/*.json"), key=lambda arquivo: arquivo.name)
+    if not salvos:
+        return {}
+    dados = json.loads(salvos[-1].read_text(encoding="utf-8"))
+    return {item["fullname"]: item.get("extra_info", {}) for item in dados.get("benchmarks", [])}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark-compare-queries",
+        action="store_true",
+        help="Falha se um benchmark fizer mais consultas ao banco que no último resultado salvo.",
+    )
+    parser.addoption(
+        "--cassette",
+        default=None,
+        help="Reproduz as respostas do Moodle deste cassete (integrador.cassette) em vez do LocalSuapHTTPMock.",
+    )
+    parser.addoption(
+        "--cassette-timing",
+        choices=["fast", "original"],
+        default="fast",
+        help="Com 'original', cada resposta do cassete demora o que demorou na gravação.",
+    )
+
+
+@pytest.fixture(scope="session")
+def baseline(request) -> dict:
+    return _ultimo_baseline(request.config) if request.config.getoption("benchmark_compare_queries") else {}
+
+
+@pytest.fixture
+def benchmark_chamada(benchmark, baseline, request):
+    """Executa o benchmark da chamada e guarda as medições em `extra_info`."""
+
+    def executar(chamada: Chamada, rounds: int = 5):
+        medicoes = chamada.medir()
+        ultima = Solicitacao.objects.order_by("-id").values_list("id", flat=True).first()
+
+        benchmark.pedantic(chamada, rounds=rounds, warmup_rounds=1, iterations=1)
+
+        benchmark.extra_info.update(medicoes)
+        benchmark.extra_info["etapas_ms"] = tempos_por_etapa(Solicitacao.objects.filter(id__gt=ultima))
+
+        anterior = baseline.get(request.node.nodeid, {}).get("consultas")
+        if anterior is not None and medicoes["consultas"] > anterior:
+            pytest.fail(f"{medicoes['consultas']} consultas ao banco; o baseline tinha {anterior}.")
+        return medicoes
+
+    return executar
+
+
+@pytest.fixture
+def sync_up(benchmark_chamada, client):
+    """Benchmark do `sync_up_enrolments` para o payload."""
+    return lambda dados, rounds=5: benchmark_chamada(SyncUp(client, dados), rounds)
+
+
+@pytest.fixture
+def sync_down(benchmark_chamada, client):
+    """Benchmark do `sync_down_grades` para o diário."""
+    return lambda diario_id, campus_sigla="ZL", rounds=5: benchmark_chamada(
+        SyncDown(client, campus_sigla, diario_id), rounds
+    )
@@ -0,0 +1,38 @@
+"""
+Benchmarks do `sync_down_grades`, de ponta a ponta, com respostas do Moodle de vários tamanhos.
+
+A resposta do Moodle vem de um cassete (`integrador.cassette`): montado aqui com as notas de N alunos ou, com
+`--cassette`, gravado de um Moodle real. Veja docs/tests/benchmarks.md.
+"""
+
+from contextlib import ExitStack
+
+import pytest
+from cenarios import criar_ambientes, gravar_cassete_notas
+
+from integrador.cassette import Cassette
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def notas(moodle, tmp_path):
+    """Sem `--cassette`, reproduz um cassete com as notas de `alunos` alunos."""
+    with ExitStack() as pilha:
+
+        def preparar(alunos: int):
+            if moodle is None:
+                caminho = tmp_path / f"notas-{alunos}.ndjson.gz"
+                gravar_cassete_notas(caminho, alunos)
+                pilha.enter_context(Cassette(str(caminho)))
+
+        yield preparar
+
+
+@pytest.mark.parametrize("alunos", [10, 100, 1_000, 10_000])
+def test_notas(sync_down, notas, alunos):
+    criar_ambientes(1)
+    notas(alunos)
+    sync_down(456, rounds=3 if alunos >= 10_000 else 5)
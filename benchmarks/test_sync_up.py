@@ -0,0 +1,43 @@
+"""
+Benchmarks do `sync_up_enrolments`, de ponta a ponta (view, decorators, broker e Moodle simulado).
+
+Cada teste varia uma dimensão a partir do cenário base (100 alunos, 1 ambiente, 10 coortes com 10 vínculos e a regra
+simples). Além dos tempos do pytest-benchmark, o `extra_info` de cada resultado traz as consultas ao banco, o pico de
+memória e a mediana de cada etapa de `Solicitacao.tempos`. Veja docs/tests/benchmarks.md.
+"""
+
+import pytest
+from cenarios import criar_ambientes, criar_coortes, payload
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.mark.parametrize("alunos", [10, 100, 1_000, 10_000])
+def test_alunos(sync_up, alunos):
+    criar_ambientes(1)
+    criar_coortes(10, 10, "simples")
+    sync_up(payload(alunos), rounds=3 if alunos >= 10_000 else 5)
+
+
+@pytest.mark.parametrize("ambientes", [1, 10, 50])
+def test_ambientes(sync_up, ambientes):
+    criar_ambientes(ambientes)
+    criar_coortes(10, 10, "simples")
+    sync_up(payload(100))
+
+
+@pytest.mark.parametrize(("coortes", "vinculos"), [(0, 0), (10, 10), (100, 10), (10, 1_000)])
+def test_coortes(sync_up, coortes, vinculos):
+    criar_ambientes(1)
+    criar_coortes(coortes, vinculos, "simples")
+    sync_up(payload(100))
+
+
+@pytest.mark.parametrize("alunos", [100, 1_000])
+@pytest.mark.parametrize("regra", ["simples", "composta", "alunos"])
+def test_regras(sync_up, regra, alunos):
+    criar_ambientes(1)
+    criar_coortes(10, 10, regra)
+    sync_up(payload(alunos))
@@ -0,0 +1,47 @@
+"""
+Benchmarks da tradução do payload do SUAP para o formato genérico do SGA (`suap2tool_sga.translator`).
+
+A tradução roda em cada `sync_up_enrolments` de um Ambiente com `tool_sga`, antes da chamada ao Moodle, então o custo
+dela é só CPU e memória do integrador. O `test_deepcopy` é a referência: uma cópia profunda do mesmo payload, o mínimo
+que uma tradução que copia o `recebido` antes de transformá-lo gastaria.
+"""
+
+import copy
+import tracemalloc
+
+import pytest
+from cenarios import payload
+
+from integrador.brokers.suap2tool_sga.translator import translate
+
+pytest.importorskip("pytest_benchmark")
+
+ALUNOS = [100, 1_000, 10_000, 100_000]
+
+
+def _medir(benchmark, funcao, dados: dict) -> None:
+    tracemalloc.start()
+    try:
+        funcao(dados)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    benchmark.pedantic(funcao, args=(dados,), rounds=3 if len(dados["alunos"]) >= 100_000 else 10, warmup_rounds=1)
+
+    benchmark.extra_info["memoria_pico_kb"] = round(pico / 1024, 1)
+    if benchmark.stats is not None:  # sem estatísticas com --benchmark-disable
+        inscricoes = len(dados["alunos"]) + len(dados["professores"])
+        benchmark.extra_info["inscricoes_por_s"] = round(inscricoes / benchmark.stats.stats.median)
+
+
+@pytest.mark.parametrize("alunos", ALUNOS)
+def test_traducao(benchmark, alunos):
+    dados = payload(alunos)
+    assert len(translate(dados)["inscricoes"]) == alunos + len(dados["professores"])  # noqa: S101
+    _medir(benchmark, translate, dados)
+
+
+@pytest.mark.parametrize("alunos", ALUNOS)
+def test_deepcopy(benchmark, alunos):
+    _medir(benchmark, copy.deepcopy, payload(alunos))
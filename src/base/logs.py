@@ -0,0 +1,137 @@
+"""
+Pipeline de logs do projeto (configurado em `settings/loggings.py`).
+
+A thread da requisição só decide se o registro fica (nível do logger e amostragem por logger) e o coloca numa fila
+limitada; a formatação da mensagem e dos extras, o truncamento e a escrita no stdout acontecem na thread do
+`QueueListener`. Com a fila cheia o registro é descartado, e não espera: o total de descartados é informado assim que
+houver espaço.
+
+Como a mensagem é formatada depois, objetos mutáveis passados como argumento (`logger.debug("%s", payload)`) são
+lidos no momento da escrita.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from datetime import UTC, datetime
+from logging.handlers import QueueHandler, QueueListener
+
+# Atributos padrão do LogRecord; os demais vieram em `extra=` e vão para o JSON.
+_ATRIBUTOS_PADRAO = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+def truncate(texto: str, limite: int) -> str:
+    if limite and len(texto) > limite:
+        return f"{texto[:limite]}... [{len(texto) - limite} caracteres omitidos]"
+    return texto
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, fmt="%(message)s", max_chars: int = 4096, **kwargs):
+        super().__init__(fmt, **kwargs)
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        return truncate(super().format(record), self.max_chars)
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha, com a mensagem e os extras truncados em `max_chars`."""
+
+    def __init__(self, max_chars: int = 4096, **kwargs):
+        super().__init__(**kwargs)
+        self.max_chars = max_chars
+
+    def _valor(self, valor):
+        if valor is None or isinstance(valor, (bool, int, float)):
+            return valor
+        texto = valor if isinstance(valor, str) else json.dumps(valor, default=str, ensure_ascii=False)
+        return truncate(texto, self.max_chars)
+
+    def format(self, record: logging.LogRecord) -> str:
+        dados = {
+            "timestamp": datetime.fromtimestamp(record.created, UTC).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage(), self.max_chars),
+        }
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_PADRAO and not chave.startswith("_"):
+                dados[chave] = self._valor(valor)
+        if record.exc_info:
+            dados["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            dados["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(dados, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Mantém só uma fração dos registros abaixo de WARNING de cada logger. `taxas` mapeia o nome do logger (vale também
+    para os filhos) à fração mantida; vale a entrada mais específica. WARNING ou acima sempre passa.
+    """
+
+    def __init__(self, taxas: dict[str, float] | None = None):
+        super().__init__()
+        self.taxas = taxas or {}
+        self._por_logger = {}
+
+    def taxa(self, nome: str) -> float:
+        if nome not in self._por_logger:
+            prefixos = [p for p in self.taxas if nome == p or nome.startswith(f"{p}.")]
+            self._por_logger[nome] = self.taxas[max(prefixos, key=len)] if prefixos else 1.0
+        return self._por_logger[nome]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.taxas:
+            return True
+        taxa = self.taxa(record.name)
+        return taxa >= 1 or random.random() < taxa  # noqa: S311
+
+
+class AsyncQueueHandler(QueueHandler):
+    """QueueHandler que não formata na thread de quem loga e não bloqueia com a fila cheia."""
+
+    descartados = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # A fila é do próprio processo: o registro não precisa ser formatado nem serializado aqui.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.descartados:
+                aviso = logging.makeLogRecord(
+                    {
+                        "name": __name__,
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": "%d registros de log descartados: fila cheia.",
+                        "args": (self.descartados,),
+                    }
+                )
+                self.queue.put_nowait(aviso)
+                self.descartados = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def start(handler: AsyncQueueHandler) -> None:
+    """Inicia o listener do handler, inclusive nos processos filhos (workers do gunicorn), e o encerra na saída."""
+    handler.listener.start()
+    atexit.register(lambda: handler.listener.stop())
+    os.register_at_fork(after_in_child=lambda: _restart(handler))
+
+
+def _restart(handler: AsyncQueueHandler) -> None:
+    # A thread do listener não sobrevive ao fork, e a fila copiada pode estar com o lock preso.
+    handler.queue = queue.Queue(maxsize=handler.queue.maxsize)
+    handler.descartados = 0
+    handler.listener = QueueListener(
+        handler.queue, *handler.listener.handlers, respect_handler_level=handler.listener.respect_handler_level
+    )
+    handler.listener.start()
@@ -6,8 +6,14 @@ Este módulo contém testes para:
 - BasicModelAdmin: ModelAdmin customizado com view mode
 - BaseModelAdmin: ModelAdmin com suporte a import/export
 - BaseChangeList: ChangeList customizado com URL de visualização
+- Logs: formatação JSON/texto com truncamento, amostragem por logger e fila que não bloqueia
 """
 
+import io
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
 from unittest.mock import MagicMock, Mock, patch
 
 from django.contrib.admin.sites import AdminSite
@@ -17,6 +23,7 @@ from django.db import models
 from django.forms.widgets import Media
 from django.test import RequestFactory, TestCase
 
+from base import logs
 from base.admin import BaseChangeList, BaseModelAdmin, BasicModelAdmin
 from base.models import ActiveMixin
 
@@ -450,3 +457,106 @@ class EdgeCasesTestCase(TestCase):
 
         obj.active = None
         self.assertEqual(obj.active_icon, "⛔")
+
+
+class LogsTestCase(TestCase):
+    """Testes do pipeline de logs (base.logs)."""
+
+    def record(self, msg="mensagem %s", args=("x",), name="integrador.brokers", level=logging.DEBUG, **extra):
+        record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter(self):
+        """Testa o JSON de uma linha com mensagem, extras e exceção, truncados no limite."""
+        formatter = logs.JsonFormatter(max_chars=20)
+        try:
+            raise ValueError("falhou")
+        except ValueError:
+            import sys
+
+            record = self.record("%s", ("a" * 50,), level=logging.ERROR, diario_id=456, recebido={"x": "y" * 50})
+            record.exc_info = sys.exc_info()
+
+        linha = formatter.format(record)
+
+        self.assertNotIn("\n", linha)
+        dados = json.loads(linha)
+        self.assertEqual((dados["level"], dados["logger"]), ("ERROR", "integrador.brokers"))
+        self.assertEqual(dados["message"], "a" * 20 + "... [30 caracteres omitidos]")
+        self.assertEqual(dados["diario_id"], 456)
+        self.assertTrue(dados["recebido"].startswith('{"x": "yyy'))
+        self.assertIn("ValueError: falhou", dados["exception"])
+
+    def test_text_formatter_trunca(self):
+        """Testa o truncamento no formato texto."""
+        self.assertEqual(
+            logs.TextFormatter(max_chars=5).format(self.record("%s", ("abcdefgh",))), "abcde... [3 caracteres omitidos]"
+        )
+
+    def test_sampling_filter(self):
+        """Testa a amostragem pelo logger mais específico, sem afetar WARNING ou acima."""
+        filtro = logs.SamplingFilter({"integrador": 1.0, "integrador.brokers": 0.0})
+
+        self.assertFalse(filtro.filter(self.record(name="integrador.brokers.suap2local_suap")))
+        self.assertTrue(filtro.filter(self.record(name="integrador.brokers.suap2local_suap", level=logging.WARNING)))
+        self.assertTrue(filtro.filter(self.record(name="integrador.utils")))
+        self.assertTrue(filtro.filter(self.record(name="integrador_outro")))
+        self.assertTrue(logs.SamplingFilter().filter(self.record()))
+
+        with patch("base.logs.random.random", return_value=0.3):
+            self.assertTrue(logs.SamplingFilter({"dashboard": 0.5}).filter(self.record(name="dashboard.storage")))
+            self.assertFalse(logs.SamplingFilter({"dashboard": 0.2}).filter(self.record(name="dashboard.storage")))
+
+    def test_queue_handler_nao_formata_na_thread_de_quem_loga(self):
+        """Testa que o registro vai para a fila sem formatar a mensagem."""
+        fila = queue.Queue()
+        handler = logs.AsyncQueueHandler(fila)
+        argumento = Mock(__str__=Mock(return_value="formatado"))
+
+        handler.handle(self.record("%s", (argumento,)))
+
+        argumento.__str__.assert_not_called()
+        self.assertEqual(fila.get_nowait().getMessage(), "formatado")
+
+    def test_queue_handler_descarta_com_a_fila_cheia(self):
+        """Testa que, com a fila cheia, o registro é descartado e o total é avisado depois."""
+        fila = queue.Queue(maxsize=2)
+        handler = logs.AsyncQueueHandler(fila)
+
+        for mensagem in ["primeiro", "segundo", "terceiro", "quarto"]:
+            handler.handle(self.record(mensagem, ()))
+        self.assertEqual(handler.descartados, 2)
+
+        fila.get_nowait()
+        fila.get_nowait()
+        handler.handle(self.record("quinto", ()))
+        self.assertEqual(fila.get_nowait().getMessage(), "2 registros de log descartados: fila cheia.")
+        self.assertEqual(fila.get_nowait().getMessage(), "quinto")
+        self.assertEqual(handler.descartados, 0)
+
+    def test_listener_escreve_e_reinicia_apos_fork(self):
+        """Testa a escrita pela thread do listener e o reinício dele no processo filho."""
+        saida = io.StringIO()
+        console = logging.StreamHandler(saida)
+        console.setFormatter(logs.TextFormatter())
+        handler = logs.AsyncQueueHandler(queue.Queue(maxsize=10))
+        handler.listener = QueueListener(handler.queue, console, respect_handler_level=True)
+        handler.listener.start()
+        antigo = handler.listener
+
+        logs._restart(handler)
+        antigo.stop()
+        handler.handle(self.record("depois do fork", ()))
+        handler.listener.stop()
+
+        self.assertIsNot(handler.listener, antigo)
+        self.assertEqual(handler.queue.maxsize, 10)
+        self.assertEqual(saida.getvalue(), "depois do fork\n")
+
+    def test_settings_usam_a_fila(self):
+        """Testa que o logger raiz escreve pela fila configurada em settings/loggings.py."""
+        handlers = [h for h in logging.getLogger().handlers if isinstance(h, logs.AsyncQueueHandler)]
+        self.assertEqual(len(handlers), 1)
+        self.assertEqual(handlers[0].queue.maxsize, 10000)
+        self.assertTrue(handlers[0].listener._thread.is_alive())
@@ -1,62 +1,59 @@
 """
-Management command para gerar solicitações de teste para o dashboard.
-Cria dados históricos para os últimos 12 meses.
+Management command para gerar dados de teste para o dashboard.
+
+Cria Ambientes, coortes com vínculos e Solicitações com payloads no formato real, distribuídas pelos últimos meses com
+a sazonalidade da produção. Veja `dashboard/sintetico.py`.
 """
 
-import random
 from datetime import timedelta
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
 from django.utils.timezone import now
 
-from integrador.models import Solicitacao
+from dashboard.sintetico import GeradorSintetico
 
 
 class Command(BaseCommand):
-    help = "Gera solicitações de teste para o dashboard"
+    help = "Gera Ambientes, coortes e solicitações sintéticas em escala de produção para o dashboard"
 
     def add_arguments(self, parser):
         parser.add_argument("--months", type=int, default=12, help="Número de meses de dados a gerar (padrão: 12)")
-        parser.add_argument("--per-day", type=int, default=10, help="Número de solicitações por dia (padrão: 10)")
+        parser.add_argument(
+            "--per-day", type=int, default=10, help="Média de solicitações por dia, se --total não for informado"
+        )
+        parser.add_argument("--total", type=int, help="Total de solicitações a gerar no período")
+        parser.add_argument("--ambientes", type=int, default=3, help="Ambientes, cada um com um grupo de campi")
+        parser.add_argument("--cohorts", type=int, default=50, help="Coortes com regra de diário (padrão: 50)")
+        parser.add_argument("--enrolments", type=int, default=20, help="Colaboradores por coorte (padrão: 20)")
+        parser.add_argument("--diarios", type=int, default=1000, help="Diários distintos (padrão: 1000)")
+        parser.add_argument("--alunos", type=int, default=35, help="Mediana de alunos por diário (padrão: 35)")
+        parser.add_argument("--seed", type=int, default=0, help="Semente, para gerar sempre os mesmos dados")
+        parser.add_argument("--batch-size", type=int, default=10000, help="Solicitações por COPY (padrão: 10000)")
 
     def handle(self, *args, **options):
-        months = options["months"]
-        per_day = options["per_day"]
-
-        # Status choices
-        statuses = [
-            Solicitacao.Status.SUCESSO,
-            Solicitacao.Status.FALHA,
-            Solicitacao.Status.PROCESSANDO,
-        ]
-
-        # Gerar dados
-        solicitacoes = []
-        current_date = now()
-        start_date = current_date - timedelta(days=30 * months)
-
-        date = start_date
-        count = 0
-
-        while date <= current_date:
-            for _ in range(per_day):
-                # Pesar os status: mais sucesso, menos falhas
-                status = random.choices(statuses, weights=[70, 20, 10], k=1)[0]  # noqa: S311
-
-                solicitacao = Solicitacao(
-                    timestamp=date
-                    + timedelta(
-                        hours=random.randint(0, 23),  # noqa: S311
-                        minutes=random.randint(0, 59),  # noqa: S311
-                    ),
-                    status=status,
-                    # Adicionar outros campos obrigatórios se necessário
-                )
-                solicitacoes.append(solicitacao)
-                count += 1
-
-            date += timedelta(days=1)
-
-        # Criar em batch
-        Solicitacao.objects.bulk_create(solicitacoes, batch_size=1000)
-        self.stdout.write(self.style.SUCCESS(f"✓ {count} solicitações de teste criadas"))
+        if connection.vendor != "postgresql":
+            raise CommandError("O gerador usa COPY e só funciona no PostgreSQL.")
+
+        fim = now()
+        inicio = fim - timedelta(days=30 * options["months"])
+        total = options["total"] if options["total"] is not None else options["per_day"] * (fim - inicio).days
+
+        gerador = GeradorSintetico(
+            semente=options["seed"],
+            ambientes=options["ambientes"],
+            coortes=options["cohorts"],
+            vinculos=options["enrolments"],
+            diarios=options["diarios"],
+            alunos=options["alunos"],
+            lote=options["batch_size"],
+            report=lambda mensagem: self.stdout.write(mensagem) if options["verbosity"] > 1 else None,
+        )
+        resultado = gerador.executa(inicio, fim, total)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✓ {resultado['solicitacoes']} solicitações de teste criadas "
+                f"({resultado['ambientes']} ambientes, {resultado['coortes']} coortes, "
+                f"{resultado['estados']} estados de diário, {resultado['rollups']} agregados horários)"
+            )
+        )
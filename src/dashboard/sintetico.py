@@ -0,0 +1,582 @@
+"""
+Gerador de dados sintéticos em escala de produção (`manage.py generate_test_solicitacoes`).
+
+Cria Ambientes com expressões seletoras por campus, coortes com vínculos e regras de diário, e Solicitações com
+`recebido`, `enviado`, `respondido` e `tempos` no formato real: o `recebido` segue o `SUDiario.schema.json` a partir
+do `JSON_DE_EXEMPLO` das coortes, e o `enviado` é o que o `Suap2LocalSuapBroker` montaria (coortes elegíveis,
+restrições e `solicitacao_url`). A distribuição também imita a produção: poucos campi concentram a maior parte dos
+diários, alguns diários são reenviados muitas vezes, o volume cai à noite, nos fins de semana e nas férias e sobe no
+início dos semestres.
+
+As tabelas volumosas (usuários, coortes, vínculos e Solicitações) são carregadas com `COPY ... FROM STDIN`, com os ids
+reservados antes na sequência da tabela. Os agregados horários e os estados dos diários são recalculados no final.
+"""
+
+import copy
+import json
+import math
+import random
+from bisect import bisect
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from django.db import connection, transaction
+from django.utils.timezone import localtime
+
+from cohort.examples import JSON_DE_EXEMPLO
+from cohort.models import Cohort, Enrolment, MoodleUser, Role
+from integrador.models import Ambiente, DiarioSyncState, Solicitacao, SolicitacaoRollup
+
+# (sigla, descrição, peso): o campus de EaD concentra boa parte dos diários.
+CAMPI = [
+    ("ZL", "CAMPUS AVANÇADO NATAL-ZONA LESTE", 35),
+    ("CNAT", "CAMPUS NATAL-CENTRAL", 12),
+    ("MO", "CAMPUS MOSSORÓ", 6),
+    ("SGA", "CAMPUS SÃO GONÇALO DO AMARANTE", 5),
+    ("PAR", "CAMPUS PARNAMIRIM", 5),
+    ("CA", "CAMPUS CAICÓ", 4),
+    ("IP", "CAMPUS IPANGUAÇU", 4),
+    ("JC", "CAMPUS JOÃO CÂMARA", 4),
+    ("PF", "CAMPUS PAU DOS FERROS", 4),
+    ("AP", "CAMPUS APODI", 3),
+    ("CN", "CAMPUS CURRAIS NOVOS", 3),
+    ("NC", "CAMPUS NOVA CRUZ", 3),
+    ("SPP", "CAMPUS SÃO PAULO DO POTENGI", 2),
+    ("LAJ", "CAMPUS LAJES", 2),
+    ("CM", "CAMPUS CEARÁ-MIRIM", 2),
+    ("CANG", "CAMPUS CANGUARETAMA", 2),
+    ("SC", "CAMPUS SANTA CRUZ", 2),
+    ("PAAS", "CAMPUS PARELHAS", 1),
+    ("MC", "CAMPUS MACAU", 1),
+    ("JUC", "CAMPUS JUCURUTU", 1),
+]
+
+MODALIDADES = [
+    ({"id": 1, "descricao": "Integrado", "nivel_ensino": {"id": 2, "descricao": "Médio"}}, 30),
+    ({"id": 2, "descricao": "Subsequente", "nivel_ensino": {"id": 2, "descricao": "Médio"}}, 15),
+    ({"id": 3, "descricao": "Licenciatura", "nivel_ensino": {"id": 3, "descricao": "Graduação"}}, 10),
+    ({"id": 4, "descricao": "Tecnologia", "nivel_ensino": {"id": 3, "descricao": "Graduação"}}, 15),
+    ({"id": 5, "descricao": "Especialização", "nivel_ensino": {"id": 4, "descricao": "Pós-graduação"}}, 5),
+    ({"id": 6, "descricao": "FIC", "nivel_ensino": {"id": 1, "descricao": "Fundamental"}}, 25),
+]
+
+PAPEIS_PROFESSOR = ["Principal", "Formador", "Tutor", "Mediador"]
+SITUACOES_ALUNO = [("ativo", 85), ("trancado", 5), ("cancelado", 4), ("transferido", 2), ("concluido", 4)]
+ROLES = [
+    ("CooCurso", "teachercoordenadorcurso"),
+    ("CooPolo", "coordenadordepolo"),
+    ("MedPedProg", "coordenadordeprograma"),
+]
+
+# (status, status_code, peso) por operação; sem status_code a solicitação ficou em processamento.
+DESFECHOS = {
+    Solicitacao.Operacao.SYNC_UP_DIARIO: [
+        (Solicitacao.Status.SUCESSO, "200", 880),
+        (Solicitacao.Status.FALHA, "500", 35),
+        (Solicitacao.Status.FALHA, "502", 25),
+        (Solicitacao.Status.FALHA, "422", 15),
+        (Solicitacao.Status.FALHA, "525", 10),
+        (Solicitacao.Status.FALHA, "504", 15),
+        (Solicitacao.Status.PROCESSANDO, None, 20),
+    ],
+    Solicitacao.Operacao.SYNC_DOWN_NOTAS: [
+        (Solicitacao.Status.SUCESSO, "200", 930),
+        (Solicitacao.Status.FALHA, "500", 30),
+        (Solicitacao.Status.FALHA, "502", 20),
+        (Solicitacao.Status.FALHA, "404", 10),
+        (Solicitacao.Status.PROCESSANDO, None, 10),
+    ],
+}
+ERROS = {
+    "500": "Erro interno do Moodle ao processar a solicitação.",
+    "502": "Não foi possível conectar ao Moodle.",
+    "504": "O Moodle não respondeu a tempo.",
+    "422": "Campos obrigatórios ausentes no payload de sync_up_enrolments: turma.codigo.",
+    "525": "Erro ao tentar obter as COORTES antes mesmo de iniciar a integração com o Moodle.",
+    "404": "Diário não encontrado no Moodle.",
+}
+# Falhas antes do envio ao Moodle, sem `enviado`.
+FALHAS_ANTES_DO_ENVIO = {"422", "525"}
+
+# Peso de cada hora do dia, de cada dia da semana (segunda = 0) e de cada mês.
+PESO_HORA = [1, 1, 1, 1, 1, 2, 4, 8, 12, 14, 14, 12, 8, 10, 13, 14, 13, 11, 8, 7, 6, 5, 3, 2]
+PESO_DIA_SEMANA = [1.0, 1.0, 1.0, 1.0, 0.9, 0.35, 0.25]
+PESO_MES = {1: 0.4, 2: 1.8, 3: 2.0, 4: 1.2, 5: 1.0, 6: 1.0, 7: 0.5, 8: 1.9, 9: 1.3, 10: 1.0, 11: 1.0, 12: 0.4}
+
+
+def reserva_ids(model, quantidade: int) -> int:
+    """Reserva `quantidade` ids consecutivos na sequência da tabela e retorna o primeiro."""
+    tabela = model._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [tabela])
+        (sequencia,) = cursor.fetchone()
+        # O lock barra os INSERTs e as outras reservas, que também tiram ids da sequência, entre o nextval e o setval.
+        cursor.execute(f"LOCK TABLE {connection.ops.quote_name(tabela)} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute("SELECT setval(%s, nextval(%s) + %s - 1)", [sequencia, sequencia, quantidade])
+        (ultimo,) = cursor.fetchone()
+    return ultimo - quantidade + 1
+
+
+def copia(model, campos: list[str], linhas: Iterable[tuple]) -> int:
+    """Carrega as linhas com `COPY ... FROM STDIN`. JSONs vão como texto já serializado."""
+    quote = connection.ops.quote_name
+    colunas = ", ".join(quote(model._meta.get_field(campo).column) for campo in campos)
+    total = 0
+    with connection.cursor() as cursor:
+        with cursor.cursor.copy(f"COPY {quote(model._meta.db_table)} ({colunas}) FROM STDIN") as destino:
+            for linha in linhas:
+                destino.write_row(linha)
+                total += 1
+    return total
+
+
+class Diario:
+    """Um diário do SUAP e a versão atual do seu payload, serializada uma vez por versão."""
+
+    def __init__(self, recebido: dict, coortes: list[dict]):
+        self.recebido = recebido
+        self.coortes = coortes
+        self._cache = None
+
+    @property
+    def id(self) -> int:
+        return self.recebido["diario"]["id"]
+
+    @property
+    def codigo(self) -> str:
+        return f"{self.recebido['turma']['codigo']}.{self.recebido['diario']['sigla']}#{self.id}"
+
+    def serializado(self) -> tuple[str, str, str]:
+        """(recebido, enviado sem o fechamento, hash do recebido) da versão atual."""
+        if self._cache is None:
+            enviado = {
+                **self.recebido,
+                "turma": {**self.recebido["turma"], "restricoes": "", "autoinscricao": False},
+                "coortes": self.coortes,
+            }
+            self._cache = (
+                json.dumps(self.recebido, ensure_ascii=False),
+                json.dumps(enviado, ensure_ascii=False)[:-1],
+                DiarioSyncState.payload_hash_of(self.recebido),
+            )
+        return self._cache
+
+    def altera(self, sorteio: random.Random) -> None:
+        """Nova versão do payload: um aluno muda de situação ou entra no diário."""
+        alunos = self.recebido["alunos"]
+        if alunos and sorteio.random() < 0.7:
+            aluno = sorteio.choice(alunos)
+            aluno["situacao"] = "ativo" if aluno["situacao"] != "ativo" else "trancado"
+        else:
+            novo = copy.deepcopy(alunos[-1]) if alunos else copy.deepcopy(JSON_DE_EXEMPLO["alunos"][0])
+            novo["id"] = sorteio.randrange(10**6, 10**7)
+            novo["matricula"] = f"{novo['matricula'][:-4]}{sorteio.randrange(10000):04d}"
+            alunos.append(novo)
+        self._cache = None
+
+
+class GeradorSintetico:
+    CAMPOS_SOLICITACAO = [
+        "id",
+        "ambiente",
+        "timestamp",
+        "campus_sigla",
+        "diario_codigo",
+        "diario_id",
+        "operacao",
+        "tipo",
+        "status",
+        "status_code",
+        "recebido",
+        "enviado",
+        "respondido",
+        "tempos",
+    ]
+
+    def __init__(
+        self,
+        semente: int = 0,
+        ambientes: int = 3,
+        coortes: int = 50,
+        vinculos: int = 20,
+        diarios: int = 1000,
+        alunos: int = 35,
+        lote: int = 10000,
+        report=None,
+    ):
+        self.sorteio = random.Random(semente)  # noqa: S311
+        self.n_ambientes = max(1, ambientes)
+        self.n_coortes = coortes
+        self.n_vinculos = vinculos
+        self.n_diarios = max(1, diarios)
+        self.alunos = max(1, alunos)
+        self.lote = lote
+        self.report = report or (lambda mensagem: None)
+        self.ambiente_por_campus: dict[str, Ambiente] = {}
+        self.coortes_por_chave: dict[tuple, list[dict]] = {}
+        self.cursos: dict[str, list[dict]] = {}
+        self.estados: dict[tuple, DiarioSyncState] = {}
+
+    # --- Ambientes, coortes e diários -------------------------------------------------------------------------------
+
+    def cria_ambientes(self) -> list[Ambiente]:
+        """Cada Ambiente atende um grupo de campi; os grupos se equilibram pelo peso dos campi."""
+        grupos = [[] for _ in range(self.n_ambientes)]
+        for i, (sigla, _, _) in enumerate(CAMPI):
+            grupos[i % self.n_ambientes].append(sigla)
+        grupos = [siglas for siglas in grupos if siglas]
+        primeiro = reserva_ids(Ambiente, len(grupos))
+        ambientes = Ambiente.objects.bulk_create(
+            Ambiente(
+                id=primeiro + i,
+                nome=f"Moodle sintético {primeiro + i}",
+                url=f"https://moodle{primeiro + i}.sintetico.local",
+                ordem=i,
+                expressao_seletora=f"campus['sigla'] in [{', '.join(repr(s) for s in siglas)}]",
+                local_suap_token=f"sintetico-{self.sorteio.getrandbits(64):016x}",
+                local_suap_active=True,
+                tool_sga_active=False,
+            )
+            for i, siglas in enumerate(grupos)
+        )
+        for ambiente, siglas in zip(ambientes, grupos, strict=True):
+            for sigla in siglas:
+                self.ambiente_por_campus[sigla] = ambiente
+        return ambientes
+
+    def _cursos(self, sigla: str) -> list[dict]:
+        if sigla not in self.cursos:
+            modalidades, pesos = zip(*MODALIDADES, strict=True)
+            self.cursos[sigla] = [
+                {
+                    "id": self.sorteio.randrange(1000, 99999),
+                    "codigo": f"{self.sorteio.randrange(10000, 99999)}",
+                    "nome": f"Curso {i + 1} do campus {sigla}",
+                    "descricao": f"Curso {i + 1}",
+                    "descricao_historico": f"Curso {i + 1}",
+                    "modalidade": self.sorteio.choices(modalidades, pesos)[0],
+                    "autoinstrucional": False,
+                }
+                for i in range(self.sorteio.randint(5, 40))
+            ]
+        return self.cursos[sigla]
+
+    def cria_coortes(self) -> int:
+        """Coortes de coordenação por curso e por campus, com regras de diário e vínculos a usuários do Moodle."""
+        if not self.n_coortes:
+            return 0
+        roles = Role.objects.bulk_create(
+            Role(name=f"{prefixo} (sintético)", shortname=shortname, active=True) for prefixo, shortname in ROLES
+        )
+
+        usuarios = max(self.n_vinculos, self.n_coortes * self.n_vinculos // 4)
+        primeiro_usuario = reserva_ids(MoodleUser, usuarios)
+        copia(
+            MoodleUser,
+            ["id", "fullname", "email", "login", "active"],
+            (
+                (i, f"Colaborador {i}", f"colaborador{i}@sintetico.local", f"sint.{i}", True)
+                for i in range(primeiro_usuario, primeiro_usuario + usuarios)
+            ),
+        )
+
+        primeira = reserva_ids(Cohort, self.n_coortes)
+        siglas, pesos = [c[0] for c in CAMPI], [c[2] for c in CAMPI]
+        linhas, vinculos = [], []
+        for cohort_id in range(primeira, primeira + self.n_coortes):
+            sigla = self.sorteio.choices(siglas, pesos)[0]
+            role = roles[self.sorteio.choices(range(len(ROLES)), [6, 3, 1])[0]]
+            if role.shortname == "teachercoordenadorcurso":
+                curso = self._escolhe_curso(sigla)
+                chave = (sigla, curso["codigo"])
+                regra = f"campus['sigla'] == '{sigla}' and curso['codigo'] == '{curso['codigo']}'"
+                nome = f"{sigla}.CooCurso.{curso['codigo']}.{cohort_id}"
+            else:
+                chave = (sigla,)
+                regra = f"campus['sigla'] == '{sigla}'"
+                nome = f"{sigla}.{role.name.split()[0]}.{cohort_id}"
+            colaboradores = self.sorteio.sample(range(primeiro_usuario, primeiro_usuario + usuarios), self.n_vinculos)
+            linhas.append((cohort_id, nome, f"sint{cohort_id}", True, role.id, regra, None, f"Coorte sintética {nome}"))
+            vinculos.extend((usuario, cohort_id, True) for usuario in colaboradores)
+            self.coortes_por_chave.setdefault(chave, []).append(
+                {
+                    "nome": nome,
+                    "role": role.shortname,
+                    "ativo": True,
+                    "idnumber": f"sint{cohort_id}",
+                    "descricao": f"Coorte sintética {nome}",
+                    "colaboradores": [
+                        {
+                            "nome": f"Colaborador {usuario}",
+                            "email": f"colaborador{usuario}@sintetico.local",
+                            "login": f"sint.{usuario}",
+                            "status": True,
+                        }
+                        for usuario in colaboradores
+                    ],
+                }
+            )
+        copia(
+            Cohort,
+            ["id", "name", "idnumber", "active", "role", "rule_diario", "rule_coordenacao", "description"],
+            linhas,
+        )
+        copia(Enrolment, ["user", "cohort", "active"], vinculos)
+        return len(linhas)
+
+    def _escolhe_curso(self, sigla: str) -> dict:
+        cursos = self._cursos(sigla)
+        # Zipf: os primeiros cursos do campus têm muito mais diários.
+        return self.sorteio.choices(cursos, [1 / (k + 1) for k in range(len(cursos))])[0]
+
+    def _alunos(self, diario_id: int, curso: dict, polo: dict) -> list[dict]:
+        quantidade = min(2000, max(1, round(self.sorteio.lognormvariate(math.log(self.alunos), 0.6))))
+        situacoes, pesos = zip(*SITUACOES_ALUNO, strict=True)
+        ano = self.sorteio.randint(2019, 2026)
+        return [
+            {
+                "id": diario_id * 1000 + i,
+                "nome": f"Aluno {diario_id}.{i}",
+                "polo": {"id": polo["id"], "descricao": polo["descricao"]},
+                "email": f"aluno{diario_id}.{i}@academico.sintetico.local",
+                "programa": curso["modalidade"]["descricao"],
+                "situacao": self.sorteio.choices(situacoes, pesos)[0],
+                "matricula": f"{ano}1{curso['codigo']}{i:04d}",
+                "situacao_diario": "ativo",
+                "email_secundario": f"aluno{diario_id}.{i}@pessoal.sintetico.local",
+            }
+            for i in range(quantidade)
+        ]
+
+    def cria_diarios(self) -> list[Diario]:
+        siglas, pesos = [c[0] for c in CAMPI], [c[2] for c in CAMPI]
+        descricoes = {sigla: descricao for sigla, descricao, _ in CAMPI}
+        campus_ids = {sigla: i + 1 for i, (sigla, _, _) in enumerate(CAMPI)}
+        diarios = []
+        for n in range(self.n_diarios):
+            diario_id = 100000 + n
+            sigla = self.sorteio.choices(siglas, pesos)[0]
+            curso = self._escolhe_curso(sigla)
+            periodo = self.sorteio.randint(1, 8)
+            componente_sigla = f"{curso['modalidade']['descricao'][:3].upper()}.{self.sorteio.randrange(10000):04d}"
+            descricao = f"Componente {componente_sigla}"
+            polo = {"id": campus_ids[sigla] * 10 + self.sorteio.randint(0, 3), "sigla": sigla}
+            polo["descricao"] = f"Polo {polo['id']} ({sigla})"
+            turma = f"2026{self.sorteio.randint(1, 2)}.{periodo}.{curso['codigo']}.{self.sorteio.randint(1, 9)}M"
+            recebido = {
+                "polo": polo if sigla == "ZL" else None,
+                "campus": {"id": campus_ids[sigla], "sigla": sigla, "descricao": descricoes[sigla]},
+                "curso": curso,
+                "turma": {"id": diario_id // 10, "codigo": turma},
+                "componente": {
+                    "id": self.sorteio.randrange(1000, 99999),
+                    "tipo": 1,
+                    "sigla": componente_sigla,
+                    "periodo": periodo,
+                    "optativo": self.sorteio.random() < 0.1,
+                    "descricao": descricao,
+                    "qtd_avaliacoes": self.sorteio.choice([1, 2, 4]),
+                    "descricao_historico": descricao,
+                },
+                "diario": {
+                    "id": diario_id,
+                    "tipo": "regular",
+                    "sigla": componente_sigla,
+                    "situacao": "Aberto",
+                    "descricao": descricao,
+                    "descricao_historico": descricao,
+                },
+                "alunos": self._alunos(diario_id, curso, polo),
+                "professores": [
+                    {
+                        "id": diario_id * 10 + i,
+                        "nome": f"Professor {diario_id}.{i}",
+                        "tipo": PAPEIS_PROFESSOR[i % len(PAPEIS_PROFESSOR)],
+                        "email": f"professor{diario_id}.{i}@sintetico.local",
+                        "login": f"{1000000 + diario_id * 10 + i}",
+                        "status": "ativo",
+                        "email_secundario": f"professor{diario_id}.{i}@pessoal.sintetico.local",
+                    }
+                    for i in range(self.sorteio.choices([1, 2, 3, 4], [50, 30, 15, 5])[0])
+                ],
+            }
+            coortes = self.coortes_por_chave.get((sigla, curso["codigo"]), []) + self.coortes_por_chave.get(
+                (sigla,), []
+            )
+            diarios.append(Diario(recebido, coortes))
+        return diarios
+
+    # --- Solicitações -----------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def distribui(inicio: datetime, fim: datetime, total: int) -> list[tuple[datetime, int]]:
+        """Quantas solicitações cada dia (no fuso local) recebe, pelo peso do dia da semana e do mês."""
+        dias = []
+        dia, fim = localtime(inicio), localtime(fim)
+        while dia <= fim:
+            dias.append((dia, PESO_DIA_SEMANA[dia.weekday()] * PESO_MES[dia.month]))
+            dia += timedelta(days=1)
+        soma = sum(peso for _, peso in dias) or 1
+        resultado, acumulado, atribuidos = [], 0.0, 0
+        for dia, peso in dias:
+            acumulado += total * peso / soma
+            quantidade = round(acumulado) - atribuidos
+            atribuidos += quantidade
+            resultado.append((dia, quantidade))
+        return resultado
+
+    def _tempos(self, operacao: str, alunos: int, status_code: str | None) -> str | None:
+        if status_code is None:
+            return None
+        lognorm = self.sorteio.lognormvariate
+        moodle = lognorm(math.log(300 + alunos * 6), 0.5)
+        if status_code == "504":
+            moodle = 30000 + lognorm(math.log(500), 0.3)
+        tempos = {
+            "leitura": round(lognorm(math.log(0.2 + alunos * 0.01), 0.3), 1),
+            "json": round(lognorm(math.log(0.1 + alunos * 0.02), 0.3), 1),
+            "ambiente": round(lognorm(math.log(1.5), 0.4), 1),
+            "criacao": round(lognorm(math.log(3), 0.4), 1),
+        }
+        if operacao == Solicitacao.Operacao.SYNC_UP_DIARIO and status_code != "422":
+            tempos["coortes"] = round(lognorm(math.log(4 + self.n_coortes * 0.05), 0.5), 1)
+            if status_code != "525":
+                tempos["restricoes"] = round(lognorm(math.log(0.05), 0.3), 2)
+                tempos["enviado"] = round(lognorm(math.log(2 + alunos * 0.05), 0.4), 1)
+                tempos["moodle"] = round(moodle, 1)
+        elif operacao == Solicitacao.Operacao.SYNC_DOWN_NOTAS:
+            tempos["moodle"] = round(moodle * 0.6, 1)
+        return json.dumps(tempos)
+
+    def _linha(self, solicitacao_id: int, momento: datetime, diario: Diario) -> tuple:
+        sorteio = self.sorteio
+        operacao = (
+            Solicitacao.Operacao.SYNC_UP_DIARIO if sorteio.random() < 0.75 else Solicitacao.Operacao.SYNC_DOWN_NOTAS
+        )
+        status, status_code = sorteio.choices(*self._desfechos[operacao])[0]
+        campus = diario.recebido["campus"]["sigla"]
+        ambiente = self.ambiente_por_campus.get(campus)
+        base_url = ambiente.base_url if ambiente else None
+        url = f"{base_url}/course/view.php?id={diario.id % 50000}"
+        url_coordenacao = f"{base_url}/course/view.php?id={diario.recebido['curso']['id']}"
+        alunos = len(diario.recebido["alunos"])
+
+        if operacao == Solicitacao.Operacao.SYNC_UP_DIARIO:
+            if sorteio.random() < 0.1:
+                diario.altera(sorteio)
+            recebido, enviado_base, payload_hash = diario.serializado()
+            enviado = None
+            if status_code is not None and status_code not in FALHAS_ANTES_DO_ENVIO:
+                enviado = (
+                    f'{enviado_base}, "solicitacao_url": '
+                    f'"https://integrador.sintetico.local/integrador/solicitacao/{solicitacao_id}/view/"}}'
+                )
+            respondido = {
+                "url": url,
+                "url_sala_coordenacao": url_coordenacao,
+                "roles_not_found": [],
+                "ambiente": base_url,
+            }
+            diario_codigo, tipo = diario.codigo, "regular"
+        else:
+            recebido_dict = {"campus": {"sigla": campus}, "diario": {"id": diario.id}}
+            recebido, enviado, payload_hash = json.dumps(recebido_dict), None, None
+            respondido = {
+                "notas": [
+                    {"matricula": aluno["matricula"], "nota": round(sorteio.uniform(0, 10), 1), "diario_id": diario.id}
+                    for aluno in diario.recebido["alunos"]
+                ],
+                "url": url,
+                "url_sala_coordenacao": url_coordenacao,
+            }
+            diario_codigo, tipo = f".#{diario.id}", None
+
+        if status == Solicitacao.Status.FALHA:
+            respondido = {"error": {"error_message": ERROS[status_code], "error": ERROS[status_code]}}
+        elif status == Solicitacao.Status.PROCESSANDO:
+            respondido = None
+
+        if status != Solicitacao.Status.PROCESSANDO and ambiente is not None:
+            self.estados[(ambiente.id, str(diario.id), operacao)] = DiarioSyncState(
+                ambiente_id=ambiente.id,
+                diario_id=str(diario.id),
+                operacao=operacao,
+                solicitacao_id=solicitacao_id,
+                status=status,
+                status_code=status_code,
+                timestamp=momento,
+                payload_hash=payload_hash or DiarioSyncState.payload_hash_of(json.loads(recebido)),
+                url=url if status == Solicitacao.Status.SUCESSO else None,
+                url_sala_coordenacao=url_coordenacao if status == Solicitacao.Status.SUCESSO else None,
+            )
+
+        return (
+            solicitacao_id,
+            ambiente.id if ambiente else None,
+            momento,
+            campus,
+            diario_codigo,
+            str(diario.id),
+            operacao,
+            tipo,
+            status,
+            status_code,
+            recebido,
+            enviado,
+            json.dumps(respondido, ensure_ascii=False) if respondido is not None else None,
+            self._tempos(operacao, alunos, status_code),
+        )
+
+    def solicitacoes(self, inicio: datetime, fim: datetime, total: int) -> int:
+        """Gera e carrega `total` Solicitações entre `inicio` e `fim`, em lotes de `lote` linhas por COPY."""
+        diarios = self.cria_diarios()
+        # Alguns diários são reenviados muito mais que os outros.
+        pesos_diarios = list(accumulate(1 / (k + 1) ** 0.8 for k in range(len(diarios))))
+        horas = list(accumulate(PESO_HORA))
+        self._desfechos = {
+            operacao: ([(status, codigo) for status, codigo, _ in opcoes], [peso for _, _, peso in opcoes])
+            for operacao, opcoes in DESFECHOS.items()
+        }
+
+        def momentos():
+            for dia, quantidade in self.distribui(inicio, fim, total):
+                meia_noite = dia.replace(hour=0, minute=0, second=0, microsecond=0)
+                instantes = sorted(
+                    meia_noite
+                    + timedelta(
+                        hours=bisect(horas, self.sorteio.random() * horas[-1]),
+                        seconds=self.sorteio.randrange(3600),
+                    )
+                    for _ in range(quantidade)
+                )
+                # O primeiro e o último dia são parciais: nada antes de `inicio` nem depois de `fim`.
+                yield from (min(max(instante, inicio), fim) for instante in instantes)
+
+        gerados = 0
+        pendentes = momentos()
+        while gerados < total:
+            quantidade = min(self.lote, total - gerados)
+            primeiro = reserva_ids(Solicitacao, quantidade)
+            linhas = (
+                self._linha(primeiro + i, momento, self.sorteio.choices(diarios, cum_weights=pesos_diarios)[0])
+                for i, momento in zip(range(quantidade), pendentes, strict=False)
+            )
+            with transaction.atomic():
+                gerados += copia(Solicitacao, self.CAMPOS_SOLICITACAO, linhas)
+            self.report(f"{gerados}/{total} solicitações")
+        return gerados
+
+    def executa(self, inicio: datetime, fim: datetime, total: int) -> dict:
+        ambientes = self.cria_ambientes()
+        coortes = self.cria_coortes()
+        gerados = self.solicitacoes(inicio, fim, total)
+        estados = DiarioSyncState.objects.upsert(list(self.estados.values()))
+        rollups = SolicitacaoRollup.objects.recompacta(inicio, fim)
+        return {
+            "ambientes": len(ambientes),
+            "coortes": coortes,
+            "solicitacoes": gerados,
+            "estados": estados,
+            "rollups": rollups,
+        }
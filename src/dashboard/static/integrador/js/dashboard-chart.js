@@ -6,7 +6,6 @@
             { label: "Total", field: "total", color: "#417690" },
             { label: "Sucesso", field: "sucesso", color: "#155724" },
             { label: "Falha", field: "falha", color: "#721c24" },
-            { label: "Processando", field: "processando", color: "#856404" },
         ],
     };
 
@@ -4,24 +4,65 @@ Isola a lógica de negócio da view.
 """
 
 import logging
+import threading
+import time
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
 from django.core.cache import cache
-from django.db.models import Count, Q
-from django.db.models.functions import TruncMonth
+from django.db import connection
+from django.db.models import Count, FloatField, Q, Sum
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast, TruncMonth
 from django.utils.timezone import now
 
 from cohort.models import Cohort, Enrolment, Role
-from integrador.models import Ambiente, Solicitacao
+from integrador.metrics import DatabaseCollector
+from integrador.models import Ambiente, Solicitacao, SolicitacaoRollup
+from integrador.timings import ETAPAS, TEMPO_TOTAL, PercentileCont
 
 logger = logging.getLogger(__name__)
 
 # Configuração de cache
 CACHE_ENABLED = getattr(settings, "DASHBOARD_CACHE_ENABLED", True)
+# Após o TTL "soft" o dado ainda é servido, mas um único processo o recalcula em segundo plano.
 CACHE_TIMEOUT = getattr(settings, "DASHBOARD_CACHE_TIMEOUT", 300)
+# Após o TTL "hard" o dado some do cache e precisa ser recalculado antes de ser exibido.
+CACHE_HARD_TIMEOUT = getattr(settings, "DASHBOARD_CACHE_HARD_TIMEOUT", 3600)
+CACHE_LOCK_TIMEOUT = getattr(settings, "DASHBOARD_CACHE_LOCK_TIMEOUT", 60)
 CACHE_KEY = "admin_dashboard_data"
+# TTL soft das seções mais caras que as demais.
+SECTION_TIMEOUTS = {"tempos": getattr(settings, "DASHBOARD_TEMPOS_CACHE_TIMEOUT", 1800)}
+
+# Cada seção é cacheada separadamente: o método que a carrega e as chaves de `data` que ele preenche.
+SECTIONS = {
+    "ambientes": ("_load_ambientes", ["ambientes_total", "ambientes_ativos", "ambientes_com_erro"]),
+    "coortes": ("_load_coortes", ["coortes_total", "coortes_ativas", "coortes_inativas", "enrolments_total"]),
+    "papeis": ("_load_papeis", ["papeis_total", "papeis_ativos", "papeis_inativos"]),
+    "usuarios": ("_load_usuarios", ["usuarios_total", "usuarios_ativos", "grupos_total"]),
+    "solicitacoes": (
+        "_load_solicitacoes",
+        [
+            "solicitacoes_24h",
+            "solicitacoes_sucesso",
+            "solicitacoes_falha",
+            "solicitacoes_processando",
+            "total_solicitacoes",
+            "taxa_sucesso",
+        ],
+    ),
+    "series": ("_load_series_temporal", ["solicitacoes_series"]),
+    "tempos": ("_load_tempos", ["tempos_por_ambiente"]),
+}
+
+
+def section_cache_key(section: str) -> str:
+    return f"{CACHE_KEY}:{section}"
+
+
+def section_lock_key(section: str) -> str:
+    return f"{CACHE_KEY}:{section}:lock"
 
 
 class DashboardStorage:
@@ -49,29 +90,74 @@ class DashboardStorage:
             "total_solicitacoes": 0,
             "taxa_sucesso": 0,
             "solicitacoes_series": [],
+            "tempos_por_ambiente": [],
         }
 
     def get_context(self):
         """
         Retorna o contexto do dashboard.
-        Tenta usar cache, caso contrário carrega dados frescos.
+
+        Com o cache habilitado, cada seção é lida da sua própria chave (stale-while-revalidate): um dado vencido
+        pelo TTL soft continua sendo servido enquanto um único processo o recalcula em segundo plano. Só quando a
+        seção não está no cache ela é calculada durante a requisição, e apenas pelo processo que obtiver o lock;
+        os demais exibem os valores padrão até que o cálculo termine.
         """
-        if CACHE_ENABLED:
-            cached_data = cache.get(CACHE_KEY)
-            if cached_data is not None:
-                logger.debug("Dashboard data carregado do cache")
-                return cached_data
-
-        self._load_data()
-
-        if CACHE_ENABLED:
-            cache.set(CACHE_KEY, self.data, CACHE_TIMEOUT)
-            logger.debug(f"Dashboard data armazenado em cache por {CACHE_TIMEOUT}s")
-        else:
+        if not CACHE_ENABLED:
+            self._load_data()
             logger.debug("Cache desabilitado - dados não foram armazenados")
+            return self.data
 
+        for section in SECTIONS:
+            self.data.update(self.get_section(section))
         return self.data
 
+    def get_section(self, section: str) -> dict:
+        """Retorna os dados de uma seção, do cache sempre que possível."""
+        entry = cache.get(section_cache_key(section))
+        if entry is None:
+            if not cache.add(section_lock_key(section), True, CACHE_LOCK_TIMEOUT):
+                logger.debug(f"Seção {section} do dashboard sendo calculada por outro processo")
+                return {}
+            try:
+                return self.refresh_section(section)["data"]
+            finally:
+                cache.delete(section_lock_key(section))
+
+        if time.time() - entry["gerado_em"] > SECTION_TIMEOUTS.get(section, CACHE_TIMEOUT) and cache.add(
+            section_lock_key(section), True, CACHE_LOCK_TIMEOUT
+        ):
+            self._refresh_in_background(section)
+        return entry["data"]
+
+    @staticmethod
+    def load_section(section: str) -> dict:
+        """Calcula, sem cache, os dados de uma seção."""
+        loader, keys = SECTIONS[section]
+        storage = DashboardStorage()
+        getattr(storage, loader)()
+        return {key: storage.data[key] for key in keys}
+
+    @classmethod
+    def refresh_section(cls, section: str) -> dict:
+        """Recalcula a seção e a grava no cache junto com o momento em que foi gerada."""
+        entry = {"data": cls.load_section(section), "gerado_em": time.time()}
+        cache.set(section_cache_key(section), entry, CACHE_HARD_TIMEOUT)
+        logger.debug(f"Seção {section} do dashboard armazenada em cache por até {CACHE_HARD_TIMEOUT}s")
+        return entry
+
+    @classmethod
+    def _refresh_in_background(cls, section: str) -> None:
+        def refresh():
+            try:
+                cls.refresh_section(section)
+            except Exception as e:
+                logger.error(f"Erro ao atualizar a seção {section} do dashboard: {e}", exc_info=True)
+            finally:
+                cache.delete(section_lock_key(section))
+                connection.close()
+
+        threading.Thread(target=refresh, name=f"dashboard-{section}", daemon=True).start()
+
     def _load_data(self):
         """Carrega todos os dados do dashboard."""
         self._load_ambientes()
@@ -80,6 +166,7 @@ class DashboardStorage:
         self._load_usuarios()
         self._load_solicitacoes()
         self._load_series_temporal()
+        self._load_tempos()
 
     def _load_ambientes(self):
         """Carrega dados de ambientes."""
@@ -133,15 +220,23 @@ class DashboardStorage:
             logger.error(f"Erro ao carregar usuários: {e}", exc_info=True)
 
     def _load_solicitacoes(self):
-        """Carrega dados agregados de solicitações."""
+        """Carrega dados agregados de solicitações a partir dos agregados horários."""
         try:
-            agora = now()
-            ontem = agora - timedelta(hours=24)
+            ontem = SolicitacaoRollup.objects.hora_de(now() - timedelta(hours=24))
 
-            self.data["solicitacoes_24h"] = Solicitacao.objects.filter(timestamp__gte=ontem).count()
-            self.data["solicitacoes_sucesso"] = Solicitacao.objects.filter(status="S").count()
-            self.data["solicitacoes_falha"] = Solicitacao.objects.filter(status="F").count()
-            self.data["solicitacoes_processando"] = Solicitacao.objects.filter(status="P").count()
+            self.data["solicitacoes_24h"] = (
+                SolicitacaoRollup.objects.filter(hora__gte=ontem).aggregate(soma=Sum("total"))["soma"] or 0
+            )
+            por_status = dict(
+                SolicitacaoRollup.objects.filter(status__isnull=False)
+                .values_list("status")
+                .annotate(soma=Sum("total"))
+                .order_by()
+            )
+            self.data["solicitacoes_sucesso"] = por_status.get(Solicitacao.Status.SUCESSO, 0)
+            self.data["solicitacoes_falha"] = por_status.get(Solicitacao.Status.FALHA, 0)
+            # Os agregados só têm as finalizadas; as em processamento vêm da mesma contagem cacheada do /metrics.
+            self.data["solicitacoes_processando"] = DatabaseCollector.conta_processando()
 
             self.data["total_solicitacoes"] = (
                 self.data["solicitacoes_sucesso"]
@@ -165,14 +260,12 @@ class DashboardStorage:
         """Carrega série temporal histórica de solicitações agregada por mês/ano."""
         try:
             series_queryset = (
-                Solicitacao.objects.all()
-                .annotate(month=TruncMonth("timestamp"))
+                SolicitacaoRollup.objects.annotate(month=TruncMonth("hora"))
                 .values("month")
                 .annotate(
-                    total=Count("id"),
-                    sucesso=Count("id", filter=Q(status=Solicitacao.Status.SUCESSO)),
-                    falha=Count("id", filter=Q(status=Solicitacao.Status.FALHA)),
-                    processando=Count("id", filter=Q(status=Solicitacao.Status.PROCESSANDO)),
+                    soma=Sum("total"),
+                    sucesso=Sum("total", filter=Q(status=Solicitacao.Status.SUCESSO), default=0),
+                    falha=Sum("total", filter=Q(status=Solicitacao.Status.FALHA), default=0),
                 )
                 .order_by("month")
             )
@@ -187,10 +280,9 @@ class DashboardStorage:
                     self.data["solicitacoes_series"].append(
                         {
                             "date": formatted_date,
-                            "total": item["total"],
+                            "total": item["soma"],
                             "sucesso": item["sucesso"],
                             "falha": item["falha"],
-                            "processando": item["processando"],
                         }
                     )
 
@@ -198,3 +290,43 @@ class DashboardStorage:
         except Exception as e:
             logger.error(f"Erro ao carregar série temporal: {e}", exc_info=True)
             self.data["solicitacoes_series"] = []
+
+    def _load_tempos(self):
+        """Carrega os percentis (p50 e p95) dos tempos por etapa de cada ambiente nas últimas 24h."""
+        try:
+            etapas = {"total": "Total", **ETAPAS}
+            percentis = {}
+            for etapa in etapas:
+                tempo = TEMPO_TOTAL if etapa == "total" else Cast(KT(f"tempos__{etapa}"), FloatField())
+                percentis[f"{etapa}_p50"] = PercentileCont(tempo, 0.5)
+                percentis[f"{etapa}_p95"] = PercentileCont(tempo, 0.95)
+
+            por_ambiente = (
+                Solicitacao.objects.filter(timestamp__gte=now() - timedelta(hours=24), tempos__isnull=False)
+                .exclude(tempos={})
+                .values("ambiente__nome")
+                .annotate(solicitacoes=Count("id"), **percentis)
+                .order_by("ambiente__nome")
+            )
+
+            self.data["tempos_por_ambiente"] = [
+                {
+                    "ambiente": item["ambiente__nome"] or "-",
+                    "solicitacoes": item["solicitacoes"],
+                    "etapas": [
+                        {
+                            "etapa": etapa,
+                            "descricao": descricao,
+                            "p50": round(item[f"{etapa}_p50"], 1),
+                            "p95": round(item[f"{etapa}_p95"], 1),
+                        }
+                        for etapa, descricao in etapas.items()
+                        if item[f"{etapa}_p50"] is not None
+                    ],
+                }
+                for item in por_ambiente
+            ]
+            logger.info(f"Tempos por etapa carregados: {len(self.data['tempos_por_ambiente'])} ambientes")
+        except Exception as e:
+            logger.error(f"Erro ao carregar tempos por etapa: {e}", exc_info=True)
+            self.data["tempos_por_ambiente"] = []
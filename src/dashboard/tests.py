@@ -2,22 +2,39 @@
 Testes unitários para a app dashboard.
 
 Este módulo contém testes para:
-- DashboardStorage: carregamento de dados e cache
+- DashboardStorage: carregamento de dados e cache por seção (stale-while-revalidate)
 - admin_views: views personalizadas do admin
+- GeradorSintetico: dados sintéticos do generate_test_solicitacoes (COPY, payloads e distribuições)
 """
 
+import importlib.util
+import threading
+import time
+from collections import Counter
 from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
 from unittest.mock import patch
 
 from django.contrib.auth.models import User
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Max, Sum
 from django.test import RequestFactory, TestCase, override_settings
 from django.utils.timezone import now
 
-from cohort.models import Cohort, Role
+from cohort.models import Cohort, Enrolment, MoodleUser, Role
+from dashboard import sintetico
 from dashboard.admin_views import admin_index_dashboard
-from dashboard.storage import DashboardStorage
-from integrador.models import Ambiente, Solicitacao
+from dashboard.storage import (
+    CACHE_TIMEOUT,
+    SECTION_TIMEOUTS,
+    SECTIONS,
+    DashboardStorage,
+    section_cache_key,
+    section_lock_key,
+)
+from integrador.models import Ambiente, DiarioSyncState, Solicitacao, SolicitacaoRollup
 
 AMBIENTE_GOOD = dict(
     nome="Ambiente Teste",  # noqa: S106
@@ -73,6 +90,9 @@ class DashboardStorageTestCase(TestCase):
             timestamp=now() - timedelta(hours=25),
         )
 
+        # O dashboard lê dos agregados horários, que aqui são recalculados a partir das solicitações criadas
+        SolicitacaoRollup.objects.recompacta(now() - timedelta(days=1), now())
+
     def tearDown(self):
         """Limpa o cache após cada teste."""
         cache.clear()
@@ -178,6 +198,7 @@ class DashboardStorageTestCase(TestCase):
     def test_load_solicitacoes_with_no_requests(self):
         """Testa carregamento quando não há solicitações."""
         Solicitacao.objects.all().delete()
+        SolicitacaoRollup.objects.all().delete()
         storage = DashboardStorage()
         context = storage.get_context()
         self.assertEqual(context["total_solicitacoes"], 0)
@@ -200,6 +221,12 @@ class DashboardStorageTestCase(TestCase):
             status=Solicitacao.Status.SUCESSO,
             timestamp=three_months_ago,
         )
+        SolicitacaoRollup.objects.create(
+            hora=SolicitacaoRollup.objects.hora_de(three_months_ago),
+            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
+            status=Solicitacao.Status.SUCESSO,
+            total=1,
+        )
 
         storage = DashboardStorage()
         context = storage.get_context()
@@ -239,15 +266,59 @@ class DashboardStorageTestCase(TestCase):
 
     def test_load_solicitacoes_handles_exception(self):
         """Testa tratamento de exceção no carregamento de solicitações."""
-        with patch("dashboard.storage.Solicitacao.objects.filter", side_effect=Exception("DB Error")):
+        with patch("dashboard.storage.SolicitacaoRollup.objects.filter", side_effect=Exception("DB Error")):
             storage = DashboardStorage()
             storage._load_solicitacoes()
             # Deve manter valores padrão
             self.assertEqual(storage.data["total_solicitacoes"], 0)
 
+    def test_load_series_temporal_sums_rollups_by_month(self):
+        """Testa que a série temporal soma os agregados horários de cada mês."""
+        SolicitacaoRollup.objects.all().delete()
+        hora = SolicitacaoRollup.objects.hora_de(now())
+        for status, total in [(Solicitacao.Status.SUCESSO, 5), (Solicitacao.Status.FALHA, 2)]:
+            SolicitacaoRollup.objects.create(
+                hora=hora, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, status=status, total=total
+            )
+
+        context = DashboardStorage().get_context()
+
+        self.assertEqual(len(context["solicitacoes_series"]), 1)
+        serie = context["solicitacoes_series"][0]
+        self.assertEqual((serie["total"], serie["sucesso"], serie["falha"]), (7, 5, 2))
+        self.assertEqual(context["solicitacoes_24h"], 7)
+
+    def test_load_tempos_percentis_por_ambiente(self):
+        """Testa os percentis dos tempos por etapa de cada ambiente nas últimas 24h."""
+        for moodle in [10.0, 20.0, 30.0, 40.0, 50.0]:
+            Solicitacao.objects.create(
+                ambiente=self.ambiente,
+                operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
+                status=Solicitacao.Status.SUCESSO,
+                tempos={"coortes": 5.0, "moodle": moodle},
+            )
+
+        storage = DashboardStorage()
+        storage._load_tempos()
+
+        self.assertEqual(len(storage.data["tempos_por_ambiente"]), 1)
+        tempos = storage.data["tempos_por_ambiente"][0]
+        self.assertEqual((tempos["ambiente"], tempos["solicitacoes"]), (self.ambiente.nome, 5))
+        etapas = {etapa["etapa"]: etapa for etapa in tempos["etapas"]}
+        self.assertEqual(list(etapas), ["total", "coortes", "moodle"])
+        self.assertEqual((etapas["moodle"]["p50"], etapas["moodle"]["p95"]), (30.0, 48.0))
+        self.assertEqual(etapas["total"]["p50"], 35.0)
+
+    def test_load_tempos_handles_exception(self):
+        """Testa tratamento de exceção no carregamento dos tempos por etapa."""
+        with patch("dashboard.storage.Solicitacao.objects.filter", side_effect=Exception("DB Error")):
+            storage = DashboardStorage()
+            storage._load_tempos()
+            self.assertEqual(storage.data["tempos_por_ambiente"], [])
+
     def test_load_series_temporal_handles_exception(self):
         """Testa tratamento de exceção no carregamento da série temporal."""
-        with patch("dashboard.storage.Solicitacao.objects.all", side_effect=Exception("DB Error")):
+        with patch("dashboard.storage.SolicitacaoRollup.objects.annotate", side_effect=Exception("DB Error")):
             storage = DashboardStorage()
             storage._load_series_temporal()
             # Deve manter lista vazia
@@ -271,34 +342,144 @@ class DashboardStorageTestCase(TestCase):
 
     def test_cache_disabled_not_stored(self):
         """Testa se cache não armazena quando desabilitado."""
-        with override_settings(DASHBOARD_CACHE_ENABLED=False):
-            self.storage.get_context()
-            # Verifica se dados não estão em cache
-            from django.core.cache import cache
+        with patch("dashboard.storage.CACHE_ENABLED", False):
+            with patch("dashboard.storage.cache.set") as mock_cache_set:
+                self.storage.get_context()
 
-            cached = cache.get("admin_dashboard_data")
-            self.assertIsNone(cached)
+        mock_cache_set.assert_not_called()
 
-    def test_get_context_stores_data_in_cache_when_enabled(self):
-        """Testa get_context persistindo dados em cache quando habilitado."""
+    def test_get_context_stores_each_section_in_cache_when_enabled(self):
+        """Testa get_context persistindo cada seção em sua própria chave, com o TTL hard."""
         with patch("dashboard.storage.CACHE_ENABLED", True):
-            with patch("dashboard.storage.CACHE_TIMEOUT", 123):
-                with patch.object(DashboardStorage, "_load_data") as mock_load_data:
-                    with patch("dashboard.storage.cache.set") as mock_cache_set:
-                        context = self.storage.get_context()
+            with patch("dashboard.storage.CACHE_HARD_TIMEOUT", 123):
+                with patch("dashboard.storage.cache.get", return_value=None):
+                    with patch("dashboard.storage.cache.add", return_value=True):
+                        with patch("dashboard.storage.cache.set") as mock_cache_set:
+                            context = self.storage.get_context()
 
-        self.assertEqual(context, self.storage.data)
-        mock_load_data.assert_called_once()
-        mock_cache_set.assert_called_once_with("admin_dashboard_data", self.storage.data, 123)
+        self.assertEqual(context["ambientes_total"], 1)
+        chaves = [call.args[0] for call in mock_cache_set.call_args_list]
+        self.assertEqual(chaves, [section_cache_key(section) for section in SECTIONS])
+        for call in mock_cache_set.call_args_list:
+            self.assertEqual(call.args[2], 123)
+            self.assertIn("gerado_em", call.args[1])
 
     def test_get_context_cache_hit_covered(self):
-        """Testa get_context quando há hit no cache para cobrir as linhas de log e return."""
-        fake_data = {"ambientes_total": 99}
+        """Testa get_context quando há hit no cache: nenhuma seção é recalculada."""
+        fake_entry = {"data": {"ambientes_total": 99}, "gerado_em": time.time()}
         with patch("dashboard.storage.CACHE_ENABLED", True):
-            with patch("dashboard.storage.cache.get", return_value=fake_data) as mock_get:
-                context = self.storage.get_context()
-                self.assertEqual(context, fake_data)
-                mock_get.assert_called_once_with("admin_dashboard_data")
+            with patch("dashboard.storage.cache.get", return_value=fake_entry) as mock_get:
+                with patch.object(DashboardStorage, "load_section") as mock_load:
+                    context = self.storage.get_context()
+
+        self.assertEqual(context["ambientes_total"], 99)
+        mock_load.assert_not_called()
+        self.assertEqual(mock_get.call_count, len(SECTIONS))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+@patch("dashboard.storage.CACHE_ENABLED", True)
+class DashboardSectionCacheTestCase(TestCase):
+    """Testes do cache por seção com stale-while-revalidate."""
+
+    def setUp(self):
+        cache.clear()
+        Ambiente.objects.create(**AMBIENTE_GOOD)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_section_cache_miss_computes_and_releases_lock(self):
+        """Testa que a seção ausente é calculada na requisição e o lock é liberado em seguida."""
+        dados = DashboardStorage().get_section("ambientes")
+
+        self.assertEqual(dados, {"ambientes_total": 1, "ambientes_ativos": 1, "ambientes_com_erro": 0})
+        self.assertEqual(cache.get(section_cache_key("ambientes"))["data"], dados)
+        self.assertIsNone(cache.get(section_lock_key("ambientes")))
+
+    def test_section_fresh_is_served_without_queries(self):
+        """Testa que uma seção dentro do TTL soft não executa consultas."""
+        DashboardStorage.refresh_section("ambientes")
+        Ambiente.objects.create(**{**AMBIENTE_GOOD, "nome": "Outro", "ordem": 2})
+
+        with self.assertNumQueries(0):
+            dados = DashboardStorage().get_section("ambientes")
+
+        self.assertEqual(dados["ambientes_total"], 1)
+
+    def test_section_stale_is_served_while_refreshing_in_background(self):
+        """Testa que a seção vencida é servida imediatamente e atualizada por um único processo."""
+        cache.set(
+            section_cache_key("ambientes"), {"data": {"ambientes_total": 7}, "gerado_em": time.time() - 10_000}, 600
+        )
+
+        with patch.object(DashboardStorage, "_refresh_in_background") as mock_refresh:
+            primeira = DashboardStorage().get_section("ambientes")
+            segunda = DashboardStorage().get_section("ambientes")
+
+        self.assertEqual(primeira, {"ambientes_total": 7})
+        self.assertEqual(segunda, {"ambientes_total": 7})
+        mock_refresh.assert_called_once_with("ambientes")
+        self.assertTrue(cache.get(section_lock_key("ambientes")))
+
+    def test_section_tempos_tem_ttl_soft_proprio(self):
+        """Testa que os percentis dos tempos só são recalculados depois do TTL soft deles, maior que o das demais."""
+        gerado_em = time.time() - CACHE_TIMEOUT - 10
+        cache.set(section_cache_key("tempos"), {"data": {"tempos_por_ambiente": []}, "gerado_em": gerado_em}, 600)
+
+        with patch.object(DashboardStorage, "_refresh_in_background") as mock_refresh:
+            DashboardStorage().get_section("tempos")
+        mock_refresh.assert_not_called()
+
+        gerado_em = time.time() - SECTION_TIMEOUTS["tempos"] - 10
+        cache.set(section_cache_key("tempos"), {"data": {"tempos_por_ambiente": []}, "gerado_em": gerado_em}, 600)
+        with patch.object(DashboardStorage, "_refresh_in_background") as mock_refresh:
+            DashboardStorage().get_section("tempos")
+        mock_refresh.assert_called_once_with("tempos")
+
+    def test_section_miss_with_lock_held_serves_defaults(self):
+        """Testa que, sem o lock, a seção ausente não é recalculada e os valores padrão são exibidos."""
+        cache.add(section_lock_key("coortes"), True, 60)
+
+        with self.assertNumQueries(0):
+            dados = DashboardStorage().get_section("coortes")
+
+        self.assertEqual(dados, {})
+        self.assertIsNone(cache.get(section_cache_key("coortes")))
+
+    def test_get_context_merges_sections_over_defaults(self):
+        """Testa que o contexto junta as seções cacheadas aos valores padrão das demais."""
+        cache.set(section_cache_key("papeis"), {"data": {"papeis_total": 5}, "gerado_em": time.time()}, 600)
+        cache.add(section_lock_key("usuarios"), True, 60)
+
+        context = DashboardStorage().get_context()
+
+        self.assertEqual(context["papeis_total"], 5)
+        self.assertEqual(context["usuarios_total"], 0)
+        self.assertEqual(context["ambientes_total"], 1)
+
+    def test_refresh_in_background_updates_cache_and_releases_lock(self):
+        """Testa a atualização em segundo plano: grava a seção e libera o lock mesmo em caso de erro."""
+        cache.add(section_lock_key("ambientes"), True, 60)
+        with patch("dashboard.storage.connection.close"):
+            with patch.object(DashboardStorage, "load_section", return_value={"ambientes_total": 3}):
+                DashboardStorage._refresh_in_background("ambientes")
+                for thread in threading.enumerate():
+                    if thread.name == "dashboard-ambientes":
+                        thread.join()
+
+        self.assertEqual(cache.get(section_cache_key("ambientes"))["data"], {"ambientes_total": 3})
+        self.assertIsNone(cache.get(section_lock_key("ambientes")))
+
+        cache.add(section_lock_key("ambientes"), True, 60)
+        with patch("dashboard.storage.connection.close"):
+            with patch.object(DashboardStorage, "load_section", side_effect=Exception("DB Error")):
+                DashboardStorage._refresh_in_background("ambientes")
+                for thread in threading.enumerate():
+                    if thread.name == "dashboard-ambientes":
+                        thread.join()
+
+        self.assertIsNone(cache.get(section_lock_key("ambientes")))
 
 
 class AdminIndexDashboardTestCase(TestCase):
@@ -375,3 +556,174 @@ class AdminIndexDashboardTestCase(TestCase):
                         context = mock_render.call_args[0][2]
                         # Deve ter lista vazia
                         self.assertEqual(context["log_entries"], [])
+
+
+class GeradorSinteticoTestCase(TestCase):
+    """Testes para o gerador de dados sintéticos (dashboard/sintetico.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fim = now()
+        cls.inicio = cls.fim - timedelta(days=60)
+        cls.gerador = sintetico.GeradorSintetico(semente=7, ambientes=3, coortes=12, vinculos=4, diarios=40, lote=150)
+        cls.resultado = cls.gerador.executa(cls.inicio, cls.fim, 400)
+        cls.solicitacoes = Solicitacao.objects.filter(ambiente__nome__startswith="Moodle sintético")
+
+    def test_executa_retorna_totais(self):
+        """Testa se os totais informados batem com o que foi gravado."""
+        self.assertEqual(self.resultado["ambientes"], 3)
+        self.assertEqual(self.resultado["coortes"], 12)
+        self.assertEqual(self.resultado["solicitacoes"], 400)
+        self.assertEqual(self.solicitacoes.count(), 400)
+        self.assertEqual(
+            SolicitacaoRollup.objects.aggregate(total=Sum("total"))["total"],
+            self.solicitacoes.exclude(status=Solicitacao.Status.PROCESSANDO).count(),
+        )
+
+    def test_ids_reservados_na_sequencia(self):
+        """Testa se os ids carregados por COPY não colidem com os criados depois pelo ORM."""
+        nova = Solicitacao.objects.create(status=Solicitacao.Status.PROCESSANDO)
+        self.assertGreater(nova.id, self.solicitacoes.aggregate(maximo=Max("id"))["maximo"])
+        maximo = MoodleUser.objects.aggregate(maximo=Max("id"))["maximo"]
+        self.assertGreater(MoodleUser.objects.create(login="depois", active=True).id, maximo)
+
+    def test_timestamps_no_periodo(self):
+        """Testa se nenhuma solicitação fica fora do período pedido."""
+        self.assertFalse(self.solicitacoes.filter(timestamp__lt=self.inicio).exists())
+        self.assertFalse(self.solicitacoes.filter(timestamp__gt=self.fim).exists())
+
+    def test_ambiente_selecionado_pela_expressao(self):
+        """Testa se o Ambiente de cada Sync Up é o que a expressão seletora escolheria."""
+        for solicitacao in self.solicitacoes.filter(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO)[:50]:
+            self.assertTrue(solicitacao.ambiente.check_selectable(solicitacao.recebido))
+
+    def test_campos_derivados_do_recebido(self):
+        """Testa se campus, diário e código do diário vêm do payload."""
+        for solicitacao in self.solicitacoes.filter(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO)[:50]:
+            recebido = solicitacao.recebido
+            self.assertEqual(solicitacao.campus_sigla, recebido["campus"]["sigla"])
+            self.assertEqual(solicitacao.diario_id, str(recebido["diario"]["id"]))
+            self.assertEqual(
+                solicitacao.diario_codigo,
+                f"{recebido['turma']['codigo']}.{recebido['diario']['sigla']}#{recebido['diario']['id']}",
+            )
+
+    @skipUnless(importlib.util.find_spec("jsonschema"), "jsonschema não instalado")
+    def test_recebido_valido_no_schema(self):
+        """Testa se o recebido do Sync Up é válido no SUDiario.schema.json."""
+        import jsonschema
+
+        schema = Solicitacao.Operacao.SYNC_UP_DIARIO.schema
+        for solicitacao in self.solicitacoes.filter(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO):
+            jsonschema.validate(solicitacao.recebido, schema)
+
+    def test_enviado_com_coortes_e_solicitacao_url(self):
+        """Testa se o enviado tem o recebido, as coortes elegíveis e a URL da própria solicitação."""
+        enviados = self.solicitacoes.filter(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, enviado__isnull=False)
+        self.assertTrue(enviados.exists())
+        for solicitacao in enviados[:50]:
+            enviado = solicitacao.enviado
+            self.assertEqual(enviado["diario"], solicitacao.recebido["diario"])
+            self.assertTrue(enviado["solicitacao_url"].endswith(f"/solicitacao/{solicitacao.id}/view/"))
+            self.assertIn("restricoes", enviado["turma"])
+            for coorte in enviado["coortes"]:
+                regra = Cohort.objects.get(idnumber=coorte["idnumber"]).rule_diario
+                self.assertIn(f"'{solicitacao.campus_sigla}'", regra)
+                self.assertEqual(len(coorte["colaboradores"]), 4)
+
+    def test_falhas_antes_do_envio_sem_enviado(self):
+        """Testa se só as falhas antes do envio ao Moodle (e as em processamento) ficam sem enviado."""
+        sem_enviado = self.solicitacoes.filter(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, enviado__isnull=True)
+        for status_code in sem_enviado.values_list("status_code", flat=True):
+            self.assertIn(status_code, {None, *sintetico.FALHAS_ANTES_DO_ENVIO})
+
+    def test_respondido_por_desfecho(self):
+        """Testa o formato do respondido de sucesso, falha e em processamento."""
+        for solicitacao in self.solicitacoes:
+            if solicitacao.status == Solicitacao.Status.SUCESSO:
+                self.assertEqual(solicitacao.status_code, "200")
+                self.assertTrue(solicitacao.respondido["url"].startswith(solicitacao.ambiente.base_url))
+            elif solicitacao.status == Solicitacao.Status.FALHA:
+                self.assertIn("error_message", solicitacao.respondido["error"])
+            else:
+                self.assertIsNone(solicitacao.respondido)
+                self.assertIsNone(solicitacao.tempos)
+
+    def test_sync_down_com_notas(self):
+        """Testa se os Sync Down de sucesso têm as notas dos alunos do diário."""
+        baixados = self.solicitacoes.filter(
+            operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS, status=Solicitacao.Status.SUCESSO
+        )
+        self.assertTrue(baixados.exists())
+        for solicitacao in baixados[:20]:
+            self.assertEqual(solicitacao.recebido["diario"]["id"], int(solicitacao.diario_id))
+            self.assertTrue(solicitacao.respondido["notas"])
+            self.assertIsNone(solicitacao.enviado)
+
+    def test_distribuicao_dos_desfechos(self):
+        """Testa se a maior parte das solicitações é de sucesso e se há falhas."""
+        status = Counter(self.solicitacoes.values_list("status", flat=True))
+        self.assertGreater(status[Solicitacao.Status.SUCESSO], 0.7 * 400)
+        self.assertGreater(status[Solicitacao.Status.FALHA], 0)
+
+    def test_coortes_e_vinculos(self):
+        """Testa se coortes, usuários e vínculos foram carregados e se as regras de diário são válidas."""
+        coortes = Cohort.objects.filter(idnumber__startswith="sint")
+        self.assertEqual(coortes.count(), 12)
+        self.assertEqual(Enrolment.objects.filter(cohort__in=coortes).count(), 12 * 4)
+        for coorte in coortes:
+            self.assertTrue(coorte.rule_diario.startswith("campus['sigla'] == "))
+            self.assertIn(coorte.role.shortname, [shortname for _, shortname in sintetico.ROLES])
+
+    def test_estados_dos_diarios(self):
+        """Testa se o DiarioSyncState tem a última solicitação finalizada de cada diário."""
+        estados = DiarioSyncState.objects.filter(ambiente__nome__startswith="Moodle sintético")
+        self.assertEqual(estados.count(), self.resultado["estados"])
+        for estado in estados[:20]:
+            ultima = (
+                self.solicitacoes.filter(
+                    ambiente=estado.ambiente,
+                    diario_id=estado.diario_id,
+                    operacao=estado.operacao,
+                    status__in=[Solicitacao.Status.SUCESSO, Solicitacao.Status.FALHA],
+                )
+                .order_by("-id")
+                .first()
+            )
+            self.assertEqual(estado.solicitacao_id, ultima.id)
+            self.assertEqual(estado.payload_hash, DiarioSyncState.payload_hash_of(ultima.recebido))
+
+    def test_mesma_semente_mesmos_payloads(self):
+        """Testa se a mesma semente gera os mesmos diários."""
+        a = sintetico.GeradorSintetico(semente=3, coortes=0, diarios=5).cria_diarios()
+        b = sintetico.GeradorSintetico(semente=3, coortes=0, diarios=5).cria_diarios()
+        self.assertEqual([d.recebido for d in a], [d.recebido for d in b])
+
+    def test_reserva_ids_consecutivos(self):
+        """Testa se os ids reservados são consecutivos e não voltam a ser usados pela sequência."""
+        primeiro = sintetico.reserva_ids(Role, 5)
+        self.assertEqual(sintetico.reserva_ids(Role, 1), primeiro + 5)
+        self.assertGreater(Role.objects.create(name="Outro papel", shortname="outro").id, primeiro + 5)
+
+    def test_distribui_respeita_total_e_sazonalidade(self):
+        """Testa se a distribuição por dia soma o total e se o fim de semana tem menos solicitações."""
+        inicio = now().replace(year=2026, month=3, day=2)  # segunda-feira
+        dias = sintetico.GeradorSintetico.distribui(inicio, inicio + timedelta(days=13), 1400)
+        self.assertEqual(sum(quantidade for _, quantidade in dias), 1400)
+        self.assertLess(dias[6][1], dias[2][1])
+
+    def test_command(self):
+        """Testa o comando generate_test_solicitacoes."""
+        saida = StringIO()
+        call_command(
+            "generate_test_solicitacoes",
+            months=1,
+            total=50,
+            ambientes=1,
+            cohorts=2,
+            enrolments=1,
+            diarios=5,
+            stdout=saida,
+        )
+        self.assertIn("50 solicitações de teste criadas", saida.getvalue())
+        self.assertEqual(Solicitacao.objects.count(), 450)
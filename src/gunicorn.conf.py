@@ -1,5 +1,7 @@
+import importlib.util
 import multiprocessing
 import os
+import shutil
 
 import boot
 
@@ -19,6 +21,21 @@ capture_output = False
 syslog = False
 logger_class = "gunicorn.glogging.Logger"
 
+# Cada worker grava as suas métricas Prometheus neste diretório e o /metrics agrega todos eles.
+prometheus_multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/dev/shm/prometheus")  # noqa: S108
+
+
+def on_starting(server):
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if importlib.util.find_spec("prometheus_client") is not None:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
 
 def when_ready(server):
     boot.boot()
@@ -2,21 +2,27 @@
 Testes unitários para a app health.
 
 Este módulo contém testes para:
-- health view: Endpoint de health check do sistema
+- health view: Endpoint de health check do sistema (Moodles lidos do cache do verificador)
+- live/ready: Endpoints de liveness e readiness
+- metrics: Endpoint Prometheus
 - URLs: Roteamento da app health
 - Verificação de status do banco de dados
 - Verificação de modo DEBUG
 """
 
 import json
+from unittest import skipUnless
 from unittest.mock import patch
 
+from django.core.cache import cache
 from django.http import JsonResponse
 from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 
 from health.apps import HealthConfig
 from health.views import health
+from integrador import metrics as integrador_metrics
 from integrador.models import Ambiente
+from integrador.probes import probe_ambientes
 
 
 class HealthViewTestCase(TestCase):
@@ -325,16 +331,18 @@ class HealthMonitoringTestCase(TransactionTestCase):
         self.assertEqual(content["Database"], "FAIL")
 
 
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
 class HealthAmbientesTestCase(TransactionTestCase):
     """Testes para o status de Ambientes no health check."""
 
     def setUp(self):
         """Configura o ambiente de teste."""
+        cache.clear()
         Ambiente.objects.all().delete()
 
-    @patch("health.views.requests.get")
+    @patch("requests.get")
     def test_health_with_ambientes(self, mock_get):
-        """Testa health check com vários tipos de ambientes e respostas da API."""
+        """Testa health check com vários tipos de ambientes e respostas da API, lidas do cache do verificador."""
         mock_response_ok = type("MockResponse", (object,), {})()
         mock_response_ok.status_code = 200
         mock_response_ok.json = lambda: {"status": "OK"}
@@ -403,6 +411,7 @@ class HealthAmbientesTestCase(TransactionTestCase):
 
         import requests  # assegura que requests está disponível no escopo do teste
 
+        probe_ambientes(Ambiente.objects.all())
         response = self.client.get("/health/")
         self.assertEqual(response.status_code, 200)
 
@@ -420,3 +429,100 @@ class HealthAmbientesTestCase(TransactionTestCase):
         # Verifica Env3 (INACTIVE para local_suap, e erro de exceção para tool_sga)
         self.assertEqual(moodles["Env3"]["local_suap"], "INACTIVE")
         self.assertIn("ERROR (Request timeout)", moodles["Env3"]["tool_sga"])
+
+        # Os resultados trazem o momento da verificação e a latência de cada chamada
+        self.assertIsNotNone(moodles["Env1"]["verificado_em"])
+        self.assertEqual(set(moodles["Env1"]["latencia_ms"]), {"url", "local_suap", "tool_sga"})
+        self.assertNotIn("local_suap", moodles["Env3"]["latencia_ms"])
+
+    @patch("health.views.cached_probes")
+    def test_health_does_not_call_moodles(self, mock_cached_probes):
+        """Testa que o relatório não faz chamadas HTTP: ambientes ainda não verificados aparecem como PENDING."""
+        ambiente = Ambiente.objects.create(
+            nome="Env1", url="https://env1.moodle.com", ordem=1, expressao_seletora="campus['sigla'] == 'ENV1'"
+        )
+        mock_cached_probes.return_value = {ambiente.id: None}
+
+        with patch("requests.get") as mock_get:
+            content = json.loads(self.client.get("/health/").content)
+
+        mock_get.assert_not_called()
+        self.assertEqual(content["Moodles"]["Env1"]["local_suap"], "PENDING")
+        self.assertIsNone(content["Moodles"]["Env1"]["verificado_em"])
+
+
+class HealthLiveReadyTestCase(TestCase):
+    """Testes para os endpoints de liveness e readiness."""
+
+    def test_live_does_not_touch_database(self):
+        """Testa que /health/live responde sem consultar o banco."""
+        with self.assertNumQueries(0):
+            response = self.client.get("/health/live")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"status": "OK"})
+        self.assertEqual(self.client.get("/health/live/").status_code, 200)
+
+    def test_ready_ok(self):
+        """Testa /health/ready com banco e cache acessíveis."""
+        response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"status": "OK", "Database": "OK", "Cache": "OK"})
+        self.assertEqual(self.client.get("/health/ready/").status_code, 200)
+
+    @patch("health.views.connection")
+    def test_ready_database_failure(self, mock_connection):
+        """Testa /health/ready retornando 503 quando o banco não responde."""
+        mock_connection.cursor.side_effect = Exception("Connection refused")
+        response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.content)["Database"], "FAIL")
+
+    @patch("health.views.cache")
+    def test_ready_cache_failure(self, mock_cache):
+        """Testa /health/ready retornando 503 quando o cache não responde."""
+        mock_cache.get.side_effect = Exception("Connection refused")
+        response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.content)["Cache"], "FAIL")
+
+
+class HealthMetricsTestCase(TestCase):
+    """Testes para o endpoint /metrics."""
+
+    @skipUnless(integrador_metrics.PROMETHEUS_AVAILABLE, "prometheus_client não instalado")
+    def test_metrics_prometheus_text_format(self):
+        """Testa que /metrics responde no formato texto do Prometheus."""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], integrador_metrics.CONTENT_TYPE)
+        self.assertIn(b"# TYPE integrador_sync_requests_total counter", response.content)
+        self.assertIn(b"integrador_solicitacoes_processando", response.content)
+
+    @skipUnless(integrador_metrics.PROMETHEUS_AVAILABLE, "prometheus_client não instalado")
+    @override_settings(METRICS_TOKEN="segredo")  # noqa: S106
+    def test_metrics_requires_token_when_configured(self):
+        """Testa que, com METRICS_TOKEN, a coleta precisa do Bearer token."""
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer segredo")
+        self.assertEqual(response.status_code, 200)
+
+    @skipUnless(integrador_metrics.PROMETHEUS_AVAILABLE, "prometheus_client não instalado")
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_sem_token_recusa_o_que_vem_pelo_ingress(self):
+        """Testa que, sem METRICS_TOKEN, /metrics recusa a requisição que passou por um proxy reverso."""
+        self.assertEqual(self.client.get("/metrics", HTTP_X_FORWARDED_FOR="200.137.2.1").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_X_REAL_IP="200.137.2.1").status_code, 403)
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    @override_settings(ALLOWED_HOSTS=["localhost", "integrador.ead.ifrn.edu.br"], METRICS_ENABLED=False)
+    def test_metrics_aceita_o_ip_do_pod_como_host(self):
+        """Testa que a coleta pelo IP do pod não é barrada pelo ALLOWED_HOSTS, ao contrário das demais URLs."""
+        self.assertEqual(self.client.get("/metrics", HTTP_HOST="10.42.0.17:8000").status_code, 503)
+        self.assertEqual(self.client.get("/health/", HTTP_HOST="10.42.0.17:8000").status_code, 400)
+
+    def test_metrics_unavailable(self):
+        """Testa que /metrics responde 503 sem o prometheus_client ou com as métricas desabilitadas."""
+        with patch("health.views.integrador_metrics.PROMETHEUS_AVAILABLE", False):
+            self.assertEqual(self.client.get("/metrics").status_code, 503)
+        with override_settings(METRICS_ENABLED=False):
+            self.assertEqual(self.client.get("/metrics/").status_code, 503)
@@ -1,11 +1,14 @@
-from django.urls import path
+from django.urls import path, re_path
 
 from .apps import HealthConfig
-from .views import health
+from .views import health, live, metrics, ready
 
 app_name = HealthConfig.name
 
 
 urlpatterns = [
     path("health/", health, name="health"),
+    re_path(r"^health/live/?$", live, name="live"),
+    re_path(r"^health/ready/?$", ready, name="ready"),
+    re_path(r"^metrics/?$", metrics, name="metrics"),
 ]
@@ -1,51 +1,78 @@
-import requests
+from datetime import UTC, datetime
+
 from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 
+from integrador import metrics as integrador_metrics
 from integrador.models import Ambiente
+from integrador.probes import PLUGINS, cached_probes
+
+
+def _plugin_status(resultado: dict) -> dict | str:
+    if resultado["status"] == "OK":
+        return resultado.get("resposta", {})
+    if resultado["status"] == "FAIL":
+        return f"FAIL ({resultado['status_code']})"
+    if resultado["status"] == "ERROR":
+        return f"ERROR ({resultado['erro']})"
+    return resultado["status"]
+
+
+def _moodle_status(ambiente: Ambiente, probe: dict | None) -> dict:
+    if probe is None:
+        return {"url": ambiente.url, "verificado_em": None, **{plugin: "PENDING" for plugin in PLUGINS}}
+    return {
+        "url": ambiente.url,
+        "verificado_em": datetime.fromtimestamp(probe["verificado_em"], UTC).isoformat(),
+        "version_php": _plugin_status(probe["url"]),
+        **{plugin: _plugin_status(probe[plugin]) for plugin in PLUGINS},
+        "latencia_ms": {
+            check: probe[check]["latencia_ms"] for check in ["url", *PLUGINS] if "latencia_ms" in probe[check]
+        },
+    }
+
 
+def live(request):
+    """Liveness: o processo responde. Não consulta banco, cache nem Moodles."""
+    return JsonResponse({"status": "OK"})
 
-def _check_plugin_token(base_url: str, token: str, api_path: str) -> dict | str:
-    if not token or not str(token).strip():
-        return "NO_TOKEN"
+
+def ready(request):
+    """Readiness: o banco e o cache (que guarda as sessões) estão acessíveis."""
+    checks = {}
     try:
-        response = requests.get(
-            f"{base_url}{api_path}",
-            headers={"Authentication": f"Token {token}"},
-            timeout=5,
-        )
-        if response.status_code == 200:
-            return response.json()
-        return f"FAIL ({response.status_code})"
-    except Exception as e:
-        return f"ERROR ({e})"
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        checks["Database"] = "OK"
+    except Exception:
+        checks["Database"] = "FAIL"
+
+    try:
+        cache.get("health:ready")
+        checks["Cache"] = "OK"
+    except Exception:
+        checks["Cache"] = "FAIL"
+
+    ok = all(status == "OK" for status in checks.values())
+    return JsonResponse({"status": "OK" if ok else "FAIL", **checks}, status=200 if ok else 503)
 
 
 def health(request):
+    """
+    Relatório detalhado. A conectividade com os Moodles vem do cache mantido pelo verificador em segundo plano
+    (`integrador.probes`), com o momento da verificação e a latência de cada chamada; nada é consultado via HTTP aqui.
+    """
     try:
         connection.connect()
         connection_result = "OK"
     except Exception:
         connection_result = "FAIL"
 
-    moodles = {}
-    for ambiente in Ambiente.objects.all().order_by("ordem", "id"):
-        local_suap_token = ambiente.local_suap_token
-        tool_sga_token = ambiente.tool_sga_token
-        moodles[ambiente.nome] = {
-            "url": ambiente.url,
-            "local_suap": (
-                _check_plugin_token(ambiente.base_url, local_suap_token, "/local/suap/api/index.php?health")
-                if ambiente.local_suap_active
-                else "INACTIVE"
-            ),
-            "tool_sga": (
-                _check_plugin_token(ambiente.base_url, tool_sga_token, "/admin/tool/sga/api/index.php?health")
-                if ambiente.tool_sga_active
-                else "INACTIVE"
-            ),
-        }
+    ambientes = list(Ambiente.objects.all().order_by("ordem", "id"))
+    probes = cached_probes(ambientes)
+    moodles = {ambiente.nome: _moodle_status(ambiente, probes[ambiente.id]) for ambiente in ambientes}
 
     return JsonResponse(
         {
@@ -55,3 +82,26 @@ def health(request):
             "Moodles": moodles,
         }
     )
+
+
+# Headers que o ingress (ou qualquer proxy reverso) acrescenta à requisição.
+PROXY_HEADERS = ("X-Forwarded-For", "X-Real-IP", "Forwarded")
+
+
+def metrics(request):
+    """Métricas no formato texto do Prometheus, agregadas entre os workers do gunicorn."""
+    if not settings.METRICS_ENABLED or not integrador_metrics.PROMETHEUS_AVAILABLE:
+        return HttpResponse(
+            "Métricas indisponíveis: instale o prometheus_client.", status=503, content_type="text/plain"
+        )
+
+    if settings.METRICS_TOKEN:
+        if request.headers.get("Authorization") != f"Bearer {settings.METRICS_TOKEN}":
+            return HttpResponse("Token inválido.", status=401, content_type="text/plain")
+    elif any(header in request.headers for header in PROXY_HEADERS):
+        # Sem token, só a coleta de dentro do cluster, direto no pod; o que passa pelo ingress chega com estes headers.
+        return HttpResponse(
+            "Sem METRICS_TOKEN, o /metrics só responde dentro do cluster.", status=403, content_type="text/plain"
+        )
+
+    return HttpResponse(integrador_metrics.render_metrics(), content_type=integrador_metrics.CONTENT_TYPE)
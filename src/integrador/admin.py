@@ -1,13 +1,15 @@
 import logging
+from contextlib import nullcontext
 from functools import update_wrapper
 
-import requests
 from django.conf import settings
-from django.contrib.admin import display, register
+from django.contrib import messages
+from django.contrib.admin import action, display, register
 from django.db import transaction
 from django.db.models import JSONField
+from django.db.models.fields.json import KT, KeyTransform
 from django.forms import ModelForm
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from django.urls import path, reverse
 from django.utils.html import format_html, format_html_join
@@ -16,9 +18,12 @@ from django.utils.translation import gettext as _
 from django_json_widget.widgets import JSONEditorWidget
 from import_export.resources import ModelResource
 
-from base.admin import BaseModelAdmin
-from integrador.brokers.suap2local_suap import Suap2LocalSuapBroker
-from integrador.models import Ambiente, Solicitacao
+from base.admin import BaseChangeList, BaseModelAdmin, BasicModelAdmin
+from integrador import profiling
+from integrador.brokers.registry import registry
+from integrador.models import Ambiente, DiarioSyncState, Solicitacao, SolicitacaoProfile
+from integrador.probes import PLUGINS, cached_probes, probe_ambientes
+from integrador.timings import ETAPAS
 
 logger = logging.getLogger(__name__)
 
@@ -57,27 +62,53 @@ class AmbienteAdmin(BaseModelAdmin):
     ]
     resource_classes = [AmbienteResource]
 
+    actions = ["atualizar_verificacoes"]
+
+    class AmbienteChangeList(BaseChangeList):
+        def get_results(self, request):
+            # O estado dos Moodles vem do cache, num único acesso para a página toda; nada é consultado via HTTP.
+            super().get_results(request)
+            probes = cached_probes(self.result_list)
+            for ambiente in self.result_list:
+                ambiente.probe = probes[ambiente.id]
+
     def get_queryset(self, request):
         """Otimiza queryset para evitar N+1 queries."""
         return super().get_queryset(request).all()
 
+    def get_changelist(self, request, **kwargs):
+        return self.AmbienteChangeList
+
+    @action(description="Verificar agora a conexão com os Moodles selecionados")
+    def atualizar_verificacoes(self, request, queryset):
+        resultados = probe_ambientes(queryset)
+        self.message_user(request, f"{len(resultados)} ambiente(s) verificado(s).", messages.SUCCESS)
+
+    def _probe(self, obj):
+        if not hasattr(obj, "probe"):
+            obj.probe = cached_probes([obj])[obj.id]
+        return obj.probe
+
+    def _pending_badge(self, label):
+        return format_html('<span title="{}">⏳</span>', f"{label}: verificação em andamento.")
+
     @display(description="URL")
     def checked_url(self, obj):
-        validation_error = format_html(
-            '<span title="{}"> {}</span>',
-            "Erro ao tentar validar a URL deste AVA.",
-            "🚫",
-        )
-        validation_success = format_html(
-            '<span title="{}"> {}</span>',
-            "A URL deste AVA foi validada com sucesso.",
-            "✅",
-        )
-        try:
-            response = requests.get(f"{obj.url}/version.php", timeout=1)
-            message = validation_success if response.status_code == 200 else validation_error
-        except Exception:
-            message = validation_error
+        probe = self._probe(obj)
+        if probe is None:
+            message = self._pending_badge("URL")
+        elif probe["url"]["status"] == "OK":
+            message = format_html(
+                '<span title="{}"> {}</span>',
+                f"A URL deste AVA foi validada com sucesso ({probe['url']['latencia_ms']} ms).",
+                "✅",
+            )
+        else:
+            message = format_html(
+                '<span title="{}"> {}</span>',
+                "Erro ao tentar validar a URL deste AVA.",
+                "🚫",
+            )
         return format_html('{}<a href="{}">{}🔗</a>', message, obj.url, obj.url)
 
     @display(description="Expressão Seletora")
@@ -104,7 +135,9 @@ class AmbienteAdmin(BaseModelAdmin):
             color=color,
         )
 
-    def _integration_badge(self, obj, active, token_field, api_path, label):
+    def _integration_badge(self, obj, plugin, label):
+        active_field, token_field, api_path = PLUGINS[plugin]
+        active = getattr(obj, active_field)
         token = getattr(obj, token_field)
         has_token = bool(token and str(token).strip())
 
@@ -116,38 +149,37 @@ class AmbienteAdmin(BaseModelAdmin):
 
         if not has_token:
             return format_html('<span title="{}">⚠️</span>', f"{label}: ativo, mas sem token configurado.")
-        try:
-            response = requests.get(
-                f"{obj.base_url}{api_path}",
-                headers={"Authentication": f"Token {token}"},
-                timeout=3,
+
+        probe = self._probe(obj)
+        if probe is None:
+            return self._pending_badge(label)
+
+        resultado = probe[plugin]
+        if resultado["status"] == "OK":
+            data = resultado.get("resposta", {})
+            title = (
+                f"{label}: OK — plugin {data.get('plugin_release', '?')} / Moodle {data.get('moodle_release', '?')}"
+                f" ({resultado['latencia_ms']} ms)"
+            )
+            return format_html('<span title="{}">✅</span>', title)
+        elif resultado.get("status_code") == 401:
+            return format_html('<span title="{}">🔑</span>', f"{label}: token inválido (401).")
+        elif resultado["status"] == "FAIL":
+            return format_html(
+                '<span title="{}">❌</span>', f"{label}: resposta inesperada ({resultado['status_code']})."
+            )
+        else:
+            return format_html(
+                '<span title="{}">⛔</span>', f"{label}: erro ao contactar o plugin — {resultado.get('erro')}."
             )
-            if response.status_code == 200:
-                data = response.json()
-                title = (
-                    f"{label}: OK — plugin {data.get('plugin_release', '?')} / Moodle {data.get('moodle_release', '?')}"
-                )
-                return format_html('<span title="{}">✅</span>', title)
-            elif response.status_code == 401:
-                return format_html('<span title="{}">🔑</span>', f"{label}: token inválido (401).")
-            else:
-                return format_html(
-                    '<span title="{}">❌</span>', f"{label}: resposta inesperada ({response.status_code})."
-                )
-        except Exception as e:
-            return format_html('<span title="{}">⛔</span>', f"{label}: erro ao contactar o plugin — {e}.")
 
     @display(description="Local SUAP")
     def checked_local_suap(self, obj):
-        return self._integration_badge(
-            obj, obj.local_suap_active, "local_suap_token", "/local/suap/api/index.php?health", "Local SUAP"
-        )
+        return self._integration_badge(obj, "local_suap", "Local SUAP")
 
     @display(description="Tool SGA")
     def checked_tool_sga(self, obj):
-        return self._integration_badge(
-            obj, obj.tool_sga_active, "tool_sga_token", "/admin/tool/sga/api/index.php?health", "Tool SGA"
-        )
+        return self._integration_badge(obj, "tool_sga", "Tool SGA")
 
 
 @register(Solicitacao)
@@ -165,10 +197,36 @@ class SolicitacaoAdmin(BaseModelAdmin):
     date_hierarchy = "timestamp"
     ordering = ("-timestamp",)
 
+    class SolicitacaoChangeList(BaseChangeList):
+        """
+        Na listagem não carrega os JSONs completos, apenas os caminhos usados por `professores` e `links`,
+        extraídos pelo próprio PostgreSQL. O `preview_view` continua carregando o registro inteiro.
+        """
+
+        def get_queryset(self, request, exclude_parameters=None):
+            return (
+                super()
+                .get_queryset(request, exclude_parameters)
+                .defer("recebido", "enviado", "respondido")
+                .annotate(
+                    json_professores=KeyTransform("professores", "recebido"),
+                    json_url=KT("respondido__url"),
+                    json_url_sala_coordenacao=KT("respondido__url_sala_coordenacao"),
+                    json_sincronizacao_url=KT("respondido__sincronizacao_url"),
+                )
+            )
+
     def get_queryset(self, request):
         """Otimiza queryset para evitar N+1 queries ao acessar ForeignKey 'ambiente'."""
         return super().get_queryset(request).select_related("ambiente")
 
+    def get_changelist(self, request, **kwargs):
+        return SolicitacaoAdmin.SolicitacaoChangeList
+
+    def get_data_for_export(self, request, queryset, **kwargs):
+        """A exportação precisa dos JSONs completos, então desfaz o `defer` da listagem."""
+        return super().get_data_for_export(request, queryset.defer(None), **kwargs)
+
     class SolicitacaoAdminForm(ModelForm):
         class Meta:
             model = Solicitacao
@@ -178,10 +236,43 @@ class SolicitacaoAdmin(BaseModelAdmin):
                 "respondido": JSONEditorWidget(),
             }
             fields = "__all__"
+            exclude = ["tempos"]
             readonly_fields = ["timestamp"]
 
     formfield_overrides = {JSONField: {"widget": JSONEditorWidget}}
     form = SolicitacaoAdminForm
+    readonly_fields = ["tempos_etapas", "profile"]
+
+    @display(description="Tempos por etapa")
+    def tempos_etapas(self, obj):
+        tempos = obj.tempos or {}
+        if not tempos:
+            return "-"
+        maior = max(tempos.values()) or 1
+        linhas = format_html_join(
+            "",
+            '<tr><td>{}</td><td style="text-align: right;">{}&nbsp;ms</td>'
+            '<td><div style="background: #1351b4; height: 8px; width: {}px;"></div></td></tr>',
+            ((ETAPAS.get(etapa, etapa), duracao, round(duracao / maior * 200)) for etapa, duracao in tempos.items()),
+        )
+        return format_html(
+            '<table>{}<tr><th>Total</th><th style="text-align: right;">{}&nbsp;ms</th><th></th></tr></table>',
+            linhas,
+            round(sum(tempos.values()), 1),
+        )
+
+    @display(description="Profile")
+    def profile(self, obj):
+        profile = SolicitacaoProfile.objects.filter(solicitacao=obj).defer("stats").first() if obj.pk else None
+        if profile is None:
+            return "-"
+        return format_html(
+            '<a href="{}">Flame graph</a> ({} ms, {}) · <a href="{}">.prof</a>',
+            reverse("admin:integrador_solicitacao_profile", args=[obj.id]),
+            profile.duracao_ms,
+            profile.get_origem_display(),
+            reverse("admin:integrador_solicitacao_profile_download", args=[obj.id]),
+        )
 
     @display(description="Requisição", ordering="timestamp")
     def requisicao(self, obj):
@@ -211,9 +302,12 @@ class SolicitacaoAdmin(BaseModelAdmin):
     @display(description="Ações")
     def acoes(self, obj):
         if obj.operacao == Solicitacao.Operacao.SYNC_UP_DIARIO:
+            url = reverse("admin:integrador_solicitacao_sync", args=[obj.id])
             return format_html(
-                '<a class="export_link" href="{}">Reenviar</a>',
-                reverse("admin:integrador_solicitacao_sync", args=[obj.id]),
+                '<a class="export_link" href="{}">Reenviar</a><br><a class="export_link" href="{}?profile=1">'
+                "Reenviar com profile</a>",
+                url,
+                url,
             )
         return "-"
 
@@ -221,7 +315,11 @@ class SolicitacaoAdmin(BaseModelAdmin):
     def professores(self, obj):
         try:
             professores = []
-            for p in (obj.recebido or {}).get("professores", []):
+            if hasattr(obj, "json_professores"):
+                lista = obj.json_professores
+            else:
+                lista = (obj.recebido or {}).get("professores", [])
+            for p in lista or []:
                 username = p.get("login", None)
                 urlpath = (
                     "/admin/comum/prestadorservico/?q="
@@ -251,7 +349,14 @@ class SolicitacaoAdmin(BaseModelAdmin):
     @display(description="Links")
     def links(self, obj):
         try:
-            respondido = obj.respondido if obj and isinstance(obj.respondido, dict) else {}
+            if hasattr(obj, "json_url"):
+                respondido = {
+                    "url": obj.json_url,
+                    "url_sala_coordenacao": obj.json_url_sala_coordenacao,
+                    "sincronizacao_url": obj.json_sincronizacao_url,
+                }
+            else:
+                respondido = obj.respondido if obj and isinstance(obj.respondido, dict) else {}
             items = []
 
             url = respondido.get("url")
@@ -315,9 +420,45 @@ class SolicitacaoAdmin(BaseModelAdmin):
                 "<path:object_id>/sync_moodle/",
                 wrap(self.sync_moodle_view),
                 name="%s_%s_sync" % info,
-            )
+            ),
+            path(
+                "<path:object_id>/profile/",
+                wrap(self.profile_view),
+                name="%s_%s_profile" % info,
+            ),
+            path(
+                "<path:object_id>/profile.prof",
+                wrap(self.profile_download_view),
+                name="%s_%s_profile_download" % info,
+            ),
         ] + super().get_urls()
 
+    def _get_profile(self, request, object_id) -> SolicitacaoProfile:
+        if not self.has_view_or_change_permission(request):
+            raise Http404
+        profile = SolicitacaoProfile.objects.filter(solicitacao_id=object_id).first()
+        if profile is None:
+            raise Http404
+        return profile
+
+    def profile_view(self, request, object_id):
+        profile = self._get_profile(request, object_id)
+        stats = profiling.load_stats(profile.stats)
+        context = {
+            **self.admin_site.each_context(request),
+            "title": f"Profile da solicitação #{profile.solicitacao_id}",
+            "profile": profile,
+            "arvore": profiling.call_tree(stats),
+            "funcoes": profiling.top_functions(stats),
+        }
+        return render(request, "admin/integrador/solicitacao/profile.html", context)
+
+    def profile_download_view(self, request, object_id):
+        profile = self._get_profile(request, object_id)
+        response = HttpResponse(bytes(profile.stats), content_type="application/octet-stream")
+        response["Content-Disposition"] = f'attachment; filename="solicitacao-{profile.solicitacao_id}.prof"'
+        return response
+
     @transaction.atomic
     def sync_moodle_view(self, request, object_id, form_url="", extra_context=None):
         original = get_object_or_404(Solicitacao, pk=object_id)
@@ -332,19 +473,18 @@ class SolicitacaoAdmin(BaseModelAdmin):
         )
 
         solicitacao.site_url = request.build_absolute_uri("/")
+        perfilador = profiling.Perfilador() if "profile" in request.GET else None
         try:
-            respondido = Suap2LocalSuapBroker(solicitacao).sync_up_enrolments()
+            with perfilador or nullcontext():
+                respondido = registry.broker_for(solicitacao).sync_up_enrolments()
             if not respondido:
                 raise ValueError("Erro desconhecido")
             solicitacao.respondido = respondido
-            solicitacao.status = Solicitacao.Status.SUCESSO
-            solicitacao.status_code = "200"
-            solicitacao.save()
-            return HttpResponseRedirect(reverse("admin:integrador_solicitacao_changelist"))
+            solicitacao.finaliza(Solicitacao.Status.SUCESSO, "200")
         except Exception as e:
-            solicitacao.status = Solicitacao.Status.FALHA
-            solicitacao.status_code = getattr(e, "code", "500")
-            solicitacao.save()
+            # Só uma finalização por solicitação: cada uma soma no agregado horário e atualiza o estado do diário.
+            solicitacao.finaliza(Solicitacao.Status.FALHA, getattr(e, "code", "500"))
+            self._salva_profile(perfilador, solicitacao, request)
             logger.exception(f"Error while syncing Moodle for Solicitacao {getattr(original, 'id', '-')}. ERROR: {e}")
             return render(
                 request,
@@ -352,3 +492,67 @@ class SolicitacaoAdmin(BaseModelAdmin):
                 context={"error_cause": str(e), "solicitacao": original},
                 status=200,
             )
+
+        if self._salva_profile(perfilador, solicitacao, request):
+            return HttpResponseRedirect(reverse("admin:integrador_solicitacao_profile", args=[solicitacao.id]))
+        return HttpResponseRedirect(reverse("admin:integrador_solicitacao_changelist"))
+
+    @staticmethod
+    def _salva_profile(perfilador, solicitacao: Solicitacao, request) -> SolicitacaoProfile | None:
+        """O profile do reenvio, se pedido. Um erro ao gravá-lo não muda o desfecho da solicitação já finalizada."""
+        if perfilador is None:
+            return None
+        try:
+            with transaction.atomic():
+                return perfilador.salva(solicitacao, SolicitacaoProfile.Origem.ADMIN, request.user.username)
+        except Exception:
+            logger.exception("Erro ao gravar o profile da Solicitacao %s", solicitacao.id)
+            return None
+
+
+@register(DiarioSyncState)
+class DiarioSyncStateAdmin(BasicModelAdmin):
+    list_display = ["diario_id", "ambiente", "operacao", "situacao", "timestamp", "ultima_solicitacao", "links"]
+    list_filter = ["operacao", "status", "ambiente"]
+    search_fields = ["diario_id"]
+    date_hierarchy = "timestamp"
+    ordering = ("-timestamp",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("ambiente")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    @display(description="Status", ordering="status")
+    def situacao(self, obj):
+        return format_html(
+            "{}{}({})", Solicitacao.Status(obj.status).icon, obj.get_status_display(), obj.status_code or ""
+        )
+
+    @display(description="Última solicitação")
+    def ultima_solicitacao(self, obj):
+        if obj.solicitacao_id is None:
+            return "-"
+        return format_html(
+            '<a href="{}">#{}</a>',
+            reverse("admin:integrador_solicitacao_view", args=[obj.solicitacao_id]),
+            obj.solicitacao_id,
+        )
+
+    @display(description="Links")
+    def links(self, obj):
+        items = [
+            format_html('<li><a href="{}">{}</a></li>', url, label)
+            for url, label in [(obj.url, "Diário no Moodle"), (obj.url_sala_coordenacao, "Sala de coordenação")]
+            if url
+        ]
+        if not items:
+            return "-"
+        return format_html("<ul>{}</ul>", format_html_join("", "{}", ((item,) for item in items)))
@@ -5,3 +5,9 @@ class IntegradorConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "integrador"
     icon = "fa fa-home"
+
+    def ready(self):
+        from integrador import cassette, tracing
+
+        tracing.configure()
+        cassette.configure()
@@ -0,0 +1,158 @@
+"""
+Framework de backfill para tarefas de manutenção em massa sobre a tabela de Solicitações.
+
+Cada tarefa percorre a tabela em lotes pela chave primária (keyset), aplica UPDATEs set-based sem trazer os JSONs
+para o Python, grava um checkpoint no banco ao fim de cada lote e respeita um limite de linhas por segundo.
+Intervalos de id diferentes podem ser processados em paralelo, cada um com o seu próprio checkpoint, e uma execução
+interrompida é retomada de onde parou.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min, QuerySet
+from django.utils.timezone import now
+
+from integrador.models import BackfillCheckpoint, Solicitacao
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillTask:
+    """Uma tarefa de backfill: quais linhas são candidatas e como atualizar um lote delas."""
+
+    name: str = None
+    model = Solicitacao
+
+    def get_queryset(self) -> QuerySet:
+        """Linhas candidatas. Deve ser barato de filtrar por intervalo de id."""
+        return self.model.objects.all()
+
+    def apply(self, lote: QuerySet) -> int:
+        """Atualiza o lote (já restrito a um intervalo de id) e retorna a quantidade de linhas alteradas."""
+        raise NotImplementedError("Este método deve ser implementado pelas subclasses.")
+
+
+class BackfillRunner:
+    def __init__(
+        self,
+        task: BackfillTask,
+        chunk_size: int = 1000,
+        rows_per_second: float | None = None,
+        workers: int = 1,
+        restart: bool = False,
+        report=None,
+    ):
+        self.task = task
+        self.chunk_size = chunk_size
+        self.rows_per_second = rows_per_second
+        self.workers = max(1, workers)
+        self.restart = restart
+        self.report = report or (lambda checkpoint, lote, taxa: None)
+
+    def checkpoints(self) -> list[BackfillCheckpoint]:
+        """Retoma os intervalos pendentes da última execução ou divide os candidatos em novos intervalos."""
+        existentes = BackfillCheckpoint.objects.filter(tarefa=self.task.name)
+        if self.restart or not existentes.filter(concluido_em__isnull=True).exists():
+            existentes.delete()
+        else:
+            return list(existentes.filter(concluido_em__isnull=True))
+
+        limites = self.task.get_queryset().aggregate(inicio=Min("id"), fim=Max("id"))
+        if limites["inicio"] is None:
+            return []
+
+        inicio, fim = limites["inicio"], limites["fim"]
+        tamanho = (fim - inicio) // self.workers + 1
+        return [
+            BackfillCheckpoint.objects.create(
+                tarefa=self.task.name, inicio=i, fim=min(i + tamanho - 1, fim), ultimo_id=i - 1
+            )
+            for i in range(inicio, fim + 1, tamanho)
+        ]
+
+    def run(self) -> int:
+        checkpoints = self.checkpoints()
+        if self.workers == 1 or len(checkpoints) <= 1:
+            return sum(self.run_range(c) for c in checkpoints)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return sum(executor.map(self._run_range_in_thread, checkpoints))
+
+    def _run_range_in_thread(self, checkpoint: BackfillCheckpoint) -> int:
+        try:
+            return self.run_range(checkpoint)
+        finally:
+            connection.close()
+
+    def run_range(self, checkpoint: BackfillCheckpoint) -> int:
+        limite = self.rows_per_second / self.workers if self.rows_per_second else None
+        candidatos = self.task.get_queryset().filter(id__lte=checkpoint.fim)
+        total = 0
+        while True:
+            inicio_lote = time.monotonic()
+            ids = list(
+                candidatos.filter(id__gt=checkpoint.ultimo_id)
+                .order_by("id")
+                .values_list("id", flat=True)[: self.chunk_size]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                atualizadas = self.task.apply(candidatos.filter(id__gte=ids[0], id__lte=ids[-1]))
+                checkpoint.ultimo_id = ids[-1]
+                checkpoint.linhas += atualizadas
+                checkpoint.save(update_fields=["ultimo_id", "linhas", "atualizado_em"])
+            total += atualizadas
+
+            decorrido = time.monotonic() - inicio_lote
+            if limite:
+                espera = len(ids) / limite - decorrido
+                if espera > 0:
+                    time.sleep(espera)
+                    decorrido += espera
+            self.report(checkpoint, len(ids), len(ids) / decorrido if decorrido > 0 else float(len(ids)))
+
+        checkpoint.concluido_em = now()
+        checkpoint.save(update_fields=["concluido_em", "atualizado_em"])
+        return total
+
+
+class BackfillCommand(BaseCommand):
+    """Base para management commands de backfill. Basta definir `task_class`."""
+
+    task_class: type[BackfillTask] = None
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Linhas por lote (padrão: 1000)")
+        parser.add_argument(
+            "--rows-per-second", type=float, default=None, help="Limite de linhas por segundo (padrão: sem limite)"
+        )
+        parser.add_argument("--workers", type=int, default=1, help="Intervalos de id processados em paralelo")
+        parser.add_argument("--restart", action="store_true", help="Descarta os checkpoints e recomeça do início")
+
+    def report(self, checkpoint: BackfillCheckpoint, lote: int, taxa: float):
+        self.stdout.write(
+            f"[{checkpoint.tarefa}] {checkpoint.inicio}-{checkpoint.fim}: {checkpoint.progresso:.1f}% "
+            f"(id {checkpoint.ultimo_id}, {checkpoint.linhas} atualizadas, lote de {lote}, {taxa:.0f} linhas/s)"
+        )
+
+    def get_task(self, options) -> BackfillTask:
+        """Instancia a tarefa. Sobrescreva para repassar opções próprias do comando."""
+        return self.task_class()
+
+    def handle(self, *args, **options):
+        runner = BackfillRunner(
+            self.get_task(options),
+            chunk_size=options["chunk_size"],
+            rows_per_second=options["rows_per_second"],
+            workers=options["workers"],
+            restart=options["restart"],
+            report=self.report,
+        )
+        total = runner.run()
+        self.stdout.write(self.style.SUCCESS(f"✓ {total} linhas atualizadas por {self.task_class.name}"))
@@ -1,19 +1,71 @@
+import contextlib
 import logging
+import threading
+from collections import OrderedDict
 
 import rule_engine
+from django.conf import settings
 
 from cohort.models import Cohort
+from integrador import metrics, tracing
+from integrador.timings import etapas_de
 
 logger = logging.getLogger(__name__)
 
+COHORT_RULE_FIELDS = ("rule_diario", "rule_coordenacao")
+# Regras compiladas mantidas por Ambiente; as menos usadas saem primeiro (as editadas no admin deixam de ser usadas).
+COHORT_RULES_MAX = getattr(settings, "BROKER_COHORT_RULES_MAX", 512)
+
+_regras_lock = threading.Lock()
+
+
+def _compila(regras: OrderedDict, cohort: Cohort, rule_field: str) -> rule_engine.Rule:
+    """A regra compilada do cohort, pelo id e pelo texto da regra: editá-la no admin a compila de novo."""
+    chave = (cohort.id, rule_field, getattr(cohort, rule_field))
+    with _regras_lock:
+        regra = regras.get(chave)
+        if regra is not None:
+            regras.move_to_end(chave)
+            return regra
+    regra = rule_engine.Rule(chave[2])
+    with _regras_lock:
+        regras[chave] = regra
+        while len(regras) > COHORT_RULES_MAX:
+            regras.popitem(last=False)
+    return regra
+
 
 class BaseBroker:
-    def __init__(self, solicitacao):
+    # Formato do payload recebido e plugin do Moodle atendidos; a chave do broker no `registry`.
+    payload_format: str | None = None
+    plugin: str | None = None
+    # Diários por chamada do `sync_down_grades_batch`; 0 se o plugin só baixa as notas de um diário por vez.
+    grades_batch_size: int = 0
+
+    def __init__(self, solicitacao, resources: dict | None = None):
         self.solicitacao = solicitacao
+        self.resources = resources or {}
+
+    @classmethod
+    def create_resources(cls, ambiente) -> dict:
+        """Recursos de longa duração do broker para o Ambiente, criados uma vez por versão da configuração."""
+        # As regras dos cohorts são compiladas aqui, e não a cada solicitação; as inválidas, em `cohort_matches`.
+        regras = OrderedDict()
+        for cohort in Cohort.objects.filter(active=True):
+            for rule_field in COHORT_RULE_FIELDS:
+                with contextlib.suppress(Exception):
+                    _compila(regras, cohort, rule_field)
+        return {"cohort_rules": regras}
+
+    @classmethod
+    def close_resources(cls, resources: dict) -> None:
+        pass
 
     @property
     def credentials(self) -> dict:
-        return {"Authentication": f"Token {self.solicitacao.ambiente.token}"}
+        ambiente = self.solicitacao.ambiente
+        token = getattr(ambiente, f"{self.plugin}_token") if self.plugin else ambiente.token
+        return {"Authentication": f"Token {token}"}
 
     def cast_cohort(self, c: Cohort) -> dict:
         return {
@@ -35,16 +87,20 @@ class BaseBroker:
 
     def cohort_matches(self, cohort: Cohort, rule_field: str) -> dict:
         try:
-            return rule_engine.Rule(getattr(cohort, rule_field)).matches(self.solicitacao.recebido)
+            with tracing.span("rule.cohort", {"integrador.cohort.id": cohort.id, "integrador.rule.field": rule_field}):
+                regra = _compila(self.resources.setdefault("cohort_rules", OrderedDict()), cohort, rule_field)
+                return regra.matches(self.solicitacao.recebido)
         except Exception as e:
-            logger.warning(f"Erro ao avaliar a regra do cohort {cohort.id} ({cohort.name}): {e}")
+            logger.warning("Erro ao avaliar a regra do cohort %s (%s): %s", cohort.id, cohort.name, e)
             return False
 
+    @tracing.traced()
     def get_cohort(self) -> list:
-        all_cohort = Cohort.objects.filter(active=True)
-        cohort_eligiveis = [self.cast_cohort(c) for c in all_cohort if self.cohort_matches(c, "rule_diario")] + [
-            self.cast_cohort(c) for c in all_cohort if self.cohort_matches(c, "rule_coordenacao")
-        ]
+        with metrics.COHORT_RESOLUTION.time(), etapas_de(self.solicitacao).medir("coortes"):
+            all_cohort = Cohort.objects.filter(active=True)
+            cohort_eligiveis = [self.cast_cohort(c) for c in all_cohort if self.cohort_matches(c, "rule_diario")] + [
+                self.cast_cohort(c) for c in all_cohort if self.cohort_matches(c, "rule_coordenacao")
+            ]
         return cohort_eligiveis
 
     def sync_up_enrolments(self) -> dict:
@@ -52,3 +108,11 @@ class BaseBroker:
 
     def sync_down_grades(self) -> dict:
         raise NotImplementedError("Este método deve ser implementado pelas subclasses.")
+
+    def sync_down_grades_if_changed(self, etag: str | None = None) -> tuple[dict | None, str | None]:
+        """As notas e o ETag delas, ou (None, `etag`) se não mudaram. Plugin sem ETag: baixa sempre, ETag None."""
+        return self.sync_down_grades(), None
+
+    def sync_down_grades_batch(self, diario_ids: list[str]) -> list[dict]:
+        """As notas de vários diários do Ambiente da solicitação, uma resposta (ou `error`) por diário."""
+        raise NotImplementedError("Este método deve ser implementado pelas subclasses com grades_batch_size.")
@@ -0,0 +1,98 @@
+"""
+Registro dos brokers: qual broker atende cada par (formato do payload, plugin do Moodle) e qual atende cada Ambiente.
+
+O broker de um Ambiente é resolvido uma vez por versão da configuração dele (`Ambiente.config_version`: URL, plugins
+ativos e tokens) e por formato de payload. O plugin é o primeiro, na ordem de `Ambiente.which_broker`, que o Ambiente
+pode usar e que tem broker para o formato. Os recursos de longa duração do broker (pools de conexões ou de threads,
+regras compiladas, estado de circuit breaker) são criados por `create_resources` junto com a resolução e
+compartilhados pelas solicitações do Ambiente; uma mudança na configuração gera novos recursos na próxima solicitação
+e fecha os da versão anterior.
+"""
+
+import logging
+import threading
+
+from integrador.brokers.base import BaseBroker
+from integrador.brokers.sga2tool_sga import Sga2ToolSgaBroker
+from integrador.brokers.suap2local_suap import Suap2LocalSuapBroker
+from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
+from integrador.utils import SyncError
+
+logger = logging.getLogger(__name__)
+
+# A mesma preferência de `Ambiente.which_broker`.
+PLUGINS = ("tool_sga", "local_suap")
+
+
+def payload_format(recebido: dict | None) -> str:
+    """`sga` para o formato genérico do SGA (com `unidade` ou `diarios`); `suap` para os demais."""
+    return "sga" if isinstance(recebido, dict) and ("unidade" in recebido or "diarios" in recebido) else "suap"
+
+
+class RegisteredBroker:
+    """O broker de um Ambiente numa versão da configuração, com os seus recursos de longa duração."""
+
+    def __init__(self, broker_class: type[BaseBroker], ambiente):
+        self.broker_class = broker_class
+        self.config_version = ambiente.config_version
+        self.resources = broker_class.create_resources(ambiente)
+
+    def __call__(self, solicitacao) -> BaseBroker:
+        return self.broker_class(solicitacao, self.resources)
+
+    def close(self) -> None:
+        self.broker_class.close_resources(self.resources)
+
+
+class BrokerRegistry:
+    def __init__(self):
+        self._classes = {}
+        self._ambientes = {}
+        self._lock = threading.Lock()
+
+    def register(self, broker_class: type[BaseBroker]) -> type[BaseBroker]:
+        self._classes[(broker_class.payload_format, broker_class.plugin)] = broker_class
+        return broker_class
+
+    def broker_class(self, ambiente, formato: str) -> type[BaseBroker]:
+        for plugin in PLUGINS:
+            if getattr(ambiente, f"can_send_to_{plugin}") and (formato, plugin) in self._classes:
+                return self._classes[(formato, plugin)]
+        raise SyncError(
+            f"O ambiente {ambiente.nome} não está configurado para enviar dados no formato {formato}"
+            " para o Local SUAP ou Tool SGA. Contacte um administrador.",
+            500,
+        )
+
+    def resolve(self, ambiente, formato: str = "suap") -> RegisteredBroker:
+        chave = (ambiente.pk, formato)
+        registrado = self._ambientes.get(chave)
+        if registrado is not None and registrado.config_version == ambiente.config_version:
+            return registrado
+        with self._lock:
+            anterior = registrado = self._ambientes.get(chave)
+            if registrado is None or registrado.config_version != ambiente.config_version:
+                registrado = self._ambientes[chave] = RegisteredBroker(self.broker_class(ambiente, formato), ambiente)
+                logger.info("Ambiente %s: broker %s (%s)", ambiente.nome, registrado.broker_class.__name__, formato)
+            else:
+                anterior = None
+        if anterior is not None:
+            # O fechamento não interrompe o trabalho já entregue aos recursos antigos (veja `close_resources`).
+            anterior.close()
+        return registrado
+
+    def broker_for(self, solicitacao) -> BaseBroker:
+        """O broker da solicitação, pelo seu Ambiente e pelo formato do payload recebido."""
+        return self.resolve(solicitacao.ambiente, payload_format(solicitacao.recebido))(solicitacao)
+
+    def clear(self) -> None:
+        with self._lock:
+            registrados, self._ambientes = list(self._ambientes.values()), {}
+        for registrado in registrados:
+            registrado.close()
+
+
+registry = BrokerRegistry()
+registry.register(Suap2LocalSuapBroker)
+registry.register(Suap2ToolSgaBroker)
+registry.register(Sga2ToolSgaBroker)
@@ -1,13 +1,222 @@
+import contextlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.client import HTTPException
 
+from django.conf import settings
+
+from integrador import tracing
 from integrador.brokers.base import BaseBroker
+from integrador.brokers.sga2tool_sga.batching import encode, split, validate
+from integrador.brokers.suap2tool_sga import GRADES_BATCH_SIZE
+from integrador.timings import etapas_de
+from integrador.utils import SyncError, http_get_json, http_get_json_if_changed, http_post_json
 
 logger = logging.getLogger(__name__)
 
+BATCH_INSCRICOES = getattr(settings, "TOOL_SGA_BATCH_INSCRICOES", 2000)
+BATCH_WORKERS = getattr(settings, "TOOL_SGA_BATCH_WORKERS", 4)
+BATCH_RETRIES = getattr(settings, "TOOL_SGA_BATCH_RETRIES", 2)
+BATCH_RETRY_BACKOFF = getattr(settings, "TOOL_SGA_BATCH_RETRY_BACKOFF", 0.5)
+
+
+def _status_de(e: Exception) -> int:
+    status = getattr(e, "code", None) or getattr(e, "status", None)
+    return int(status) if str(status).isdigit() else 500
+
 
 class Sga2ToolSgaBroker(BaseBroker):
+    """
+    Envia o payload do SGA genérico ao `tool_sga` em lotes (veja `batching`).
+
+    Os lotes são enviados ao `sync_up_batch` por até `batch_workers` threads; um lote que falha com erro transitório
+    (5xx ou falha de conexão) é reenviado com a mesma `batch_key`. Depois do primeiro lote que falha de vez, os que
+    ainda não começaram não são enviados e a solicitação falha com o código do erro: reenviá-la é seguro, os lotes
+    já aplicados não são reaplicados.
+
+    Registrado (veja `integrador.brokers.registry`), o broker usa o pool de threads do Ambiente; instanciado direto,
+    um pool só para a solicitação.
+    """
+
+    payload_format = "sga"
+    plugin = "tool_sga"
+    grades_batch_size = GRADES_BATCH_SIZE
+
+    batch_inscricoes = BATCH_INSCRICOES
+    batch_workers = BATCH_WORKERS
+    batch_retries = BATCH_RETRIES
+    batch_retry_backoff = BATCH_RETRY_BACKOFF
+
+    @classmethod
+    def create_resources(cls, ambiente) -> dict:
+        # Um pool por Ambiente, compartilhado pelas solicitações: limita também os lotes simultâneos no Moodle dele.
+        return super().create_resources(ambiente) | {
+            "executor": ThreadPoolExecutor(max_workers=cls.batch_workers, thread_name_prefix=f"tool-sga-{ambiente.pk}")
+        }
+
+    @classmethod
+    def close_resources(cls, resources: dict) -> None:
+        # Os lotes já entregues ao pool ainda são enviados; as threads terminam em seguida.
+        resources["executor"].shutdown(wait=False)
+
+    @property
+    def moodle_base_api_url(self):
+        return f"{self.solicitacao.ambiente.base_url}/admin/tool/sga/api"
+
+    def get_service_url(self, service: str) -> str:
+        return f"{self.moodle_base_api_url}/index.php?{service}"
+
+    def send_batch(self, lote: list[dict], url: str, headers: dict) -> dict:
+        batch_key, corpo = encode(lote)
+        for tentativa in range(self.batch_retries + 1):
+            try:
+                return http_post_json(url, headers=dict(headers), data=corpo)
+            except (SyncError, HTTPException) as e:
+                if _status_de(e) < 500 or tentativa == self.batch_retries:
+                    raise
+                logger.warning("Lote %s falhou (%s), tentativa %d; reenviando", batch_key, e, tentativa + 1)
+                time.sleep(self.batch_retry_backoff * 2**tentativa)
+
+    def send_batches(self, lotes: list[list[dict]]) -> list[dict]:
+        """As respostas dos lotes, na ordem dos lotes."""
+        # URL e credenciais são lidas aqui: as threads não consultam o banco.
+        url, headers = self.get_service_url("sync_up_batch"), self.credentials
+        falhou = threading.Event()
+
+        def envia(lote: list[dict]) -> dict | None:
+            # Depois da primeira falha, os lotes que ainda não começaram não são enviados.
+            if falhou.is_set():
+                return None
+            try:
+                return self.send_batch(lote, url, headers)
+            except Exception:
+                falhou.set()
+                raise
+
+        compartilhado = self.resources.get("executor")
+        proprio = None
+
+        def submete(lote: list[dict]):
+            nonlocal proprio
+            if proprio is None and compartilhado is not None:
+                # O pool do Ambiente pode ter sido fechado por uma mudança na configuração durante a solicitação.
+                with contextlib.suppress(RuntimeError):
+                    return compartilhado.submit(envia, lote)
+            if proprio is None:
+                proprio = ThreadPoolExecutor(max_workers=self.batch_workers, thread_name_prefix="tool-sga")
+            return proprio.submit(envia, lote)
+
+        try:
+            futuros = [submete(lote) for lote in lotes]
+            wait(futuros)
+        finally:
+            if proprio is not None:
+                proprio.shutdown()
+        falhas = [i for i, futuro in enumerate(futuros) if futuro.exception() is not None]
+        if falhas:
+            erro = futuros[falhas[0]].exception()
+            enviados = sum(1 for futuro in futuros if futuro.exception() is None and futuro.result() is not None)
+            raise SyncError(
+                f"Erro no lote {falhas[0] + 1} de {len(lotes)} ao enviar ao Moodle:"
+                f" {getattr(erro, 'message', erro)}. {enviados} lotes foram aplicados;"
+                " reenviar a solicitação não os reaplica.",
+                _status_de(erro),
+                retorno=getattr(erro, "retorno", None),
+            ) from erro
+        return [futuro.result() for futuro in futuros]
+
+    @staticmethod
+    def merge(respostas: list[dict]) -> list[dict]:
+        """Uma resposta por diário, somando as inscrições das partes enviadas em lotes diferentes."""
+        diarios = {}
+        for resposta in respostas:
+            for parte in resposta.get("diarios") or []:
+                diario = diarios.get(parte["diario_id"])
+                if diario is None:
+                    diarios[parte["diario_id"]] = {**parte, "inscricoes": dict(parte.get("inscricoes") or {})}
+                    continue
+                for chave, quantidade in (parte.get("inscricoes") or {}).items():
+                    diario["inscricoes"][chave] = diario["inscricoes"].get(chave, 0) + quantidade
+        return list(diarios.values())
+
+    @tracing.traced()
     def sync_up_enrolments(self) -> dict:
-        raise NotImplementedError("Ainda não implementado.")
+        recebido = self.solicitacao.recebido or {}
+        diarios = validate(recebido)
 
+        try:
+            coortes = self.get_cohort()
+        except Exception as e:
+            raise SyncError(
+                "Erro ao tentar obter as COORTES "
+                + "antes mesmo de iniciar a integração com o Moodle."
+                + f" Contacte um administrador. Erro: {e}.",
+                getattr(e, "code", 525),
+            )
+
+        lotes = list(split(diarios, self.batch_inscricoes, coortes))
+        # O recebido já tem os diários; o enviado registra só como eles foram divididos.
+        self.solicitacao.enviado = {
+            "sga": recebido.get("sga"),
+            "lotes": [
+                {
+                    "diarios": [str(parte["diario"]["id"]) for parte in lote],
+                    "inscricoes": sum(len(p["inscricoes"]) for p in lote),
+                }
+                for lote in lotes
+            ],
+        }
+        try:
+            with etapas_de(self.solicitacao).medir("enviado"):
+                self.solicitacao.save(update_fields=["enviado"])
+        except Exception as e:
+            raise SyncError(
+                "Erro ao tentar SALVAR o payload "
+                + "antes mesmo de ser enviado ao Moodle."
+                + f" Contacte um administrador. Erro: {e}.",
+                getattr(e, "code", 527),
+            )
+
+        with etapas_de(self.solicitacao).medir("moodle"):
+            respostas = self.send_batches(lotes)
+
+        result = {
+            "ambiente": self.solicitacao.ambiente.base_url,
+            "diarios": self.merge(respostas),
+            "lotes": [
+                {"batch_key": resposta.get("batch_key"), "repetido": bool(resposta.get("repetido"))}
+                for resposta in respostas
+            ],
+        }
+        if len(result["diarios"]) == 1:
+            result.update(
+                url=result["diarios"][0].get("url"),
+                url_sala_coordenacao=result["diarios"][0].get("url_sala_coordenacao"),
+            )
+        return result
+
+    @tracing.traced()
     def sync_down_grades(self) -> dict:
-        raise NotImplementedError("Ainda não implementado.")
+        with etapas_de(self.solicitacao).medir("moodle"):
+            return http_get_json(
+                f"{self.get_service_url('sync_down_grades')}&diario_id={self.solicitacao.diario_id}",
+                headers=self.credentials,
+            )
+
+    @tracing.traced()
+    def sync_down_grades_if_changed(self, etag: str | None = None) -> tuple[dict | None, str | None]:
+        with etapas_de(self.solicitacao).medir("moodle"):
+            return http_get_json_if_changed(
+                f"{self.get_service_url('sync_down_grades')}&diario_id={self.solicitacao.diario_id}",
+                headers=self.credentials,
+                etag=etag,
+            )
+
+    @tracing.traced()
+    def sync_down_grades_batch(self, diario_ids: list[str]) -> list[dict]:
+        resposta = http_post_json(
+            self.get_service_url("sync_down_grades_batch"), {"diario_ids": list(diario_ids)}, self.credentials
+        )
+        return resposta.get("diarios") or []
@@ -0,0 +1,102 @@
+"""
+Divisão de um payload do SGA genérico em lotes para o serviço `sync_up_batch` do `tool_sga`.
+
+Um payload é um diário no formato genérico do SGA ou, para as cargas de semestre inteiro (SIGAA, qAcadêmico etc.),
+`{"sga": ..., "diarios": [...]}`. As inscrições dos diários são divididas em lotes de no máximo `max_inscricoes`: um
+lote junta vários diários pequenos e um diário grande vai em partes, cada uma com os dados do diário e uma fatia das
+inscrições (o `tool_sga` mantém as inscrições que não vêm no envio, então as partes se somam). As partes são dicts
+rasos com fatias das listas do `recebido`; nada é copiado em profundidade.
+
+Cada lote é serializado uma única vez e a `batch_key` vem dos diários do lote e do hash desse JSON: reenviar o mesmo
+lote, numa retentativa ou numa nova solicitação (o reenvio do SGA ou o "Reenviar" do admin), não o reaplica no Moodle.
+"""
+
+import hashlib
+import json
+from collections.abc import Iterator
+
+from integrador.utils import SyncError
+
+REQUIRED_FIELDS = {
+    "unidade": ["sigla"],
+    "curso": ["id", "codigo"],
+    "turma": ["codigo"],
+    "diario": ["id", "codigo"],
+}
+
+# Erros listados na resposta 422, no máximo.
+MAX_ERROS = 20
+
+
+def diarios_de(recebido: dict) -> list:
+    return recebido["diarios"] if isinstance(recebido.get("diarios"), list) else [recebido]
+
+
+def _erros_do_diario(diario) -> list[str]:
+    if not isinstance(diario, dict):
+        return ["não é um objeto JSON"]
+    erros = [
+        f"{field}.{sub}"
+        for field, subfields in REQUIRED_FIELDS.items()
+        for sub in subfields
+        if not isinstance(diario.get(field), dict) or sub not in diario[field]
+    ]
+    inscricoes = diario.get("inscricoes") or []
+    if not isinstance(inscricoes, list) or any(
+        not isinstance(i, dict) or "login" not in i or "papel" not in i for i in inscricoes
+    ):
+        erros.append("inscricoes[].login/papel")
+    return erros
+
+
+def validate(recebido: dict) -> list[dict]:
+    """Os diários do payload. Levanta SyncError (422) com os campos obrigatórios ausentes em cada diário."""
+    diarios = diarios_de(recebido)
+    if not diarios:
+        raise SyncError("O payload do SGA não tem diários.", 422)
+    erros = [
+        f"diário {indice}: {', '.join(faltando)}"
+        for indice, diario in enumerate(diarios)
+        if (faltando := _erros_do_diario(diario))
+    ]
+    if erros:
+        mais = f" e mais {len(erros) - MAX_ERROS} diários" if len(erros) > MAX_ERROS else ""
+        raise SyncError(
+            f"Campos obrigatórios ausentes no payload do SGA: {'; '.join(erros[:MAX_ERROS])}{mais}.",
+            422,
+        )
+    return diarios
+
+
+def split(diarios: list[dict], max_inscricoes: int, coortes: list | None = None) -> Iterator[list[dict]]:
+    """
+    Os lotes, na ordem dos diários, cada um com no máximo `max_inscricoes` inscrições.
+
+    Um diário sem inscrições conta como uma. As `coortes` vão só na primeira parte de cada diário, somadas às do
+    próprio diário.
+    """
+    lote, peso = [], 0
+    for diario in diarios:
+        inscricoes = diario.get("inscricoes") or []
+        for inicio in range(0, max(len(inscricoes), 1), max_inscricoes):
+            parte = {**diario, "inscricoes": inscricoes[inicio : inicio + max_inscricoes]}
+            if inicio == 0:
+                parte["coortes"] = [*(diario.get("coortes") or []), *(coortes or [])]
+            else:
+                parte["coortes"] = []
+            tamanho = max(len(parte["inscricoes"]), 1)
+            if lote and peso + tamanho > max_inscricoes:
+                yield lote
+                lote, peso = [], 0
+            lote.append(parte)
+            peso += tamanho
+    if lote:
+        yield lote
+
+
+def encode(lote: list[dict]) -> tuple[str, bytes]:
+    """A `batch_key` e o corpo do `sync_up_batch` do lote, serializando os diários uma única vez."""
+    diarios = json.dumps(lote, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    ids = ",".join(str(parte["diario"]["id"]) for parte in lote)
+    batch_key = hashlib.sha256(f"{ids}:{hashlib.sha256(diarios).hexdigest()}".encode()).hexdigest()
+    return batch_key, b'{"batch_key":"' + batch_key.encode("ascii") + b'","diarios":' + diarios + b"}"
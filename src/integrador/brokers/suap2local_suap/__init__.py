@@ -1,7 +1,9 @@
 import copy
 import logging
 
+from integrador import tracing
 from integrador.brokers.base import BaseBroker
+from integrador.timings import etapas_de
 from integrador.utils import SyncError, http_get_json, http_post_json
 
 logger = logging.getLogger(__name__)
@@ -16,23 +18,27 @@ _SYNC_UP_REQUIRED_FIELDS = {
 
 
 class Suap2LocalSuapBroker(BaseBroker):
+    payload_format = "suap"
+    plugin = "local_suap"
 
     @property
     def moodle_base_api_url(self):
         return f"{self.solicitacao.ambiente.base_url}/local/suap/api"
 
     def __get_service_url(self, service: str) -> str:
-        logger.debug(f"{self.moodle_base_api_url}/index.php?{service}")
+        logger.debug("%s/index.php?%s", self.moodle_base_api_url, service)
         return f"{self.moodle_base_api_url}/index.php?{service}"
 
     def __get_json(self, service: str, **params: dict):
         querystring = "&".join([f"{k}={v}" for k, v in params.items() if v is not None]) if params is not None else ""
-        result = http_get_json(f"{self.__get_service_url(service)}&{querystring}", headers=self.credentials)
-        logger.debug(f"Response: {result}")
+        with etapas_de(self.solicitacao).medir("moodle"):
+            result = http_get_json(f"{self.__get_service_url(service)}&{querystring}", headers=self.credentials)
+        logger.debug("Response: %s", result)
         return result
 
     def __post_json(self, service: str, jsonbody: dict):
-        result = http_post_json(self.__get_service_url(service), jsonbody, self.credentials)
+        with etapas_de(self.solicitacao).medir("moodle"):
+            result = http_post_json(self.__get_service_url(service), jsonbody, self.credentials)
         return result
 
     def _validate_sync_payload(self, payload: dict) -> None:
@@ -48,6 +54,7 @@ class Suap2LocalSuapBroker(BaseBroker):
                 422,
             )
 
+    @tracing.traced()
     def _set_restricoes(self, enviados: dict) -> None:
         def get_tipos_usuarios(ai: dict) -> str:
             tipos_usuarios = []
@@ -99,6 +106,7 @@ class Suap2LocalSuapBroker(BaseBroker):
         if payload["turma"].get("autoinscricao") is None:
             payload["turma"]["autoinscricao"] = payload.get("autoinscricao") is not None
 
+    @tracing.traced()
     def sync_up_enrolments(self) -> dict:
         self._validate_sync_payload(self.solicitacao.recebido)
         self.solicitacao.enviado = copy.deepcopy(self.solicitacao.recebido) if self.solicitacao.recebido else {}
@@ -117,7 +125,8 @@ class Suap2LocalSuapBroker(BaseBroker):
             )
 
         try:
-            self._set_restricoes(self.solicitacao.enviado)
+            with etapas_de(self.solicitacao).medir("restricoes"):
+                self._set_restricoes(self.solicitacao.enviado)
         except Exception as e:
             raise SyncError(
                 "Erro ao tentar processar as RESTRIÇÕES do curso com autoinscrição "
@@ -127,7 +136,8 @@ class Suap2LocalSuapBroker(BaseBroker):
             )
 
         try:
-            self.solicitacao.save(update_fields=["enviado"])
+            with etapas_de(self.solicitacao).medir("enviado"):
+                self.solicitacao.save(update_fields=["enviado"])
         except Exception as e:
             raise SyncError(
                 "Erro ao tentar SALVAR o payload "
@@ -143,5 +153,6 @@ class Suap2LocalSuapBroker(BaseBroker):
             result.pop(key, None)
         return result
 
+    @tracing.traced()
     def sync_down_grades(self) -> dict:
         return self.__get_json("sync_down_grades", diario_id=self.solicitacao.diario_id)
@@ -1,13 +1,87 @@
 import logging
 
+from django.conf import settings
+
+from integrador import tracing
 from integrador.brokers.base import BaseBroker
+from integrador.brokers.suap2tool_sga.translator import translate, validate
+from integrador.timings import etapas_de
+from integrador.utils import SyncError, http_get_json, http_get_json_if_changed, http_post_json
 
 logger = logging.getLogger(__name__)
 
+GRADES_BATCH_SIZE = getattr(settings, "TOOL_SGA_GRADES_BATCH_SIZE", 100)
+
 
 class Suap2ToolSgaBroker(BaseBroker):
-    def sync_up_enrolments(self):
-        raise NotImplementedError("Ainda não implementado.")
+    payload_format = "suap"
+    plugin = "tool_sga"
+    grades_batch_size = GRADES_BATCH_SIZE
+
+    @property
+    def moodle_base_api_url(self):
+        return f"{self.solicitacao.ambiente.base_url}/admin/tool/sga/api"
+
+    def get_service_url(self, service: str) -> str:
+        return f"{self.moodle_base_api_url}/index.php?{service}"
+
+    @tracing.traced()
+    def sync_up_enrolments(self) -> dict:
+        recebido = self.solicitacao.recebido or {}
+        validate(recebido)
+        solicitacao_url = f"{self.solicitacao.site_url}/integrador/solicitacao/{self.solicitacao.id}/view/"
+
+        try:
+            coortes = self.get_cohort()
+        except Exception as e:
+            raise SyncError(
+                "Erro ao tentar obter as COORTES "
+                + "antes mesmo de iniciar a integração com o Moodle."
+                + f" Contacte um administrador. Erro: {e}.",
+                getattr(e, "code", 525),
+            )
+
+        with etapas_de(self.solicitacao).medir("traducao"):
+            self.solicitacao.enviado = translate(recebido, coortes, solicitacao_url)
+
+        try:
+            with etapas_de(self.solicitacao).medir("enviado"):
+                self.solicitacao.save(update_fields=["enviado"])
+        except Exception as e:
+            raise SyncError(
+                "Erro ao tentar SALVAR o payload "
+                + "antes mesmo de ser enviado ao Moodle."
+                + f" Contacte um administrador. Erro: {e}.",
+                getattr(e, "code", 527),
+            )
+
+        with etapas_de(self.solicitacao).medir("moodle"):
+            result = http_post_json(
+                self.get_service_url("sync_up_enrolments"), self.solicitacao.enviado, self.credentials
+            )
+        result["ambiente"] = self.solicitacao.ambiente.base_url
+        return result
+
+    @tracing.traced()
+    def sync_down_grades(self) -> dict:
+        with etapas_de(self.solicitacao).medir("moodle"):
+            return http_get_json(
+                f"{self.get_service_url('sync_down_grades')}&diario_id={self.solicitacao.diario_id}",
+                headers=self.credentials,
+            )
+
+    @tracing.traced()
+    def sync_down_grades_if_changed(self, etag: str | None = None) -> tuple[dict | None, str | None]:
+        with etapas_de(self.solicitacao).medir("moodle"):
+            return http_get_json_if_changed(
+                f"{self.get_service_url('sync_down_grades')}&diario_id={self.solicitacao.diario_id}",
+                headers=self.credentials,
+                etag=etag,
+            )
 
-    def sync_down_grades(self):
-        raise NotImplementedError("Ainda não implementado.")
+    @tracing.traced()
+    def sync_down_grades_batch(self, diario_ids: list[str]) -> list[dict]:
+        resposta = http_post_json(
+            self.get_service_url("sync_down_grades_batch"), {"diario_ids": list(diario_ids)}, self.credentials
+        )
+        return resposta.get("diarios") or []
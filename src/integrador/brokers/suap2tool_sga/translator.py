@@ -0,0 +1,122 @@
+"""
+Tradução do payload do SUAP (`SUDiario.schema.json`) para o formato genérico do SGA, o do plugin `tool_sga`.
+
+A tradução é uma única passada pelo payload: os campos do diário são mapeados e os alunos, professores e membros da
+equipe viram `inscricoes` à medida que são lidos, sem `copy.deepcopy` nem listas intermediárias. Os valores (strings,
+números e os objetos que o formato genérico repassa, como `autoinscricao`) são compartilhados com o `recebido`, não
+copiados; o custo é linear no tamanho do diário e a memória extra é a do dict de cada inscrição.
+"""
+
+from collections.abc import Iterator
+
+from integrador.utils import SyncError
+
+SGA = "suap"
+
+REQUIRED_FIELDS = {
+    "campus": ["id", "sigla"],
+    "curso": ["id", "codigo"],
+    "turma": ["id", "codigo"],
+    "componente": ["id", "sigla"],
+    "diario": ["id", "sigla"],
+}
+
+# Tipo do professor no SUAP: papel da inscrição no SGA. Tipos não listados viram `professor`.
+PAPEIS_PROFESSOR = {
+    "Principal": "professor",
+    "Formador": "formador",
+    "Tutor": "tutor",
+    "Moderador": "moderador",
+}
+
+
+def validate(recebido: dict) -> None:
+    missing = [
+        f"{field}.{sub}"
+        for field, subfields in REQUIRED_FIELDS.items()
+        for sub in subfields
+        if not isinstance(recebido.get(field), dict) or sub not in recebido[field]
+    ]
+    if missing:
+        raise SyncError(f"Campos obrigatórios ausentes no payload do SUAP: {', '.join(missing)}.", 422)
+
+
+def _situacao(valor) -> str:
+    return "ativo" if str(valor or "ativo").lower() in ("ativo", "ativa") else "suspenso"
+
+
+def _polo(polo: dict | None) -> dict | None:
+    return {"id": polo.get("id"), "nome": polo.get("descricao") or polo.get("nome")} if polo else None
+
+
+def iter_inscricoes(recebido: dict) -> Iterator[dict]:
+    """As inscrições do diário, uma por aluno, professor e membro da equipe, na ordem do payload."""
+    # Os alunos de um diário vêm de poucos polos: cada polo é traduzido uma vez e compartilhado entre as inscrições.
+    polos = {}
+    for aluno in recebido.get("alunos") or ():
+        polo = aluno.get("polo")
+        if polo and polo.get("id") not in polos:
+            polos[polo.get("id")] = _polo(polo)
+        yield {
+            "papel": "aluno",
+            "login": aluno.get("username") or aluno["matricula"],
+            "matricula": aluno["matricula"],
+            "nome": aluno.get("nome"),
+            "email": aluno.get("email") or aluno.get("email_secundario"),
+            "situacao": _situacao(aluno.get("situacao_diario") or aluno.get("situacao")),
+            "polo": polos[polo.get("id")] if polo else None,
+            "programa": aluno.get("programa"),
+        }
+    for professor in recebido.get("professores") or ():
+        yield {
+            "papel": PAPEIS_PROFESSOR.get(professor.get("tipo"), "professor"),
+            "login": professor.get("username") or professor["login"],
+            "nome": professor.get("nome"),
+            "email": professor.get("email") or professor.get("email_secundario"),
+            "situacao": _situacao(professor.get("status")),
+        }
+    for membro in recebido.get("equipe") or ():
+        yield {
+            "papel": "equipe",
+            "login": membro["username"],
+            "nome": membro.get("nome"),
+            "email": membro.get("email") or membro.get("email_secundario"),
+            "situacao": "ativo" if membro.get("ativo", True) else "suspenso",
+            "papeis": membro.get("papeis") or [],
+        }
+
+
+def translate(recebido: dict, coortes: list | None = None, solicitacao_url: str | None = None) -> dict:
+    """O diário no formato genérico do SGA. Levanta SyncError (422) se faltar um campo obrigatório."""
+    validate(recebido)
+    try:
+        inscricoes = list(iter_inscricoes(recebido))
+    except KeyError as e:
+        raise SyncError(f"Campo obrigatório ausente em aluno, professor ou membro da equipe: {e}.", 422) from e
+    campus, curso, turma = recebido["campus"], recebido["curso"], recebido["turma"]
+    componente, diario = recebido["componente"], recebido["diario"]
+    return {
+        "sga": SGA,
+        "unidade": {"id": campus["id"], "sigla": campus["sigla"], "nome": campus.get("descricao")},
+        "polo": _polo(recebido.get("polo")),
+        "curso": {"id": curso["id"], "codigo": curso["codigo"], "nome": curso.get("nome")},
+        "turma": {"id": turma["id"], "codigo": turma["codigo"]},
+        "disciplina": {
+            "id": componente["id"],
+            "sigla": componente["sigla"],
+            "nome": componente.get("descricao"),
+            "periodo": componente.get("periodo"),
+            "avaliacoes": componente.get("qtd_avaliacoes") or 1,
+        },
+        "diario": {
+            "id": diario["id"],
+            "codigo": f"{turma['codigo']}.{diario['sigla']}#{diario['id']}",
+            "situacao": diario.get("situacao"),
+            "tipo": diario.get("tipo", "regular"),
+            "nome": diario.get("descricao") or componente.get("descricao"),
+        },
+        "autoinscricao": recebido.get("autoinscricao"),
+        "inscricoes": inscricoes,
+        "coortes": coortes or [],
+        "solicitacao_url": solicitacao_url,
+    }
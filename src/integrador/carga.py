@@ -0,0 +1,326 @@
+"""
+Teste de carga do integrador (`manage.py teste_carga`).
+
+Reenvia requisições a um integrador em execução, a partir de um arquivo NDJSON, das últimas Solicitações gravadas ou
+de payloads sintéticos, numa taxa alvo (`rps`, em malha aberta) ou com um número fixo de clientes simultâneos (em
+malha fechada). Ao final informa a vazão, as latências p50/p95/p99, os erros por status e as conexões do banco.
+
+Cada linha do NDJSON é um objeto `{"method": "POST", "path": "/api/enviar_diarios/", "body": {...}}`; uma linha sem
+`path` é tratada como o body de um `enviar_diarios`.
+
+Em malha aberta a latência é contada a partir do instante em que a requisição deveria ter saído, e não de quando saiu:
+se o integrador não acompanha a taxa, a espera aparece na latência em vez de sumir da medição.
+"""
+
+import http.client
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from django.db import connection
+
+from integrador.models import Solicitacao
+
+logger = logging.getLogger(__name__)
+
+SYNC_UP_PATH = "/api/enviar_diarios/"
+SYNC_DOWN_PATH = "/api/baixar_notas/"
+# Campus que nenhum Ambiente real seleciona: com o Moodle mock, as requisições são levadas para ele.
+CAMPUS_CARGA = "CARGA"
+
+
+def requisicao(method: str, path: str, body: dict | None = None) -> dict:
+    return {"method": method.upper(), "path": path, "body": body}
+
+
+def le_ndjson(arquivo) -> list[dict]:
+    requisicoes = []
+    for numero, linha in enumerate(arquivo, start=1):
+        if not linha.strip():
+            continue
+        try:
+            dados = json.loads(linha)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Linha {numero} não é um JSON válido: {e}") from e
+        if "path" in dados:
+            requisicoes.append(requisicao(dados.get("method", "GET"), dados["path"], dados.get("body")))
+        else:
+            requisicoes.append(requisicao("POST", SYNC_UP_PATH, dados))
+    return requisicoes
+
+
+def escreve_ndjson(requisicoes: list[dict], arquivo) -> None:
+    for item in requisicoes:
+        arquivo.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def de_solicitacoes(limite: int) -> list[dict]:
+    """Requisições equivalentes às últimas `limite` Solicitações gravadas, na ordem em que chegaram."""
+    requisicoes = []
+    solicitacoes = (
+        Solicitacao.objects.filter(recebido__isnull=False)
+        .order_by("-id")
+        .values("operacao", "recebido", "campus_sigla", "diario_id")[:limite]
+    )
+    for solicitacao in reversed(list(solicitacoes)):
+        if solicitacao["operacao"] == Solicitacao.Operacao.SYNC_DOWN_NOTAS:
+            query = urlencode({"campus_sigla": solicitacao["campus_sigla"], "diario_id": solicitacao["diario_id"]})
+            requisicoes.append(requisicao("GET", f"{SYNC_DOWN_PATH}?{query}"))
+        else:
+            requisicoes.append(requisicao("POST", SYNC_UP_PATH, solicitacao["recebido"]))
+    return requisicoes
+
+
+def no_campus(requisicoes: list[dict], sigla: str = CAMPUS_CARGA) -> list[dict]:
+    """As requisições com o campus (ou a unidade, no formato genérico do SGA) trocado por `sigla`."""
+
+    def troca(payload):
+        if not isinstance(payload, dict):
+            return payload
+        trocado = dict(payload)
+        for chave in ("campus", "unidade"):
+            if isinstance(payload.get(chave), dict):
+                trocado[chave] = {**payload[chave], "sigla": sigla}
+        if isinstance(payload.get("diarios"), list):
+            trocado["diarios"] = [troca(diario) for diario in payload["diarios"]]
+        return trocado
+
+    trocadas = []
+    for item in requisicoes:
+        partes = urlsplit(item["path"])
+        if partes.query:
+            query = [(chave, sigla if chave == "campus_sigla" else valor) for chave, valor in parse_qsl(partes.query)]
+            path = f"{partes.path}?{urlencode(query)}"
+        else:
+            path = item["path"]
+        trocadas.append(requisicao(item["method"], path, troca(item["body"])))
+    return trocadas
+
+
+def payload_sintetico(diario_id: int, alunos: int, campus_sigla: str = "ZL") -> dict:
+    return {
+        "campus": {"id": 1, "sigla": campus_sigla, "descricao": f"CAMPUS {campus_sigla}"},
+        "curso": {"id": 10 + diario_id % 50, "codigo": f"{15000 + diario_id % 50}", "nome": "Curso sintético"},
+        "turma": {"id": diario_id, "codigo": f"20261.1.{15000 + diario_id % 50}.{diario_id}E"},
+        "componente": {"id": 5 + diario_id % 200, "sigla": f"COMP.{diario_id % 200:04d}", "descricao": "Componente"},
+        "diario": {"id": diario_id, "sigla": f"COMP.{diario_id % 200:04d}", "situacao": "Aberto"},
+        "professores": [
+            {"id": diario_id, "nome": "Professor", "email": f"prof{diario_id}@carga.local", "login": f"{diario_id}"}
+        ],
+        "alunos": [
+            {
+                "id": i,
+                "nome": f"Aluno {i}",
+                "email": f"aluno{i}@carga.local",
+                "email_secundario": "",
+                "matricula": f"2026{i:07d}",
+                "situacao": "ativo",
+                "situacao_diario": "ativo",
+            }
+            for i in range(alunos)
+        ],
+    }
+
+
+def sinteticas(quantidade: int, alunos: int, proporcao_notas: float = 0.0, semente: int = 0) -> list[dict]:
+    """`quantidade` requisições para diários distintos; `proporcao_notas` delas são `baixar_notas`."""
+    sorteio = random.Random(semente)  # noqa: S311
+    requisicoes = []
+    for diario_id in range(1, quantidade + 1):
+        if sorteio.random() < proporcao_notas:
+            requisicoes.append(requisicao("GET", f"{SYNC_DOWN_PATH}?campus_sigla=ZL&diario_id={diario_id}"))
+        else:
+            requisicoes.append(requisicao("POST", SYNC_UP_PATH, payload_sintetico(diario_id, alunos)))
+    return requisicoes
+
+
+def percentil(valores: list[float], p: float) -> float | None:
+    """Percentil pelo método do posto mais próximo; `valores` já ordenados."""
+    if not valores:
+        return None
+    return valores[max(0, math.ceil(p / 100 * len(valores)) - 1)]
+
+
+class AmostradorConexoes(threading.Thread):
+    """Conta, a cada `intervalo` segundos, as conexões abertas no banco do integrador, por estado."""
+
+    SQL = (
+        "SELECT COALESCE(state, 'desconhecido'), COUNT(*) FROM pg_stat_activity"
+        " WHERE datname = current_database() AND pid <> pg_backend_pid() GROUP BY 1"
+    )
+
+    def __init__(self, intervalo: float = 1.0):
+        super().__init__(name="carga-conexoes", daemon=True)
+        self.intervalo = intervalo
+        self.amostras: list[dict[str, int]] = []
+        self.max_connections = None
+        self._parar = threading.Event()
+
+    def run(self):
+        if connection.vendor != "postgresql":
+            return
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW max_connections")
+                self.max_connections = int(cursor.fetchone()[0])
+                while not self._parar.is_set():
+                    cursor.execute(self.SQL)
+                    self.amostras.append(dict(cursor.fetchall()))
+                    self._parar.wait(self.intervalo)
+        except Exception as e:
+            logger.warning("Não foi possível amostrar as conexões do banco: %s", e)
+        finally:
+            connection.close()
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+    def resumo(self) -> dict:
+        totais = [sum(amostra.values()) for amostra in self.amostras]
+        ativas = [amostra.get("active", 0) for amostra in self.amostras]
+        return {
+            "amostras": len(self.amostras),
+            "max_connections": self.max_connections,
+            "maximo": max(totais, default=None),
+            "media": round(sum(totais) / len(totais), 1) if totais else None,
+            "ativas_maximo": max(ativas, default=None),
+        }
+
+
+class TesteCarga:
+    """
+    Dispara as requisições em ciclo até `duracao` segundos ou `total` requisições. Com `rps`, um agendador libera as
+    requisições na taxa alvo para `concorrencia` clientes; sem ele, cada cliente envia a próxima assim que recebe a
+    resposta da anterior.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        requisicoes: list[dict],
+        concorrencia: int = 10,
+        rps: float | None = None,
+        duracao: float | None = 30,
+        total: int | None = None,
+        timeout: float = 60,
+    ):
+        if not requisicoes:
+            raise ValueError("Nenhuma requisição para enviar.")
+        partes = urlsplit(url)
+        self.https = partes.scheme == "https"
+        self.host = partes.netloc
+        self.prefixo = partes.path.rstrip("/")
+        self.headers = {"Authentication": f"Token {token}", "Content-Type": "application/json"}
+        self.requisicoes = [
+            (item["method"], self.prefixo + item["path"], json.dumps(item["body"]) if item["body"] else None)
+            for item in requisicoes
+        ]
+        self.concorrencia = max(1, concorrencia)
+        self.rps = rps
+        self.duracao = duracao
+        self.total = total
+        self.timeout = timeout
+        self.resultados: list[tuple[str, int | str, float]] = []
+        self.inicio = self.decorrido = None
+        self._lock = threading.Lock()
+        self._enviadas = 0
+
+    def _proxima(self) -> tuple[int, float] | None:
+        """Índice da próxima requisição e o instante em que ela deveria sair, ou None quando acabou."""
+        with self._lock:
+            n = self._enviadas
+            if self.total is not None and n >= self.total:
+                return None
+            agendada = self.inicio + n / self.rps if self.rps else time.perf_counter()
+            if self.duracao is not None and agendada - self.inicio >= self.duracao:
+                return None
+            self._enviadas += 1
+        return n, agendada
+
+    def _conexao(self):
+        classe = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return classe(self.host, timeout=self.timeout)
+
+    def _envia(self, conexao, method: str, path: str, body: str | None) -> int:
+        conexao.request(method, path, body=body, headers=self.headers)
+        response = conexao.getresponse()
+        response.read()
+        return response.status
+
+    def _cliente(self):
+        conexao = self._conexao()
+        try:
+            while (proxima := self._proxima()) is not None:
+                n, agendada = proxima
+                espera = agendada - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                method, path, body = self.requisicoes[n % len(self.requisicoes)]
+                try:
+                    status = self._envia(conexao, method, path, body)
+                except (OSError, http.client.HTTPException) as e:
+                    status = type(e).__name__
+                    conexao.close()
+                    conexao = self._conexao()
+                latencia = (time.perf_counter() - agendada) * 1000
+                with self._lock:
+                    self.resultados.append((path.split("?", 1)[0], status, latencia))
+        finally:
+            conexao.close()
+
+    def executa(self, amostrador: AmostradorConexoes | None = None) -> dict:
+        if amostrador is not None:
+            amostrador.start()
+        self.inicio = time.perf_counter()
+        clientes = [
+            threading.Thread(target=self._cliente, name=f"carga-{i}", daemon=True) for i in range(self.concorrencia)
+        ]
+        for cliente in clientes:
+            cliente.start()
+        for cliente in clientes:
+            cliente.join()
+        self.decorrido = time.perf_counter() - self.inicio
+        if amostrador is not None:
+            amostrador.parar()
+        return self.relatorio(amostrador)
+
+    @staticmethod
+    def _estatisticas(resultados: list[tuple], decorrido: float) -> dict:
+        latencias = sorted(latencia for _, _, latencia in resultados)
+        status = Counter(str(status) for _, status, _ in resultados)
+        erros = sum(quantidade for codigo, quantidade in status.items() if not codigo.startswith("2"))
+        return {
+            "requisicoes": len(resultados),
+            "vazao_rps": round(len(resultados) / decorrido, 2) if decorrido else None,
+            "p50_ms": round(percentil(latencias, 50), 1) if latencias else None,
+            "p95_ms": round(percentil(latencias, 95), 1) if latencias else None,
+            "p99_ms": round(percentil(latencias, 99), 1) if latencias else None,
+            "max_ms": round(latencias[-1], 1) if latencias else None,
+            "taxa_erros": round(erros / len(resultados), 4) if resultados else None,
+            "status": dict(sorted(status.items())),
+        }
+
+    def relatorio(self, amostrador: AmostradorConexoes | None = None) -> dict:
+        por_endpoint = defaultdict(list)
+        for resultado in self.resultados:
+            por_endpoint[resultado[0]].append(resultado)
+        return {
+            "parametros": {
+                "concorrencia": self.concorrencia,
+                "rps_alvo": self.rps,
+                "duracao_s": round(self.decorrido, 2),
+            },
+            "geral": self._estatisticas(self.resultados, self.decorrido),
+            "por_endpoint": {
+                endpoint: self._estatisticas(resultados, self.decorrido)
+                for endpoint, resultados in sorted(por_endpoint.items())
+            },
+            "conexoes_banco": amostrador.resumo() if amostrador is not None else None,
+        }
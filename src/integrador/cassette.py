@@ -0,0 +1,283 @@
+"""
+Gravação e reprodução das chamadas aos Moodles, como transporte de `integrador.utils`.
+
+Em modo `record` cada chamada segue para a rede (ou para o transporte informado) e o par requisição/resposta é
+gravado num cassete: NDJSON comprimido com gzip, uma interação por linha. Tokens não são gravados: o header de
+autenticação fica de fora e os parâmetros da URL e as chaves do JSON enviado com nomes como `token`, `key` ou
+`password` são mascarados.
+
+Em modo `replay` nenhuma chamada sai para a rede. A resposta é a gravada para o mesmo método, caminho, parâmetros e
+corpo; na falta dela, a gravada para o mesmo serviço do plugin (`sync_down_grades`, `sync_up_enrolments` etc.), em
+rodízio. O host não entra na comparação, então um cassete gravado em homologação serve para qualquer Ambiente. Com
+`timing="original"` cada resposta demora o que demorou na gravação (dividido por `speed`); com `"fast"`, nada.
+
+Para ligar no integrador em execução (teste de carga), use `MOODLE_HTTP_CASSETTE` e `MOODLE_HTTP_CASSETTE_MODE`.
+"""
+
+import atexit
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.error
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from django.conf import settings
+
+from integrador import utils
+
+logger = logging.getLogger(__name__)
+
+MASCARA = "***"
+SENSIVEL = re.compile(r"token|key|secret|senha|password|authorization|authentication", re.IGNORECASE)
+MODES = ("record", "replay")
+TIMINGS = ("fast", "original")
+
+
+def sanitize(valor):
+    """Mascara, recursivamente, os valores das chaves sensíveis."""
+    if isinstance(valor, dict):
+        return {chave: MASCARA if SENSIVEL.search(str(chave)) else sanitize(item) for chave, item in valor.items()}
+    if isinstance(valor, list):
+        return [sanitize(item) for item in valor]
+    return valor
+
+
+def sanitize_url(url: str) -> str:
+    """Caminho e parâmetros da URL, sem host nem credenciais, com os parâmetros sensíveis mascarados."""
+    partes = urlsplit(url)
+    parametros = [
+        (nome, MASCARA if SENSIVEL.search(nome) else valor)
+        for nome, valor in parse_qsl(partes.query, keep_blank_values=True)
+    ]
+    return f"{partes.path}?{urlencode(parametros)}" if parametros else partes.path
+
+
+def service_of(url: str) -> str:
+    """Serviço do plugin: o primeiro parâmetro da URL, como no `LocalSuapHTTPMock`."""
+    return urlsplit(url).query.split("&", 1)[0].split("=", 1)[0]
+
+
+def body_hash(data: bytes | None) -> str | None:
+    if not data:
+        return None
+    try:
+        canonico = json.dumps(sanitize(json.loads(data)), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        canonico = data
+    return hashlib.sha256(canonico).hexdigest()
+
+
+class CassetteResponse(io.BytesIO):
+    """Resposta reproduzida, com a interface do `urlopen` usada por `integrador.utils`."""
+
+    def __init__(self, content: bytes, status: int = 200, headers: dict | None = None):
+        super().__init__(content)
+        self.status = status
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+
+class CassetteMiss(urllib.error.URLError):
+    """Não há gravação para a requisição; vira um 502 em `integrador.utils`, como uma falha de conexão."""
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = "replay", timing: str = "fast", speed: float = 1.0, transport=None):
+        if mode not in MODES:
+            raise ValueError(f"Modo de cassete desconhecido: {mode}. Use um de {', '.join(MODES)}.")
+        if timing not in TIMINGS:
+            raise ValueError(f"Timing de cassete desconhecido: {timing}. Use um de {', '.join(TIMINGS)}.")
+        # Com vários workers gravando, use `{pid}` no caminho para cada um ter o seu cassete.
+        self.path = path.replace("{pid}", str(os.getpid())) if mode == "record" else path
+        self.mode = mode
+        self.timing = timing
+        self.speed = speed or 1.0
+        self.transport = transport or utils.UrllibTransport()
+        self._lock = threading.Lock()
+        self._anterior = None
+        self._arquivo = None
+        self.interacoes = []
+        self._exatas = {}
+        self._por_servico = {}
+        self._cursores = {}
+        self._inicio = time.monotonic()
+        if mode == "record":
+            self._arquivo = gzip.open(self.path, "wt", encoding="utf-8")
+        else:
+            self.load()
+
+    # --- Chaves -----------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def exact_key(method: str, url: str, request_hash: str | None) -> tuple:
+        return method, url, request_hash
+
+    @staticmethod
+    def service_key(method: str, url: str) -> tuple:
+        return method, urlsplit(url).path, service_of(url)
+
+    # --- Reprodução -------------------------------------------------------------------------------------------------
+
+    def load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as arquivo:
+            for numero, linha in enumerate(arquivo, start=1):
+                if linha.strip():
+                    try:
+                        self._indexa(json.loads(linha))
+                    except (ValueError, KeyError) as e:
+                        raise ValueError(f"{self.path}, linha {numero}: interação inválida: {e}") from e
+        logger.info("Cassete %s carregado com %d interações", self.path, len(self.interacoes))
+
+    def _indexa(self, interacao: dict) -> None:
+        self.interacoes.append(interacao)
+        exata = self.exact_key(interacao["method"], interacao["url"], interacao.get("request_hash"))
+        self._exatas.setdefault(exata, []).append(interacao)
+        self._por_servico.setdefault(self.service_key(interacao["method"], interacao["url"]), []).append(interacao)
+
+    def _proxima(self, chave: tuple, candidatas: list[dict]) -> dict:
+        with self._lock:
+            cursor = self._cursores.get(chave, 0)
+            self._cursores[chave] = cursor + 1
+        return candidatas[cursor % len(candidatas)]
+
+    def find(self, method: str, url: str, data: bytes | None) -> dict | None:
+        url = sanitize_url(url)
+        for nome, chave, indice in (
+            ("exata", self.exact_key(method, url, body_hash(data)), self._exatas),
+            ("servico", self.service_key(method, url), self._por_servico),
+        ):
+            if chave in indice:
+                return self._proxima((nome, chave), indice[chave])
+        return None
+
+    def _reproduz(self, req):
+        interacao = self.find(req.get_method(), req.full_url, req.data)
+        if interacao is None:
+            raise CassetteMiss(f"Sem gravação no cassete para {req.get_method()} {sanitize_url(req.full_url)}")
+        if self.timing == "original":
+            time.sleep(interacao.get("elapsed_s", 0) / self.speed)
+        if interacao.get("error"):
+            raise urllib.error.URLError(interacao["error"])
+
+        if "body_b64" in interacao:
+            content = base64.b64decode(interacao["body_b64"])
+        else:
+            content = (interacao.get("body") or "").encode("utf-8")
+        status = interacao.get("status", 200)
+        headers = interacao.get("headers") or {}
+        if status >= 400:
+            raise urllib.error.HTTPError(
+                req.full_url, status, interacao.get("reason", ""), headers, io.BytesIO(content)
+            )
+        return CassetteResponse(content, status, headers)
+
+    # --- Gravação ---------------------------------------------------------------------------------------------------
+
+    def add(
+        self,
+        method: str,
+        url: str,
+        status: int = 200,
+        content: bytes = b"",
+        headers: dict | None = None,
+        request_data: bytes | None = None,
+        elapsed_s: float = 0.0,
+        reason: str = "",
+        error: str | None = None,
+    ) -> dict:
+        """Grava uma interação; usado pela gravação e para montar cassetes sintéticos."""
+        interacao = {
+            "offset_s": round(time.monotonic() - self._inicio, 4),
+            "elapsed_s": round(elapsed_s, 4),
+            "method": method,
+            "url": sanitize_url(url),
+            "request_hash": body_hash(request_data),
+            "status": status,
+            "reason": reason,
+            "headers": {"Content-Type": headers.get("Content-Type")} if headers and "Content-Type" in headers else {},
+        }
+        try:
+            interacao["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            interacao["body_b64"] = base64.b64encode(content).decode("ascii")
+        if error is not None:
+            interacao["error"] = error
+        linha = json.dumps(interacao, ensure_ascii=False)
+        with self._lock:
+            self._arquivo.write(linha + "\n")
+        return interacao
+
+    def _grava(self, req, timeout):
+        inicio = time.perf_counter()
+        method, url = req.get_method(), req.full_url
+        try:
+            with self.transport.urlopen(req, timeout) as response:
+                content = response.read()
+                status = getattr(response, "status", 200)
+                headers = dict(getattr(response, "headers", None) or {})
+        except urllib.error.HTTPError as exc:
+            content = exc.read()
+            self.add(
+                method,
+                url,
+                exc.code,
+                content,
+                dict(exc.headers or {}),
+                req.data,
+                time.perf_counter() - inicio,
+                exc.reason,
+            )
+            raise urllib.error.HTTPError(exc.url, exc.code, exc.reason, exc.headers, io.BytesIO(content)) from None
+        except urllib.error.URLError as exc:
+            self.add(method, url, 502, b"", None, req.data, time.perf_counter() - inicio, error=str(exc.reason))
+            raise
+        self.add(method, url, status, content, headers, req.data, time.perf_counter() - inicio)
+        return CassetteResponse(content, status, headers)
+
+    # --- Transporte -------------------------------------------------------------------------------------------------
+
+    def urlopen(self, req, timeout):
+        if self.mode == "record":
+            return self._grava(req, timeout)
+        return self._reproduz(req)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._arquivo is not None:
+                self._arquivo.close()
+                self._arquivo = None
+
+    def __enter__(self):
+        self._anterior = utils.set_transport(self)
+        return self
+
+    def __exit__(self, *exc):
+        utils.set_transport(self._anterior)
+        self.close()
+        return False
+
+
+def configure() -> Cassette | None:
+    """Liga o cassete de MOODLE_HTTP_CASSETTE como transporte do processo, se configurado."""
+    path = getattr(settings, "MOODLE_HTTP_CASSETTE", None)
+    if not path:
+        return None
+    cassette = Cassette(
+        path,
+        mode=getattr(settings, "MOODLE_HTTP_CASSETTE_MODE", "replay"),
+        timing=getattr(settings, "MOODLE_HTTP_CASSETTE_TIMING", "fast"),
+        speed=float(getattr(settings, "MOODLE_HTTP_CASSETTE_SPEED", 1.0)),
+    )
+    utils.set_transport(cassette)
+    atexit.register(cassette.close)
+    logger.warning("Chamadas aos Moodles pelo cassete %s (%s)", path, cassette.mode)
+    return cassette
@@ -1,23 +1,156 @@
 import json
+import time
+from collections.abc import Iterator
 from functools import wraps
 
 import sentry_sdk
 from django.conf import settings
-from django.http import HttpRequest, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
 
+from integrador import metrics, notas, profiling, tracing
+from integrador.brokers.registry import registry
 from integrador.models import Ambiente, Solicitacao
+from integrador.timings import etapas_de
 from integrador.utils import SyncError
 
 
+def _endpoint(request: HttpRequest, func) -> str:
+    resolver_match = getattr(request, "resolver_match", None)
+    return resolver_match.url_name if resolver_match and resolver_match.url_name else func.__name__
+
+
+def trace_request(func):
+    @wraps(func)
+    def inner(request: HttpRequest, *args, **kwargs):
+        with tracing.server_span(request, _endpoint(request, func)) as span:
+            response = func(request, *args, **kwargs)
+            solicitacao = getattr(request, "solicitacao", None)
+            tracing.set_attributes(
+                span,
+                {
+                    "http.response.status_code": response.status_code,
+                    "integrador.ambiente": getattr(getattr(request, "ambiente", None), "nome", None),
+                    "integrador.solicitacao.id": getattr(solicitacao, "id", None),
+                    "integrador.operacao": getattr(solicitacao, "operacao", None),
+                },
+            )
+            return response
+
+    return inner
+
+
+def observe_metrics(func):
+    @wraps(func)
+    def inner(request: HttpRequest, *args, **kwargs):
+        endpoint = _endpoint(request, func)
+        inicio = time.perf_counter()
+        status = 500
+        try:
+            with metrics.track_in_progress(endpoint):
+                response = func(request, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            solicitacao = getattr(request, "solicitacao", None)
+            ambiente = getattr(getattr(request, "ambiente", None), "nome", None) or "-"
+            metrics.observe_sync_request(
+                endpoint,
+                ambiente,
+                solicitacao.operacao if solicitacao is not None else "-",
+                status,
+                time.perf_counter() - inicio,
+            )
+            # Usadas por integrador.sampling para decidir se a transação vai para o Sentry.
+            sentry_sdk.set_tag("integrador.endpoint", endpoint)
+            sentry_sdk.set_tag("integrador.ambiente", ambiente)
+
+    return inner
+
+
+def profile_request(func):
+    @wraps(func)
+    def inner(request: HttpRequest, *args, **kwargs):
+        pedido = profiling.origem(request)
+        if pedido is None:
+            return func(request, *args, **kwargs)
+
+        with profiling.Perfilador() as perfilador:
+            response = func(request, *args, **kwargs)
+        profile = perfilador.salva(getattr(request, "solicitacao", None), *pedido)
+        if profile is not None:
+            response["X-Integrador-Profile-Id"] = str(profile.solicitacao_id)
+        return response
+
+    return inner
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
 def json_response(func):
+    @tracing.traced("json_response")
     def inner(request: HttpRequest, *args, **kwargs):
         result = func(request, *args, **kwargs)
-        return result if isinstance(result, JsonResponse) else JsonResponse(result, safe=False)
+        response = result if isinstance(result, HttpResponseBase) else JsonResponse(result, safe=False)
+        if getattr(request, "etapas", None) is not None:
+            response["Server-Timing"] = request.etapas.server_timing()
+        return response
+
+    return inner
+
+
+def _json_chunks(result, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    O JSON de `result`, como o do JsonResponse, em pedaços de ~`chunk_size` bytes. Cada item das listas do primeiro
+    nível (as notas) é codificado à parte, pelo encoder em C, então o corpo inteiro nunca fica em memória.
+    """
+    encoder = DjangoJSONEncoder()
+
+    def partes() -> Iterator[str]:
+        if not isinstance(result, dict):
+            yield encoder.encode(result)
+            return
+        yield "{"
+        for i, (chave, valor) in enumerate(result.items()):
+            yield f"{', ' if i else ''}{encoder.encode(str(chave))}: "
+            if isinstance(valor, list):
+                yield "["
+                for j, item in enumerate(valor):
+                    yield f"{', ' if j else ''}{encoder.encode(item)}"
+                yield "]"
+            else:
+                yield encoder.encode(valor)
+        yield "}"
+
+    buffer, tamanho = [], 0
+    for parte in partes():
+        buffer.append(parte)
+        tamanho += len(parte)
+        if tamanho >= chunk_size:
+            yield "".join(buffer).encode("utf-8")
+            buffer, tamanho = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def json_stream_response(func):
+    """Como o `json_response`, mas responde um StreamingHttpResponse, escrito aos pedaços à medida que é enviado."""
+
+    @tracing.traced("json_stream_response")
+    @wraps(func)
+    def inner(request: HttpRequest, *args, **kwargs):
+        result = func(request, *args, **kwargs)
+        if isinstance(result, HttpResponseBase):
+            return result
+        return StreamingHttpResponse(_json_chunks(result), content_type="application/json")
 
     return inner
 
 
 def exception_as_json(func):
+    @tracing.traced("exception_as_json")
     def inner(request: HttpRequest, *args, **kwargs):
         def __response_error(request: HttpRequest, error: Exception):
             event_id = sentry_sdk.capture_exception(error)
@@ -42,14 +175,17 @@ def exception_as_json(func):
         try:
             return func(request, *args, **kwargs)
         except SyncError as se:
+            tracing.record_exception(se)
             return __response_error(request, se)
         except Exception as e2:
+            tracing.record_exception(e2)
             return __response_error(request, e2)
 
     return inner
 
 
 def check_is_post(func):
+    @tracing.traced("check_is_post")
     def inner(request: HttpRequest, *args, **kwargs):
         if request.method != "POST":
             raise SyncError("Method HTTP não autorizado.", 501)
@@ -59,6 +195,7 @@ def check_is_post(func):
 
 
 def valid_token(func):
+    @tracing.traced("valid_token")
     def inner(request: HttpRequest, *args, **kwargs):
         if not hasattr(settings, "SUAP_INTEGRADOR_KEY"):
             raise SyncError("Você se esqueceu de configurar a settings 'SUAP_INTEGRADOR_KEY'.", 428)
@@ -77,6 +214,7 @@ def valid_token(func):
 
 
 def check_is_get(func):
+    @tracing.traced("check_is_get")
     def inner(request: HttpRequest, *args, **kwargs):
         if request.method != "GET":
             raise SyncError("Não implementado.", 501)
@@ -87,13 +225,19 @@ def check_is_get(func):
 
 def check_json(operacao: str):
     def decorator(func):
+        @tracing.traced("check_json")
         @wraps(func)
         def wrapper(request: HttpRequest, *args, **kwargs):
             try:
                 message = ""
-                message = request.body.decode("utf-8")
+                etapas = etapas_de(request)
+                with etapas.medir("leitura"):
+                    body = request.body
+                metrics.PAYLOAD_BYTES.labels(fluxo="recebido").observe(len(body))
+                message = body.decode("utf-8")
                 try:
-                    request.json_recebido = json.loads(message)
+                    with etapas.medir("json"):
+                        request.json_recebido = json.loads(message)
 
                     # TODO: Remover comentário após corrigir todos os schemas
                 except Exception as e2:
@@ -116,24 +260,72 @@ def check_json(operacao: str):
 
 
 def detect_ambiente(func):
+    @tracing.traced("detect_ambiente")
     def inner(request: HttpRequest, *args, **kwargs):
         request.json_recebido = getattr(
             request, "json_recebido", {"campus": {"sigla": request.GET.get("campus_sigla")}}
         )
-        request.ambiente = Ambiente.objects.seleciona_ambiente(request.json_recebido)
+        with etapas_de(request).medir("ambiente"):
+            request.ambiente = Ambiente.objects.seleciona_ambiente(request.json_recebido)
         if getattr(request, "ambiente") is None:
             origin = request.json_recebido.get("campus", {}).get("sigla")
             if origin is None:
                 origin = request.json_recebido.get("check_json", {}).get("error", {}).get("message", "desconecido")
             raise SyncError(f"Nao encontramos um Ambiente ativo para o campus '{origin}'", 404)
 
-        return JsonResponse(func(request, *args, **kwargs), safe=False)
+        result = func(request, *args, **kwargs)
+        return result if isinstance(result, HttpResponseBase) else JsonResponse(result, safe=False)
 
     return inner
 
 
-def try_solicitacao(operacao: str):
+def grades_cache(func):
+    """
+    Serve o `baixar_notas` pelo cache de notas (`integrador.notas.NotasEmCache`). A Solicitação completa, de
+    `try_solicitacao`, só é criada quando as notas não estavam no cache ou mudaram; a view recebe, em
+    `request.notas_moodle`, as notas (ou o erro) que a revalidação já baixou.
+    """
+
+    @tracing.traced("grades_cache")
+    @wraps(func)
+    def inner(request: HttpRequest, *args, **kwargs):
+        diario_id = request.GET.get("diario_id") or ""
+        if not notas.CACHE_TTL or not diario_id.isdigit():
+            return func(request, *args, **kwargs)
+
+        cacheadas = notas.NotasEmCache(request.ambiente, diario_id)
+        recebido = {"campus": request.json_recebido.get("campus", {}), "diario": {"id": int(diario_id)}}
+        if cacheadas.fresca:
+            request.solicitacao = cacheadas.registra(recebido, etapas_de(request).tempos, revalidada=False)
+            return cacheadas.entrada["resposta"]
+
+        # As credenciais e a URL do broker vêm do Ambiente e do diário; a solicitação ainda não existe.
+        transiente = Solicitacao(ambiente=request.ambiente, diario_id=diario_id)
+        transiente.etapas = etapas_de(request)
+        try:
+            request.notas_moodle = cacheadas.revalida(registry.resolve(request.ambiente, "suap")(transiente))
+        except Exception as e:
+            request.notas_moodle = e
+        if request.notas_moodle is None:
+            request.solicitacao = cacheadas.registra(recebido, etapas_de(request).tempos, revalidada=True)
+            return cacheadas.entrada["resposta"]
+
+        metrics.GRADES_CACHE.labels(resultado="baixada").inc()
+        resultado = func(request, *args, **kwargs)
+        if not isinstance(request.notas_moodle, Exception):
+            cacheadas.grava(request.solicitacao, request.notas_moodle)
+        return resultado
+
+    return inner
+
+
+def try_solicitacao(operacao: str, resumo=None):
+    """
+    Com `resumo`, o `respondido` da solicitação guarda `resumo(resposta)`; a view ainda devolve a resposta inteira.
+    """
+
     def decorator(func):
+        @tracing.traced("try_solicitacao")
         @wraps(func)
         def wrapper(request: HttpRequest, *args, **kwargs):
             solicitacao = None
@@ -156,16 +348,19 @@ def try_solicitacao(operacao: str):
                 id_diario = str(request.json_recebido.get("diario", {}).get("id", "#-"))
                 diario_codigo = f"{campus_sigla}:{codigo_turma}.{sigla_componente}#{id_diario}"
 
-                solicitacao = Solicitacao.objects.create(
-                    ambiente=request.ambiente,
-                    campus_sigla=campus_sigla,
-                    diario_id=id_diario,
-                    diario_codigo=diario_codigo,
-                    recebido=request.json_recebido,
-                    status=Solicitacao.Status.PROCESSANDO,
-                    operacao=operacao,
-                    tipo=request.json_recebido.get("tipo_diario", "diario"),
-                )
+                etapas = etapas_de(request)
+                with etapas.medir("criacao"):
+                    solicitacao = Solicitacao.objects.create(
+                        ambiente=request.ambiente,
+                        campus_sigla=campus_sigla,
+                        diario_id=id_diario,
+                        diario_codigo=diario_codigo,
+                        recebido=request.json_recebido,
+                        status=Solicitacao.Status.PROCESSANDO,
+                        operacao=operacao,
+                        tipo=request.json_recebido.get("tipo_diario", "diario"),
+                    )
+                solicitacao.etapas = etapas
                 solicitacao.site_url = request.build_absolute_uri("/")
 
                 if request.ambiente is None:
@@ -174,13 +369,12 @@ def try_solicitacao(operacao: str):
                 request.solicitacao = solicitacao
 
                 # Tudo validado
-                solicitacao.respondido = func(request, *args, **kwargs)
+                resposta = func(request, *args, **kwargs)
+                solicitacao.respondido = resumo(resposta) if resumo is not None else resposta
 
-                solicitacao.status = Solicitacao.Status.SUCESSO
-                solicitacao.status_code = 200
-                solicitacao.save()
+                solicitacao.finaliza(Solicitacao.Status.SUCESSO, 200)
 
-                return solicitacao.respondido
+                return resposta
             except Exception as e:
                 error_text = f"Contacte um administrador. O AVA retornou o seguinte erro:\n{e}."
                 if solicitacao is not None:
@@ -188,9 +382,7 @@ def try_solicitacao(operacao: str):
                         solicitacao.respondido = e.retorno
                     else:
                         solicitacao.respondido = {"error": {"error_message": f"{e}", "error": f"{e}"}}
-                    solicitacao.status = Solicitacao.Status.FALHA
-                    solicitacao.status_code = getattr(e, "code", 500)
-                    solicitacao.save()
+                    solicitacao.finaliza(Solicitacao.Status.FALHA, getattr(e, "code", 500))
                     raise SyncError(error_text, solicitacao.status_code, retorno=getattr(e, "retorno", None))
                 raise SyncError(error_text, 500, retorno=getattr(e, "retorno", None))
 
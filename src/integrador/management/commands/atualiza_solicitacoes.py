@@ -1,18 +1,91 @@
-# painel/management/commands/init_local_data.py
-from django.core.management.base import BaseCommand
+from collections import defaultdict
 
-from integrador.models import Solicitacao
+from django.db.models import Case, CharField, Q, QuerySet, Value, When
+from django.db.models.fields.json import KT
+from django.db.models.functions import Coalesce, Concat, NullIf
 
+from integrador.backfill import BackfillCommand, BackfillTask
+from integrador.models import Ambiente, Solicitacao
 
-class Command(BaseCommand):
-    help = "Atualiza os registros de Solicitação para definir campos novos como nulos."
 
-    def handle(self, *args, **options):
-        while Solicitacao.objects.filter(diario_codigo__isnull=True).exists():
-            for solicitacao in Solicitacao.objects.filter(diario_codigo__isnull=True).order_by("id")[0:1000]:
-                solicitacao.ambiente = None
-                solicitacao.campus_sigla = None
-                solicitacao.diario_id = None
-                solicitacao.diario_codigo = None
-                solicitacao.tipo = None
-                solicitacao.save()
+class AtualizaCamposSolicitacao(BackfillTask):
+    """
+    Deriva, direto no PostgreSQL, os campos de Solicitacao que o `save()` extrai do JSON recebido.
+
+    Como sempre fez, o Ambiente de cada linha é selecionado de novo pelas expressões seletoras atuais, e fica nulo se
+    nenhum casar. Com `mantem_ambiente`, o Ambiente já gravado é mantido e só as linhas sem Ambiente são avaliadas.
+    """
+
+    name = "atualiza_solicitacoes"
+
+    def __init__(self, mantem_ambiente: bool = False):
+        self.mantem_ambiente = mantem_ambiente
+
+    def get_queryset(self) -> QuerySet:
+        return Solicitacao.objects.filter(diario_codigo__isnull=True)
+
+    def apply(self, lote: QuerySet) -> int:
+        self.seleciona_ambientes(lote)
+        texto = CharField()
+        diario_id = Coalesce(KT("recebido__diario__id"), Value(""), output_field=texto)
+        diario_codigo = Concat(
+            Coalesce(KT("recebido__turma__codigo"), Value(""), output_field=texto),
+            Value("."),
+            Coalesce(KT("recebido__diario__sigla"), Value(""), output_field=texto),
+            Value("#"),
+            diario_id,
+            output_field=texto,
+        )
+        # No formato genérico do SGA, o campus é a `unidade` e o diário já traz o seu código.
+        generico = Q(recebido__has_key="unidade")
+        return (
+            lote.filter(recebido__isnull=False)
+            .exclude(recebido={})
+            .update(
+                campus_sigla=Case(
+                    When(generico, then=KT("recebido__unidade__sigla")),
+                    default=KT("recebido__campus__sigla"),
+                    output_field=texto,
+                ),
+                diario_id=diario_id,
+                diario_codigo=Case(
+                    When(generico, then=Coalesce(NullIf(KT("recebido__diario__codigo"), Value("")), diario_codigo)),
+                    default=diario_codigo,
+                    output_field=texto,
+                ),
+                tipo=Coalesce(
+                    KT("recebido__diario__tipo"),
+                    Case(When(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, then=Value("regular")), default=None),
+                    output_field=texto,
+                ),
+            )
+        )
+
+    def seleciona_ambientes(self, lote: QuerySet) -> None:
+        # As expressões seletoras só podem ser avaliadas no Python: o JSON das linhas é lido e a gravação é feita com
+        # um UPDATE por ambiente.
+        ambientes = list(Ambiente.objects.all())
+        por_ambiente = defaultdict(list)
+        candidatas = lote.filter(ambiente__isnull=True) if self.mantem_ambiente else lote
+        for solicitacao_id, recebido in candidatas.values_list("id", "recebido").iterator():
+            ambiente = Ambiente.objects.seleciona_ambiente(recebido, ambientes) if recebido else None
+            if ambiente is not None or not self.mantem_ambiente:
+                por_ambiente[ambiente and ambiente.id].append(solicitacao_id)
+        for ambiente_id, ids in por_ambiente.items():
+            Solicitacao.objects.filter(id__in=ids).update(ambiente_id=ambiente_id)
+
+
+class Command(BackfillCommand):
+    help = "Preenche os campos derivados do JSON recebido nas Solicitações antigas, em lotes retomáveis."
+    task_class = AtualizaCamposSolicitacao
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--mantem-ambiente",
+            action="store_true",
+            help="Mantém o Ambiente já gravado e só seleciona o das linhas sem Ambiente (padrão: seleciona de novo)",
+        )
+
+    def get_task(self, options) -> AtualizaCamposSolicitacao:
+        return self.task_class(mantem_ambiente=options["mantem_ambiente"])
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from integrador.models import DiarioSyncState, Solicitacao
+
+
+class Command(BaseCommand):
+    help = "Reconstrói a tabela DiarioSyncState a partir do histórico de Solicitações finalizadas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Solicitações por lote (padrão: 1000)")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        solicitacoes = (
+            Solicitacao.objects.filter(
+                status__in=[Solicitacao.Status.SUCESSO, Solicitacao.Status.FALHA],
+                ambiente__isnull=False,
+                diario_id__isnull=False,
+            )
+            .defer("enviado")
+            .order_by("id")
+        )
+
+        # Em ordem de id, a solicitação mais recente de cada diário sobrescreve as anteriores.
+        total = 0
+        lote = []
+        for solicitacao in solicitacoes.iterator(chunk_size=batch_size):
+            lote.append(solicitacao)
+            if len(lote) >= batch_size:
+                total += DiarioSyncState.objects.registra(*lote)
+                lote = []
+        if lote:
+            total += DiarioSyncState.objects.registra(*lote)
+
+        self.stdout.write(self.style.SUCCESS(f"✓ {total} estados de diário atualizados"))
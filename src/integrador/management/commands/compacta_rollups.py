@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils.timezone import now
+
+from integrador.models import Solicitacao, SolicitacaoRollup
+
+
+class Command(BaseCommand):
+    help = "Recalcula os agregados horários de Solicitações usados pelo dashboard."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--horas", type=int, default=48, help="Quantas horas fechadas recalcular (padrão: 48)")
+        parser.add_argument("--tudo", action="store_true", help="Recalcula todo o histórico, um dia por vez")
+
+    def handle(self, *args, **options):
+        # A hora corrente fica de fora: ela ainda recebe incrementos de cada Solicitacao finalizada.
+        fim = SolicitacaoRollup.objects.hora_de(now()) - timedelta(hours=1)
+        if options["tudo"]:
+            primeira = Solicitacao.objects.aggregate(primeira=Min("timestamp"))["primeira"]
+            inicio = SolicitacaoRollup.objects.hora_de(primeira) if primeira else fim + timedelta(hours=1)
+        else:
+            inicio = fim - timedelta(hours=options["horas"] - 1)
+
+        total = 0
+        while inicio <= fim:
+            total += SolicitacaoRollup.objects.recompacta(inicio, min(inicio + timedelta(hours=23), fim))
+            inicio += timedelta(hours=24)
+
+        self.stdout.write(self.style.SUCCESS(f"✓ {total} agregados horários recalculados"))
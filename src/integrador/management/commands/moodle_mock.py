@@ -0,0 +1,107 @@
+import json
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from integrador.moodle_mock import (
+    FAULTS_CONTROL_PATH,
+    TOOL_SGA_CONTROL_PATH,
+    FaultInjector,
+    LocalSuapHTTPMock,
+    ToolSgaHTTPMock,
+    get_fault_injector,
+    get_tool_sga_state,
+    start_mock_moodle_server,
+    stop_mock_moodle_server_in_background,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Sobe o Moodle mock (plugins local_suap e tool_sga) como um servidor independente, com latência e falhas "
+        "configuráveis, para testar retentativas, timeouts e pools de conexão localmente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1", help="Host de bind (padrão: 127.0.0.1)")
+        parser.add_argument("--port", type=int, default=18091, help="Porta (padrão: 18091)")
+        parser.add_argument("--token", help="Token aceito no header Authentication (padrão: um token aleatório)")
+        parser.add_argument("--faults", help="Arquivo JSON com a configuração por serviço (veja FaultInjector)")
+        parser.add_argument("--seed", type=int, help="Semente, para repetir a mesma sequência de falhas")
+        parser.add_argument("--duration", type=float, help="Para após N segundos (padrão: até Ctrl+C)")
+
+        todos = parser.add_argument_group("atalhos para todos os serviços (sobrepõem o '*' do --faults)")
+        todos.add_argument("--latency-ms", type=float, help="Latência: fixa, ou a mediana com --latency-dist")
+        todos.add_argument(
+            "--latency-dist", choices=sorted(FaultInjector.DISTRIBUTIONS), default="fixed", help="Distribuição"
+        )
+        todos.add_argument("--error-rate", type=float, help="Fração de erros JSON 5xx")
+        todos.add_argument("--html-error-rate", type=float, help="Fração de páginas HTML de erro fatal")
+        todos.add_argument("--timeout-rate", type=float, help="Fração de conexões seguradas sem resposta")
+        todos.add_argument("--timeout-s", type=float, help="Quanto tempo segurar a conexão (padrão: 30)")
+        todos.add_argument("--reset-rate", type=float, help="Fração de conexões fechadas com RST")
+        todos.add_argument("--rps", type=float, help="Limite de requisições por segundo; acima responde 429")
+
+    def faults(self, options) -> dict:
+        faults = {}
+        if options["faults"]:
+            try:
+                with open(options["faults"], encoding="utf-8") as arquivo:
+                    faults = json.load(arquivo)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Não foi possível ler {options['faults']}: {e}") from e
+
+        todos = {
+            chave: options[chave]
+            for chave in ("error_rate", "html_error_rate", "timeout_rate", "timeout_s", "reset_rate", "rps")
+            if options[chave] is not None
+        }
+        if options["latency_ms"] is not None:
+            ms = options["latency_ms"]
+            todos["latency"] = {
+                "fixed": {"dist": "fixed", "ms": ms},
+                "uniform": {"dist": "uniform", "min_ms": 0, "max_ms": 2 * ms},
+                "lognormal": {"dist": "lognormal", "median_ms": ms, "sigma": 0.5},
+                "pareto": {"dist": "pareto", "scale_ms": ms / 2 ** (1 / 2), "alpha": 2},
+            }[options["latency_dist"]]
+        if todos:
+            faults["*"] = {**faults.get("*", {}), **todos}
+
+        try:
+            FaultInjector.validate(faults)
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+        return faults
+
+    def handle(self, *args, **options):
+        faults = self.faults(options)
+        if options["token"]:
+            LocalSuapHTTPMock.TEST_TOKEN = ToolSgaHTTPMock.TEST_TOKEN = options["token"]
+
+        try:
+            start_mock_moodle_server(options["host"], options["port"], faults=faults, seed=options["seed"])
+        except OSError as e:
+            raise CommandError(f"Não foi possível abrir {options['host']}:{options['port']}: {e}") from e
+
+        base = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(f"Moodle mock em {base}/local/suap/api/index.php e {base}{ToolSgaHTTPMock.PLUGIN_PATH}")
+        self.stdout.write(f"Token: {LocalSuapHTTPMock.TEST_TOKEN}")
+        self.stdout.write(f"Falhas: {json.dumps(faults, ensure_ascii=False) if faults else 'nenhuma'}")
+        self.stdout.write(
+            f"Controle: GET/PUT/DELETE {base}{FAULTS_CONTROL_PATH}, GET/DELETE {base}{TOOL_SGA_CONTROL_PATH}"
+        )
+
+        try:
+            threading.Event().wait(options["duration"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            injector = get_fault_injector()
+            contadores = injector.snapshot()["counters"] if injector is not None else {}
+            tool_sga = get_tool_sga_state()
+            estado = tool_sga.snapshot() if tool_sga is not None else {}
+            stop_mock_moodle_server_in_background()
+
+        self.stdout.write(f"Requisições: {json.dumps(contadores, ensure_ascii=False)}")
+        self.stdout.write(f"tool_sga: {json.dumps(estado, ensure_ascii=False)}")
+        self.stdout.write(self.style.SUCCESS("✓ Moodle mock encerrado"))
@@ -0,0 +1,159 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min, ProtectedError
+
+from integrador import carga
+from integrador.models import Ambiente, Solicitacao
+from integrador.moodle_mock import LocalSuapHTTPMock, start_mock_moodle_server, stop_mock_moodle_server_in_background
+
+AMBIENTE_MOCK = "Teste de carga (Moodle mock)"
+
+
+class Command(BaseCommand):
+    help = (
+        "Reenvia requisições a um integrador em execução numa taxa ou concorrência alvo e informa vazão, latências, "
+        "erros e conexões do banco. Use só contra um ambiente local ou de homologação."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", nargs="?", default="http://localhost:8000", help="URL do integrador")
+
+        origem = parser.add_mutually_exclusive_group()
+        origem.add_argument("--arquivo", help="Arquivo NDJSON com as requisições")
+        origem.add_argument("--solicitacoes", type=int, help="Usa as últimas N Solicitações gravadas")
+        origem.add_argument("--sinteticas", type=int, default=100, help="Gera N diários sintéticos (padrão: 100)")
+        parser.add_argument("--alunos", type=int, default=40, help="Alunos por diário sintético (padrão: 40)")
+        parser.add_argument(
+            "--proporcao-notas", type=float, default=0.0, help="Fração de baixar_notas entre as sintéticas"
+        )
+        parser.add_argument("--exporta", help="Grava as requisições neste NDJSON e sai, sem enviar nada")
+
+        parser.add_argument("--concorrencia", type=int, default=10, help="Clientes simultâneos (padrão: 10)")
+        parser.add_argument("--rps", type=float, help="Taxa alvo em requisições por segundo (malha aberta)")
+        parser.add_argument("--duracao", type=float, default=30, help="Segundos de teste (padrão: 30)")
+        parser.add_argument("--total", type=int, help="Para após N requisições")
+        parser.add_argument("--timeout", type=float, default=60, help="Timeout de cada requisição, em segundos")
+        parser.add_argument("--token", default=None, help="Token do integrador (padrão: SUAP_INTEGRADOR_KEY)")
+
+        parser.add_argument(
+            "--moodle-mock",
+            type=int,
+            metavar="PORTA",
+            help=(
+                f"Sobe o Moodle mock nesta porta e envia todas as requisições no campus {carga.CAMPUS_CARGA}, que só "
+                "o Ambiente do mock seleciona"
+            ),
+        )
+        parser.add_argument(
+            "--moodle-mock-url",
+            default=None,
+            help="URL do Moodle mock como o integrador a vê (padrão: http://127.0.0.1:PORTA)",
+        )
+        parser.add_argument("--sem-banco", action="store_true", help="Não amostra as conexões do banco")
+        parser.add_argument("--saida", help="Grava o relatório em JSON neste arquivo")
+
+    def requisicoes(self, options) -> list[dict]:
+        if options["arquivo"]:
+            try:
+                with open(options["arquivo"], encoding="utf-8") as arquivo:
+                    return carga.le_ndjson(arquivo)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Não foi possível ler {options['arquivo']}: {e}") from e
+        if options["solicitacoes"]:
+            return carga.de_solicitacoes(options["solicitacoes"])
+        return carga.sinteticas(options["sinteticas"], options["alunos"], options["proporcao_notas"])
+
+    def prepara_moodle_mock(self, porta: int, url: str | None) -> Ambiente:
+        start_mock_moodle_server("0.0.0.0", porta)  # noqa: S104
+        # Só o campus sintético, e antes de todos os outros Ambientes: o tráfego real nunca vai para o mock, e o do
+        # teste nunca vai para um Moodle real.
+        primeiro = Ambiente.objects.exclude(nome=AMBIENTE_MOCK).aggregate(ordem=Min("ordem"))["ordem"] or 0
+        ambiente, _ = Ambiente.objects.update_or_create(
+            nome=AMBIENTE_MOCK,
+            defaults={
+                "url": url or f"http://127.0.0.1:{porta}",
+                "ordem": primeiro - 1,
+                "expressao_seletora": f"campus['sigla'] == '{carga.CAMPUS_CARGA}'",
+                "local_suap_token": LocalSuapHTTPMock.TEST_TOKEN,
+                "local_suap_active": True,
+                "tool_sga_active": False,
+            },
+        )
+        self.stdout.write(
+            f"Moodle mock na porta {porta}; as requisições vão no campus {carga.CAMPUS_CARGA}, do Ambiente "
+            f"'{AMBIENTE_MOCK}'."
+        )
+        return ambiente
+
+    def remove_moodle_mock(self, ambiente: Ambiente):
+        try:
+            with transaction.atomic():
+                Solicitacao.objects.filter(ambiente=ambiente).delete()
+                ambiente.delete()
+        except ProtectedError:
+            # Uma requisição do teste terminou depois da limpeza: o Ambiente fica, desativado, com as Solicitações.
+            Ambiente.objects.filter(pk=ambiente.pk).update(local_suap_active=False)
+            self.stdout.write(
+                self.style.WARNING(f"O Ambiente '{AMBIENTE_MOCK}' ficou desativado: ainda tem Solicitações.")
+            )
+
+    def handle(self, *args, **options):
+        requisicoes = self.requisicoes(options)
+        if options["exporta"]:
+            with open(options["exporta"], "w", encoding="utf-8") as arquivo:
+                carga.escreve_ndjson(requisicoes, arquivo)
+            self.stdout.write(self.style.SUCCESS(f"✓ {len(requisicoes)} requisições gravadas em {options['exporta']}"))
+            return
+
+        ambiente = None
+        if options["moodle_mock"]:
+            requisicoes = carga.no_campus(requisicoes)
+            ambiente = self.prepara_moodle_mock(options["moodle_mock"], options["moodle_mock_url"])
+
+        try:
+            teste = carga.TesteCarga(
+                options["url"],
+                options["token"] or getattr(settings, "SUAP_INTEGRADOR_KEY", ""),
+                requisicoes,
+                concorrencia=options["concorrencia"],
+                rps=options["rps"],
+                duracao=options["duracao"],
+                total=options["total"],
+                timeout=options["timeout"],
+            )
+            relatorio = teste.executa(None if options["sem_banco"] else carga.AmostradorConexoes())
+        finally:
+            if ambiente is not None:
+                stop_mock_moodle_server_in_background()
+                self.remove_moodle_mock(ambiente)
+
+        self.imprime(relatorio)
+        if options["saida"]:
+            with open(options["saida"], "w", encoding="utf-8") as arquivo:
+                json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+
+    def imprime(self, relatorio: dict):
+        parametros = relatorio["parametros"]
+        self.stdout.write(
+            f"Concorrência {parametros['concorrencia']}, RPS alvo {parametros['rps_alvo'] or '-'}, "
+            f"{parametros['duracao_s']}s"
+        )
+        linhas = [("geral", relatorio["geral"])] + list(relatorio["por_endpoint"].items())
+        self.stdout.write(f"{'endpoint':<24}{'req':>8}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'erros':>9}")
+        for nome, dados in linhas:
+            self.stdout.write(
+                f"{nome:<24}{dados['requisicoes']:>8}{dados['vazao_rps'] or 0:>10}{dados['p50_ms'] or 0:>10}"
+                f"{dados['p95_ms'] or 0:>10}{dados['p99_ms'] or 0:>10}{(dados['taxa_erros'] or 0) * 100:>8.1f}%"
+            )
+        self.stdout.write(f"Status: {relatorio['geral']['status']}")
+        if relatorio["conexoes_banco"]:
+            conexoes = relatorio["conexoes_banco"]
+            self.stdout.write(
+                f"Conexões do banco: máximo {conexoes['maximo']}, média {conexoes['media']}, "
+                f"ativas no máximo {conexoes['ativas_maximo']} (max_connections {conexoes['max_connections']})"
+            )
+        style = self.style.SUCCESS if not relatorio["geral"]["taxa_erros"] else self.style.WARNING
+        self.stdout.write(style(f"✓ {relatorio['geral']['requisicoes']} requisições enviadas"))
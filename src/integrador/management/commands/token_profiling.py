@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from integrador.profiling import PROFILE_HEADER, sign_token
+
+
+class Command(BaseCommand):
+    help = "Gera o header assinado que pede o profiling de uma chamada a enviar_diarios ou baixar_notas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("usuario", help="Quem está pedindo o profiling (fica registrado no profile)")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{PROFILE_HEADER}: {sign_token(options['usuario'])}")
+        self.stderr.write(f"Válido por {settings.PROFILING_TOKEN_MAX_AGE} segundos.")
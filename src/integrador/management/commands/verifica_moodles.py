@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from integrador.models import Ambiente
+from integrador.probes import PROBE_TTL, probe_ambientes
+
+
+class Command(BaseCommand):
+    help = "Verifica em paralelo a conexão com os Moodles de todos os Ambientes e grava o resultado no cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Repete a verificação indefinidamente")
+        parser.add_argument(
+            "--intervalo",
+            type=int,
+            default=max(1, PROBE_TTL // 2),
+            help="Segundos entre as verificações com --loop (padrão: metade de MOODLE_PROBE_TTL)",
+        )
+
+    def verifica(self):
+        resultados = probe_ambientes(Ambiente.objects.all())
+        falhas = sum(
+            1
+            for resultado in resultados.values()
+            for nome, check in resultado.items()
+            if nome != "verificado_em" and check["status"] in ("FAIL", "ERROR")
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"✓ {len(resultados)} ambientes verificados ({falhas} verificações com falha)")
+        )
+
+    def handle(self, *args, **options):
+        self.verifica()
+        while options["loop"]:
+            time.sleep(options["intervalo"])
+            close_old_connections()
+            self.verifica()
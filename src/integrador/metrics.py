@@ -0,0 +1,186 @@
+"""
+Métricas Prometheus do integrador.
+
+O `prometheus_client` é opcional: sem ele as métricas viram no-op e o endpoint `/metrics` responde 503. Com a
+variável de ambiente `PROMETHEUS_MULTIPROC_DIR` definida (o `gunicorn.conf.py` define), cada worker grava os seus
+valores nesse diretório e o `/metrics` agrega todos eles, seja qual for o worker que atender a coleta.
+"""
+
+import importlib.util
+import logging
+import os
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_AVAILABLE = importlib.util.find_spec("prometheus_client") is not None
+
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(2**i for i in range(8, 25, 2))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    @contextmanager
+    def time(self):
+        yield
+
+
+if PROMETHEUS_AVAILABLE:
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+    from prometheus_client.core import GaugeMetricFamily
+
+    SYNC_REQUESTS = Counter(
+        "integrador_sync_requests_total",
+        "Requisições de sincronização recebidas.",
+        ["endpoint", "ambiente", "operacao", "status"],
+    )
+    SYNC_DURATION = Histogram(
+        "integrador_sync_request_duration_seconds",
+        "Duração das requisições de sincronização.",
+        ["endpoint", "ambiente", "operacao", "status"],
+        buckets=LATENCY_BUCKETS,
+    )
+    SYNC_IN_PROGRESS = Gauge(
+        "integrador_sync_in_progress",
+        "Requisições de sincronização em andamento, somadas entre os workers.",
+        ["endpoint"],
+        multiprocess_mode="livesum",
+    )
+    MOODLE_DURATION = Histogram(
+        "integrador_moodle_request_duration_seconds",
+        "Duração das chamadas HTTP feitas aos Moodles.",
+        ["method", "host", "status"],
+        buckets=LATENCY_BUCKETS,
+    )
+    MOODLE_ERRORS = Counter(
+        "integrador_moodle_errors_total",
+        "Chamadas HTTP aos Moodles que falharam, por código de erro.",
+        ["method", "host", "code"],
+    )
+    COHORT_RESOLUTION = Histogram(
+        "integrador_cohort_resolution_seconds",
+        "Tempo para avaliar as regras e montar as coortes de um diário.",
+        buckets=LATENCY_BUCKETS,
+    )
+    PAYLOAD_BYTES = Histogram(
+        "integrador_payload_bytes",
+        "Tamanho dos payloads recebidos do SGA e trocados com os Moodles.",
+        ["fluxo"],
+        buckets=SIZE_BUCKETS,
+    )
+    GRADES_CACHE = Counter(
+        "integrador_grades_cache_total",
+        "Downloads de notas pelo cache: servidas do cache, revalidadas no Moodle ou baixadas de novo.",
+        ["resultado"],
+    )
+else:
+    SYNC_REQUESTS = SYNC_DURATION = SYNC_IN_PROGRESS = _NoopMetric()
+    MOODLE_DURATION = MOODLE_ERRORS = COHORT_RESOLUTION = PAYLOAD_BYTES = GRADES_CACHE = _NoopMetric()
+
+
+def observe_sync_request(endpoint: str, ambiente: str, operacao: str, status, duracao: float) -> None:
+    labels = {"endpoint": endpoint, "ambiente": ambiente, "operacao": operacao, "status": str(status)}
+    SYNC_REQUESTS.labels(**labels).inc()
+    SYNC_DURATION.labels(**labels).observe(duracao)
+
+
+def observe_moodle_call(method: str, url: str, status, duracao: float, enviado: int, recebido: int) -> None:
+    host = urlsplit(url).netloc or "-"
+    MOODLE_DURATION.labels(method=method, host=host, status=str(status)).observe(duracao)
+    # 304 é a resposta de um GET condicional cujo conteúdo não mudou, não um erro.
+    if not str(status).startswith("2") and str(status) != "304":
+        MOODLE_ERRORS.labels(method=method, host=host, code=str(status)).inc()
+    if enviado:
+        PAYLOAD_BYTES.labels(fluxo="enviado").observe(enviado)
+    PAYLOAD_BYTES.labels(fluxo="respondido").observe(recebido)
+
+
+@contextmanager
+def track_in_progress(endpoint: str):
+    SYNC_IN_PROGRESS.labels(endpoint=endpoint).inc()
+    try:
+        yield
+    finally:
+        SYNC_IN_PROGRESS.labels(endpoint=endpoint).dec()
+
+
+# O COUNT das solicitações em processamento varre a tabela: é refeito no máximo uma vez por este intervalo (s), e não a
+# cada coleta de cada Prometheus.
+PROCESSANDO_CACHE_KEY = "integrador_metrics_processando"
+PROCESSANDO_CACHE_TIMEOUT = 60
+
+
+class DatabaseCollector:
+    """Métricas lidas do banco no momento da coleta, e não em cada worker."""
+
+    @staticmethod
+    def conta_processando() -> int:
+        from django.core.cache import cache
+
+        from integrador.models import Solicitacao
+
+        return cache.get_or_set(
+            PROCESSANDO_CACHE_KEY,
+            lambda: Solicitacao.objects.filter(status=Solicitacao.Status.PROCESSANDO).count(),
+            PROCESSANDO_CACHE_TIMEOUT,
+        )
+
+    def collect(self):
+
+        processando = GaugeMetricFamily(
+            "integrador_solicitacoes_processando",
+            "Solicitações ainda em processamento (fila de sincronizações em andamento).",
+        )
+        conexoes = GaugeMetricFamily(
+            "integrador_db_connections",
+            "Conexões abertas no banco do integrador, por estado.",
+            labels=["state"],
+        )
+        try:
+            processando.add_metric([], self.conta_processando())
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COALESCE(state, 'unknown'), COUNT(*) FROM pg_stat_activity "
+                    "WHERE datname = current_database() GROUP BY 1"
+                )
+                for state, total in cursor.fetchall():
+                    conexoes.add_metric([state], total)
+        except Exception as e:
+            logger.warning(f"Não foi possível coletar as métricas do banco: {e}")
+            return
+        yield processando
+        yield conexoes
+
+
+def render_metrics() -> bytes:
+    """Gera as métricas no formato texto do Prometheus, agregando os workers em modo multiprocesso."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        from prometheus_client import REGISTRY as registry
+
+    banco = CollectorRegistry()
+    banco.register(DatabaseCollector())
+    return generate_latest(registry) + generate_latest(banco)
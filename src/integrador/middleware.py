@@ -2,6 +2,7 @@
 import logging
 import re
 
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 
 logger = logging.getLogger(__name__)
@@ -30,3 +31,25 @@ class DisableCSRFForAPIMiddleware(MiddlewareMixin):
                 break
 
         return None
+
+
+class InternalHostMiddleware(MiddlewareMixin):
+    """
+    Aceita a coleta do Prometheus feita pelo IP do pod, que chega como Host e não está no ALLOWED_HOSTS (a coleta não
+    permite trocar o header). Nas URLs internas, que não usam o Host, ele vira o primeiro host permitido.
+    Deve vir ANTES do CommonMiddleware, que valida o Host.
+    """
+
+    INTERNAL_URLS = [
+        re.compile(r"^metrics/?$"),  # Prometheus
+    ]
+
+    def process_request(self, request):
+        path = request.path_info.lstrip("/")
+        if not any(pattern.match(path) for pattern in self.INTERNAL_URLS) or "*" in settings.ALLOWED_HOSTS:
+            return None
+
+        # Sem ALLOWED_HOSTS, o Django em DEBUG aceita o localhost; ".dominio" aceita o próprio domínio.
+        request.META["HTTP_HOST"] = settings.ALLOWED_HOSTS[0].lstrip(".") if settings.ALLOWED_HOSTS else "localhost"
+        request.META.pop("HTTP_X_FORWARDED_HOST", None)
+        return None
@@ -0,0 +1,78 @@
+# Generated by Django 6.0.8 on 2026-10-19 06:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import integrador.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("integrador", "0016_alter_ambiente_local_suap_token_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DiarioSyncState",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("diario_id", models.CharField(db_index=True, max_length=256, verbose_name="ID do diário")),
+                (
+                    "operacao",
+                    models.CharField(
+                        choices=integrador.models.Solicitacao.Operacao.choices, max_length=256, verbose_name="operação"
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=integrador.models.Solicitacao.Status.choices,
+                        max_length=256,
+                        null=True,
+                        verbose_name="status",
+                    ),
+                ),
+                ("status_code", models.CharField(blank=True, max_length=256, null=True, verbose_name="status code")),
+                ("timestamp", models.DateTimeField(verbose_name="quando ocorreu")),
+                (
+                    "payload_hash",
+                    models.CharField(blank=True, max_length=64, null=True, verbose_name="hash do JSON recebido"),
+                ),
+                (
+                    "url",
+                    models.CharField(blank=True, max_length=2048, null=True, verbose_name="URL do diário no Moodle"),
+                ),
+                (
+                    "url_sala_coordenacao",
+                    models.CharField(blank=True, max_length=2048, null=True, verbose_name="URL da sala de coordenação"),
+                ),
+                (
+                    "ambiente",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="integrador.ambiente", verbose_name="ambiente"
+                    ),
+                ),
+                (
+                    "solicitacao",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="integrador.solicitacao",
+                        verbose_name="última solicitação",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "estado do diário",
+                "verbose_name_plural": "estados dos diários",
+                "ordering": ["-timestamp"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("ambiente", "diario_id", "operacao"), name="integrador_diariosyncstate_unique"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0.8 on 2026-10-19 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("integrador", "0017_diariosyncstate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BackfillCheckpoint",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("tarefa", models.CharField(max_length=255, verbose_name="tarefa")),
+                ("inicio", models.BigIntegerField(verbose_name="primeiro id do intervalo")),
+                ("fim", models.BigIntegerField(verbose_name="último id do intervalo")),
+                ("ultimo_id", models.BigIntegerField(verbose_name="último id processado")),
+                ("linhas", models.BigIntegerField(default=0, verbose_name="linhas atualizadas")),
+                ("iniciado_em", models.DateTimeField(auto_now_add=True, verbose_name="iniciado em")),
+                ("atualizado_em", models.DateTimeField(auto_now=True, verbose_name="atualizado em")),
+                ("concluido_em", models.DateTimeField(blank=True, null=True, verbose_name="concluído em")),
+            ],
+            options={
+                "verbose_name": "checkpoint de backfill",
+                "verbose_name_plural": "checkpoints de backfill",
+                "ordering": ["tarefa", "inicio"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("tarefa", "inicio", "fim"), name="integrador_backfillcheckpoint_unique"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 6.0.8 on 2026-10-19 06:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import integrador.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("integrador", "0018_backfillcheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SolicitacaoRollup",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("hora", models.DateTimeField(verbose_name="hora")),
+                (
+                    "operacao",
+                    models.CharField(
+                        choices=integrador.models.Solicitacao.Operacao.choices, max_length=256, verbose_name="operação"
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=integrador.models.Solicitacao.Status.choices,
+                        max_length=256,
+                        null=True,
+                        verbose_name="status",
+                    ),
+                ),
+                ("campus_sigla", models.CharField(max_length=256, null=True, verbose_name="campus")),
+                ("total", models.IntegerField(default=0, verbose_name="total")),
+                (
+                    "ambiente",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="integrador.ambiente",
+                        verbose_name="ambiente",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "agregado horário de solicitações",
+                "verbose_name_plural": "agregados horários de solicitações",
+                "ordering": ["-hora"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("hora", "ambiente", "operacao", "status", "campus_sigla"),
+                        name="integrador_solicitacaorollup_unique",
+                        nulls_distinct=False,
+                    )
+                ],
+            },
+        ),
+    ]
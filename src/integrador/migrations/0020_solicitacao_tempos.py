@@ -0,0 +1,18 @@
+# Generated by Django 6.0.8 on 2026-10-19 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("integrador", "0019_solicitacaorollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="solicitacao",
+            name="tempos",
+            field=models.JSONField(blank=True, null=True, verbose_name="tempos por etapa (ms)"),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 6.0.8 on 2026-10-19 07:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import integrador.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("integrador", "0020_solicitacao_tempos"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SolicitacaoProfile",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("timestamp", models.DateTimeField(auto_now_add=True, verbose_name="quando ocorreu")),
+                (
+                    "origem",
+                    models.CharField(
+                        choices=integrador.models.SolicitacaoProfile.Origem.choices,
+                        max_length=16,
+                        verbose_name="origem",
+                    ),
+                ),
+                (
+                    "solicitado_por",
+                    models.CharField(blank=True, max_length=255, null=True, verbose_name="solicitado por"),
+                ),
+                ("duracao_ms", models.FloatField(verbose_name="duração (ms)")),
+                ("stats", models.BinaryField(verbose_name="estatísticas do cProfile")),
+                (
+                    "solicitacao",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="integrador.solicitacao",
+                        verbose_name="solicitação",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "profile de solicitação",
+                "verbose_name_plural": "profiles de solicitações",
+                "ordering": ["-timestamp"],
+            },
+        ),
+    ]
@@ -1,23 +1,39 @@
+import hashlib
 import json
+from collections import Counter
+from datetime import UTC, datetime, timedelta
 from pathlib import Path
 
+from django.db import IntegrityError, connections, transaction
 from django.db.models import (
+    CASCADE,
     PROTECT,
+    SET_NULL,
+    BigIntegerField,
+    BinaryField,
     BooleanField,
     CharField,
+    Count,
     DateTimeField,
+    F,
+    FloatField,
     ForeignKey,
     IntegerField,
     JSONField,
     Manager,
     Model,
+    OneToOneField,
     TextField,
+    UniqueConstraint,
 )
+from django.db.models.functions import TruncHour
 from django.utils.html import format_html
 from django.utils.translation import gettext as _
 from django_better_choices import Choices
 from rule_engine import Rule
 
+from integrador import tracing
+from integrador.timings import etapas_de
 from sga.db.fields import PermissiveURLField
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -26,8 +42,8 @@ STATIC_DIR = BASE_DIR / "static"
 
 class Ambiente(Model):
     class AmbienteManager(Manager):
-        def seleciona_ambiente(self, sync_json: dict) -> Model:
-            ambientes = list(Ambiente.objects.all())
+        def seleciona_ambiente(self, sync_json: dict, ambientes: list | None = None) -> Model:
+            ambientes = list(Ambiente.objects.all()) if ambientes is None else ambientes
             for a in ambientes:
                 if a.check_selectable(sync_json):
                     return a
@@ -87,11 +103,18 @@ class Ambiente(Model):
     def token(self):
         return getattr(self, f"{self.which_broker}_token", None)
 
+    @property
+    def config_version(self) -> str:
+        """Muda sempre que muda a configuração que define o broker do Ambiente: URL, plugins ativos e tokens."""
+        config = (self.url, self.local_suap_active, self.local_suap_token, self.tool_sga_active, self.tool_sga_token)
+        return hashlib.sha256(repr(config).encode("utf-8")).hexdigest()[:16]
+
     def check_selectable(self, sync_json: dict):
         if (not self.can_send_to_local_suap and not self.can_send_to_tool_sga) or not self.valid_expressao_seletora:
             return False
         try:
-            return Rule(self.expressao_seletora).matches(sync_json)
+            with tracing.span("rule.ambiente", {"integrador.ambiente": self.nome}):
+                return Rule(self.expressao_seletora).matches(sync_json)
         except Exception:
             return False
 
@@ -136,6 +159,7 @@ class Solicitacao(Model):
     recebido = JSONField(_("JSON recebido"), null=True, blank=True)
     enviado = JSONField(_("JSON enviado"), null=True, blank=True)
     respondido = JSONField(_("JSON respondido"), null=True, blank=True)
+    tempos = JSONField(_("tempos por etapa (ms)"), null=True, blank=True)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -156,21 +180,309 @@ class Solicitacao(Model):
             "{}{}({})", Solicitacao.Status(self.status).icon, self.get_status_display(), self.status_code or ""
         )
 
-    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+    def finaliza(self, status: str, status_code) -> None:
+        """
+        Grava o desfecho da solicitação e atualiza o estado do diário na mesma transação.
+
+        Os tempos por etapa são gravados junto, num único UPDATE; o da própria gravação final só é conhecido depois
+        dela, então fica fora de `tempos` e vai só no header `Server-Timing`.
+        """
+        self.status = status
+        self.status_code = status_code
+        etapas = etapas_de(self)
+        self.tempos = dict(etapas.tempos)
+        with transaction.atomic(), etapas.medir("finalizacao"):
+            self.save()
+            DiarioSyncState.objects.registra(self)
+            SolicitacaoRollup.objects.incrementa(self)
+
+    def preenche_do_recebido(self) -> None:
+        """Deriva do `recebido` o Ambiente, o campus, o diário e o tipo. O `save` chama; o `bulk_create`, não."""
         if self.recebido:
             diario = self.recebido.get("diario", {})
             componente = diario.get("sigla", "")
             turma = self.recebido.get("turma", {}).get("codigo", "")
             self.ambiente = self.ambiente or Ambiente.objects.seleciona_ambiente(self.recebido)
-            self.campus_sigla = self.recebido.get("campus", {}).get("sigla", None)
+            # No formato genérico do SGA, o campus é a `unidade` e o diário já traz o seu código.
+            generico = "unidade" in self.recebido
+            self.campus_sigla = self.recebido.get("unidade" if generico else "campus", {}).get("sigla", None)
             self.diario_id = diario.get("id", "")
-            self.diario_codigo = f"{turma}.{componente}#{self.diario_id}"
+            self.diario_codigo = (generico and diario.get("codigo")) or f"{turma}.{componente}#{self.diario_id}"
             self.tipo = self.recebido.get("diario", {}).get(
                 "tipo", "regular" if self.operacao == Solicitacao.Operacao.SYNC_UP_DIARIO else None
             )
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        self.preenche_do_recebido()
         return super().save(
             force_insert=force_insert,
             force_update=force_update,
             using=using,
             update_fields=update_fields,
         )
+
+
+class DiarioSyncState(Model):
+    class DiarioSyncStateManager(Manager):
+        CAMPOS = [
+            "ambiente",
+            "diario_id",
+            "operacao",
+            "solicitacao",
+            "status",
+            "status_code",
+            "timestamp",
+            "payload_hash",
+            "url",
+            "url_sala_coordenacao",
+        ]
+        UPSERT_SQL = """
+            INSERT INTO integrador_diariosyncstate
+                (ambiente_id, diario_id, operacao, solicitacao_id, status, status_code, "timestamp", payload_hash, url,
+                 url_sala_coordenacao)
+            VALUES %s
+            ON CONFLICT (ambiente_id, diario_id, operacao) DO UPDATE SET
+                solicitacao_id = EXCLUDED.solicitacao_id,
+                status = EXCLUDED.status,
+                status_code = EXCLUDED.status_code,
+                "timestamp" = EXCLUDED."timestamp",
+                payload_hash = EXCLUDED.payload_hash,
+                url = EXCLUDED.url,
+                url_sala_coordenacao = EXCLUDED.url_sala_coordenacao
+            WHERE EXCLUDED."timestamp" >= integrador_diariosyncstate."timestamp"
+        """
+
+        def registra(self, *solicitacoes: Solicitacao) -> int:
+            """Faz o upsert do estado mais recente de cada (ambiente, diário, operação) das solicitações finalizadas."""
+            estados = {}
+            for solicitacao in solicitacoes:
+                estado = DiarioSyncState.from_solicitacao(solicitacao)
+                if estado is None:
+                    continue
+                chave = (estado.ambiente_id, estado.diario_id, estado.operacao)
+                if chave not in estados or estado.timestamp >= estados[chave].timestamp:
+                    estados[chave] = estado
+            return self.upsert(list(estados.values()))
+
+        def upsert(self, estados: list["DiarioSyncState"], batch_size: int | None = 1000) -> int:
+            """
+            Grava os estados; o existente de cada (ambiente, diário, operação) só é substituído por um de mesmo
+            `timestamp` ou mais novo.
+
+            O `bulk_create(update_conflicts=True)` não filtra o `DO UPDATE`; com o `WHERE` no próprio `ON CONFLICT`,
+            uma solicitação antiga que termina por último (uma retentativa, um backfill) não apaga o estado da nova.
+            """
+            if not estados:
+                return 0
+            connection = connections[self.db]
+            campos = [self.model._meta.get_field(nome) for nome in self.CAMPOS]
+            linha = f"({', '.join(['%s'] * len(campos))})"
+            batch_size = batch_size or len(estados)
+            with connection.cursor() as cursor:
+                for inicio in range(0, len(estados), batch_size):
+                    lote = estados[inicio : inicio + batch_size]
+                    cursor.execute(
+                        self.UPSERT_SQL % ", ".join([linha] * len(lote)),
+                        [
+                            campo.get_db_prep_save(getattr(estado, campo.attname), connection)
+                            for estado in lote
+                            for campo in campos
+                        ],
+                    )
+            return len(estados)
+
+    ambiente = ForeignKey(Ambiente, verbose_name=_("ambiente"), on_delete=CASCADE)
+    diario_id = CharField(_("ID do diário"), max_length=256, db_index=True)
+    operacao = CharField(_("operação"), max_length=256, choices=Solicitacao.Operacao.choices)
+    solicitacao = ForeignKey(
+        Solicitacao, verbose_name=_("última solicitação"), on_delete=SET_NULL, null=True, related_name="+"
+    )
+    status = CharField(_("status"), max_length=256, choices=Solicitacao.Status.choices, null=True)
+    status_code = CharField(_("status code"), max_length=256, null=True, blank=True)
+    timestamp = DateTimeField(_("quando ocorreu"))
+    payload_hash = CharField(_("hash do JSON recebido"), max_length=64, null=True, blank=True)
+    url = CharField(_("URL do diário no Moodle"), max_length=2048, null=True, blank=True)
+    url_sala_coordenacao = CharField(_("URL da sala de coordenação"), max_length=2048, null=True, blank=True)
+
+    objects = DiarioSyncStateManager()
+
+    class Meta:
+        verbose_name = _("estado do diário")
+        verbose_name_plural = _("estados dos diários")
+        ordering = ["-timestamp"]
+        constraints = [
+            UniqueConstraint(fields=["ambiente", "diario_id", "operacao"], name="integrador_diariosyncstate_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.diario_id}={self.status}, {self.operacao}[{self.ambiente}]"
+
+    @staticmethod
+    def payload_hash_of(recebido) -> str | None:
+        if recebido is None:
+            return None
+        canonical = json.dumps(recebido, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def from_solicitacao(cls, solicitacao: Solicitacao) -> "DiarioSyncState | None":
+        finalizada = solicitacao.status in (Solicitacao.Status.SUCESSO, Solicitacao.Status.FALHA)
+        if not finalizada or solicitacao.ambiente_id is None or not solicitacao.diario_id:
+            return None
+        respondido = solicitacao.respondido if isinstance(solicitacao.respondido, dict) else {}
+        return cls(
+            ambiente_id=solicitacao.ambiente_id,
+            diario_id=solicitacao.diario_id,
+            operacao=solicitacao.operacao,
+            solicitacao_id=solicitacao.id,
+            status=solicitacao.status,
+            status_code=solicitacao.status_code,
+            timestamp=solicitacao.timestamp,
+            payload_hash=cls.payload_hash_of(solicitacao.recebido),
+            url=respondido.get("url"),
+            url_sala_coordenacao=respondido.get("url_sala_coordenacao"),
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "ambiente": self.ambiente.nome,
+            "diario_id": self.diario_id,
+            "operacao": self.operacao,
+            "solicitacao_id": self.solicitacao_id,
+            "status": self.status,
+            "status_code": self.status_code,
+            "timestamp": self.timestamp.isoformat() if self.timestamp else None,
+            "payload_hash": self.payload_hash,
+            "url": self.url,
+            "url_sala_coordenacao": self.url_sala_coordenacao,
+        }
+
+
+class BackfillCheckpoint(Model):
+    tarefa = CharField(_("tarefa"), max_length=255)
+    inicio = BigIntegerField(_("primeiro id do intervalo"))
+    fim = BigIntegerField(_("último id do intervalo"))
+    ultimo_id = BigIntegerField(_("último id processado"))
+    linhas = BigIntegerField(_("linhas atualizadas"), default=0)
+    iniciado_em = DateTimeField(_("iniciado em"), auto_now_add=True)
+    atualizado_em = DateTimeField(_("atualizado em"), auto_now=True)
+    concluido_em = DateTimeField(_("concluído em"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("checkpoint de backfill")
+        verbose_name_plural = _("checkpoints de backfill")
+        ordering = ["tarefa", "inicio"]
+        constraints = [
+            UniqueConstraint(fields=["tarefa", "inicio", "fim"], name="integrador_backfillcheckpoint_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.tarefa}[{self.inicio}-{self.fim}]: {self.ultimo_id}"
+
+    @property
+    def progresso(self) -> float:
+        total = self.fim - self.inicio + 1
+        return min(100.0, max(0.0, (self.ultimo_id - self.inicio + 1) * 100.0 / total)) if total > 0 else 100.0
+
+
+class SolicitacaoRollup(Model):
+    class SolicitacaoRollupManager(Manager):
+        # Só as finalizadas: uma em processamento contada na recompactação seria somada de novo ao ser finalizada.
+        STATUS = [Solicitacao.Status.SUCESSO, Solicitacao.Status.FALHA]
+
+        @staticmethod
+        def hora_de(momento: datetime) -> datetime:
+            return momento.astimezone(UTC).replace(minute=0, second=0, microsecond=0)
+
+        def chave_de(self, solicitacao: Solicitacao) -> tuple:
+            return (
+                self.hora_de(solicitacao.timestamp),
+                solicitacao.ambiente_id,
+                solicitacao.operacao,
+                solicitacao.status,
+                solicitacao.campus_sigla,
+            )
+
+        def incrementa(self, *solicitacoes: Solicitacao) -> None:
+            """Soma as solicitações finalizadas aos agregados das horas em que foram recebidas."""
+            totais = Counter(self.chave_de(s) for s in solicitacoes if s.status in self.STATUS)
+            for (hora, ambiente_id, operacao, status, campus_sigla), total in totais.items():
+                chave = dict(
+                    hora=hora, ambiente_id=ambiente_id, operacao=operacao, status=status, campus_sigla=campus_sigla
+                )
+                if self.filter(**chave).update(total=F("total") + total):
+                    continue
+                try:
+                    with transaction.atomic():
+                        self.create(**chave, total=total)
+                except IntegrityError:
+                    self.filter(**chave).update(total=F("total") + total)
+
+        def recompacta(self, inicio: datetime, fim: datetime) -> int:
+            """Recalcula, a partir das Solicitações, os agregados exatos das horas entre `inicio` e `fim`."""
+            inicio = self.hora_de(inicio)
+            fim = self.hora_de(fim)
+            fim = fim if fim >= inicio else inicio
+            fim += timedelta(hours=1)
+            agregados = (
+                Solicitacao.objects.filter(timestamp__gte=inicio, timestamp__lt=fim, status__in=self.STATUS)
+                .annotate(hora=TruncHour("timestamp", tzinfo=UTC))
+                .values("hora", "ambiente_id", "operacao", "status", "campus_sigla")
+                .annotate(total=Count("id"))
+                .order_by()
+            )
+            with transaction.atomic():
+                if connections[self.db].vendor == "postgresql":
+                    # Espera os `incrementa` em andamento e segura os novos até o commit: um incremento feito entre a
+                    # contagem e a troca dos agregados se perderia ou seria contado duas vezes.
+                    with connections[self.db].cursor() as cursor:
+                        cursor.execute("LOCK TABLE integrador_solicitacaorollup IN SHARE ROW EXCLUSIVE MODE")
+                self.filter(hora__gte=inicio, hora__lt=fim).delete()
+                criados = self.bulk_create([SolicitacaoRollup(**a) for a in agregados], batch_size=1000)
+            return len(criados)
+
+    hora = DateTimeField(_("hora"))
+    ambiente = ForeignKey(Ambiente, verbose_name=_("ambiente"), on_delete=CASCADE, null=True)
+    operacao = CharField(_("operação"), max_length=256, choices=Solicitacao.Operacao.choices)
+    status = CharField(_("status"), max_length=256, choices=Solicitacao.Status.choices, null=True)
+    campus_sigla = CharField(_("campus"), max_length=256, null=True)
+    total = IntegerField(_("total"), default=0)
+
+    objects = SolicitacaoRollupManager()
+
+    class Meta:
+        verbose_name = _("agregado horário de solicitações")
+        verbose_name_plural = _("agregados horários de solicitações")
+        ordering = ["-hora"]
+        constraints = [
+            UniqueConstraint(
+                fields=["hora", "ambiente", "operacao", "status", "campus_sigla"],
+                name="integrador_solicitacaorollup_unique",
+                nulls_distinct=False,
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.hora:%Y-%m-%d %H}h {self.operacao}={self.status}[{self.ambiente}]: {self.total}"
+
+
+class SolicitacaoProfile(Model):
+    class Origem(Choices):
+        HEADER = Choices.Value(_("Header assinado"), value="header")
+        STAFF = Choices.Value(_("Usuário da equipe"), value="staff")
+        ADMIN = Choices.Value(_("Reenvio pelo admin"), value="admin")
+
+    solicitacao = OneToOneField(Solicitacao, verbose_name=_("solicitação"), on_delete=CASCADE, related_name="+")
+    timestamp = DateTimeField(_("quando ocorreu"), auto_now_add=True)
+    origem = CharField(_("origem"), max_length=16, choices=Origem.choices)
+    solicitado_por = CharField(_("solicitado por"), max_length=255, null=True, blank=True)
+    duracao_ms = FloatField(_("duração (ms)"))
+    stats = BinaryField(_("estatísticas do cProfile"))
+
+    class Meta:
+        verbose_name = _("profile de solicitação")
+        verbose_name_plural = _("profiles de solicitações")
+        ordering = ["-timestamp"]
+
+    def __str__(self):
+        return f"{self.solicitacao_id}: {self.duracao_ms} ms ({self.origem})"
@@ -1,7 +1,17 @@
+import hashlib
+import itertools
 import json
 import logging
+import math
+import os
+import random
+import socket
+import struct
 import threading
+import time
 import uuid
+import zlib
+from collections import Counter, OrderedDict, namedtuple
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import parse_qs, urlparse
@@ -29,8 +39,15 @@ _LOCAL_SUAP_IMPLEMENTED_SERVICES = frozenset(
 )
 
 # ---------------------------------------------------------------------------
-# tool_sga plugin — serviços conhecidos (broker ainda não implementado)
+# tool_sga plugin — serviços implementados no mock e o método de cada um
 # ---------------------------------------------------------------------------
+_TOOL_SGA_SERVICES = {
+    "health": "GET",
+    "sync_up_enrolments": "POST",
+    "sync_up_batch": "POST",
+    "sync_down_grades": "GET",
+    "sync_down_grades_batch": "POST",
+}
 
 
 class MockHTTPResponse:
@@ -42,18 +59,23 @@ class MockHTTPResponse:
         self.content = json.dumps(payload).encode("utf-8")
 
     @classmethod
-    def html_error(cls, status_code: int = 500, message: str | None = None) -> "MockHTTPResponse":
-        """Simula resposta HTML do Moodle, como ocorre em erros fatais do PHP."""
-        phrase = message or HTTPStatus(status_code).phrase
-        html = f"<!DOCTYPE html><html><body><h1>{phrase}</h1></body></html>".encode("utf-8")
+    def from_content(cls, content: bytes, status_code: int = 200, headers: dict | None = None) -> "MockHTTPResponse":
+        """Resposta com o corpo já serializado, sem passar de novo pelo json.dumps."""
         obj = object.__new__(cls)
         obj.status_code = status_code
         obj.ok = 200 <= status_code < 300
         obj.reason = HTTPStatus(status_code).phrase
-        obj.headers = {"Content-Type": "text/html; charset=utf-8"}
-        obj.content = html
+        obj.headers = headers if headers is not None else {"Content-Type": "application/json"}
+        obj.content = content
         return obj
 
+    @classmethod
+    def html_error(cls, status_code: int = 500, message: str | None = None) -> "MockHTTPResponse":
+        """Simula resposta HTML do Moodle, como ocorre em erros fatais do PHP."""
+        phrase = message or HTTPStatus(status_code).phrase
+        html = f"<!DOCTYPE html><html><body><h1>{phrase}</h1></body></html>".encode("utf-8")
+        return cls.from_content(html, status_code, {"Content-Type": "text/html; charset=utf-8"})
+
 
 class LocalSuapHTTPMock:
     """
@@ -181,22 +203,201 @@ class LocalSuapHTTPMock:
         return self.request("POST", url, jsonbody=jsonbody, headers=headers)
 
 
+class ToolSgaState:
+    """
+    Estado em memória do plugin `tool_sga`: cursos, inscrições e notas de cada diário.
+
+    Cada diário tem o seu lock (de um conjunto fixo de `LOCKS` locks, pelo id), então requisições de diários
+    diferentes não esperam umas pelas outras. A resposta do `sync_down_grades` de cada diário é serializada uma vez e
+    reaproveitada até o diário mudar; o ETag é a versão do diário.
+
+    Sem notas lançadas por `set_grades`, cada aluno ativo recebe uma nota por avaliação, calculada do login, para
+    que a mesma inscrição sempre devolva as mesmas notas.
+    """
+
+    LOCKS = 64
+    # Chaves de lote lembradas para responder às retentativas; as mais antigas são esquecidas.
+    BATCH_KEYS_MAX = 10_000
+
+    def __init__(self):
+        self._locks = [threading.Lock() for _ in range(self.LOCKS)]
+        self._batches_lock = threading.Lock()
+        self._ids = itertools.count(3)
+        self._versoes = itertools.count(1)
+        self.reset()
+
+    def reset(self) -> None:
+        self.diarios = {}
+        self.coordenacoes = {}
+        self.inscricoes = {}
+        self._batches = OrderedDict()
+        self._grades_cache = {}
+        self.counters = Counter()
+
+    def _lock(self, diario_id: str) -> threading.Lock:
+        return self._locks[zlib.crc32(diario_id.encode("utf-8")) % self.LOCKS]
+
+    def _diario(self, diario_id: str) -> dict:
+        return self.diarios.setdefault(diario_id, {"lancadas": None, "avaliacoes": 1})
+
+    def upsert_diario(self, payload: dict, base_url: str) -> dict:
+        """Cria ou atualiza o curso do diário e as suas inscrições; inscrições ausentes do payload são mantidas."""
+        diario_id = str(payload["diario"]["id"])
+        criadas = atualizadas = suspensas = 0
+        with self._lock(diario_id):
+            diario = self._diario(diario_id)
+            curso_id = diario.get("curso_id") or next(self._ids)
+            # A sala de coordenação é do curso, compartilhada entre diários; o setdefault é atômico, e o next()
+            # descartado numa corrida só deixa um id sem uso.
+            chave = (payload["unidade"]["sigla"], payload["curso"]["codigo"])
+            coordenacao_id = self.coordenacoes.get(chave) or self.coordenacoes.setdefault(chave, next(self._ids))
+            inscricoes = self.inscricoes.setdefault(diario_id, {})
+            for inscricao in payload.get("inscricoes") or []:
+                anterior = inscricoes.get(inscricao["login"])
+                if anterior is None:
+                    criadas += 1
+                elif anterior != inscricao:
+                    atualizadas += 1
+                if inscricao.get("situacao", "ativo") != "ativo":
+                    suspensas += 1
+                inscricoes[inscricao["login"]] = inscricao
+            diario.update(
+                avaliacoes=int((payload.get("disciplina") or {}).get("avaliacoes") or 1),
+                curso_id=curso_id,
+                coordenacao_id=coordenacao_id,
+                versao=next(self._versoes),
+            )
+            self._grades_cache.pop(diario_id, None)
+        self.counters["sync_up"] += 1
+        return {
+            "diario_id": diario_id,
+            "url": f"{base_url}/course/view.php?id={curso_id}",
+            "url_sala_coordenacao": f"{base_url}/course/view.php?id={coordenacao_id}",
+            "inscricoes": {"criadas": criadas, "atualizadas": atualizadas, "suspensas": suspensas},
+        }
+
+    def set_grades(self, diario_id, notas: list[dict]) -> None:
+        """Lança as notas do diário (`matricula`, `etapa`, `nota`), no lugar das calculadas."""
+        diario_id = str(diario_id)
+        with self._lock(diario_id):
+            self._diario(diario_id).update(lancadas=list(notas), versao=next(self._versoes))
+            self._grades_cache.pop(diario_id, None)
+
+    def _calcula_notas(self, diario_id: str, diario: dict) -> list[dict]:
+        if diario["lancadas"] is not None:
+            return [{**nota, "diario_id": diario_id} for nota in diario["lancadas"]]
+        return [
+            {
+                "matricula": inscricao.get("matricula") or login,
+                "etapa": etapa,
+                "nota": zlib.crc32(f"{login}:{etapa}".encode("utf-8")) % 101 / 10,
+                "diario_id": diario_id,
+            }
+            for login, inscricao in self.inscricoes.get(diario_id, {}).items()
+            if inscricao.get("papel") == "aluno" and inscricao.get("situacao", "ativo") == "ativo"
+            for etapa in range(1, diario["avaliacoes"] + 1)
+        ]
+
+    def grades(self, diario_id, base_url: str) -> tuple[str, bytes] | None:
+        """ETag e corpo JSON das notas do diário, ou None se o diário não existe no Moodle."""
+        diario_id = str(diario_id)
+        self.counters["sync_down"] += 1
+        cached = self._grades_cache.get(diario_id)
+        if cached is not None and cached[0] == base_url:
+            return cached[1:]
+        with self._lock(diario_id):
+            diario = self.diarios.get(diario_id)
+            if diario is None or "curso_id" not in diario:
+                return None
+            etag = f'"{diario["versao"]}"'
+            body = json.dumps(
+                {
+                    "diario_id": diario_id,
+                    "notas": self._calcula_notas(diario_id, diario),
+                    "url": f"{base_url}/course/view.php?id={diario['curso_id']}",
+                    "url_sala_coordenacao": f"{base_url}/course/view.php?id={diario['coordenacao_id']}",
+                }
+            ).encode("utf-8")
+            self._grades_cache[diario_id] = (base_url, etag, body)
+        return etag, body
+
+    def batch(self, batch_key: str, body_hash: str, processa) -> tuple[dict, bool]:
+        """
+        Executa `processa()` uma única vez por `batch_key` e devolve (resposta, repetido).
+
+        Uma retentativa com a mesma chave recebe a resposta da primeira execução, mesmo que chegue enquanto ela
+        ainda roda. A mesma chave com outro conteúdo é um erro (ValueError).
+        """
+        with self._batches_lock:
+            entrada = self._batches.get(batch_key)
+            dono = entrada is None
+            if dono:
+                entrada = self._batches[batch_key] = {"hash": body_hash, "pronto": threading.Event(), "resposta": None}
+                while len(self._batches) > self.BATCH_KEYS_MAX:
+                    self._batches.popitem(last=False)
+        if entrada["hash"] != body_hash:
+            raise ValueError(f"batch_key {batch_key} já usada com outro conteúdo")
+        if not dono:
+            entrada["pronto"].wait()
+            if entrada["resposta"] is None:
+                raise ValueError(f"batch_key {batch_key} falhou na primeira execução; use outra chave")
+            self.counters["lotes_repetidos"] += 1
+            return entrada["resposta"], True
+        try:
+            entrada["resposta"] = processa()
+        except Exception:
+            with self._batches_lock:
+                self._batches.pop(batch_key, None)
+            raise
+        finally:
+            entrada["pronto"].set()
+        self.counters["lotes"] += 1
+        return entrada["resposta"], False
+
+    def snapshot(self) -> dict:
+        return {
+            "diarios": sum(1 for diario in list(self.diarios.values()) if "curso_id" in diario),
+            "inscricoes": sum(len(inscricoes) for inscricoes in list(self.inscricoes.values())),
+            "lotes": len(self._batches),
+            "counters": dict(self.counters),
+        }
+
+
 class ToolSgaHTTPMock:
     """
-    Mock HTTP client para o plugin `tool_sga` do Moodle.
+    Mock HTTP client para o plugin `tool_sga` do Moodle, com estado (`ToolSgaState`).
 
     Usado pelos brokers:
       - `Suap2ToolSgaBroker` (suap2tool_sga)
       - `Sga2ToolSgaBroker`  (sga2tool_sga)
 
-    **Atenção:** os brokers correspondentes ainda não estão implementados,
-    portanto este mock retorna 501 para qualquer chamada enquanto aguarda
-    a definição da API do plugin `tool_sga`.
+    Simula o endpoint `/admin/tool/sga/api/index.php` com os serviços:
+      - health                  (GET)
+      - sync_up_enrolments      (POST) um diário no formato genérico do SGA
+      - sync_up_batch           (POST) {"batch_key": ..., "diarios": [...]}, idempotente pela batch_key
+      - sync_down_grades        (GET)  diario_id=...; com If-None-Match igual ao ETag, 304
+      - sync_down_grades_batch  (POST) {"diario_ids": [...]}
+
+    Formato genérico de um diário (campos obrigatórios em `SYNC_UP_REQUIRED_FIELDS`)::
+
+        {"sga": "suap", "unidade": {...}, "curso": {...}, "turma": {...}, "disciplina": {...}, "diario": {...},
+         "polo": {...}, "inscricoes": [{"papel", "login", "nome", "email", "situacao", "matricula"}, ...],
+         "coortes": [...]}
     """
 
     TEST_TOKEN = LocalSuapHTTPMock.TEST_TOKEN
 
-    PLUGIN_PATH = "/local/tool_sga/api/index.php"
+    PLUGIN_PATH = "/admin/tool/sga/api/index.php"
+
+    SYNC_UP_REQUIRED_FIELDS = {
+        "unidade": ["sigla"],
+        "curso": ["id", "codigo"],
+        "turma": ["codigo"],
+        "diario": ["id", "codigo"],
+    }
+
+    def __init__(self, state: ToolSgaState | None = None):
+        self.state = state or ToolSgaState()
 
     def _validate_authentication(self, headers: dict) -> MockHTTPResponse | None:
         auth = headers.get("Authentication") or headers.get("authentication")
@@ -212,6 +413,84 @@ class ToolSgaHTTPMock:
             )
         return None
 
+    @staticmethod
+    def _error(message: str, code: int) -> MockHTTPResponse:
+        return MockHTTPResponse({"error": {"message": message, "code": code}}, status_code=code)
+
+    def _validate_diario(self, payload) -> str | None:
+        if not isinstance(payload, dict):
+            return "Diário deve ser um objeto JSON"
+        missing = [
+            f"{field}.{sub}"
+            for field, subfields in self.SYNC_UP_REQUIRED_FIELDS.items()
+            for sub in subfields
+            if not isinstance(payload.get(field), dict) or sub not in payload[field]
+        ]
+        inscricoes = payload.get("inscricoes") or []
+        if not isinstance(inscricoes, list) or any(
+            not isinstance(i, dict) or "login" not in i or "papel" not in i for i in inscricoes
+        ):
+            missing.append("inscricoes[].login/papel")
+        return f"Campos obrigatórios ausentes: {', '.join(missing)}" if missing else None
+
+    def health(self) -> MockHTTPResponse:
+        return MockHTTPResponse({"status": "ok", "plugin": "tool_sga", **self.state.snapshot()})
+
+    def sync_up_enrolments(self, base_url: str, jsonbody) -> MockHTTPResponse:
+        erro = self._validate_diario(jsonbody)
+        if erro:
+            return self._error(erro, 422)
+        return MockHTTPResponse(self.state.upsert_diario(jsonbody, base_url))
+
+    def sync_up_batch(self, base_url: str, jsonbody) -> MockHTTPResponse:
+        jsonbody = jsonbody if isinstance(jsonbody, dict) else {}
+        batch_key, diarios = jsonbody.get("batch_key"), jsonbody.get("diarios")
+        if not batch_key or not isinstance(diarios, list):
+            return self._error("Informe batch_key e a lista diarios", 422)
+        erros = {i: erro for i, diario in enumerate(diarios) if (erro := self._validate_diario(diario))}
+        if erros:
+            return MockHTTPResponse(
+                {"error": {"message": "Lote com diários inválidos", "code": 422, "diarios": erros}}, status_code=422
+            )
+
+        body_hash = hashlib.sha256(json.dumps(diarios, sort_keys=True).encode("utf-8")).hexdigest()
+        try:
+            resposta, repetido = self.state.batch(
+                batch_key,
+                body_hash,
+                lambda: {"batch_key": batch_key, "diarios": [self.state.upsert_diario(d, base_url) for d in diarios]},
+            )
+        except ValueError as e:
+            return self._error(str(e), 409)
+        return MockHTTPResponse({**resposta, "repetido": repetido})
+
+    def sync_down_grades(self, base_url: str, params: dict, headers: dict) -> MockHTTPResponse:
+        diario_id = params.get("diario_id")
+        if not diario_id:
+            return self._error("Informe o diario_id", 422)
+        grades = self.state.grades(diario_id, base_url)
+        if grades is None:
+            return self._error(f"Diário {diario_id} não encontrado", 404)
+        etag, body = grades
+        # O urllib envia o header como "If-none-match"; o nome de um header não diferencia maiúsculas.
+        if {k.lower(): v for k, v in headers.items()}.get("if-none-match") == etag:
+            return MockHTTPResponse.from_content(b"", 304, {"ETag": etag})
+        return MockHTTPResponse.from_content(body, 200, {"Content-Type": "application/json", "ETag": etag})
+
+    def sync_down_grades_batch(self, base_url: str, jsonbody) -> MockHTTPResponse:
+        diario_ids = jsonbody.get("diario_ids") if isinstance(jsonbody, dict) else None
+        if not isinstance(diario_ids, list):
+            return self._error("Informe a lista diario_ids", 422)
+        partes = []
+        for diario_id in diario_ids:
+            grades = self.state.grades(diario_id, base_url)
+            if grades is None:
+                erro = {"diario_id": str(diario_id), "error": {"message": "Diário não encontrado", "code": 404}}
+                partes.append(json.dumps(erro).encode("utf-8"))
+            else:
+                partes.append(grades[1])
+        return MockHTTPResponse.from_content(b'{"diarios": [' + b", ".join(partes) + b"]}")
+
     def request(
         self, method: str, url: str, jsonbody: dict | None = None, headers: dict | None = None
     ) -> MockHTTPResponse:
@@ -219,15 +498,28 @@ class ToolSgaHTTPMock:
         if not parsed.path.endswith(self.PLUGIN_PATH):
             return MockHTTPResponse({"error": "Endpoint Moodle mock não reconhecido."}, status_code=404)
 
-        auth_error = self._validate_authentication(headers or {})
+        headers = headers or {}
+        auth_error = self._validate_authentication(headers)
         if auth_error:
             return auth_error
 
-        # Broker ainda não implementado — todos os serviços retornam 501
-        return MockHTTPResponse(
-            {"error": {"message": "Broker tool_sga ainda não implementado.", "code": 501}},
-            status_code=501,
-        )
+        service = parsed.query.split("&", 1)[0].split("=", 1)[0]
+        if service not in _TOOL_SGA_SERVICES:
+            return self._error("Serviço não existe", 404)
+        if method != _TOOL_SGA_SERVICES[service]:
+            return self._error(f"Use {_TOOL_SGA_SERVICES[service]} em {service}", 405)
+
+        base_url = f"{parsed.scheme}://{parsed.netloc}"
+        if service == "health":
+            return self.health()
+        if service == "sync_up_enrolments":
+            return self.sync_up_enrolments(base_url, jsonbody)
+        if service == "sync_up_batch":
+            return self.sync_up_batch(base_url, jsonbody)
+        if service == "sync_down_grades":
+            params = {key: values[0] for key, values in parse_qs(parsed.query).items() if values}
+            return self.sync_down_grades(base_url, params, headers)
+        return self.sync_down_grades_batch(base_url, jsonbody)
 
     def get(self, url: str, headers: dict | None = None) -> MockHTTPResponse:
         return self.request("GET", url, headers=headers)
@@ -241,58 +533,327 @@ class ToolSgaHTTPMock:
 MoodleHTTPMock = LocalSuapHTTPMock
 
 
+# ---------------------------------------------------------------------------
+# Injeção de latência e falhas no servidor em background
+# ---------------------------------------------------------------------------
+FAULTS_CONTROL_PATH = "/__mock__/faults"
+TOOL_SGA_CONTROL_PATH = "/__mock__/tool_sga"
+
+Fault = namedtuple("Fault", ["kind", "delay_s", "status"])
+
+
+class FaultInjector:
+    """
+    Decide, para cada requisição ao servidor mock, quanto ela demora e se falha.
+
+    A configuração mapeia o serviço (`sync_up_enrolments`, `sync_down_grades` etc.) ou `"*"` (todos) às opções
+    abaixo; as do serviço sobrepõem as de `"*"`:
+
+    - `latency`: milissegundos fixos, ou `{"dist": "fixed", "ms": 200}`, `{"dist": "uniform", "min_ms", "max_ms"}`,
+      `{"dist": "lognormal", "median_ms", "sigma"}` ou `{"dist": "pareto", "scale_ms", "alpha"}`, com `max_ms`
+      opcional como teto;
+    - `error_rate` e `error_status` (padrão `[500, 502, 503]`): erro JSON do plugin;
+    - `html_error_rate`: página HTML de erro fatal do PHP, com status 500;
+    - `timeout_rate` e `timeout_s` (padrão 30): segura a conexão e fecha sem responder;
+    - `reset_rate`: fecha a conexão com RST, sem responder;
+    - `rps` e `burst` (padrão `rps`): acima da taxa responde 429 com `Retry-After`, sem latência.
+    """
+
+    OPTIONS = frozenset(
+        {
+            "latency",
+            "error_rate",
+            "error_status",
+            "html_error_rate",
+            "timeout_rate",
+            "timeout_s",
+            "reset_rate",
+            "rps",
+            "burst",
+        }
+    )
+    RATES = ("reset_rate", "timeout_rate", "html_error_rate", "error_rate")
+    DISTRIBUTIONS = frozenset({"fixed", "uniform", "lognormal", "pareto"})
+
+    def __init__(self, config: dict | None = None, seed: int | None = None):
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)  # noqa: S311
+        self._stop = threading.Event()
+        self.configure({} if config is None else config)
+
+    @classmethod
+    def validate(cls, config: dict) -> None:
+        if not isinstance(config, dict):
+            raise ValueError("A configuração de falhas deve ser um objeto JSON.")
+        for service, options in config.items():
+            if not isinstance(options, dict):
+                raise ValueError(f"{service}: as opções devem ser um objeto JSON.")
+            unknown = set(options) - cls.OPTIONS
+            if unknown:
+                raise ValueError(f"{service}: opções desconhecidas: {', '.join(sorted(unknown))}.")
+            for rate in cls.RATES:
+                if not 0 <= options.get(rate, 0) <= 1:
+                    raise ValueError(f"{service}: {rate} deve estar entre 0 e 1.")
+            if sum(options.get(rate, 0) for rate in cls.RATES) > 1:
+                raise ValueError(f"{service}: a soma das taxas de falha passa de 1.")
+            latency = options.get("latency")
+            if isinstance(latency, dict) and latency.get("dist", "fixed") not in cls.DISTRIBUTIONS:
+                raise ValueError(f"{service}: distribuição de latência desconhecida: {latency.get('dist')}.")
+
+    def configure(self, config: dict) -> None:
+        """Troca a configuração e zera os contadores e os limites de taxa."""
+        self.validate(config)
+        with self._lock:
+            self.config = config
+            self._services = {}
+            self._buckets = {}
+            self.counters = Counter()
+
+    def options(self, service: str) -> dict:
+        if service not in self._services:
+            self._services[service] = {**self.config.get("*", {}), **self.config.get(service, {})}
+        return self._services[service]
+
+    def latency_s(self, latency) -> float:
+        if not latency:
+            return 0.0
+        if not isinstance(latency, dict):
+            return float(latency) / 1000
+        dist = latency.get("dist", "fixed")
+        with self._lock:
+            if dist == "uniform":
+                ms = self._random.uniform(latency.get("min_ms", 0), latency.get("max_ms", 0))
+            elif dist == "lognormal":
+                ms = self._random.lognormvariate(math.log(latency.get("median_ms", 100)), latency.get("sigma", 0.5))
+            elif dist == "pareto":
+                ms = latency.get("scale_ms", 100) * self._random.paretovariate(latency.get("alpha", 2))
+            else:
+                ms = latency.get("ms", 0)
+        if "max_ms" in latency and dist != "uniform":
+            ms = min(ms, latency["max_ms"])
+        return ms / 1000
+
+    def _throttled(self, service: str, rps: float, burst: float) -> bool:
+        """Token bucket por serviço."""
+        agora = time.monotonic()
+        with self._lock:
+            tokens, antes = self._buckets.get(service, (burst, agora))
+            tokens = min(burst, tokens + (agora - antes) * rps)
+            if tokens < 1:
+                self._buckets[service] = (tokens, agora)
+                return True
+            self._buckets[service] = (tokens - 1, agora)
+            return False
+
+    def _count(self, service: str, kind: str) -> None:
+        with self._lock:
+            self.counters[(service, kind)] += 1
+
+    def decide(self, service: str) -> Fault:
+        options = self.options(service or "*")
+        if not options:
+            self._count(service, "ok")
+            return Fault(None, 0.0, None)
+        if options.get("rps") and self._throttled(service, options["rps"], options.get("burst", options["rps"])):
+            self._count(service, "throttle")
+            return Fault("throttle", 0.0, 429)
+
+        delay_s = self.latency_s(options.get("latency"))
+        with self._lock:
+            sorteio = self._random.random()
+            status = self._random.choice(options.get("error_status", [500, 502, 503]))
+        kind = None
+        for rate in self.RATES:
+            sorteio -= options.get(rate, 0)
+            if sorteio < 0:
+                kind = rate.removesuffix("_rate")
+                break
+        self._count(service, kind or "ok")
+        if kind == "html_error":
+            return Fault(kind, delay_s, 500)
+        return Fault(kind, delay_s, status if kind == "error" else None)
+
+    def wait(self, seconds: float) -> None:
+        """Espera `seconds`, interrompida se o servidor for parado."""
+        if seconds > 0:
+            self._stop.wait(seconds)
+
+    def timeout_s(self, service: str) -> float:
+        return self.options(service or "*").get("timeout_s", 30)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            itens = sorted(self.counters.items(), key=lambda item: (item[0][0] or "", item[0][1]))
+        counters = {}
+        for (service, kind), total in itens:
+            counters.setdefault(service or "*", {})[kind] = total
+        return {"config": self.config, "counters": counters}
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class _MockServer(ThreadingHTTPServer):
+    # O padrão (5) recusa conexões nos testes de carga.
+    request_queue_size = 128
+
+
 _server_lock = threading.Lock()
 _server = None
 _server_thread = None
+_fault_injector = None
+_tool_sga_state = None
+
+
+def get_fault_injector() -> FaultInjector | None:
+    """O injetor de falhas do servidor em execução, ou None se ele não estiver rodando."""
+    return _fault_injector
+
+
+def get_tool_sga_state() -> ToolSgaState | None:
+    """O estado do tool_sga do servidor em execução, ou None se ele não estiver rodando."""
+    return _tool_sga_state
 
 
 def start_mock_moodle_server_in_background() -> None:
     """Start a lightweight HTTP server serving mocked Moodle endpoints.
 
-    Cobre apenas o broker `Suap2LocalSuapBroker` (plugin `local_suap`).
-    Os brokers `Suap2ToolSgaBroker` e `Sga2ToolSgaBroker` ainda não estão
-    implementados e, portanto, não possuem servidor mock em background.
+    Serve os plugins `local_suap` (`LocalSuapHTTPMock`) e `tool_sga` (`ToolSgaHTTPMock`, com estado).
     """
-    global _server
-    global _server_thread
-
     if not getattr(settings, "MOODLE_HTTP_MOCK_BACKGROUND", False):
         return
 
+    start_mock_moodle_server(
+        getattr(settings, "MOODLE_HTTP_MOCK_HOST", "127.0.0.1"), int(getattr(settings, "MOODLE_HTTP_MOCK_PORT", 18091))
+    )
+
+
+def start_mock_moodle_server(host: str, port: int, faults: dict | None = None, seed: int | None = None) -> None:
+    """Start the threaded mock server on host:port, regardless of MOODLE_HTTP_MOCK_BACKGROUND.
+
+    `faults` configura o `FaultInjector`; sem ele vale `MOODLE_HTTP_MOCK_FAULTS`. A configuração pode ser trocada
+    com o servidor rodando por `PUT /__mock__/faults`. O estado do tool_sga é lido em `GET /__mock__/tool_sga` e
+    apagado em `DELETE /__mock__/tool_sga`.
+    """
+    global _server
+    global _server_thread
+    global _fault_injector
+    global _tool_sga_state
+
     with _server_lock:
         if _server_thread is not None and _server_thread.is_alive():
             return
 
-        host = getattr(settings, "MOODLE_HTTP_MOCK_HOST", "127.0.0.1")
-        port = int(getattr(settings, "MOODLE_HTTP_MOCK_PORT", 18091))
         mock = LocalSuapHTTPMock()
+        tool_sga = ToolSgaHTTPMock()
+        injector = FaultInjector(getattr(settings, "MOODLE_HTTP_MOCK_FAULTS", {}) if faults is None else faults, seed)
 
         class Handler(BaseHTTPRequestHandler):
-            def _write_response(self, response: MockHTTPResponse):
+            protocol_version = "HTTP/1.1"
+
+            def _write_response(self, response: MockHTTPResponse, headers: dict | None = None):
                 self.send_response(response.status_code)
-                for key, value in response.headers.items():
+                for key, value in {**response.headers, **(headers or {})}.items():
                     self.send_header(key, value)
+                self.send_header("Content-Length", str(len(response.content)))
                 self.end_headers()
                 self.wfile.write(response.content)
 
-            def do_GET(self):
-                response = mock.get(self.path, headers=dict(self.headers))
-                self._write_response(response)
-
-            def do_POST(self):
+            def _read_body(self) -> bytes:
                 content_length = int(self.headers.get("Content-Length", 0))
-                raw_body = self.rfile.read(content_length) if content_length > 0 else b"{}"
+                return self.rfile.read(content_length) if content_length > 0 else b""
+
+            def _control(self, method: str, raw_body: bytes):
+                if mock._validate_authentication(dict(self.headers)) is not None:
+                    return self._write_response(MockHTTPResponse({"error": "Unauthorized"}, status_code=401))
                 try:
-                    body = json.loads(raw_body.decode("utf-8") or "{}")
-                except json.JSONDecodeError:
-                    body = {}
-                response = mock.post(self.path, jsonbody=body, headers=dict(self.headers))
+                    if method in ("PUT", "POST"):
+                        injector.configure(json.loads(raw_body.decode("utf-8") or "{}"))
+                    elif method == "DELETE":
+                        injector.configure({})
+                except ValueError as e:
+                    return self._write_response(MockHTTPResponse({"error": str(e)}, status_code=400))
+                self._write_response(MockHTTPResponse(injector.snapshot()))
+
+            def _tool_sga_control(self, method: str):
+                if mock._validate_authentication(dict(self.headers)) is not None:
+                    return self._write_response(MockHTTPResponse({"error": "Unauthorized"}, status_code=401))
+                if method == "DELETE":
+                    tool_sga.state.reset()
+                self._write_response(MockHTTPResponse(tool_sga.state.snapshot()))
+
+            def _reset(self):
+                # SO_LINGER com tempo zero faz o close enviar RST em vez de FIN. O descritor é fechado aqui, antes
+                # do shutdown(SHUT_WR) do socketserver, que enviaria um FIN.
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                os.close(self.connection.detach())
+                self.close_connection = True
+
+            def _handle(self, method: str):
+                raw_body = self._read_body()
+                path = urlparse(self.path).path
+                if path == FAULTS_CONTROL_PATH:
+                    return self._control(method, raw_body)
+                if path == TOOL_SGA_CONTROL_PATH:
+                    return self._tool_sga_control(method)
+
+                service = mock._extract_service(self.path)
+                fault = injector.decide(service)
+                if fault.kind == "throttle":
+                    return self._write_response(
+                        MockHTTPResponse({"error": {"message": "Too Many Requests", "code": 429}}, status_code=429),
+                        {"Retry-After": "1"},
+                    )
+                injector.wait(fault.delay_s)
+                if fault.kind == "reset":
+                    return self._reset()
+                if fault.kind == "timeout":
+                    injector.wait(injector.timeout_s(service))
+                    self.close_connection = True
+                    return
+                if fault.kind == "html_error":
+                    return self._write_response(
+                        MockHTTPResponse.html_error(fault.status, "Fatal error: Allowed memory size exhausted")
+                    )
+                if fault.kind == "error":
+                    return self._write_response(
+                        MockHTTPResponse(
+                            {"error": {"message": "Erro injetado pelo mock", "code": fault.status}},
+                            status_code=fault.status,
+                        )
+                    )
+
+                # URL completa, para que as URLs devolvidas (course/view.php) apontem para o próprio mock.
+                url = f"http://{self.headers.get('Host', f'{host}:{port}')}{self.path}"
+                alvo = tool_sga if path.endswith(ToolSgaHTTPMock.PLUGIN_PATH) else mock
+                if method == "GET":
+                    response = alvo.get(url, headers=dict(self.headers))
+                else:
+                    try:
+                        body = json.loads(raw_body.decode("utf-8") or "{}")
+                    except json.JSONDecodeError:
+                        body = {}
+                    response = alvo.post(url, jsonbody=body, headers=dict(self.headers))
                 self._write_response(response)
 
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
             def log_message(self, format, *args):
                 logger.debug("local-suap-mock: " + format, *args)
 
-        _server = ThreadingHTTPServer((host, port), Handler)
+        _server = _MockServer((host, port), Handler)
+        _fault_injector = injector
+        _tool_sga_state = tool_sga.state
         _server_thread = threading.Thread(target=_server.serve_forever, daemon=True)
         _server_thread.start()
         logger.info("Moodle mock HTTP server running on %s:%s", host, port)
@@ -302,7 +863,13 @@ def stop_mock_moodle_server_in_background() -> None:
     """Stop the background HTTP mock server."""
     global _server
     global _server_thread
+    global _fault_injector
+    global _tool_sga_state
     with _server_lock:
+        _tool_sga_state = None
+        if _fault_injector is not None:
+            _fault_injector.stop()
+            _fault_injector = None
         if _server is not None:
             _server.shutdown()
             _server.server_close()
@@ -0,0 +1,329 @@
+"""
+Download das notas de vários diários numa única requisição (`api/baixar_notas_lote/`).
+
+O pedido é `{"diarios": [{"campus_sigla": "ZL", "diario_id": 1}, ...]}`. Os diários são agrupados pelo Ambiente do
+campus e baixados do Moodle de cada Ambiente por no máximo `SYNC_DOWN_BATCH_WORKERS` chamadas simultâneas: uma por
+diário ou, se o broker tem o serviço em lote (`grades_batch_size`), uma por fatia de diários. Cada diário é uma
+Solicitação `SYNC_DOWN_NOTAS`, como no `api/baixar_notas/`: as do Ambiente são inseridas de uma vez e gravadas, com o
+estado do diário e o agregado horário, à medida que as chamadas terminam.
+
+A resposta é NDJSON, uma linha por diário, escrita depois que a sua solicitação é gravada; as linhas vêm na ordem em
+que os diários ficam prontos, não na do pedido. Uma linha tem `campus_sigla`, `diario_id`, `solicitacao` e `code` e,
+conforme o `code`, a `resposta` do Moodle ou o `error`.
+
+O `api/baixar_notas/` de um diário passa pelo cache de notas (`NotasEmCache`). Nos dois, o `respondido` da
+solicitação guarda um `resumo` da resposta de no máximo ~`SYNC_DOWN_RESPONDIDO_MAX_BYTES`; a resposta ao SUAP é
+inteira.
+"""
+
+import json
+import logging
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from integrador import metrics
+from integrador.brokers.base import BaseBroker
+from integrador.brokers.registry import RegisteredBroker, registry
+from integrador.models import Ambiente, DiarioSyncState, Solicitacao, SolicitacaoRollup
+from integrador.timings import etapas_de
+from integrador.utils import SyncError
+
+logger = logging.getLogger(__name__)
+
+BATCH_WORKERS = getattr(settings, "SYNC_DOWN_BATCH_WORKERS", 4)
+BATCH_MAX_DIARIOS = getattr(settings, "SYNC_DOWN_BATCH_MAX_DIARIOS", 5000)
+
+CONTENT_TYPE = "application/x-ndjson"
+
+# 0 guarda a resposta inteira no `respondido`.
+RESPONDIDO_MAX_BYTES = getattr(settings, "SYNC_DOWN_RESPONDIDO_MAX_BYTES", 64 * 1024)
+
+# 0 desliga o cache de notas.
+CACHE_TTL = getattr(settings, "SYNC_DOWN_CACHE_TTL", 60)
+CACHE_TIMEOUT = getattr(settings, "SYNC_DOWN_CACHE_TIMEOUT", 900)
+CACHE_KEY = "notas"
+
+
+def parse_pedido(recebido: dict) -> list[tuple[str, str]]:
+    """Os pares (campus, diário) do pedido, sem repetições. Levanta SyncError (422) se o pedido for inválido."""
+    erro = recebido.get("error") or recebido.get("check_json", {}).get("error")
+    if erro:
+        raise SyncError(erro.get("message", "Erro desconhecido."), erro.get("code", 400))
+
+    diarios = recebido.get("diarios")
+    if not isinstance(diarios, list) or not diarios:
+        raise SyncError("Informe a lista 'diarios' com o 'campus_sigla' e o 'diario_id' de cada diário.", 422)
+    if len(diarios) > BATCH_MAX_DIARIOS:
+        raise SyncError(f"Informe no máximo {BATCH_MAX_DIARIOS} diários por requisição.", 422)
+
+    pedidos = {}
+    for indice, diario in enumerate(diarios):
+        campus_sigla = diario.get("campus_sigla") if isinstance(diario, dict) else None
+        diario_id = str(diario.get("diario_id", "")) if isinstance(diario, dict) else ""
+        if not campus_sigla or not diario_id.isdigit():
+            raise SyncError(f"O diário {indice} não tem 'campus_sigla' ou tem um 'diario_id' inválido.", 422)
+        pedidos[(campus_sigla, diario_id)] = None
+    return list(pedidos)
+
+
+def resumo(resposta, limite: int | None = None):
+    """
+    A `resposta` para o `respondido`: as listas do primeiro nível (as notas) cortadas para caber em ~`limite` bytes de
+    JSON, com o tamanho original de cada lista cortada em `truncado`. Os demais campos, como as URLs, ficam inteiros.
+    """
+    limite = RESPONDIDO_MAX_BYTES if limite is None else limite
+    if not limite or not isinstance(resposta, dict):
+        return resposta
+
+    restante, resumida, truncado = limite, {}, {}
+    for chave, valor in resposta.items():
+        if not isinstance(valor, list):
+            resumida[chave] = valor
+            continue
+        mantidos = []
+        for item in valor:
+            restante -= len(json.dumps(item, ensure_ascii=False, default=str)) + 2
+            if restante < 0:
+                break
+            mantidos.append(item)
+        resumida[chave] = mantidos
+        if len(mantidos) < len(valor):
+            truncado[chave] = len(valor)
+    return resumida | {"truncado": truncado} if truncado else resposta
+
+
+def _linha(campus_sigla: str, diario_id: str, solicitacao_id: int | None, code, **conteudo) -> bytes:
+    linha = {"campus_sigla": campus_sigla, "diario_id": diario_id, "solicitacao": solicitacao_id, "code": code}
+    return json.dumps(linha | conteudo, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+
+
+def baixa(registrado: RegisteredBroker, solicitacoes: list[Solicitacao]) -> list[tuple]:
+    """(solicitação, resposta, erro) de cada diário da tarefa. Roda numa thread: só faz HTTP."""
+    broker = registrado(solicitacoes[0])
+    if not broker.grades_batch_size:
+        try:
+            return [(solicitacoes[0], broker.sync_down_grades(), None)]
+        except Exception as e:
+            return [(solicitacoes[0], None, e)]
+
+    try:
+        with ExitStack() as etapas:
+            for solicitacao in solicitacoes:
+                etapas.enter_context(etapas_de(solicitacao).medir("moodle"))
+            ids = [str(solicitacao.diario_id) for solicitacao in solicitacoes]
+            respostas = {str(r.get("diario_id")): r for r in broker.sync_down_grades_batch(ids)}
+    except Exception as e:
+        return [(solicitacao, None, e) for solicitacao in solicitacoes]
+
+    resultados = []
+    for solicitacao in solicitacoes:
+        resposta = respostas.get(str(solicitacao.diario_id))
+        if resposta is None:
+            resultados.append((solicitacao, None, SyncError("O Moodle não devolveu as notas do diário.", 502)))
+        elif isinstance(resposta.get("error"), dict):
+            erro = resposta["error"]
+            resultados.append(
+                (solicitacao, None, SyncError(erro.get("message"), erro.get("code", 500), retorno=resposta))
+            )
+        else:
+            resultados.append((solicitacao, resposta, None))
+    return resultados
+
+
+def finaliza(resultados: list[tuple]) -> None:
+    """Grava o desfecho das solicitações, o estado dos diários e os agregados horários numa transação."""
+    solicitacoes = []
+    for solicitacao, resposta, erro in resultados:
+        if erro is None:
+            solicitacao.status, solicitacao.status_code = Solicitacao.Status.SUCESSO, 200
+            solicitacao.respondido = resumo(resposta)
+        else:
+            solicitacao.status, solicitacao.status_code = Solicitacao.Status.FALHA, getattr(erro, "code", 500)
+            solicitacao.respondido = getattr(erro, "retorno", None) or {
+                "error": {"error_message": f"{erro}", "error": f"{erro}"}
+            }
+        solicitacao.tempos = etapas_de(solicitacao).tempos
+        solicitacoes.append(solicitacao)
+    with transaction.atomic():
+        Solicitacao.objects.bulk_update(solicitacoes, ["status", "status_code", "respondido", "tempos"])
+        DiarioSyncState.objects.registra(*solicitacoes)
+        SolicitacaoRollup.objects.incrementa(*solicitacoes)
+
+
+class Grupo:
+    """Os diários de um Ambiente, com o broker e as tarefas (um diário ou uma fatia) que faltam baixar."""
+
+    def __init__(self, ambiente: Ambiente, solicitacoes: list[Solicitacao]):
+        self.ambiente = ambiente
+        self.solicitacoes = solicitacoes
+        self.registrado = registry.resolve(ambiente, "suap")
+        tamanho = self.registrado.broker_class.grades_batch_size or 1
+        self.tarefas = deque(solicitacoes[i : i + tamanho] for i in range(0, len(solicitacoes), tamanho))
+
+
+class NotasEmLote:
+    """As linhas NDJSON do download das notas dos `pedidos`; as solicitações são criadas em `prepara`."""
+
+    def __init__(self, pedidos: list[tuple[str, str]], site_url: str | None = None, workers: int = BATCH_WORKERS):
+        self.pedidos = pedidos
+        self.site_url = site_url
+        self.workers = max(1, workers)
+        self.grupos: list[Grupo] = []
+        self.linhas: list[bytes] = []
+        self.falhas: list[tuple] = []
+
+    def prepara(self) -> "NotasEmLote":
+        """Seleciona o Ambiente de cada campus e insere as solicitações, uma consulta por Ambiente."""
+        ambientes = list(Ambiente.objects.all())
+        por_campus, por_ambiente = {}, {}
+        for campus_sigla, diario_id in self.pedidos:
+            if campus_sigla not in por_campus:
+                por_campus[campus_sigla] = Ambiente.objects.seleciona_ambiente(
+                    {"campus": {"sigla": campus_sigla}}, ambientes
+                )
+            ambiente = por_campus[campus_sigla]
+            if ambiente is None:
+                erro = f"Nao encontramos um Ambiente ativo para o campus '{campus_sigla}'"
+                self.linhas.append(_linha(campus_sigla, diario_id, None, 404, error=erro))
+                continue
+            solicitacao = Solicitacao(
+                ambiente=ambiente,
+                operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS,
+                status=Solicitacao.Status.PROCESSANDO,
+                recebido={"campus": {"sigla": campus_sigla}, "diario": {"id": int(diario_id)}},
+            )
+            solicitacao.preenche_do_recebido()
+            solicitacao.site_url = self.site_url
+            por_ambiente.setdefault(ambiente.pk, (ambiente, []))[1].append(solicitacao)
+
+        for ambiente, solicitacoes in por_ambiente.values():
+            with transaction.atomic():
+                Solicitacao.objects.bulk_create(solicitacoes)
+            try:
+                self.grupos.append(Grupo(ambiente, solicitacoes))
+            except SyncError as e:
+                self.falhas.extend((solicitacao, None, e) for solicitacao in solicitacoes)
+        return self
+
+    @staticmethod
+    def linhas_de(resultados: list[tuple]) -> Iterator[bytes]:
+        for solicitacao, resposta, erro in resultados:
+            conteudo = {"resposta": resposta} if erro is None else {"error": getattr(erro, "message", f"{erro}")}
+            yield _linha(
+                solicitacao.campus_sigla,
+                str(solicitacao.diario_id),
+                solicitacao.id,
+                solicitacao.status_code,
+                **conteudo,
+            )
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.linhas
+        if self.falhas:
+            finaliza(self.falhas)
+            yield from self.linhas_de(self.falhas)
+        if not self.grupos:
+            return
+
+        # Cada Ambiente tem no máximo `workers` tarefas em andamento; quando uma termina, a próxima dele começa.
+        executor = ThreadPoolExecutor(max_workers=self.workers * len(self.grupos), thread_name_prefix="notas-lote")
+        futuros = {}
+
+        def submete(grupo: Grupo) -> None:
+            if grupo.tarefas:
+                futuros[executor.submit(baixa, grupo.registrado, grupo.tarefas.popleft())] = grupo
+
+        pendentes = {id(s): s for grupo in self.grupos for s in grupo.solicitacoes}
+        try:
+            for grupo in self.grupos:
+                for _ in range(self.workers):
+                    submete(grupo)
+            while futuros:
+                prontos, _ = wait(futuros, return_when=FIRST_COMPLETED)
+                resultados = []
+                for futuro in prontos:
+                    submete(futuros.pop(futuro))
+                    resultados.extend(futuro.result())
+                finaliza(resultados)
+                for solicitacao, _, _ in resultados:
+                    pendentes.pop(id(solicitacao), None)
+                yield from self.linhas_de(resultados)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if pendentes:
+                # O cliente desconectou (ou a gravação falhou) antes de todos os diários ficarem prontos.
+                logger.warning("Download de notas em lote interrompido com %d diários pendentes", len(pendentes))
+                interrompido = SyncError("O download em lote foi interrompido antes da resposta do Moodle.", 500)
+                try:
+                    finaliza([(solicitacao, None, interrompido) for solicitacao in pendentes.values()])
+                except Exception:
+                    logger.exception("Erro ao gravar as solicitações pendentes do download em lote")
+
+
+class NotasEmCache:
+    """
+    As últimas notas de um diário de um Ambiente, no cache do Django, para o `baixar_notas`.
+
+    Por `CACHE_TTL` segundos as notas são servidas do cache, sem chamar o Moodle. Depois, enquanto estiverem no cache
+    (`CACHE_TIMEOUT`), são revalidadas: pelo ETag, se o plugin o devolve (o Moodle responde 304, sem corpo), ou pelo
+    hash da resposta. Servidas do cache ou revalidadas, as notas viram uma Solicitação curta, que aponta a solicitação
+    com a resposta completa em vez de repeti-la e não muda o estado do diário. A chave tem a versão da configuração do
+    Ambiente: mudar a URL ou o plugin descarta o cache.
+    """
+
+    def __init__(self, ambiente: Ambiente, diario_id):
+        self.ambiente = ambiente
+        self.diario_id = str(diario_id)
+        self.key = f"{CACHE_KEY}:{ambiente.pk}:{ambiente.config_version}:{self.diario_id}"
+        self.entrada = cache.get(self.key)
+        self.etag = None
+
+    @property
+    def fresca(self) -> bool:
+        return self.entrada is not None and time.time() - self.entrada["em"] < CACHE_TTL
+
+    def revalida(self, broker: BaseBroker) -> dict | None:
+        """As notas novas do Moodle ou, se as do cache continuam valendo, None (e elas valem por mais `CACHE_TTL`)."""
+        etag = self.entrada["etag"] if self.entrada else None
+        resposta, self.etag = broker.sync_down_grades_if_changed(etag)
+        if self.entrada is not None and (
+            resposta is None or DiarioSyncState.payload_hash_of(resposta) == self.entrada["hash"]
+        ):
+            self.entrada["em"] = time.time()
+            cache.set(self.key, self.entrada, CACHE_TIMEOUT)
+            return None
+        return resposta
+
+    def grava(self, solicitacao: Solicitacao, resposta: dict) -> None:
+        self.entrada = {
+            "solicitacao": solicitacao.id,
+            "etag": self.etag,
+            "hash": DiarioSyncState.payload_hash_of(resposta),
+            "resposta": resposta,
+            "em": time.time(),
+        }
+        cache.set(self.key, self.entrada, CACHE_TIMEOUT)
+
+    def registra(self, recebido: dict, tempos: dict, revalidada: bool) -> Solicitacao:
+        """A Solicitação curta de notas servidas do cache: um INSERT e o agregado horário."""
+        metrics.GRADES_CACHE.labels(resultado="revalidada" if revalidada else "fresca").inc()
+        solicitacao = Solicitacao(
+            ambiente=self.ambiente,
+            operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS,
+            status=Solicitacao.Status.SUCESSO,
+            status_code=200,
+            recebido=recebido,
+            respondido={"cache": {"solicitacao": self.entrada["solicitacao"], "revalidada": revalidada}},
+            tempos=tempos,
+        )
+        with transaction.atomic():
+            solicitacao.save()
+            SolicitacaoRollup.objects.incrementa(solicitacao)
+        return solicitacao
@@ -0,0 +1,138 @@
+"""
+Verificações de conectividade com os Moodles dos Ambientes.
+
+As verificações de todos os ambientes rodam em paralelo e o resultado de cada ambiente fica no cache, com o momento
+da verificação e a latência de cada chamada. Quem exibe o estado (o admin de Ambiente, o /health/) apenas lê o
+cache: se o resultado estiver vencido ou ausente, uma nova verificação é disparada em segundo plano, por um único
+processo de cada vez.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+PROBE_TTL = getattr(settings, "MOODLE_PROBE_TTL", 60)
+PROBE_CACHE_TIMEOUT = getattr(settings, "MOODLE_PROBE_CACHE_TIMEOUT", 3600)
+PROBE_TIMEOUT = getattr(settings, "MOODLE_PROBE_TIMEOUT", 3)
+PROBE_WORKERS = getattr(settings, "MOODLE_PROBE_WORKERS", 8)
+PROBE_LOCK_TIMEOUT = getattr(settings, "MOODLE_PROBE_LOCK_TIMEOUT", 60)
+PROBE_CACHE_KEY = "moodle_probe"
+PROBE_LOCK_KEY = f"{PROBE_CACHE_KEY}:lock"
+
+# Plugin: campo de ativação, campo do token e caminho da API de health.
+PLUGINS = {
+    "local_suap": ("local_suap_active", "local_suap_token", "/local/suap/api/index.php?health"),
+    "tool_sga": ("tool_sga_active", "tool_sga_token", "/admin/tool/sga/api/index.php?health"),
+}
+
+
+def probe_cache_key(ambiente_id) -> str:
+    return f"{PROBE_CACHE_KEY}:{ambiente_id}"
+
+
+def _latencia_ms(inicio: float) -> float:
+    return round((time.monotonic() - inicio) * 1000, 1)
+
+
+def probe_url(ambiente) -> dict:
+    """Verifica se o `version.php` do Moodle responde."""
+    inicio = time.monotonic()
+    try:
+        response = requests.get(f"{ambiente.url}/version.php", timeout=PROBE_TIMEOUT)
+        resultado = {"status": "OK" if response.status_code == 200 else "FAIL", "status_code": response.status_code}
+    except Exception as e:
+        resultado = {"status": "ERROR", "erro": str(e)}
+    return resultado | {"latencia_ms": _latencia_ms(inicio)}
+
+
+def probe_plugin(ambiente, plugin: str) -> dict:
+    """Verifica a API de health de um plugin. Plugins inativos ou sem token não são consultados."""
+    active_field, token_field, api_path = PLUGINS[plugin]
+    token = getattr(ambiente, token_field)
+    if not getattr(ambiente, active_field):
+        return {"status": "INACTIVE"}
+    if not token or not str(token).strip():
+        return {"status": "NO_TOKEN"}
+
+    inicio = time.monotonic()
+    try:
+        response = requests.get(
+            f"{ambiente.base_url}{api_path}",
+            headers={"Authentication": f"Token {token}"},
+            timeout=PROBE_TIMEOUT,
+        )
+        if response.status_code == 200:
+            resposta = response.json()
+            resultado = {"status": "OK", "status_code": 200, "resposta": resposta if isinstance(resposta, dict) else {}}
+        else:
+            resultado = {"status": "FAIL", "status_code": response.status_code}
+    except Exception as e:
+        resultado = {"status": "ERROR", "erro": str(e)}
+    return resultado | {"latencia_ms": _latencia_ms(inicio)}
+
+
+def probe_ambientes(ambientes) -> dict:
+    """Verifica, em paralelo, a URL e os plugins de cada ambiente, grava os resultados no cache e os retorna."""
+    ambientes = list(ambientes)
+    if not ambientes:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix="moodle-probe") as executor:
+        futuros = {
+            ambiente.id: {
+                "url": executor.submit(probe_url, ambiente),
+                **{plugin: executor.submit(probe_plugin, ambiente, plugin) for plugin in PLUGINS},
+            }
+            for ambiente in ambientes
+        }
+        verificado_em = time.time()
+        resultados = {
+            ambiente_id: {"verificado_em": verificado_em, **{nome: futuro.result() for nome, futuro in checks.items()}}
+            for ambiente_id, checks in futuros.items()
+        }
+
+    cache.set_many({probe_cache_key(id): resultado for id, resultado in resultados.items()}, PROBE_CACHE_TIMEOUT)
+    return resultados
+
+
+def refresh_in_background(ambientes) -> bool:
+    """Dispara a verificação em segundo plano, a menos que outro processo já esteja verificando."""
+    if not cache.add(PROBE_LOCK_KEY, True, PROBE_LOCK_TIMEOUT):
+        return False
+
+    ambientes = list(ambientes)
+
+    def refresh():
+        try:
+            probe_ambientes(ambientes)
+        except Exception as e:
+            logger.error(f"Erro ao verificar os ambientes: {e}", exc_info=True)
+        finally:
+            cache.delete(PROBE_LOCK_KEY)
+
+    threading.Thread(target=refresh, name="moodle-probe-refresh", daemon=True).start()
+    return True
+
+
+def cached_probes(ambientes) -> dict:
+    """
+    Retorna o último resultado de cada ambiente (`None` se ainda não houver) sem fazer chamadas HTTP.
+
+    Ambientes sem resultado ou com resultado mais antigo que `MOODLE_PROBE_TTL` são reverificados em segundo plano.
+    """
+    ambientes = list(ambientes)
+    encontrados = cache.get_many([probe_cache_key(ambiente.id) for ambiente in ambientes])
+    resultados = {ambiente.id: encontrados.get(probe_cache_key(ambiente.id)) for ambiente in ambientes}
+
+    limite = time.time() - PROBE_TTL
+    vencidos = [a for a in ambientes if resultados[a.id] is None or resultados[a.id]["verificado_em"] < limite]
+    if vencidos:
+        refresh_in_background(vencidos)
+    return resultados
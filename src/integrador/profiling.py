@@ -0,0 +1,172 @@
+"""
+Profiling sob demanda de uma única sincronização.
+
+Um `enviar_diarios` ou `baixar_notas` é executado sob o `cProfile` quando:
+
+- traz o header `X-Integrador-Profile` com um token assinado (gerado por `manage.py token_profiling`), ou
+- é feito por um usuário da equipe (`is_staff`) com `?profile=1`, ou
+- é um "Reenviar com profile" do admin de Solicitação.
+
+O resultado fica em `SolicitacaoProfile` e é visto como flame graph no admin, ou baixado em `.prof` para o snakeviz,
+speedscope etc. Sem o gatilho, o custo é a leitura de um header e de um parâmetro da querystring.
+"""
+
+import cProfile
+import logging
+import marshal
+import os
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core import signing
+
+from integrador.models import Solicitacao, SolicitacaoProfile
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Integrador-Profile"
+SIGNING_SALT = "integrador.profiling"
+
+
+def sign_token(usuario: str) -> str:
+    """Gera o valor do header `X-Integrador-Profile`, válido por PROFILING_TOKEN_MAX_AGE segundos."""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign_object({"usuario": usuario})
+
+
+def origem(request) -> tuple[str, str | None] | None:
+    """Retorna (origem, solicitado_por) se a requisição pediu profiling, ou None."""
+    if not settings.PROFILING_ENABLED:
+        return None
+
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        try:
+            dados = signing.TimestampSigner(salt=SIGNING_SALT).unsign_object(
+                token, max_age=settings.PROFILING_TOKEN_MAX_AGE
+            )
+            return SolicitacaoProfile.Origem.HEADER, dados.get("usuario")
+        except signing.BadSignature as e:
+            logger.warning(f"Token de profiling inválido ou expirado: {e}")
+            return None
+
+    if "profile" in request.GET:
+        user = getattr(request, "user", None)
+        if user is not None and user.is_staff:
+            return SolicitacaoProfile.Origem.STAFF, user.username
+    return None
+
+
+class Perfilador:
+    """Executa um trecho sob o cProfile e grava o resultado na Solicitacao."""
+
+    def __init__(self):
+        self.profiler = None
+        self.duracao_ms = None
+
+    def __enter__(self):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            self.profiler = profiler
+        except ValueError as e:
+            # Outro profiler já está ativo nesta thread.
+            logger.warning(f"Não foi possível iniciar o cProfile: {e}")
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.duracao_ms = round((time.perf_counter() - self.inicio) * 1000, 1)
+        return False
+
+    def salva(self, solicitacao: Solicitacao, origem: str, solicitado_por: str | None = None):
+        if self.profiler is None or solicitacao is None or solicitacao.pk is None:
+            return None
+        self.profiler.create_stats()
+        profile, _ = SolicitacaoProfile.objects.update_or_create(
+            solicitacao=solicitacao,
+            defaults={
+                "origem": origem,
+                "solicitado_por": solicitado_por,
+                "duracao_ms": self.duracao_ms,
+                "stats": marshal.dumps(self.profiler.stats),
+            },
+        )
+        return profile
+
+
+def load_stats(dados: bytes) -> dict:
+    """Carrega as estatísticas no formato do `pstats` (o mesmo do arquivo `.prof`)."""
+    return marshal.loads(bytes(dados))  # noqa: S302
+
+
+def _nome(func: tuple) -> str:
+    arquivo, linha, nome = func
+    if arquivo == "~":
+        return nome
+    return f"{nome} ({os.path.basename(arquivo)}:{linha})"
+
+
+def top_functions(stats: dict, limite: int = 30) -> list[dict]:
+    """Funções com mais tempo próprio."""
+    funcoes = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limite]
+    return [
+        {
+            "funcao": _nome(func),
+            "arquivo": f"{func[0]}:{func[1]}",
+            "chamadas": nc,
+            "proprio_ms": round(tt * 1000, 2),
+            "acumulado_ms": round(ct * 1000, 2),
+        }
+        for func, (cc, nc, tt, ct, callers) in funcoes
+    ]
+
+
+def call_tree(stats: dict, fracao_minima: float = 0.005, profundidade_maxima: int = 60) -> dict:
+    """
+    Árvore de chamadas para o flame graph. O cProfile guarda os tempos por par (chamador, chamado), então os filhos de
+    uma função somam as chamadas feitas por ela a partir de qualquer chamador, como no gprof2dot. Ramos com menos de
+    `fracao_minima` do tempo total são omitidos.
+    """
+    filhos = defaultdict(list)
+    raizes = []
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if not callers:
+            raizes.append((func, (cc, nc, tt, ct)))
+        for chamador, aresta in callers.items():
+            filhos[chamador].append((func, aresta))
+
+    total = sum(aresta[3] for _, aresta in raizes) or 1e-9
+
+    def no(func, aresta, pai_ct, caminho):
+        ct = aresta[3]
+        ramos = []
+        if len(caminho) < profundidade_maxima and func not in caminho:
+            for filho, aresta_filho in sorted(filhos[func], key=lambda item: item[1][3], reverse=True):
+                if aresta_filho[3] >= total * fracao_minima:
+                    ramos.append(no(filho, aresta_filho, ct, caminho | {func}))
+        return {
+            "funcao": _nome(func),
+            "arquivo": f"{func[0]}:{func[1]}",
+            "chamadas": aresta[1],
+            "tempo_ms": round(ct * 1000, 2),
+            "percentual": round(ct / total * 100, 1),
+            "largura": round(min(100.0, ct / pai_ct * 100) if pai_ct else 100.0, 2),
+            "filhos": ramos,
+        }
+
+    return {
+        "funcao": "total",
+        "arquivo": "",
+        "chamadas": 1,
+        "tempo_ms": round(total * 1000, 2),
+        "percentual": 100.0,
+        "largura": 100.0,
+        "filhos": [
+            no(func, aresta, total, frozenset())
+            for func, aresta in sorted(raizes, key=lambda item: item[1][3], reverse=True)
+            if aresta[3] >= total * fracao_minima
+        ],
+    }
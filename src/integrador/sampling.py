@@ -0,0 +1,200 @@
+"""
+Política de amostragem e de limpeza dos eventos enviados ao Sentry.
+
+As sincronizações (`enviar_diarios` e `baixar_notas`) são rastreadas na taxa `SENTRY_SYNC_TRACES_SAMPLE_RATE`,
+decidida no início da requisição para que as demais não paguem o custo do rastreamento. Das rastreadas, são enviadas
+as que falharem, as lentas para o seu Ambiente (acima do percentil `SENTRY_SLOW_PERCENTILE` do tempo total das
+últimas 24h) e, das saudáveis, o suficiente para que `SENTRY_SYNC_HEALTHY_SAMPLE_RATE` delas cheguem ao Sentry. O
+restante das requisições usa `SENTRY_TRACES_SAMPLE_RATE`; health checks, métricas e estáticos nunca são rastreados.
+
+Os limiares de lentidão são recalculados em segundo plano, por um único processo de cada vez (lock no cache),
+enquanto os demais seguem com os anteriores.
+
+Os payloads grandes (o `recebido` de uma solicitação chega a vários MB) são truncados em `SENTRY_MAX_PAYLOAD_CHARS`
+nos extras, no corpo da requisição e nos breadcrumbs.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+SYNC_URL_NAMES = ["api_sync_up_enrolments", "api_sync_down_grades", "api_sync_down_grades_batch"]
+IGNORED_URL_NAMES = ["health", "live", "ready", "metrics"]
+IGNORED_PATH_PREFIXES = ["/static/", "/media/"]
+
+SLOW_CACHE_KEY = "sentry_slow_thresholds"
+SLOW_LOCK_KEY = "sentry_slow_thresholds:lock"
+# Depois deste tempo (s) os limiares são recalculados; até lá, e durante o recálculo, os anteriores valem.
+SLOW_CACHE_TIMEOUT = 600
+SLOW_CACHE_HARD_TIMEOUT = 86400
+SLOW_LOCK_TIMEOUT = 120
+# Limiares lidos do cache ficam também no processo, para não consultar o cache a cada transação.
+SLOW_LOCAL_TTL = 60
+
+_limiares = {"valores": None, "lido_em": 0.0}
+
+
+def _url_name(path: str) -> str | None:
+    try:
+        return resolve(path).url_name
+    except Resolver404:
+        return None
+
+
+def traces_sampler(sampling_context: dict) -> float:
+    """Decide, no início da requisição, se ela será rastreada."""
+    if sampling_context.get("parent_sampled") is not None:
+        return float(sampling_context["parent_sampled"])
+
+    path = (sampling_context.get("wsgi_environ") or {}).get("PATH_INFO", "")
+    if any(path.startswith(prefixo) for prefixo in IGNORED_PATH_PREFIXES):
+        return 0.0
+    url_name = _url_name(path) if path else None
+    if url_name in IGNORED_URL_NAMES:
+        return 0.0
+    if url_name in SYNC_URL_NAMES:
+        # Das rastreadas, quais são enviadas depende do resultado e da duração: é decidido em before_send_transaction.
+        return settings.SENTRY_SYNC_TRACES_SAMPLE_RATE
+    return settings.SENTRY_TRACES_SAMPLE_RATE
+
+
+def slow_thresholds() -> dict[str, float]:
+    """Duração (ms) acima da qual uma sincronização é considerada lenta, por nome do Ambiente."""
+    if _limiares["valores"] is not None and time.monotonic() - _limiares["lido_em"] < SLOW_LOCAL_TTL:
+        return _limiares["valores"]
+
+    from django.core.cache import cache
+
+    entrada = cache.get(SLOW_CACHE_KEY)
+    vencida = entrada is None or time.time() - entrada["gerado_em"] > SLOW_CACHE_TIMEOUT
+    if vencida and cache.add(SLOW_LOCK_KEY, True, SLOW_LOCK_TIMEOUT):
+        _atualiza_em_segundo_plano()
+    valores = entrada["valores"] if entrada is not None else _limiares["valores"] or {}
+    _limiares.update(valores=valores, lido_em=time.monotonic())
+    return valores
+
+
+def atualiza_limiares() -> dict[str, float]:
+    """Recalcula os limiares de lentidão e os grava no cache."""
+    from django.core.cache import cache
+
+    valores = _calcula_limiares()
+    cache.set(SLOW_CACHE_KEY, {"valores": valores, "gerado_em": time.time()}, SLOW_CACHE_HARD_TIMEOUT)
+    return valores
+
+
+def _atualiza_em_segundo_plano() -> None:
+    def atualiza():
+        from django.core.cache import cache
+        from django.db import connection
+
+        try:
+            atualiza_limiares()
+        finally:
+            cache.delete(SLOW_LOCK_KEY)
+            connection.close()
+
+    threading.Thread(target=atualiza, name="sentry-limiares", daemon=True).start()
+
+
+def _calcula_limiares() -> dict[str, float]:
+    from django.utils.timezone import now
+
+    from integrador.models import Solicitacao
+    from integrador.timings import TEMPO_TOTAL, PercentileCont
+
+    try:
+        por_ambiente = (
+            Solicitacao.objects.filter(
+                timestamp__gte=now() - timedelta(hours=24), tempos__isnull=False, ambiente__isnull=False
+            )
+            .exclude(tempos={})
+            .values("ambiente__nome")
+            .annotate(limiar=PercentileCont(TEMPO_TOTAL, settings.SENTRY_SLOW_PERCENTILE / 100.0))
+        )
+        return {item["ambiente__nome"]: item["limiar"] for item in por_ambiente if item["limiar"] is not None}
+    except Exception as e:
+        logger.warning(f"Não foi possível calcular os limiares de lentidão do Sentry: {e}")
+        return {}
+
+
+def _timestamp(valor) -> float | None:
+    if isinstance(valor, datetime):
+        return valor.timestamp()
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor).timestamp()
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    return None
+
+
+def _duracao_ms(event: dict) -> float | None:
+    inicio, fim = _timestamp(event.get("start_timestamp")), _timestamp(event.get("timestamp"))
+    return (fim - inicio) * 1000 if inicio is not None and fim is not None else None
+
+
+def truncate(valor):
+    """Trunca textos e estruturas maiores que SENTRY_MAX_PAYLOAD_CHARS (estruturas viram texto JSON truncado)."""
+    limite = settings.SENTRY_MAX_PAYLOAD_CHARS
+    if isinstance(valor, (dict, list)):
+        texto = json.dumps(valor, default=str, ensure_ascii=False)
+        if len(texto) <= limite:
+            return valor
+        valor = texto
+    if isinstance(valor, str) and len(valor) > limite:
+        return f"{valor[:limite]}... [{len(valor) - limite} caracteres omitidos]"
+    return valor
+
+
+def _limpa(event: dict) -> dict:
+    if isinstance(event.get("extra"), dict):
+        event["extra"] = {chave: truncate(valor) for chave, valor in event["extra"].items()}
+    if isinstance(event.get("request"), dict) and "data" in event["request"]:
+        event["request"]["data"] = truncate(event["request"]["data"])
+    breadcrumbs = event.get("breadcrumbs")
+    if isinstance(breadcrumbs, dict):
+        breadcrumbs["values"] = [before_breadcrumb(crumb, {}) for crumb in breadcrumbs.get("values", [])]
+    return event
+
+
+def before_send(event: dict, hint: dict) -> dict:
+    """Erros são sempre enviados, com os payloads grandes truncados."""
+    return _limpa(event)
+
+
+def before_send_transaction(event: dict, hint: dict) -> dict | None:
+    """Mantém as sincronizações com falha, as lentas para o seu Ambiente e uma amostra das saudáveis."""
+    tags = event.get("tags") or {}
+    if "integrador.endpoint" not in tags:
+        return _limpa(event)
+
+    if event.get("contexts", {}).get("trace", {}).get("status", "ok") != "ok":
+        return _limpa(event)
+
+    duracao = _duracao_ms(event)
+    limiar = slow_thresholds().get(tags.get("integrador.ambiente"), settings.SENTRY_SLOW_DEFAULT_MS)
+    if duracao is not None and duracao >= limiar:
+        return _limpa(event)
+
+    # A transação já passou pelo traces_sampler: a taxa aqui completa a SENTRY_SYNC_HEALTHY_SAMPLE_RATE.
+    rastreadas = settings.SENTRY_SYNC_TRACES_SAMPLE_RATE
+    taxa = settings.SENTRY_SYNC_HEALTHY_SAMPLE_RATE / rastreadas if rastreadas else 0.0
+    if random.random() < taxa:  # noqa: S311
+        return _limpa(event)
+    return None
+
+
+def before_breadcrumb(crumb: dict, hint: dict) -> dict:
+    if "message" in crumb:
+        crumb["message"] = truncate(crumb["message"])
+    if isinstance(crumb.get("data"), dict):
+        crumb["data"] = {chave: truncate(valor) for chave, valor in crumb["data"].items()}
+    return crumb
@@ -7,30 +7,58 @@ Este módulo contém testes para:
 detect_ambiente
 - Views: sync_up_enrolments, sync_down_grades
 - Utils: SyncError, http_get, http_post, http_get_json, http_post_json
+- Cassette: gravação e reprodução das chamadas aos Moodles, sem tokens e sem rede
 - Middleware: DisableCSRFForAPIMiddleware
-- Brokers: BaseBroker, Suap2LocalSuapBroker
-- Management Commands: atualiza_solicitacoes
+- Brokers: BaseBroker, Suap2LocalSuapBroker, Suap2ToolSgaBroker e a tradução SUAP→SGA, Sga2ToolSgaBroker e os lotes,
+  registro dos brokers por formato do payload e plugin
+- Notas em lote: download das notas de vários diários por Ambiente, com fan-out limitado, em NDJSON
+- Cache de notas: TTL, revalidação por ETag ou hash e Solicitações curtas no baixar_notas
+- Notas em streaming: JSON aos pedaços no baixar_notas e resumo limitado no respondido
+- Management Commands: atualiza_solicitacoes (framework de backfill), backfill_diario_sync_state
+- Tempos por etapa: Solicitacao.tempos, Server-Timing e admin
+- Tracing: spans OpenTelemetry dos decorators, brokers, HTTP, banco e regras
+- Sampling: amostragem do Sentry por resultado e lentidão e truncamento de payloads
+- Profiling: cProfile sob demanda (header assinado, staff, reenvio pelo admin) e flame graph no admin
+- Carga: teste de carga (teste_carga) com NDJSON, Solicitações ou sintéticas, latências e conexões do banco
+- Moodle mock: latência, erros, HTML de erro fatal, timeouts, resets e limite de taxa (FaultInjector, moodle_mock)
+- Moodle mock do tool_sga: cursos, inscrições e notas por diário, lotes idempotentes, ETag e servidor concorrente
+- Metrics: métricas Prometheus de sincronização, chamadas aos Moodles, coortes e banco
+- Probes: verificação paralela e cacheada dos Moodles (admin de Ambiente)
+- DiarioSyncState: upsert ao finalizar Solicitacao, admin e API de leitura
+- SolicitacaoRollup: agregados horários incrementais e compacta_rollups
 """
 
+import copy
 import io
 import json
 import logging
+import threading
+import time
 import urllib.error
+import urllib.parse
 import uuid
+from collections import OrderedDict
+from datetime import UTC, datetime, timedelta
 from http.client import HTTPException
 from types import SimpleNamespace
+from unittest import skipUnless
 from unittest.mock import MagicMock, Mock, patch
 
+import rule_engine
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.core.exceptions import ValidationError
 from django.core.management import call_command
 from django.http import JsonResponse
-from django.test import RequestFactory, TestCase, override_settings
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
 
 from cohort.models import Cohort, Enrolment, MoodleUser, Role
+from integrador import carga, cassette, metrics, profiling, sampling, tracing
 from integrador.apps import IntegradorConfig
+from integrador.backfill import BackfillRunner, BackfillTask
 from integrador.brokers.base import BaseBroker
 from integrador.brokers.suap2local_suap import Suap2LocalSuapBroker
 from integrador.decorators import (
@@ -40,14 +68,55 @@ from integrador.decorators import (
     detect_ambiente,
     exception_as_json,
     json_response,
+    json_stream_response,
+    observe_metrics,
     try_solicitacao,
     valid_token,
 )
-from integrador.middleware import DisableCSRFForAPIMiddleware
-from integrador.models import Ambiente, Solicitacao
-from integrador.moodle_mock import LocalSuapHTTPMock, MockHTTPResponse, ToolSgaHTTPMock
-from integrador.utils import SyncError, http_get, http_get_json, http_post, http_post_json
-from integrador.views import sync_up_enrolments
+from integrador.middleware import DisableCSRFForAPIMiddleware, InternalHostMiddleware
+from integrador.models import (
+    Ambiente,
+    BackfillCheckpoint,
+    DiarioSyncState,
+    Solicitacao,
+    SolicitacaoProfile,
+    SolicitacaoRollup,
+)
+from integrador.moodle_mock import (
+    FAULTS_CONTROL_PATH,
+    TOOL_SGA_CONTROL_PATH,
+    FaultInjector,
+    LocalSuapHTTPMock,
+    MockHTTPResponse,
+    ToolSgaHTTPMock,
+    ToolSgaState,
+    get_fault_injector,
+    get_tool_sga_state,
+    start_mock_moodle_server,
+    stop_mock_moodle_server_in_background,
+)
+from integrador.probes import (
+    PROBE_LOCK_KEY,
+    cached_probes,
+    probe_ambientes,
+    probe_cache_key,
+    probe_plugin,
+    probe_url,
+    refresh_in_background,
+)
+from integrador.timings import ETAPAS, Etapas, etapas_de
+from integrador.utils import (
+    SyncError,
+    UrllibTransport,
+    get_transport,
+    http_get,
+    http_get_json,
+    http_get_json_if_changed,
+    http_post,
+    http_post_json,
+    set_transport,
+)
+from integrador.views import diario_sync_state, sync_up_enrolments
 
 # Configura logging para WARNING durante testes (suprime DEBUG e INFO)
 logging.getLogger("integrador").setLevel(logging.WARNING)
@@ -80,6 +149,28 @@ AMBIENTE_GOOD_SUAP = dict(
 )
 
 
+class MockMoodleTransport:
+    """Transporte de `integrador.utils` que responde pelo mock do plugin, como o servidor real responderia."""
+
+    def __init__(self, mock):
+        self.mock = mock
+        self.chamadas = 0
+        self._lock = threading.Lock()
+
+    def urlopen(self, req, timeout):
+        with self._lock:
+            self.chamadas += 1
+        jsonbody = json.loads(req.data) if req.data else None
+        response = self.mock.request(
+            req.get_method(), req.full_url, jsonbody=jsonbody, headers=dict(req.header_items())
+        )
+        if not response.ok:
+            raise urllib.error.HTTPError(
+                req.full_url, response.status_code, response.reason, response.headers, io.BytesIO(response.content)
+            )
+        return cassette.CassetteResponse(response.content, response.status_code, response.headers)
+
+
 class IntegradorConfigTestCase(TestCase):
     """Testes para a configuração da app integrador."""
 
@@ -270,14 +361,43 @@ class UtilsFunctionsTestCase(TestCase):
             http_post("http://test.com")
         self.assertEqual(ctx.exception.status, 500)
 
-    @patch("integrador.utils.http_get")
-    def test_http_get_json_success(self, mock_http_get):
+    @patch("integrador.utils.urllib.request.urlopen")
+    def test_http_get_json_success(self, mock_urlopen):
         """Testa http_get_json com sucesso."""
-        mock_http_get.return_value = '{"key": "value"}'
+        mock_urlopen.return_value = cassette.CassetteResponse('{"key": "válido"}'.encode())
 
         result = http_get_json("http://test.com")
 
-        self.assertEqual(result, {"key": "value"})
+        self.assertEqual(result, {"key": "válido"})
+
+    @patch("integrador.utils.urllib.request.urlopen")
+    def test_http_get_json_le_o_corpo_direto_da_resposta(self, mock_urlopen):
+        """Testa que http_get_json lê o JSON direto da resposta e conta os bytes lidos para as métricas."""
+        corpo = json.dumps({"notas": [{"matricula": str(i), "nota": 7.5} for i in range(1000)]}).encode()
+        mock_urlopen.return_value = cassette.CassetteResponse(corpo)
+
+        with (
+            patch("integrador.utils.IJSON_AVAILABLE", False),
+            patch("integrador.utils.metrics.observe_moodle_call") as observe,
+        ):
+            result = http_get_json("http://test.com")
+
+        self.assertEqual(len(result["notas"]), 1000)
+        self.assertEqual(observe.call_args.args[5], len(corpo))
+
+    @patch("integrador.utils.urllib.request.urlopen")
+    def test_http_get_json_invalido_com_qualquer_parser(self, mock_urlopen):
+        """Testa que HTML com status 200 levanta JSONDecodeError com e sem o ijson."""
+        import importlib.util
+
+        parsers = [False] + ([True] if importlib.util.find_spec("ijson") else [])
+        for ijson_disponivel in parsers:
+            for corpo in [b"<!DOCTYPE html><html><body>Fatal error</body></html>", b"", b'{"a": 1} x']:
+                mock_urlopen.return_value = cassette.CassetteResponse(corpo)
+                with self.subTest(ijson=ijson_disponivel, corpo=corpo):
+                    with patch("integrador.utils.IJSON_AVAILABLE", ijson_disponivel):
+                        with self.assertRaises(json.JSONDecodeError):
+                            http_get_json("http://test.com")
 
     @patch("integrador.utils.http_post")
     def test_http_post_json_success(self, mock_http_post):
@@ -289,15 +409,187 @@ class UtilsFunctionsTestCase(TestCase):
         self.assertEqual(result, {"result": "success"})
 
 
+class CassetteTestCase(TestCase):
+    """Testes da gravação e reprodução das chamadas aos Moodles (integrador.cassette)."""
+
+    BASE = "https://moodle.test/local/suap/api/index.php"
+    AUTH = {"Authentication": f"Token {LocalSuapHTTPMock.TEST_TOKEN}"}
+    PAYLOAD = {
+        "campus": {"id": 1, "sigla": "ZL", "descricao": "Campus ZL"},
+        "curso": {"id": 1, "codigo": "15806", "nome": "Curso"},
+        "turma": {"id": 2, "codigo": "20261.6.15806.1E"},
+        "componente": {"id": 1, "sigla": "TEC.1023", "descricao": "Componente"},
+        "diario": {"id": 2, "sigla": "TEC.1023", "situacao": "Aberto"},
+        "token": "segredo-do-payload",
+    }
+
+    def setUp(self):
+        import tempfile
+
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.caminho = f"{diretorio.name}/moodle.ndjson.gz"
+
+    def grava(self, **kwargs) -> "MockMoodleTransport":
+        transporte = MockMoodleTransport(LocalSuapHTTPMock())
+        with cassette.Cassette(self.caminho, mode="record", transport=transporte, **kwargs):
+            http_post_json(f"{self.BASE}?sync_up_enrolments", jsonbody=self.PAYLOAD, headers=dict(self.AUTH))
+            http_get_json(f"{self.BASE}?sync_down_grades&diario_id=2&wstoken=abc", headers=self.AUTH)
+            with self.assertRaises(SyncError):
+                http_get_json(f"{self.BASE}?sync_down_grades&diario_id=3", headers={"Authentication": "Token x"})
+        return transporte
+
+    def test_sanitize(self):
+        """Testa o mascaramento de chaves e parâmetros sensíveis e a retirada do host."""
+        self.assertEqual(
+            cassette.sanitize({"a": 1, "api_key": "x", "itens": [{"Token": "y", "b": 2}]}),
+            {"a": 1, "api_key": "***", "itens": [{"Token": "***", "b": 2}]},
+        )
+        self.assertEqual(
+            cassette.sanitize_url("https://u:p@moodle.test/x/index.php?sync_down_grades&diario_id=1&wstoken=abc"),
+            "/x/index.php?sync_down_grades=&diario_id=1&wstoken=%2A%2A%2A",
+        )
+        self.assertEqual(cassette.sanitize_url("https://moodle.test/x"), "/x")
+        self.assertEqual(cassette.service_of(f"{self.BASE}?sync_down_grades&diario_id=1"), "sync_down_grades")
+        self.assertEqual(cassette.body_hash(b'{"b": 1, "token": "x"}'), cassette.body_hash(b'{"token":"y","b":1}'))
+        self.assertIsNone(cassette.body_hash(None))
+        self.assertEqual(len(cassette.body_hash(b"nao-json")), 64)
+
+    def test_grava_sem_tokens(self):
+        """Testa a gravação das interações, inclusive de erro, sem tokens nem header de autenticação."""
+        import gzip
+
+        self.grava()
+
+        with gzip.open(self.caminho, "rt", encoding="utf-8") as arquivo:
+            conteudo = arquivo.read()
+        interacoes = [json.loads(linha) for linha in conteudo.splitlines()]
+        self.assertEqual([i["status"] for i in interacoes], [200, 200, 401])
+        self.assertEqual(interacoes[0]["method"], "POST")
+        self.assertEqual(interacoes[0]["url"], "/local/suap/api/index.php?sync_up_enrolments=")
+        self.assertIn("url_sala_coordenacao", json.loads(interacoes[0]["body"]))
+        self.assertEqual(interacoes[1]["headers"], {"Content-Type": "application/json"})
+        self.assertTrue(all(i["url"].startswith("/local/suap/") for i in interacoes))
+        for segredo in (LocalSuapHTTPMock.TEST_TOKEN, "segredo-do-payload", "abc"):
+            self.assertNotIn(segredo, conteudo)
+
+    def test_reproduz_sem_rede(self):
+        """Testa a reprodução das respostas e erros gravados sem chamar o transporte nem a rede."""
+        transporte = self.grava()
+
+        with (
+            patch("integrador.utils.urllib.request.urlopen", side_effect=AssertionError("rede")),
+            cassette.Cassette(self.caminho) as reproducao,
+        ):
+            resultado = http_post_json(
+                f"https://outro.host{urllib.parse.urlsplit(self.BASE).path}?sync_up_enrolments",
+                jsonbody=self.PAYLOAD,
+                headers=dict(self.AUTH),
+            )
+            notas = http_get_json(f"{self.BASE}?sync_down_grades&diario_id=2&wstoken=outro", headers=self.AUTH)
+            with self.assertRaises(SyncError) as ctx:
+                http_get_json(f"{self.BASE}?sync_down_grades&diario_id=3", headers=self.AUTH)
+
+        self.assertEqual(transporte.chamadas, 3)
+        self.assertEqual(len(reproducao.interacoes), 3)
+        self.assertIn("url", resultado)
+        self.assertEqual(notas["notas"][0]["diario_id"], "2")
+        self.assertEqual(ctx.exception.code, 401)
+        self.assertIs(get_transport().__class__, UrllibTransport)
+
+    def test_reproduz_por_servico_em_rodizio(self):
+        """Testa que, sem gravação exata, vale a do mesmo serviço, em rodízio."""
+        gravacao = cassette.Cassette(self.caminho, mode="record")
+        for diario_id in (1, 2):
+            gravacao.add("GET", f"{self.BASE}?sync_down_grades&diario_id={diario_id}", content=b'{"d": %d}' % diario_id)
+        gravacao.close()
+
+        with cassette.Cassette(self.caminho):
+            respostas = [http_get_json(f"{self.BASE}?sync_down_grades&diario_id=9") for _ in range(3)]
+            exata = http_get_json(f"{self.BASE}?sync_down_grades&diario_id=2")
+            with self.assertRaises(HTTPException) as ctx:
+                http_post_json(f"{self.BASE}?sync_up_enrolments", jsonbody={})
+
+        self.assertEqual(respostas, [{"d": 1}, {"d": 2}, {"d": 1}])
+        self.assertEqual(exata, {"d": 2})
+        self.assertEqual(ctx.exception.status, 502)
+        self.assertIn("Sem gravação", ctx.exception.reason)
+
+    def test_erro_de_conexao_e_corpo_binario(self):
+        """Testa a gravação e reprodução de falha de conexão e de resposta que não é UTF-8."""
+        transporte = Mock()
+        transporte.urlopen.side_effect = urllib.error.URLError("Connection refused")
+        with cassette.Cassette(self.caminho, mode="record", transport=transporte):
+            with self.assertRaises(HTTPException):
+                http_get(f"{self.BASE}?sync_down_grades&diario_id=1")
+        gravacao = cassette.Cassette(self.caminho.replace(".ndjson", "-b.ndjson"), mode="record")
+        gravacao.add("GET", f"{self.BASE}?arquivo", content=b"\xff\xfe")
+        gravacao.close()
+
+        with cassette.Cassette(self.caminho):
+            with self.assertRaises(HTTPException) as ctx:
+                http_get(f"{self.BASE}?sync_down_grades&diario_id=1")
+        with cassette.Cassette(gravacao.path):
+            conteudo = http_get(f"{self.BASE}?arquivo", decode=False)
+
+        self.assertEqual(ctx.exception.status, 502)
+        self.assertEqual(ctx.exception.reason, "Connection refused")
+        self.assertEqual(conteudo, b"\xff\xfe")
+
+    def test_timing_original(self):
+        """Testa que, com timing original, cada resposta demora o gravado dividido por speed."""
+        gravacao = cassette.Cassette(self.caminho, mode="record")
+        gravacao.add("GET", f"{self.BASE}?sync_down_grades", content=b"{}", elapsed_s=0.8)
+        gravacao.close()
+
+        with patch("integrador.cassette.time.sleep") as sleep:
+            with cassette.Cassette(self.caminho, timing="original", speed=4):
+                http_get_json(f"{self.BASE}?sync_down_grades")
+            with cassette.Cassette(self.caminho):
+                http_get_json(f"{self.BASE}?sync_down_grades")
+
+        sleep.assert_called_once_with(0.2)
+
+    def test_validacoes(self):
+        """Testa modo e timing desconhecidos, linha inválida e {pid} no caminho de gravação."""
+        import gzip
+        import os
+
+        with self.assertRaisesMessage(ValueError, "Modo de cassete desconhecido"):
+            cassette.Cassette(self.caminho, mode="gravar")
+        with self.assertRaisesMessage(ValueError, "Timing de cassete desconhecido"):
+            cassette.Cassette(self.caminho, timing="lento")
+        with gzip.open(self.caminho, "wt") as arquivo:
+            arquivo.write('{"method": "GET", "url": "/x"}\n\n{"url": "/y"}\n')
+        with self.assertRaisesMessage(ValueError, "linha 3"):
+            cassette.Cassette(self.caminho)
+
+        gravacao = cassette.Cassette(self.caminho.replace("moodle", "moodle-{pid}"), mode="record")
+        gravacao.close()
+        self.assertTrue(gravacao.path.endswith(f"moodle-{os.getpid()}.ndjson.gz"))
+
+    def test_configure(self):
+        """Testa a ligação do cassete dos settings como transporte do processo."""
+        self.grava()
+        anterior = get_transport()
+        self.addCleanup(set_transport, anterior)
+
+        self.assertIsNone(cassette.configure())
+        with override_settings(MOODLE_HTTP_CASSETTE=self.caminho, MOODLE_HTTP_CASSETTE_TIMING="original"):
+            configurado = cassette.configure()
+
+        self.assertIs(get_transport(), configurado)
+        self.assertEqual(configurado.timing, "original")
+        self.assertEqual(set_transport(anterior), configurado)
+
+
 class ToolSgaHTTPMockTestCase(TestCase):
     """
-    Testes para ToolSgaHTTPMock.
+    Testes para ToolSgaHTTPMock e ToolSgaState.
 
-    Cobre o mock do plugin `tool_sga`, usado pelos brokers
-    `Suap2ToolSgaBroker` e `Sga2ToolSgaBroker`.
-
-    Os brokers ainda não estão implementados, portanto os testes cobrem
-    apenas o comportamento de stub (respostas 4xx/501).
+    Cobre o mock com estado do plugin `tool_sga`, usado pelos brokers
+    `Suap2ToolSgaBroker` e `Sga2ToolSgaBroker`: cursos, inscrições e notas
+    por diário, lotes idempotentes, ETag e o servidor em background.
     """
 
     PLUGIN_PATH = ToolSgaHTTPMock.PLUGIN_PATH
@@ -307,6 +599,27 @@ class ToolSgaHTTPMockTestCase(TestCase):
     def setUp(self):
         self.mock = ToolSgaHTTPMock()
 
+    @staticmethod
+    def diario(diario_id: int, alunos: int = 2, curso: str = "15806", **extra) -> dict:
+        return {
+            "sga": "suap",
+            "unidade": {"id": 1, "sigla": "ZL", "nome": "Campus ZL"},
+            "curso": {"id": 1, "codigo": curso, "nome": "Curso"},
+            "turma": {"id": 2, "codigo": "20261.6.15806.1E"},
+            "disciplina": {"id": 3, "sigla": "TEC.1023", "nome": "Bancos de Dados", "avaliacoes": 2},
+            "diario": {"id": diario_id, "codigo": f"TEC.1023.{diario_id}", "situacao": "Aberto"},
+            "inscricoes": [
+                {"papel": "aluno", "login": f"2026{i:04d}", "matricula": f"2026{i:04d}", "situacao": "ativo"}
+                for i in range(alunos)
+            ]
+            + [{"papel": "professor", "login": "1234567", "situacao": "ativo"}],
+            **extra,
+        }
+
+    def post(self, service: str, jsonbody) -> tuple[int, dict]:
+        response = self.mock.post(f"{self.BASE_URL}?{service}", jsonbody=jsonbody, headers=self.AUTH_HEADERS)
+        return response.status_code, json.loads(response.content) if response.content else None
+
     def test_sem_authentication_retorna_400(self):
         """Chamada sem cabeçalho Authentication deve retornar 400."""
         response = self.mock.get(self.BASE_URL)
@@ -326,12 +639,211 @@ class ToolSgaHTTPMockTestCase(TestCase):
         response = self.mock.get("https://test.moodle.com/outro/path", headers=self.AUTH_HEADERS)
         self.assertEqual(response.status_code, 404)
 
-    def test_qualquer_servico_retorna_501(self):
-        """Qualquer serviço autenticado deve retornar 501 enquanto o broker não for implementado."""
-        response = self.mock.post(self.BASE_URL, jsonbody={}, headers=self.AUTH_HEADERS)
-        self.assertEqual(response.status_code, 501)
+    def test_servico_desconhecido_e_metodo_errado(self):
+        """Serviço inexistente deve retornar 404 e o método errado, 405."""
+        self.assertEqual(self.post("qualquer_servico", {})[0], 404)
+        self.assertEqual(
+            self.mock.get(f"{self.BASE_URL}?sync_up_enrolments", headers=self.AUTH_HEADERS).status_code, 405
+        )
+
+    def test_health(self):
+        """health responde ok, com a contagem de diários e inscrições."""
+        self.post("sync_up_enrolments", self.diario(1))
+        response = self.mock.get(f"{self.BASE_URL}?health", headers=self.AUTH_HEADERS)
         data = json.loads(response.content)
-        self.assertEqual(data["error"]["code"], 501)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data["status"], data["diarios"], data["inscricoes"]), ("ok", 1, 3))
+
+    def test_sync_up_cria_e_atualiza(self):
+        """Reenvio do diário mantém o curso, conta inscrições novas, alteradas e suspensas; a coordenação é do curso."""
+        status, primeiro = self.post("sync_up_enrolments", self.diario(10))
+        self.assertEqual(status, 200)
+        self.assertEqual(primeiro["inscricoes"], {"criadas": 3, "atualizadas": 0, "suspensas": 0})
+
+        diario = self.diario(10, alunos=3)
+        diario["inscricoes"][0]["situacao"] = "suspenso"
+        _, segundo = self.post("sync_up_enrolments", diario)
+        _, outro = self.post("sync_up_enrolments", self.diario(11))
+        _, outro_curso = self.post("sync_up_enrolments", self.diario(12, curso="99999"))
+
+        self.assertEqual(segundo["inscricoes"], {"criadas": 1, "atualizadas": 1, "suspensas": 1})
+        self.assertEqual(segundo["url"], primeiro["url"])
+        self.assertTrue(primeiro["url"].startswith("https://test.moodle.com/course/view.php?id="))
+        self.assertNotEqual(outro["url"], primeiro["url"])
+        self.assertEqual(outro["url_sala_coordenacao"], primeiro["url_sala_coordenacao"])
+        self.assertNotEqual(outro_curso["url_sala_coordenacao"], primeiro["url_sala_coordenacao"])
+        self.assertEqual(len(self.mock.state.inscricoes["10"]), 4)
+
+    def test_sync_up_campos_obrigatorios(self):
+        """Diário sem os campos obrigatórios ou com inscrição sem login deve retornar 422."""
+        diario = self.diario(1)
+        del diario["curso"]["codigo"]
+        diario["inscricoes"].append({"papel": "aluno"})
+
+        status, data = self.post("sync_up_enrolments", diario)
+        self.assertEqual(status, 422)
+        self.assertIn("curso.codigo", data["error"]["message"])
+        self.assertIn("inscricoes[].login/papel", data["error"]["message"])
+        self.assertEqual(self.post("sync_up_enrolments", [])[0], 422)
+        self.assertEqual(self.mock.state.diarios, {})
+
+    def test_sync_down_notas_calculadas(self):
+        """Cada aluno ativo recebe uma nota por avaliação, sempre a mesma; professores e suspensos não."""
+        diario = self.diario(20, alunos=2)
+        diario["inscricoes"][1]["situacao"] = "suspenso"
+        self.post("sync_up_enrolments", diario)
+
+        response = self.mock.get(f"{self.BASE_URL}?sync_down_grades&diario_id=20", headers=self.AUTH_HEADERS)
+        data = json.loads(response.content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(n["matricula"], n["etapa"]) for n in data["notas"]], [("20260000", 1), ("20260000", 2)])
+        self.assertTrue(all(0 <= n["nota"] <= 10 and n["diario_id"] == "20" for n in data["notas"]))
+
+        outro = ToolSgaHTTPMock()
+        outro.post(f"{self.BASE_URL}?sync_up_enrolments", jsonbody=diario, headers=self.AUTH_HEADERS)
+        notas = outro.get(f"{self.BASE_URL}?sync_down_grades&diario_id=20", headers=self.AUTH_HEADERS).content
+        self.assertEqual(json.loads(notas)["notas"], data["notas"])
+
+    def test_sync_down_etag(self):
+        """Com If-None-Match igual ao ETag a resposta é 304; notas lançadas ou reenvio mudam o ETag."""
+        self.post("sync_up_enrolments", self.diario(30))
+        url = f"{self.BASE_URL}?sync_down_grades&diario_id=30"
+        etag = self.mock.get(url, headers=self.AUTH_HEADERS).headers["ETag"]
+
+        response = self.mock.get(url, headers={**self.AUTH_HEADERS, "If-None-Match": etag})
+        self.assertEqual((response.status_code, response.content), (304, b""))
+
+        self.mock.state.set_grades(30, [{"matricula": "20260000", "etapa": 1, "nota": 9.5}])
+        response = self.mock.get(url, headers={**self.AUTH_HEADERS, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content)["notas"],
+            [{"matricula": "20260000", "etapa": 1, "nota": 9.5, "diario_id": "30"}],
+        )
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        self.post("sync_up_enrolments", self.diario(30))
+        self.assertNotEqual(self.mock.get(url, headers=self.AUTH_HEADERS).headers["ETag"], response.headers["ETag"])
+
+    def test_sync_down_erros(self):
+        """Diário que não existe no Moodle retorna 404; sem diario_id, 422."""
+        response = self.mock.get(f"{self.BASE_URL}?sync_down_grades&diario_id=404", headers=self.AUTH_HEADERS)
+        self.assertEqual(response.status_code, 404)
+        response = self.mock.get(f"{self.BASE_URL}?sync_down_grades", headers=self.AUTH_HEADERS)
+        self.assertEqual(response.status_code, 422)
+
+    def test_sync_down_grades_batch(self):
+        """As notas de vários diários numa resposta, com erro por diário para os que não existem."""
+        for diario_id in (40, 41):
+            self.post("sync_up_enrolments", self.diario(diario_id, alunos=1))
+
+        status, data = self.post("sync_down_grades_batch", {"diario_ids": [40, "41", 42]})
+
+        self.assertEqual(status, 200)
+        self.assertEqual([d["diario_id"] for d in data["diarios"]], ["40", "41", "42"])
+        self.assertEqual(len(data["diarios"][0]["notas"]), 2)
+        self.assertEqual(data["diarios"][2]["error"]["code"], 404)
+        self.assertEqual(self.post("sync_down_grades_batch", {"diario_ids": "40"})[0], 422)
+
+    def test_sync_up_batch_idempotente(self):
+        """A retentativa de um lote devolve a mesma resposta sem reaplicar; a chave com outro conteúdo, 409."""
+        lote = {"batch_key": "lote-1", "diarios": [self.diario(50), self.diario(51)]}
+
+        status, primeiro = self.post("sync_up_batch", lote)
+        _, repetido = self.post("sync_up_batch", lote)
+        conflito, _ = self.post("sync_up_batch", {**lote, "diarios": [self.diario(52)]})
+        invalido, data = self.post("sync_up_batch", {"batch_key": "lote-2", "diarios": [self.diario(53), {}]})
+
+        self.assertEqual(status, 200)
+        self.assertFalse(primeiro["repetido"])
+        self.assertEqual([d["diario_id"] for d in primeiro["diarios"]], ["50", "51"])
+        self.assertEqual({**repetido, "repetido": False}, primeiro)
+        self.assertTrue(repetido["repetido"])
+        self.assertEqual(conflito, 409)
+        self.assertEqual((invalido, list(data["error"]["diarios"])), (422, ["1"]))
+        self.assertEqual(self.post("sync_up_batch", {"diarios": []})[0], 422)
+        self.assertEqual(self.mock.state.counters["sync_up"], 2)
+        self.assertEqual(self.mock.state.snapshot()["lotes"], 1)
+
+    def test_batch_concorrente_executa_uma_vez(self):
+        """Retentativas simultâneas da mesma chave esperam a primeira execução e recebem a resposta dela."""
+        state = ToolSgaState()
+        execucoes = []
+        liberado = threading.Event()
+
+        def processa():
+            execucoes.append(1)
+            liberado.wait(2)
+            return {"ok": True}
+
+        resultados = []
+        threads = [
+            threading.Thread(target=lambda: resultados.append(state.batch("k", "h", processa))) for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        liberado.set()
+        for thread in threads:
+            thread.join(2)
+
+        self.assertEqual(len(execucoes), 1)
+        self.assertEqual(sorted(repetido for _, repetido in resultados), [False, True, True, True, True])
+
+    def test_batch_keys_limitadas(self):
+        """As chaves mais antigas são esquecidas acima de BATCH_KEYS_MAX; falha na execução libera a chave."""
+        state = ToolSgaState()
+        state.BATCH_KEYS_MAX = 2
+        for chave in "abc":
+            state.batch(chave, "h", dict)
+        with self.assertRaises(RuntimeError):
+            state.batch("d", "h", Mock(side_effect=RuntimeError))
+
+        self.assertEqual(list(state._batches), ["c"])
+        self.assertEqual(state.batch("d", "h", dict), ({}, False))
+        self.assertEqual(state.batch("c", "h", list), ({}, True))
+
+    def test_servidor_concorrente(self):
+        """O servidor em background atende clientes simultâneos sem perder inscrições e expõe o estado."""
+        import http.client
+        import socket
+        from concurrent.futures import ThreadPoolExecutor
+
+        with socket.socket() as livre:
+            livre.bind(("127.0.0.1", 0))
+            porta = livre.getsockname()[1]
+        start_mock_moodle_server("127.0.0.1", porta, faults={})
+        self.addCleanup(stop_mock_moodle_server_in_background)
+
+        def envia(cliente: int) -> list[int]:
+            conexao = http.client.HTTPConnection("127.0.0.1", porta, timeout=5)
+            status = []
+            for diario_id in range(cliente * 10, cliente * 10 + 10):
+                conexao.request(
+                    "POST",
+                    f"{self.PLUGIN_PATH}?sync_up_enrolments",
+                    body=json.dumps(self.diario(diario_id, alunos=5)),
+                    headers=self.AUTH_HEADERS,
+                )
+                response = conexao.getresponse()
+                response.read()
+                status.append(response.status)
+            conexao.close()
+            return status
+
+        with ThreadPoolExecutor(8) as executor:
+            status = [s for lista in executor.map(envia, range(8)) for s in lista]
+
+        self.assertEqual(set(status), {200})
+        self.assertEqual(get_tool_sga_state().snapshot()["diarios"], 80)
+
+        conexao = http.client.HTTPConnection("127.0.0.1", porta, timeout=5)
+        self.addCleanup(conexao.close)
+        conexao.request("GET", f"{self.PLUGIN_PATH}?sync_down_grades&diario_id=7", headers=self.AUTH_HEADERS)
+        data = json.loads(conexao.getresponse().read())
+        self.assertTrue(data["url"].startswith(f"http://127.0.0.1:{porta}/course/view.php?id="))
+        conexao.request("DELETE", TOOL_SGA_CONTROL_PATH, headers=self.AUTH_HEADERS)
+        self.assertEqual(json.loads(conexao.getresponse().read())["diarios"], 0)
 
 
 class LocalSuapHTTPMockTestCase(TestCase):
@@ -515,6 +1027,43 @@ class MiddlewareTestCase(TestCase):
             self.assertTrue(getattr(match.func, "csrf_exempt", False))
 
 
+class InternalHostMiddlewareTestCase(TestCase):
+    """Testes para o middleware que aceita o IP do pod como Host na coleta do Prometheus."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = InternalHostMiddleware(lambda x: None)
+
+    def request(self, path):
+        request = self.factory.get(path, HTTP_HOST="10.42.0.17:8000", HTTP_X_FORWARDED_HOST="10.42.0.17")
+        self.middleware.process_request(request)
+        return request
+
+    @override_settings(ALLOWED_HOSTS=["localhost", "integrador.ead.ifrn.edu.br"])
+    def test_metrics_usa_o_primeiro_host_permitido(self):
+        """Testa que, em /metrics, o Host vira o primeiro host permitido e o X-Forwarded-Host é descartado."""
+        for path in ["/metrics", "/metrics/"]:
+            request = self.request(path)
+            self.assertEqual(request.get_host(), "localhost")
+            self.assertNotIn("HTTP_X_FORWARDED_HOST", request.META)
+
+    @override_settings(ALLOWED_HOSTS=[".ifrn.edu.br"])
+    def test_host_permitido_por_dominio(self):
+        """Testa que um host permitido como ".dominio" vira o próprio domínio."""
+        self.assertEqual(self.request("/metrics").META["HTTP_HOST"], "ifrn.edu.br")
+
+    @override_settings(ALLOWED_HOSTS=["localhost"])
+    def test_outras_urls_mantem_o_host(self):
+        """Testa que as demais URLs continuam validadas pelo Host recebido."""
+        for path in ["/health/", "/admin/", "/api/baixar_notas/"]:
+            self.assertEqual(self.request(path).META["HTTP_HOST"], "10.42.0.17:8000")
+
+    @override_settings(ALLOWED_HOSTS=["*"])
+    def test_qualquer_host_permitido(self):
+        """Testa que, com ALLOWED_HOSTS=["*"], o Host não é trocado."""
+        self.assertEqual(self.request("/metrics").META["HTTP_HOST"], "10.42.0.17:8000")
+
+
 class CSRFErrorViewTestCase(TestCase):
     """Testes para a view customizada de erro CSRF."""
 
@@ -944,6 +1493,11 @@ class AmbienteAdminTestCase(TestCase):
         self.admin = AmbienteAdmin(Ambiente, AdminSite())
         self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
 
+    def probed(self, ambiente):
+        """Verifica o ambiente (com o HTTP do teste) e anexa o resultado, como faz a changelist."""
+        ambiente.probe = probe_ambientes([ambiente])[ambiente.id]
+        return ambiente
+
     @patch("requests.get")
     def test_ok_checked_url(self, mock_get):
         """Testa checked_url com sucesso."""
@@ -951,7 +1505,7 @@ class AmbienteAdminTestCase(TestCase):
         mock_response.status_code = 200
         mock_get.return_value = mock_response
 
-        result = self.admin.checked_url(Ambiente(**AMBIENTE_GOOD_SGA))
+        result = self.admin.checked_url(self.probed(Ambiente(**AMBIENTE_GOOD_SGA)))
         self.assertIn("✅", result)
         self.assertIn("https://test.moodle.com", result)
 
@@ -960,7 +1514,7 @@ class AmbienteAdminTestCase(TestCase):
         """Testa checked_url com falha."""
         mock_get.side_effect = Exception("Connection error")
 
-        result = self.admin.checked_url(Ambiente(**AMBIENTE_GOOD_SGA))
+        result = self.admin.checked_url(self.probed(Ambiente(**AMBIENTE_GOOD_SGA)))
         self.assertIn("🚫", result)
 
     def test_ok_checked_expressao_seletora(self):
@@ -991,7 +1545,7 @@ class AmbienteAdminTestCase(TestCase):
 
         # mock_get.side_effect = Exception("Connection error")
         mock_get.return_value = Mock(status_code=200, text="")
-        result = self.admin.checked_tool_sga(Ambiente(**AMBIENTE_GOOD_SGA))
+        result = self.admin.checked_tool_sga(self.probed(Ambiente(**AMBIENTE_GOOD_SGA)))
         self.assertIn("Tool SGA", result)
         self.assertIn("✅", result)
 
@@ -1001,7 +1555,7 @@ class AmbienteAdminTestCase(TestCase):
 
         # mock_get.side_effect = Exception("Connection error")
         mock_get.return_value = Mock(status_code=401, text="")
-        result = self.admin.checked_tool_sga(Ambiente(**AMBIENTE_GOOD_SGA))
+        result = self.admin.checked_tool_sga(self.probed(Ambiente(**AMBIENTE_GOOD_SGA)))
         self.assertIn("Tool SGA", result)
         self.assertIn("🔑", result)  # Token inválido
 
@@ -1009,7 +1563,7 @@ class AmbienteAdminTestCase(TestCase):
     def test_not_ok_checked_tool_sga2(self, mock_get):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
         mock_get.return_value = Mock(status_code=500, text="")
-        result = self.admin.checked_tool_sga(Ambiente(**AMBIENTE_GOOD_SGA))
+        result = self.admin.checked_tool_sga(self.probed(Ambiente(**AMBIENTE_GOOD_SGA)))
         self.assertIn("Tool SGA", result)
         self.assertIn("❌", result)  # Qualquer outro erro
 
@@ -1018,7 +1572,7 @@ class AmbienteAdminTestCase(TestCase):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
         mock_get.return_value = Mock(status_code=500, text="")
         ambiente = Ambiente(**(AMBIENTE_GOOD_SGA | {"tool_sga_active": False, "tool_sga_token": None}))
-        result = self.admin.checked_tool_sga(ambiente)
+        result = self.admin.checked_tool_sga(self.probed(ambiente))
         self.assertIn("Tool SGA", result)
         self.assertIn("🚫", result)
 
@@ -1027,7 +1581,7 @@ class AmbienteAdminTestCase(TestCase):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
         mock_get.return_value = Mock(status_code=500, text="")
         ambiente = Ambiente(**(AMBIENTE_GOOD_SGA | {"tool_sga_active": False}))
-        result = self.admin.checked_tool_sga(ambiente)
+        result = self.admin.checked_tool_sga(self.probed(ambiente))
         self.assertIn("Tool SGA", result)
         self.assertIn("⏸️", result)
 
@@ -1036,13 +1590,13 @@ class AmbienteAdminTestCase(TestCase):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
         mock_get.return_value = Mock(status_code=500, text="")
         ambiente = Ambiente(**(AMBIENTE_GOOD_SGA | {"tool_sga_token": None}))
-        result = self.admin.checked_tool_sga(ambiente)
+        result = self.admin.checked_tool_sga(self.probed(ambiente))
         self.assertIn("Tool SGA", result)
         self.assertIn("⚠️", result)
 
     def test_not_ok_checked_tool_sga6(self):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
-        result = self.admin.checked_tool_sga(Ambiente(**AMBIENTE_GOOD_SGA))
+        result = self.admin.checked_tool_sga(self.probed(Ambiente(**AMBIENTE_GOOD_SGA)))
         self.assertIn("Tool SGA", result)
         self.assertIn("⛔", result)
 
@@ -1052,7 +1606,7 @@ class AmbienteAdminTestCase(TestCase):
 
         # mock_get.side_effect = Exception("Connection error")
         mock_get.return_value = Mock(status_code=200, text="")
-        result = self.admin.checked_local_suap(Ambiente(**AMBIENTE_GOOD_SUAP))
+        result = self.admin.checked_local_suap(self.probed(Ambiente(**AMBIENTE_GOOD_SUAP)))
         self.assertIn("Local SUAP", result)
         self.assertIn("✅", result)
 
@@ -1062,7 +1616,7 @@ class AmbienteAdminTestCase(TestCase):
 
         # mock_get.side_effect = Exception("Connection error")
         mock_get.return_value = Mock(status_code=401, text="")
-        result = self.admin.checked_local_suap(Ambiente(**AMBIENTE_GOOD_SUAP))
+        result = self.admin.checked_local_suap(self.probed(Ambiente(**AMBIENTE_GOOD_SUAP)))
         self.assertIn("Local SUAP", result)
         self.assertIn("🔑", result)  # Token inválido
 
@@ -1070,7 +1624,7 @@ class AmbienteAdminTestCase(TestCase):
     def test_not_ok_checked_local_suap2(self, mock_get):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
         mock_get.return_value = Mock(status_code=500, text="")
-        result = self.admin.checked_local_suap(Ambiente(**AMBIENTE_GOOD_SUAP))
+        result = self.admin.checked_local_suap(self.probed(Ambiente(**AMBIENTE_GOOD_SUAP)))
         self.assertIn("Local SUAP", result)
         self.assertIn("❌", result)  # Qualquer outro erro
 
@@ -1079,7 +1633,7 @@ class AmbienteAdminTestCase(TestCase):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
         mock_get.return_value = Mock(status_code=500, text="")
         ambiente = Ambiente(**(AMBIENTE_GOOD_SUAP | {"local_suap_active": False, "local_suap_token": None}))
-        result = self.admin.checked_local_suap(ambiente)
+        result = self.admin.checked_local_suap(self.probed(ambiente))
         self.assertIn("Local SUAP", result)
         self.assertIn("🚫", result)
 
@@ -1088,7 +1642,7 @@ class AmbienteAdminTestCase(TestCase):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
         mock_get.return_value = Mock(status_code=500, text="")
         ambiente = Ambiente(**(AMBIENTE_GOOD_SUAP | {"local_suap_active": False}))
-        result = self.admin.checked_local_suap(ambiente)
+        result = self.admin.checked_local_suap(self.probed(ambiente))
         self.assertIn("Local SUAP", result)
         self.assertIn("⏸️", result)
 
@@ -1097,483 +1651,1546 @@ class AmbienteAdminTestCase(TestCase):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
         mock_get.return_value = Mock(status_code=500, text="")
         ambiente = Ambiente(**(AMBIENTE_GOOD_SUAP | {"local_suap_token": None}))
-        result = self.admin.checked_local_suap(ambiente)
+        result = self.admin.checked_local_suap(self.probed(ambiente))
         self.assertIn("Local SUAP", result)
         self.assertIn("⚠️", result)
 
     def test_not_ok_checked_local_suap6(self):
         """Testa que AmbienteAdmin.get_queryset chama all() no queryset base."""
-        result = self.admin.checked_local_suap(Ambiente(**(AMBIENTE_GOOD_SUAP)))
+        result = self.admin.checked_local_suap(self.probed(Ambiente(**(AMBIENTE_GOOD_SUAP))))
         self.assertIn("Local SUAP", result)
         self.assertIn("⛔", result)
 
+    def test_checked_badges_pending_without_probe(self):
+        """Testa que, sem resultado no cache, o admin exibe a verificação como pendente sem chamar o Moodle."""
+        self.ambiente.probe = None
+        self.assertIn("⏳", self.admin.checked_url(self.ambiente))
+        self.assertIn("⏳", self.admin.checked_tool_sga(self.ambiente))
+
+    @patch("integrador.admin.cached_probes")
+    def test_probe_read_from_cache_when_not_attached(self, mock_cached_probes):
+        """Testa que, fora da changelist, o resultado é lido do cache."""
+        mock_cached_probes.return_value = {self.ambiente.id: None}
+        self.assertIn("⏳", self.admin.checked_url(self.ambiente))
+        self.assertIn("⏳", self.admin.checked_tool_sga(self.ambiente))
+        mock_cached_probes.assert_called_once_with([self.ambiente])
+
+    @patch("integrador.admin.cached_probes")
+    def test_changelist_attaches_cached_probes(self, mock_cached_probes):
+        """Testa que a changelist busca o estado de todos os ambientes da página de uma só vez."""
+        Ambiente.objects.create(**(AMBIENTE_GOOD_SUAP | {"nome": "Outro"}))
+        mock_cached_probes.side_effect = lambda ambientes: {a.id: None for a in ambientes}
+        request = RequestFactory().get("/admin/integrador/ambiente/")
+        request.user = User.objects.create_superuser("admin_amb", "admin_amb@test.com", str(uuid.uuid4()))
 
-class DecoratorsTestCase(TestCase):
-    """Testes para decorators."""
+        changelist = self.admin.get_changelist_instance(request)
 
-    def setUp(self):
-        """Configura o ambiente de teste."""
-        self.factory = RequestFactory()
+        mock_cached_probes.assert_called_once()
+        self.assertEqual(len(changelist.result_list), 2)
+        self.assertTrue(all(hasattr(ambiente, "probe") for ambiente in changelist.result_list))
 
-    def test_json_response_decorator_with_dict(self):
-        """Testa decorator json_response com dicionário."""
+    @patch("integrador.admin.probe_ambientes")
+    def test_atualizar_verificacoes_action(self, mock_probe_ambientes):
+        """Testa a ação que verifica imediatamente os ambientes selecionados."""
+        mock_probe_ambientes.return_value = {self.ambiente.id: {}}
+        request = RequestFactory().post("/admin/integrador/ambiente/")
+        queryset = Ambiente.objects.all()
 
-        @json_response
-        def test_view(request):
-            return {"status": "ok"}
+        with patch.object(self.admin, "message_user") as mock_message_user:
+            self.admin.atualizar_verificacoes(request, queryset)
 
-        request = self.factory.get("/test/")
-        response = test_view(request)
+        mock_probe_ambientes.assert_called_once_with(queryset)
+        self.assertIn("1 ambiente(s) verificado(s)", mock_message_user.call_args.args[1])
 
-        self.assertIsInstance(response, JsonResponse)
 
-    def test_json_response_decorator_with_json_response(self):
-        """Testa decorator json_response com JsonResponse."""
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class MoodleProbesTestCase(TestCase):
+    """Testes do serviço de verificação dos Moodles (integrador.probes)."""
 
-        @json_response
-        def test_view(request):
-            return JsonResponse({"status": "ok"})
+    def setUp(self):
+        from django.core.cache import cache
 
-        request = self.factory.get("/test/")
-        response = test_view(request)
+        cache.clear()
+        self.cache = cache
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
 
-        self.assertIsInstance(response, JsonResponse)
+    @patch("requests.get")
+    def test_probe_plugin_skips_inactive_and_without_token(self, mock_get):
+        """Testa que plugins inativos ou sem token não são consultados."""
+        self.assertEqual(probe_plugin(Ambiente(**AMBIENTE_GOOD_SUAP), "tool_sga")["status"], "INACTIVE")
+        ambiente = Ambiente(**(AMBIENTE_GOOD_SGA | {"tool_sga_token": " "}))
+        self.assertEqual(probe_plugin(ambiente, "tool_sga")["status"], "NO_TOKEN")
+        mock_get.assert_not_called()
 
-    def test_exception_as_json_decorator_success(self):
-        """Testa decorator exception_as_json com sucesso."""
+    @patch("requests.get")
+    def test_probe_results_have_status_and_latency(self, mock_get):
+        """Testa o formato dos resultados de cada verificação."""
+        mock_get.return_value = Mock(status_code=200, json=Mock(return_value={"plugin_release": "1.0"}))
+        self.assertEqual(probe_plugin(self.ambiente, "tool_sga")["resposta"], {"plugin_release": "1.0"})
+        self.assertIn("latencia_ms", probe_url(self.ambiente))
 
-        @exception_as_json
-        def test_view(request):
-            return JsonResponse({"status": "ok"})
+        mock_get.return_value = Mock(status_code=503)
+        self.assertEqual(probe_url(self.ambiente)["status"], "FAIL")
+        self.assertEqual(probe_plugin(self.ambiente, "tool_sga")["status_code"], 503)
 
-        request = self.factory.get("/test/")
-        response = test_view(request)
+        mock_get.side_effect = Exception("timeout")
+        resultado = probe_plugin(self.ambiente, "tool_sga")
+        self.assertEqual((resultado["status"], resultado["erro"]), ("ERROR", "timeout"))
 
-        self.assertEqual(response.status_code, 200)
+    @patch("requests.get")
+    def test_probe_ambientes_runs_in_parallel_and_caches(self, mock_get):
+        """Testa que as verificações de todos os ambientes rodam em paralelo e são gravadas no cache."""
+        outro = Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"nome": "Outro"}))
+
+        def lento(*args, **kwargs):
+            time.sleep(0.2)
+            return Mock(status_code=200, json=Mock(return_value={}))
+
+        mock_get.side_effect = lento
+        inicio = time.monotonic()
+        resultados = probe_ambientes([self.ambiente, outro])
+
+        # 6 chamadas HTTP de 0,2s (a URL e os dois plugins de cada ambiente) levariam 1,2s em sequência
+        self.assertLess(time.monotonic() - inicio, 0.8)
+        self.assertEqual(mock_get.call_count, 6)
+        self.assertEqual(resultados[outro.id]["tool_sga"]["status"], "OK")
+        self.assertEqual(self.cache.get(probe_cache_key(self.ambiente.id)), resultados[self.ambiente.id])
+
+    @patch("integrador.probes.refresh_in_background")
+    def test_cached_probes_refreshes_only_stale_or_missing(self, mock_refresh):
+        """Testa que a leitura do cache dispara a reverificação apenas dos ambientes vencidos ou ausentes."""
+        vencido = Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"nome": "Vencido"}))
+        ausente = Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"nome": "Ausente"}))
+        self.cache.set(probe_cache_key(self.ambiente.id), {"verificado_em": time.time()})
+        self.cache.set(probe_cache_key(vencido.id), {"verificado_em": time.time() - 10_000})
+
+        resultados = cached_probes([self.ambiente, vencido, ausente])
+
+        self.assertIsNotNone(resultados[self.ambiente.id])
+        self.assertIsNotNone(resultados[vencido.id])
+        self.assertIsNone(resultados[ausente.id])
+        mock_refresh.assert_called_once_with([vencido, ausente])
+
+        mock_refresh.reset_mock()
+        self.cache.set(probe_cache_key(vencido.id), {"verificado_em": time.time()})
+        self.cache.set(probe_cache_key(ausente.id), {"verificado_em": time.time()})
+        cached_probes([self.ambiente, vencido, ausente])
+        mock_refresh.assert_not_called()
+
+    @patch("integrador.probes.probe_ambientes")
+    def test_refresh_in_background_single_writer(self, mock_probe_ambientes):
+        """Testa que só um processo verifica por vez e que o lock é liberado ao final, mesmo com erro."""
+        self.cache.add(PROBE_LOCK_KEY, True, 60)
+        self.assertFalse(refresh_in_background([self.ambiente]))
+        mock_probe_ambientes.assert_not_called()
+        self.cache.delete(PROBE_LOCK_KEY)
+
+        for efeito in [None, Exception("falhou")]:
+            mock_probe_ambientes.side_effect = efeito
+            self.assertTrue(refresh_in_background([self.ambiente]))
+            for thread in threading.enumerate():
+                if thread.name == "moodle-probe-refresh":
+                    thread.join()
+            self.assertIsNone(self.cache.get(PROBE_LOCK_KEY))
+        self.assertEqual(mock_probe_ambientes.call_count, 2)
+
+    @patch("integrador.management.commands.verifica_moodles.probe_ambientes")
+    def test_verifica_moodles_command(self, mock_probe_ambientes):
+        """Testa o comando que verifica todos os ambientes e conta as falhas."""
+        mock_probe_ambientes.return_value = {
+            self.ambiente.id: {
+                "verificado_em": time.time(),
+                "url": {"status": "OK"},
+                "local_suap": {"status": "ERROR"},
+                "tool_sga": {"status": "FAIL"},
+            }
+        }
+        out = io.StringIO()
 
-    def test_exception_as_json_decorator_with_sync_error(self):
-        """Testa decorator exception_as_json com SyncError."""
+        call_command("verifica_moodles", stdout=out)
 
-        @exception_as_json
-        def test_view(request):
-            raise SyncError("Test error", 400)
+        mock_probe_ambientes.assert_called_once()
+        self.assertIn("1 ambientes verificados (2 verificações com falha)", out.getvalue())
 
-        request = self.factory.get("/test/")
-        response = test_view(request)
 
-        self.assertEqual(response.status_code, 400)
-        data = json.loads(response.content)
-        self.assertIn("error", data)
+@skipUnless(metrics.PROMETHEUS_AVAILABLE, "prometheus_client não instalado")
+class MetricsTestCase(TestCase):
+    """Testes das métricas Prometheus (integrador.metrics)."""
 
-    def test_exception_as_json_decorator_with_generic_exception(self):
-        """Testa decorator exception_as_json com exceção genérica."""
+    def sample(self, name, **labels):
+        from prometheus_client import REGISTRY
 
-        @exception_as_json
-        def test_view(request):
-            raise Exception("Generic error")
+        return REGISTRY.get_sample_value(name, labels) or 0
 
-        request = self.factory.get("/test/")
-        response = test_view(request)
+    def test_sync_request_counted_per_endpoint_and_status(self):
+        """Testa que as views de sincronização contam requisições e duração por endpoint, ambiente e status."""
+        labels = {"endpoint": "api_sync_up_enrolments", "ambiente": "-", "operacao": "-", "status": "501"}
+        antes = self.sample("integrador_sync_requests_total", **labels)
+        duracoes = self.sample("integrador_sync_request_duration_seconds_count", **labels)
 
-        self.assertEqual(response.status_code, 500)
+        response = self.client.get("/api/enviar_diarios/")
 
-    def test_exception_as_json_decorator_with_sync_error_and_retorno(self):
-        """Testa decorator exception_as_json com SyncError contendo retorno (supressão de trace)."""
-        error_payload = {"error": {"message": "Erro do Moodle", "code": 527, "trace": "Traceback aqui"}}
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(self.sample("integrador_sync_requests_total", **labels), antes + 1)
+        self.assertEqual(self.sample("integrador_sync_request_duration_seconds_count", **labels), duracoes + 1)
+        self.assertEqual(self.sample("integrador_sync_in_progress", endpoint="api_sync_up_enrolments"), 0)
+
+    def test_observe_metrics_records_ambiente_and_operacao(self):
+        """Testa que ambiente e operação vêm do request preenchido pelos decorators."""
+        ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+
+        @observe_metrics
+        def view(request):
+            request.ambiente = ambiente
+            request.solicitacao = Solicitacao(operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS)
+            return JsonResponse({}, status=200)
+
+        labels = {
+            "endpoint": "view",
+            "ambiente": ambiente.nome,
+            "operacao": str(Solicitacao.Operacao.SYNC_DOWN_NOTAS),
+            "status": "200",
+        }
+        antes = self.sample("integrador_sync_requests_total", **labels)
+        view(RequestFactory().get("/"))
+        self.assertEqual(self.sample("integrador_sync_requests_total", **labels), antes + 1)
 
-        @exception_as_json
-        def test_view(request):
-            raise SyncError("Erro do Moodle", 527, retorno=error_payload)
+    @patch("integrador.utils.urllib.request.urlopen")
+    def test_moodle_call_latency_and_error_codes(self, mock_urlopen):
+        """Testa a latência e a contagem de erros por código das chamadas HTTP aos Moodles."""
+        mock_urlopen.side_effect = urllib.error.HTTPError(
+            "http://metrics.moodle/x", 404, "Not Found", {}, io.BytesIO(b"")
+        )
+        erros = self.sample("integrador_moodle_errors_total", method="POST", host="metrics.moodle", code="404")
+        chamadas = self.sample(
+            "integrador_moodle_request_duration_seconds_count", method="POST", host="metrics.moodle", status="404"
+        )
+        enviados = self.sample("integrador_payload_bytes_count", fluxo="enviado")
 
-        request = self.factory.get("/test/")
-        response = test_view(request)
+        with self.assertRaises(HTTPException):
+            http_post("http://metrics.moodle/x", jsonbody={"a": 1})
 
-        self.assertEqual(response.status_code, 527)
-        data = json.loads(response.content)
-        self.assertEqual(data["error"]["code"], 527)
-        self.assertEqual(data["error"]["message"], "Erro do Moodle")
-        self.assertNotIn("trace", data["error"])
-        # Garante que o payload original (para salvamento) não foi corrompido/alterado
-        self.assertIn("trace", error_payload["error"])
+        self.assertEqual(
+            self.sample("integrador_moodle_errors_total", method="POST", host="metrics.moodle", code="404"), erros + 1
+        )
+        self.assertEqual(
+            self.sample(
+                "integrador_moodle_request_duration_seconds_count", method="POST", host="metrics.moodle", status="404"
+            ),
+            chamadas + 1,
+        )
+        self.assertEqual(self.sample("integrador_payload_bytes_count", fluxo="enviado"), enviados + 1)
 
-    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
-    def test_valid_token_decorator_success(self):
-        """Testa decorator valid_token com token válido."""
+    def test_cohort_resolution_time_observed(self):
+        """Testa que o tempo de resolução das coortes é medido."""
+        antes = self.sample("integrador_cohort_resolution_seconds_count")
+        BaseBroker(Solicitacao(recebido={})).get_cohort()
+        self.assertEqual(self.sample("integrador_cohort_resolution_seconds_count"), antes + 1)
 
-        @valid_token
-        def test_view(request):
-            return {"status": "ok"}
+    def test_database_collector(self):
+        """Testa as métricas lidas do banco na coleta: solicitações em processamento e conexões."""
+        from django.core.cache import cache
 
-        request = self.factory.get("/test/")
-        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+        cache.delete(metrics.PROCESSANDO_CACHE_KEY)
+        self.addCleanup(cache.delete, metrics.PROCESSANDO_CACHE_KEY)
+        Solicitacao.objects.create(status=Solicitacao.Status.PROCESSANDO, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO)
+        familias = {familia.name: familia for familia in metrics.DatabaseCollector().collect()}
 
-        result = test_view(request)
-        self.assertEqual(result["status"], "ok")
+        self.assertEqual(familias["integrador_solicitacoes_processando"].samples[0].value, 1)
+        self.assertTrue(familias["integrador_db_connections"].samples)
 
-    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
-    def test_valid_token_decorator_invalid_token(self):
-        """Testa decorator valid_token com token inválido."""
+        # A contagem é reaproveitada até expirar no cache.
+        Solicitacao.objects.create(status=Solicitacao.Status.PROCESSANDO, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO)
+        with self.assertNumQueries(1):
+            familias = {familia.name: familia for familia in metrics.DatabaseCollector().collect()}
+        self.assertEqual(familias["integrador_solicitacoes_processando"].samples[0].value, 1)
 
-        @valid_token
-        def test_view(request):
-            return {"status": "ok"}
+        with patch("integrador.metrics.connection.cursor", side_effect=Exception("sem banco")):
+            self.assertEqual(list(metrics.DatabaseCollector().collect()), [])
 
-        # Exibe o sucesso primeiro para cobrir a linha interna da view
-        request_ok = self.factory.get("/test/")
-        request_ok.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
-        test_view(request_ok)
+    def test_render_metrics_multiprocess(self):
+        """Testa que, com PROMETHEUS_MULTIPROC_DIR, a coleta agrega os arquivos dos workers."""
+        import tempfile
 
-        request = self.factory.get("/test/")
-        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN_NOT_OK}"
+        with tempfile.TemporaryDirectory() as diretorio:
+            with patch.dict("os.environ", {"PROMETHEUS_MULTIPROC_DIR": diretorio}):
+                with patch("prometheus_client.multiprocess.MultiProcessCollector") as mock_collector:
+                    conteudo = metrics.render_metrics()
 
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
+        mock_collector.assert_called_once()
+        self.assertIn(b"integrador_solicitacoes_processando", conteudo)
 
-        self.assertEqual(context.exception.code, 403)
+    def test_noop_metric(self):
+        """Testa que, sem o prometheus_client, as métricas aceitam as mesmas chamadas sem efeito."""
+        noop = metrics._NoopMetric()
+        noop.labels(a=1).inc()
+        noop.dec()
+        noop.set(1)
+        noop.observe(1)
+        with noop.time():
+            pass
 
-    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
-    def test_valid_token_decorator_missing_token(self):
-        """Testa decorator valid_token sem token."""
 
-        @valid_token
-        def test_view(request):
-            return {"status": "ok"}
+class SolicitacaoTemposTestCase(TestCase):
+    """Testes dos tempos por etapa gravados em Solicitacao.tempos e devolvidos no Server-Timing."""
 
-        # Exibe o sucesso primeiro para cobrir a linha interna da view
-        request_ok = self.factory.get("/test/")
-        request_ok.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
-        test_view(request_ok)
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+
+    def test_etapas_medir_acumula_e_formata_server_timing(self):
+        """Testa a medição acumulada por etapa e o formato do header Server-Timing."""
+        etapas = Etapas()
+        with patch("integrador.timings.time.perf_counter", side_effect=[0, 0.010, 1, 1.0025]):
+            with etapas.medir("moodle"):
+                pass
+            with etapas.medir("moodle"):
+                pass
+
+        self.assertEqual(etapas.tempos, {"moodle": 12.5})
+        self.assertEqual(etapas.total, 12.5)
+        self.assertEqual(etapas.server_timing(), 'moodle;dur=12.5;desc="HTTP do Moodle"')
+
+        etapas.tempos = {"ambiente": 1.0, "restricoes": 2.0}
+        self.assertEqual(
+            etapas.server_timing(), 'ambiente;dur=1.0;desc="Selecao do ambiente", restricoes;dur=2.0;desc="Restricoes"'
+        )
+        self.assertTrue(etapas.server_timing().isascii())
 
-        request = self.factory.get("/test/")
+    def test_etapas_de_cria_uma_vez(self):
+        """Testa que etapas_de cria as etapas na primeira chamada e as reutiliza depois."""
+        request = SimpleNamespace()
+        self.assertIs(etapas_de(request), etapas_de(request))
 
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
+    def test_finaliza_grava_tempos_num_unico_update(self):
+        """Testa que a gravação final grava os tempos junto, sem um UPDATE só deles, e mede a si mesma à parte."""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
 
-        self.assertEqual(context.exception.code, 431)
+        solicitacao = Solicitacao.objects.create(
+            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, status=Solicitacao.Status.PROCESSANDO
+        )
+        solicitacao.etapas = Etapas()
+        solicitacao.etapas.tempos = {"moodle": 100.0}
 
-    def test_check_is_post_decorator_success(self):
-        """Testa decorator check_is_post com POST."""
+        with CaptureQueriesContext(connection) as queries:
+            solicitacao.finaliza(Solicitacao.Status.SUCESSO, 200)
+        solicitacao.refresh_from_db()
 
-        @check_is_post
-        def test_view(request):
-            return {"status": "ok"}
+        updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "integrador_solicitacao"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(solicitacao.tempos, {"moodle": 100.0})
+        self.assertIn("finalizacao", solicitacao.etapas.tempos)
 
-        request = self.factory.post("/test/")
-        result = test_view(request)
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    @patch("integrador.brokers.suap2local_suap.http_post_json")
+    def test_sync_up_registra_todas_as_etapas(self, mock_post):
+        """Testa que o fluxo de sync_up_enrolments mede todas as etapas e as devolve no Server-Timing."""
+        mock_post.return_value = {"url": "https://moodle.test/course/view.php?id=1"}
+        json_data = {
+            "campus": {"id": 1, "sigla": "TEST", "descricao": "Campus"},
+            "curso": {"id": 10, "codigo": "15806", "nome": "Curso"},
+            "turma": {"id": 2, "codigo": "T123"},
+            "componente": {"id": 5, "sigla": "COMP", "descricao": "Componente"},
+            "diario": {"id": 456, "sigla": "COMP", "situacao": "Aberto"},
+            "professores": [],
+        }
+        request = self.factory.post("/api/enviar_diarios/", data=json.dumps(json_data), content_type="application/json")
+        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
 
-        self.assertEqual(result["status"], "ok")
+        response = sync_up_enrolments(request)
 
-    def test_check_is_post_decorator_failure(self):
-        """Testa decorator check_is_post com GET."""
+        self.assertEqual(response.status_code, 200)
+        solicitacao = Solicitacao.objects.get()
+        # A tradução é só do broker do tool_sga; a gravação final não mede a si mesma em `tempos`.
+        etapas = [etapa for etapa in ETAPAS if etapa != "traducao"]
+        self.assertCountEqual(solicitacao.tempos, [etapa for etapa in etapas if etapa != "finalizacao"])
+        for etapa in etapas:
+            self.assertIn(f"{etapa};dur=", response["Server-Timing"])
+
+    def test_admin_tempos_etapas(self):
+        """Testa a exibição dos tempos por etapa no admin."""
+        from django.contrib.admin.sites import AdminSite
 
-        @check_is_post
-        def test_view(request):
-            return {"status": "ok"}
+        from integrador.admin import SolicitacaoAdmin
 
-        # Exibe o sucesso primeiro para cobrir a linha interna da view
-        request_ok = self.factory.post("/test/")
-        test_view(request_ok)
+        admin = SolicitacaoAdmin(Solicitacao, AdminSite())
+        html = admin.tempos_etapas(Solicitacao(tempos={"coortes": 10.0, "moodle": 30.5}))
 
-        request = self.factory.get("/test/")
+        self.assertIn("Resolução das coortes", html)
+        self.assertIn("HTTP do Moodle", html)
+        self.assertIn("40.5&nbsp;ms", html)
+        self.assertEqual(admin.tempos_etapas(Solicitacao()), "-")
 
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
 
-        self.assertEqual(context.exception.code, 501)
+class TracingDisponibilidadeTestCase(TestCase):
+    """Testes da detecção dos pacotes opcionais do OpenTelemetry, que roda na importação de integrador.tracing."""
 
-    def test_check_is_get_decorator_success(self):
-        """Testa decorator check_is_get com GET."""
+    def test_submodulo_sem_o_pacote_pai(self):
+        """Testa que um submódulo cujo pacote pai não está instalado conta como ausente, sem ModuleNotFoundError."""
+        self.assertFalse(tracing._instalado("integrador_pacote_inexistente.exporter.otlp"))
+        self.assertTrue(tracing._instalado("integrador.tracing"))
 
-        @check_is_get
-        def test_view(request):
-            return {"status": "ok"}
+    @patch("integrador.tracing.importlib.util.find_spec", side_effect=ModuleNotFoundError("opentelemetry.exporter"))
+    def test_exporter_otlp_ausente(self, _find_spec):
+        """Testa o SDK instalado sem o exporter OTLP (o setup local com o console): o exporter conta como ausente."""
+        self.assertFalse(tracing._instalado("opentelemetry.exporter.otlp.proto.http"))
 
-        request = self.factory.get("/test/")
-        result = test_view(request)
 
-        self.assertEqual(result["status"], "ok")
+@skipUnless(tracing.OTEL_AVAILABLE, "opentelemetry-sdk não instalado")
+class TracingTestCase(TestCase):
+    """Testes do rastreamento OpenTelemetry (integrador.tracing)."""
 
-    def test_check_is_get_decorator_failure(self):
-        """Testa decorator check_is_get com POST."""
+    TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
 
-        @check_is_get
-        def test_view(request):
-            return {"status": "ok"}
+    def setUp(self):
+        from django.db import connection
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+        self.exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(self.exporter))
+        tracer = patch.object(tracing, "_tracer", provider.get_tracer("tests"))
+        tracer.start()
+        self.addCleanup(tracer.stop)
+
+        tracing.instrument_connection(connection)
+        self.addCleanup(connection.execute_wrappers.remove, tracing._trace_query)
+        self.factory = RequestFactory()
 
-        # Exibe o sucesso primeiro para cobrir a linha interna da view
-        request_ok = self.factory.get("/test/")
-        test_view(request_ok)
+    def spans(self) -> dict:
+        return {span.name: span for span in self.exporter.get_finished_spans()}
+
+    def test_span_sem_tracer_nao_faz_nada(self):
+        """Testa que, sem tracer configurado, span() e inject() não fazem nada."""
+        with patch.object(tracing, "_tracer", None):
+            with tracing.span("qualquer") as span:
+                self.assertIsNone(span)
+            self.assertEqual(tracing.inject({}), {})
+            self.assertEqual(Ambiente.objects.count(), 0)
+        self.assertEqual(self.exporter.get_finished_spans(), ())
+
+    def test_configure_desligado(self):
+        """Testa que configure() não faz nada com OTEL_ENABLED desligado."""
+        with patch.object(tracing, "_tracer", None), override_settings(OTEL_ENABLED=False):
+            self.assertFalse(tracing.configure())
+            self.assertIsNone(tracing._tracer)
+
+    def test_configure_com_amostragem_zero_nao_grava(self):
+        """Testa que, fora da amostra, os spans não são gravados e as consultas não abrem span."""
+        from django.db.backends.signals import connection_created
+
+        self.addCleanup(connection_created.disconnect, dispatch_uid="integrador.tracing")
+        with (
+            patch.object(tracing, "_tracer", None),
+            override_settings(OTEL_ENABLED=True, OTEL_EXPORTER="none", OTEL_TRACES_SAMPLE_RATE=0.0),
+        ):
+            self.assertTrue(tracing.configure())
+            with tracing.span("fora_da_amostra") as span:
+                self.assertFalse(span.is_recording())
+                Ambiente.objects.count()
+
+    def test_exporter_file_grava_uma_linha_por_span(self):
+        """Testa o exportador em arquivo, com um span JSON por linha."""
+        import tempfile
+
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+
+        with tempfile.NamedTemporaryFile(suffix=".jsonl") as arquivo:
+            with override_settings(OTEL_EXPORTER="file", OTEL_EXPORTER_FILE=arquivo.name):
+                exporter = tracing._exporter()
+            provider = TracerProvider()
+            provider.add_span_processor(SimpleSpanProcessor(exporter))
+            with provider.get_tracer("tests").start_as_current_span("um"):
+                pass
+            provider.shutdown()
+
+            with open(arquivo.name, encoding="utf-8") as linhas:
+                self.assertEqual(json.loads(linhas.readline())["name"], "um")
 
-        request = self.factory.post("/test/")
-
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
-
-        self.assertEqual(context.exception.code, 501)
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    @patch("integrador.brokers.suap2local_suap.http_post_json")
+    def test_sync_up_gera_spans_do_pipeline(self, mock_post):
+        """Testa os spans de cada decorator, do broker, das regras e do banco, continuando o trace do SUAP."""
+        from opentelemetry.trace import SpanKind
 
-    def test_check_json_decorator_valid_json(self):
-        """Testa decorator check_json com JSON válido."""
+        Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+        mock_post.return_value = {"url": "https://moodle.test/course/view.php?id=1"}
+        json_data = {
+            "campus": {"id": 1, "sigla": "TEST", "descricao": "Campus"},
+            "curso": {"id": 10, "codigo": "15806", "nome": "Curso"},
+            "turma": {"id": 2, "codigo": "T123"},
+            "componente": {"id": 5, "sigla": "COMP", "descricao": "Componente"},
+            "diario": {"id": 456, "sigla": "COMP", "situacao": "Aberto"},
+            "professores": [],
+        }
+        response = self.client.post(
+            "/api/enviar_diarios/",
+            data=json.dumps(json_data),
+            content_type="application/json",
+            HTTP_AUTHENTICATION=f"Token {TEST_TOKEN}",
+            HTTP_TRACEPARENT=f"00-{self.TRACE_ID}-00f067aa0ba902b7-01",
+        )
 
-        @check_json(Solicitacao.Operacao.SYNC_UP_DIARIO)
-        def test_view(request):
-            return request.json_recebido
+        self.assertEqual(response.status_code, 200)
+        spans = self.spans()
+        for nome in [
+            "api_sync_up_enrolments",
+            "json_response",
+            "exception_as_json",
+            "check_is_post",
+            "valid_token",
+            "check_json",
+            "detect_ambiente",
+            "try_solicitacao",
+            "rule.ambiente",
+            "Suap2LocalSuapBroker.sync_up_enrolments",
+            "BaseBroker.get_cohort",
+            "Suap2LocalSuapBroker._set_restricoes",
+            "db INSERT",
+        ]:
+            self.assertIn(nome, spans)
+
+        raiz = spans["api_sync_up_enrolments"]
+        self.assertEqual(raiz.kind, SpanKind.SERVER)
+        self.assertEqual(f"{raiz.context.trace_id:032x}", self.TRACE_ID)
+        self.assertEqual(raiz.attributes["http.response.status_code"], 200)
+        self.assertEqual(raiz.attributes["integrador.solicitacao.id"], Solicitacao.objects.get().id)
+        self.assertEqual(spans["db INSERT"].attributes["db.system"], "postgresql")
+        self.assertTrue(all(span.context.trace_id == raiz.context.trace_id for span in spans.values()))
+
+    def test_exception_as_json_marca_o_span_com_erro(self):
+        """Testa que a exceção tratada pelo exception_as_json fica registrada no span."""
+        from opentelemetry.trace import StatusCode
+
+        response = exception_as_json(check_is_post(lambda request: {}))(self.factory.get("/"))
 
-        json_data = {"campus": {"sigla": "TEST"}}
-        request = self.factory.post("/test/", data=json.dumps(json_data), content_type="application/json")
+        self.assertEqual(response.status_code, 501)
+        span = self.spans()["exception_as_json"]
+        self.assertEqual(span.status.status_code, StatusCode.ERROR)
+        self.assertEqual(span.events[0].name, "exception")
 
-        result = test_view(request)
-        self.assertEqual(result, json_data)
+    @patch("integrador.utils.urllib.request.urlopen")
+    def test_http_propaga_o_contexto_para_o_moodle(self, mock_urlopen):
+        """Testa o span de cliente das chamadas HTTP e o header traceparent enviado ao Moodle."""
+        from opentelemetry.trace import SpanKind
+
+        mock_urlopen.return_value = cassette.CassetteResponse(b'{"ok": true}')
+
+        with tracing.span("pai"):
+            http_get_json("https://moodle.test/local/suap/api/index.php?sync_down_grades&diario_id=1")
+
+        span = self.spans()["GET"]
+        enviado = mock_urlopen.call_args.args[0]
+        self.assertEqual(span.kind, SpanKind.CLIENT)
+        self.assertEqual(span.attributes["url.full"], "https://moodle.test/local/suap/api/index.php")
+        self.assertEqual(span.attributes["http.response.status_code"], 200)
+        self.assertTrue(
+            enviado.get_header("Traceparent").startswith(
+                f"00-{span.context.trace_id:032x}-{span.context.span_id:016x}-"
+            )
+        )
 
-    def test_check_json_decorator_invalid_json(self):
-        """Testa decorator check_json com JSON inválido."""
 
-        @check_json(Solicitacao.Operacao.SYNC_UP_DIARIO)
-        def test_view(request):
-            return request.json_recebido
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SENTRY_TRACES_SAMPLE_RATE=0.1,
+    SENTRY_SYNC_TRACES_SAMPLE_RATE=0.25,
+    SENTRY_SYNC_HEALTHY_SAMPLE_RATE=0.0,
+    SENTRY_SLOW_PERCENTILE=95,
+    SENTRY_SLOW_DEFAULT_MS=5000,
+    SENTRY_MAX_PAYLOAD_CHARS=100,
+)
+class SentrySamplingTestCase(TestCase):
+    """Testes da política de amostragem e limpeza dos eventos do Sentry (integrador.sampling)."""
 
-        request = self.factory.post("/test/", data="invalid json {{{", content_type="application/json")
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        limiares = patch.dict(sampling._limiares, {"valores": None, "lido_em": 0.0})
+        limiares.start()
+        self.addCleanup(limiares.stop)
+        # O recálculo em segundo plano roda em outra conexão, que não enxerga a transação do teste.
+        segundo_plano = patch.object(sampling, "_atualiza_em_segundo_plano")
+        self.atualiza_em_segundo_plano = segundo_plano.start()
+        self.addCleanup(segundo_plano.stop)
+
+    def transaction(self, duracao_ms: float, status: str = "ok", ambiente: str = "Moodle") -> dict:
+        return {
+            "type": "transaction",
+            "start_timestamp": "2026-01-01T00:00:00.000000Z",
+            "timestamp": (datetime(2026, 1, 1, tzinfo=UTC) + timedelta(milliseconds=duracao_ms)).isoformat(),
+            "contexts": {"trace": {"status": status}},
+            "tags": {"integrador.endpoint": "api_sync_up_enrolments", "integrador.ambiente": ambiente},
+        }
 
-        result = test_view(request)
-        self.assertIn("check_json", result)
-        self.assertIn("error", result.get("check_json", {}))
+    def test_traces_sampler(self):
+        """Testa a decisão inicial: sincronizações pela taxa delas, health e estáticos nunca, o resto pela geral."""
+        self.assertEqual(sampling.traces_sampler({"wsgi_environ": {"PATH_INFO": "/api/enviar_diarios/"}}), 0.25)
+        self.assertEqual(sampling.traces_sampler({"wsgi_environ": {"PATH_INFO": "/api/baixar_notas/"}}), 0.25)
+        self.assertEqual(sampling.traces_sampler({"wsgi_environ": {"PATH_INFO": "/health/ready/"}}), 0.0)
+        self.assertEqual(sampling.traces_sampler({"wsgi_environ": {"PATH_INFO": "/metrics"}}), 0.0)
+        self.assertEqual(sampling.traces_sampler({"wsgi_environ": {"PATH_INFO": "/static/x.css"}}), 0.0)
+        self.assertEqual(sampling.traces_sampler({"wsgi_environ": {"PATH_INFO": "/integrador/ambiente/"}}), 0.1)
+        self.assertEqual(sampling.traces_sampler({"parent_sampled": False}), 0.0)
+
+    def test_sync_rapida_e_saudavel_fica_na_amostra(self):
+        """Testa que sincronizações rápidas e bem-sucedidas só vão para o Sentry na amostra configurada."""
+        self.assertIsNone(sampling.before_send_transaction(self.transaction(100), {}))
+        # A taxa de saudáveis é sobre o total: das rastreadas (25%), vão 0.25 / 0.25 = todas.
+        with override_settings(SENTRY_SYNC_HEALTHY_SAMPLE_RATE=0.25):
+            self.assertIsNotNone(sampling.before_send_transaction(self.transaction(100), {}))
+        with override_settings(SENTRY_SYNC_HEALTHY_SAMPLE_RATE=0.125), patch.object(sampling.random, "random") as rnd:
+            rnd.return_value = 0.49
+            self.assertIsNotNone(sampling.before_send_transaction(self.transaction(100), {}))
+            rnd.return_value = 0.51
+            self.assertIsNone(sampling.before_send_transaction(self.transaction(100), {}))
+
+    def test_sync_com_falha_sempre_vai(self):
+        """Testa que sincronizações com falha são sempre enviadas."""
+        event = self.transaction(100, status="internal_error")
+        self.assertIs(sampling.before_send_transaction(event, {}), event)
+
+    def test_sync_lenta_para_o_ambiente_sempre_vai(self):
+        """Testa o limiar de lentidão calculado pelo percentil do tempo total de cada Ambiente."""
+        ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+        for total in range(100, 1100, 100):
+            Solicitacao.objects.create(
+                ambiente=ambiente,
+                operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
+                status=Solicitacao.Status.SUCESSO,
+                tempos={"moodle": total},
+            )
 
-    def test_detect_ambiente_decorator_found(self):
-        """Testa decorator detect_ambiente encontrando ambiente."""
-        Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        sampling.atualiza_limiares()
+        self.assertAlmostEqual(sampling.slow_thresholds()[ambiente.nome], 955.0)
+        self.atualiza_em_segundo_plano.assert_not_called()
+        self.assertIsNone(sampling.before_send_transaction(self.transaction(900, ambiente=ambiente.nome), {}))
+        self.assertIsNotNone(sampling.before_send_transaction(self.transaction(1000, ambiente=ambiente.nome), {}))
+        # Ambiente sem histórico usa SENTRY_SLOW_DEFAULT_MS
+        self.assertIsNone(sampling.before_send_transaction(self.transaction(1000, ambiente="Outro"), {}))
+        self.assertIsNotNone(sampling.before_send_transaction(self.transaction(5000, ambiente="Outro"), {}))
+
+    def test_limiares_recalculados_em_segundo_plano_uma_vez(self):
+        """Testa que o hook de envio não consulta o banco e que só um processo recalcula os limiares vencidos."""
+        with self.assertNumQueries(0):
+            self.assertEqual(sampling.slow_thresholds(), {})
+            sampling._limiares["valores"] = None
+            self.assertEqual(sampling.slow_thresholds(), {})
+        self.atualiza_em_segundo_plano.assert_called_once()
+
+        # Limiares vencidos continuam valendo enquanto o recálculo não termina.
+        from django.core.cache import cache
+
+        cache.set(sampling.SLOW_CACHE_KEY, {"valores": {"Moodle": 10.0}, "gerado_em": 0.0})
+        sampling._limiares["valores"] = None
+        self.assertEqual(sampling.slow_thresholds(), {"Moodle": 10.0})
+        self.atualiza_em_segundo_plano.assert_called_once()
+
+    def test_transacao_fora_das_sincronizacoes_nao_e_filtrada(self):
+        """Testa que transações que não são de sincronização passam (a amostragem delas foi feita no início)."""
+        event = {"type": "transaction", "tags": {}}
+        self.assertIs(sampling.before_send_transaction(event, {}), event)
+
+    def test_before_send_trunca_payloads(self):
+        """Testa o truncamento do recebido nos extras, no corpo da requisição e nos breadcrumbs."""
+        recebido = {"alunos": [{"nome": f"Aluno {i}"} for i in range(50)]}
+        event = {
+            "extra": {"recebido": recebido, "diario_id": 1},
+            "request": {"data": json.dumps(recebido)},
+            "breadcrumbs": {"values": [{"message": "x" * 500, "data": {"retorno": recebido}}, {"message": "ok"}]},
+        }
 
-        @detect_ambiente
-        def test_view(request):
-            return {"ambiente": request.ambiente.nome}
+        event = sampling.before_send(event, {})
 
-        request = self.factory.get("/test/?campus_sigla=TEST")
-        request.json_recebido = {"campus": {"sigla": "TEST"}}
+        self.assertTrue(event["extra"]["recebido"].endswith("caracteres omitidos]"))
+        self.assertEqual(event["extra"]["diario_id"], 1)
+        self.assertTrue(event["request"]["data"].startswith('{"alunos": [{"nome": "Aluno 0"}'))
+        self.assertLess(len(event["request"]["data"]), 150)
+        self.assertEqual(event["breadcrumbs"]["values"][0]["message"], "x" * 100 + "... [400 caracteres omitidos]")
+        self.assertIsInstance(event["breadcrumbs"]["values"][0]["data"]["retorno"], str)
+        self.assertEqual(event["breadcrumbs"]["values"][1]["message"], "ok")
 
-        response = test_view(request)
-        data = json.loads(response.content)
-        self.assertEqual(data["ambiente"], "Ambiente Teste")
+    def test_before_breadcrumb_mantem_payload_pequeno(self):
+        """Testa que estruturas pequenas não são alteradas."""
+        crumb = {"data": {"retorno": {"ok": True}}}
+        self.assertEqual(sampling.before_breadcrumb(crumb, {}), {"data": {"retorno": {"ok": True}}})
 
-    def test_detect_ambiente_decorator_not_found(self):
-        """Testa decorator detect_ambiente não encontrando ambiente."""
+    @patch("integrador.decorators.sentry_sdk.set_tag")
+    def test_observe_metrics_marca_a_transacao(self, mock_set_tag):
+        """Testa as tags que identificam a sincronização e o Ambiente na transação do Sentry."""
+        ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
 
-        @detect_ambiente
-        def test_view(request):
-            return {"status": "ok"}
+        @observe_metrics
+        def view(request):
+            request.ambiente = ambiente
+            return JsonResponse({})
 
-        # Exibe o sucesso primeiro para cobrir a linha interna da view
-        Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
-        request_ok = self.factory.get("/test/?campus_sigla=TEST")
-        request_ok.json_recebido = {"campus": {"sigla": "TEST"}}
-        test_view(request_ok)
+        view(RequestFactory().get("/"))
 
-        # Limpa e executa a falha
-        Ambiente.objects.all().delete()
-        request = self.factory.get("/test/?campus_sigla=INEXISTENTE")
-        request.json_recebido = {"campus": {"sigla": "INEXISTENTE"}}
+        mock_set_tag.assert_any_call("integrador.endpoint", "view")
+        mock_set_tag.assert_any_call("integrador.ambiente", ambiente.nome)
 
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
 
-        self.assertEqual(context.exception.code, 404)
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProfilingTestCase(TestCase):
+    """Testes do profiling sob demanda de uma sincronização (integrador.profiling)."""
 
-    def test_valid_token_decorator_missing_key_in_settings(self):
-        """Testa decorator valid_token quando a chave SUAP_INTEGRADOR_KEY não está no settings."""
-        test_view = valid_token(MagicMock())
+    JSON_DATA = {
+        "campus": {"id": 1, "sigla": "TEST", "descricao": "Campus"},
+        "curso": {"id": 10, "codigo": "15806", "nome": "Curso"},
+        "turma": {"id": 2, "codigo": "T123"},
+        "componente": {"id": 5, "sigla": "COMP", "descricao": "Componente"},
+        "diario": {"id": 456, "sigla": "COMP", "situacao": "Aberto"},
+        "professores": [],
+    }
 
-        request = self.factory.get("/test/")
-        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+        self.staff = User.objects.create_superuser("admin_prof", "admin_prof@test.com", str(uuid.uuid4()))
 
-        with patch("integrador.decorators.settings", object()):
-            with self.assertRaises(SyncError) as context:
-                test_view(request)
-            self.assertEqual(context.exception.code, 428)
+    def request(self, **extra):
+        request = self.factory.get("/api/baixar_notas/", **extra)
+        request.user = Mock(is_staff=False)
+        return request
 
-    def test_check_json_decorator_unicode_decode_error(self):
-        """Testa decorator check_json com erro de decodificação UTF-8."""
+    @patch("integrador.brokers.suap2local_suap.http_post_json")
+    def post(self, mock_post, **extra):
+        mock_post.return_value = {"url": "https://moodle.test/course/view.php?id=1"}
+        with override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN):
+            return self.client.post(
+                "/api/enviar_diarios/",
+                data=json.dumps(self.JSON_DATA),
+                content_type="application/json",
+                HTTP_AUTHENTICATION=f"Token {TEST_TOKEN}",
+                **extra,
+            )
 
-        @check_json(Solicitacao.Operacao.SYNC_UP_DIARIO)
-        def test_view(request):
-            return request.json_recebido
+    def test_origem_header_assinado(self):
+        """Testa o gatilho pelo header assinado, registrando quem pediu."""
+        token = profiling.sign_token("fulano")
+        self.assertEqual(
+            profiling.origem(self.request(HTTP_X_INTEGRADOR_PROFILE=token)),
+            (SolicitacaoProfile.Origem.HEADER, "fulano"),
+        )
+        self.assertIsNone(profiling.origem(self.request(HTTP_X_INTEGRADOR_PROFILE=token + "x")))
+        with override_settings(PROFILING_TOKEN_MAX_AGE=-1):
+            self.assertIsNone(profiling.origem(self.request(HTTP_X_INTEGRADOR_PROFILE=token)))
+
+    def test_origem_staff(self):
+        """Testa o gatilho por ?profile=1, aceito apenas de usuários da equipe."""
+        request = self.factory.get("/api/baixar_notas/?profile=1")
+        request.user = self.staff
+        self.assertEqual(profiling.origem(request), (SolicitacaoProfile.Origem.STAFF, "admin_prof"))
+
+        request.user = Mock(is_staff=False)
+        self.assertIsNone(profiling.origem(request))
+        self.assertIsNone(profiling.origem(self.request()))
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_origem_desligado(self):
+        """Testa que, com PROFILING_ENABLED desligado, nenhum gatilho vale."""
+        token = profiling.sign_token("fulano")
+        self.assertIsNone(profiling.origem(self.request(HTTP_X_INTEGRADOR_PROFILE=token)))
+
+    def test_sync_up_sem_gatilho_nao_perfila(self):
+        """Testa que, sem gatilho, o cProfile nem é criado."""
+        with patch("integrador.profiling.cProfile.Profile") as mock_profile:
+            response = self.post()
 
-        request = self.factory.post("/test/", data=b"\xff", content_type="application/json")
-        result = test_view(request)
-        self.assertIn("error", result)
-        self.assertEqual(result["error"]["code"], 405)
-        self.assertIn("Erro ao decodificar", result["error"]["message"])
+        self.assertEqual(response.status_code, 200)
+        mock_profile.assert_not_called()
+        self.assertFalse(SolicitacaoProfile.objects.exists())
+        self.assertNotIn("X-Integrador-Profile-Id", response)
 
-    def test_detect_ambiente_decorator_fallback_origin(self):
-        """Testa detect_ambiente com fallback da origem quando campus_sigla é ausente."""
-        test_view = detect_ambiente(MagicMock())
+    def test_sync_up_com_header_grava_o_profile(self):
+        """Testa que a sincronização com o header assinado grava o profile da Solicitacao."""
+        response = self.post(HTTP_X_INTEGRADOR_PROFILE=profiling.sign_token("fulano"))
 
-        request = self.factory.get("/test/")
-        request.json_recebido = {
-            "check_json": {"error": {"code": 512, "message": "Foi enviado um JSON mal formado ou nem é JSON."}}
+        self.assertEqual(response.status_code, 200)
+        profile = SolicitacaoProfile.objects.get()
+        self.assertEqual(response["X-Integrador-Profile-Id"], str(profile.solicitacao_id))
+        self.assertEqual((profile.origem, profile.solicitado_por), (SolicitacaoProfile.Origem.HEADER, "fulano"))
+        self.assertGreater(profile.duracao_ms, 0)
+
+        stats = profiling.load_stats(profile.stats)
+        self.assertTrue(any(nome == "sync_up_enrolments" for _, _, nome in stats))
+        self.assertTrue(profiling.top_functions(stats))
+
+    def test_call_tree(self):
+        """Testa a árvore do flame graph: larguras relativas ao pai, ramos pequenos omitidos e ciclos interrompidos."""
+        raiz, filho, pequeno = ("app.py", 1, "raiz"), ("app.py", 10, "filho"), ("~", 0, "<built-in len>")
+        stats = {
+            raiz: (1, 1, 0.1, 1.0, {}),
+            filho: (2, 2, 0.5, 0.8, {raiz: (2, 2, 0.5, 0.8), filho: (1, 1, 0.1, 0.2)}),
+            pequeno: (1, 1, 0.001, 0.001, {filho: (1, 1, 0.001, 0.001)}),
         }
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
-        self.assertEqual(context.exception.code, 404)
-        self.assertIn("Foi enviado um JSON mal formado", context.exception.message)
 
+        arvore = profiling.call_tree(stats)
 
-class TrySolicitacaoDecoratorTestCase(TestCase):
-    """Testes para o decorator try_solicitacao."""
+        self.assertEqual(arvore["tempo_ms"], 1000.0)
+        [no_raiz] = arvore["filhos"]
+        self.assertEqual(no_raiz["funcao"], "raiz (app.py:1)")
+        [no_filho] = no_raiz["filhos"]
+        self.assertEqual((no_filho["largura"], no_filho["percentual"]), (80.0, 80.0))
+        [recursao] = no_filho["filhos"]
+        self.assertEqual((recursao["funcao"], recursao["filhos"]), ("filho (app.py:10)", []))
 
-    def setUp(self):
-        """Configura o ambiente de teste."""
-        self.factory = RequestFactory()
-        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+    def test_admin_profile_e_download(self):
+        """Testa o flame graph e o download .prof no admin de Solicitação."""
+        self.post(HTTP_X_INTEGRADOR_PROFILE=profiling.sign_token("fulano"))
+        profile = SolicitacaoProfile.objects.get()
+        self.client.force_login(self.staff)
 
-    def test_try_solicitacao_success(self):
-        """Testa try_solicitacao com sucesso."""
+        response = self.client.get(reverse("admin:integrador_solicitacao_profile", args=[profile.solicitacao_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "flame-frame")
+        self.assertContains(response, "sync_up_enrolments")
 
-        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
-        def test_view(request):
-            return {"status": "ok"}
+        response = self.client.get(
+            reverse("admin:integrador_solicitacao_profile_download", args=[profile.solicitacao_id])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(profiling.load_stats(response.content), profiling.load_stats(profile.stats))
 
-        request = self.factory.post("/test/")
-        request.ambiente = self.ambiente
-        request.json_recebido = {
-            "campus": {"sigla": "TEST"},
-            "turma": {"codigo": "T1"},
-            "componente": {"sigla": "C1"},
-            "diario": {"id": 123},
-        }
+        response = self.client.get(reverse("admin:integrador_solicitacao_profile", args=[profile.solicitacao_id + 1]))
+        self.assertEqual(response.status_code, 404)
 
-        result = test_view(request)
+        from django.contrib.admin.sites import site
 
-        self.assertEqual(result["status"], "ok")
-        self.assertEqual(Solicitacao.objects.count(), 1)
+        html = site._registry[Solicitacao].profile(profile.solicitacao)
+        self.assertIn("Flame graph", html)
+        self.assertEqual(site._registry[Solicitacao].profile(Solicitacao()), "-")
 
-        solicitacao = Solicitacao.objects.first()
-        self.assertEqual(solicitacao.status, Solicitacao.Status.SUCESSO)
+        response = self.client.get(reverse("admin:integrador_solicitacao_change", args=[profile.solicitacao_id]))
+        self.assertContains(response, "Flame graph")
+        self.assertContains(
+            response, reverse("admin:integrador_solicitacao_profile_download", args=[profile.solicitacao_id])
+        )
 
-    def test_try_solicitacao_with_error(self):
-        """Testa try_solicitacao com erro na view."""
+    @patch("integrador.admin.registry.broker_for")
+    def test_admin_reenviar_com_profile(self, mock_broker):
+        """Testa o "Reenviar com profile" do admin: reexecuta a solicitação e abre o flame graph."""
+        mock_broker.return_value.sync_up_enrolments.return_value = {"url": "https://moodle.test/course/view.php?id=1"}
+        original = Solicitacao.objects.create(
+            ambiente=self.ambiente, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido=self.JSON_DATA
+        )
+        self.client.force_login(self.staff)
 
-        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
-        def test_view(request):
-            raise Exception("View error")
+        response = self.client.get(reverse("admin:integrador_solicitacao_sync", args=[original.id]) + "?profile=1")
 
-        request = self.factory.post("/test/")
-        request.ambiente = self.ambiente
-        request.json_recebido = {
-            "campus": {"sigla": "TEST"},
-            "turma": {"codigo": "T1"},
-            "componente": {"sigla": "C1"},
-            "diario": {"id": 123},
-        }
+        profile = SolicitacaoProfile.objects.get()
+        self.assertNotEqual(profile.solicitacao_id, original.id)
+        self.assertEqual((profile.origem, profile.solicitado_por), (SolicitacaoProfile.Origem.ADMIN, "admin_prof"))
+        self.assertRedirects(
+            response,
+            reverse("admin:integrador_solicitacao_profile", args=[profile.solicitacao_id]),
+            fetch_redirect_response=False,
+        )
 
-        with self.assertRaises(SyncError):
-            test_view(request)
+    def test_token_profiling_command(self):
+        """Testa o comando que gera o header assinado."""
+        out = io.StringIO()
+        call_command("token_profiling", "fulano", stdout=out, stderr=io.StringIO())
 
-        solicitacao = Solicitacao.objects.first()
-        self.assertEqual(solicitacao.status, Solicitacao.Status.FALHA)
+        header, token = out.getvalue().strip().split(": ")
+        self.assertEqual(header, profiling.PROFILE_HEADER)
+        self.assertEqual(
+            profiling.origem(self.request(HTTP_X_INTEGRADOR_PROFILE=token)),
+            (SolicitacaoProfile.Origem.HEADER, "fulano"),
+        )
 
-    def test_try_solicitacao_with_json_error(self):
-        """Testa try_solicitacao com erro no JSON."""
 
-        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
-        def test_view(request):
-            return {"status": "ok"}
+class CargaTestCase(TestCase):
+    """Testes do teste de carga (integrador.carga e manage.py teste_carga)."""
 
-        # Exibe o sucesso primeiro para cobrir a linha interna da view
-        request_ok = self.factory.post("/test/")
-        request_ok.ambiente = self.ambiente
-        request_ok.json_recebido = {
-            "campus": {"sigla": "TEST"},
-            "turma": {"codigo": "T1"},
-            "componente": {"sigla": "C1"},
-            "diario": {"id": 123},
-        }
-        test_view(request_ok)
+    def test_le_ndjson(self):
+        """Testa a leitura de requisições completas, de payloads soltos e de linha inválida."""
+        linhas = [
+            '{"method": "get", "path": "/api/baixar_notas/?diario_id=1"}',
+            "",
+            '{"campus": {"sigla": "ZL"}}',
+        ]
 
-        # Executa a falha
-        request = self.factory.post("/test/")
-        request.ambiente = self.ambiente
-        request.json_recebido = {"error": {"code": 400, "message": "Invalid JSON"}}
+        requisicoes = carga.le_ndjson(io.StringIO("\n".join(linhas)))
 
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
+        self.assertEqual(
+            requisicoes,
+            [
+                {"method": "GET", "path": "/api/baixar_notas/?diario_id=1", "body": None},
+                {"method": "POST", "path": "/api/enviar_diarios/", "body": {"campus": {"sigla": "ZL"}}},
+            ],
+        )
+        with self.assertRaisesMessage(ValueError, "Linha 2"):
+            carga.le_ndjson(io.StringIO('{}\n{"quebrado"\n'))
 
-        self.assertEqual(context.exception.code, 400)
+    def test_escreve_e_le_ndjson(self):
+        """Testa que as requisições exportadas são lidas de volta iguais."""
+        requisicoes = carga.sinteticas(3, alunos=2, proporcao_notas=0.5, semente=1)
+        arquivo = io.StringIO()
 
-    def test_try_solicitacao_preserves_trace_on_http_error(self):
-        """Testa que try_solicitacao salva o trace de erro no atributo respondido."""
-        error_payload = {
-            "error": {
-                "message": "Algum erro no Moodle",
-                "code": 527,
-                "source": "local_suap",
-                "trace": "Traceback fake do Moodle aqui...",
-            }
-        }
+        carga.escreve_ndjson(requisicoes, arquivo)
+        arquivo.seek(0)
 
-        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
-        def test_view(request):
-            raise SyncError("Algum erro no Moodle", 527, retorno=error_payload)
+        self.assertEqual(carga.le_ndjson(arquivo), requisicoes)
 
-        request = self.factory.post("/test/")
-        request.ambiente = self.ambiente
-        request.json_recebido = {
-            "campus": {"sigla": "TEST"},
-            "turma": {"codigo": "T1"},
-            "componente": {"sigla": "C1"},
-            "diario": {"id": 123},
-        }
+    def test_de_solicitacoes(self):
+        """Testa a conversão das últimas Solicitações, em ordem de chegada, para requisições."""
+        recebido = {"campus": {"sigla": "ZL"}, "diario": {"id": 10}}
+        Solicitacao.objects.create(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido={"diario": {"id": 1}})
+        Solicitacao.objects.create(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido=recebido)
+        Solicitacao.objects.create(operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS, recebido=recebido)
 
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
+        requisicoes = carga.de_solicitacoes(2)
 
-        self.assertEqual(context.exception.code, 527)
-        self.assertNotIn("Traceback fake do Moodle aqui...", context.exception.message)
+        self.assertEqual(
+            requisicoes,
+            [
+                {"method": "POST", "path": "/api/enviar_diarios/", "body": recebido},
+                {"method": "GET", "path": "/api/baixar_notas/?campus_sigla=ZL&diario_id=10", "body": None},
+            ],
+        )
 
-        solicitacao = Solicitacao.objects.first()
-        self.assertEqual(solicitacao.status, Solicitacao.Status.FALHA)
-        self.assertEqual(solicitacao.status_code, "527")
-        self.assertEqual(solicitacao.respondido, error_payload)
+    def test_sinteticas(self):
+        """Testa a geração de diários distintos, com a proporção de baixar_notas e a semente."""
+        requisicoes = carga.sinteticas(200, alunos=3, proporcao_notas=0.25, semente=7)
+
+        self.assertEqual(requisicoes, carga.sinteticas(200, alunos=3, proporcao_notas=0.25, semente=7))
+        posts = [r for r in requisicoes if r["method"] == "POST"]
+        self.assertTrue(30 < len(requisicoes) - len(posts) < 70)
+        self.assertEqual(len({r["body"]["diario"]["id"] for r in posts}), len(posts))
+        self.assertEqual(len(posts[0]["body"]["alunos"]), 3)
+        self.assertTrue(Ambiente(**AMBIENTE_GOOD_SUAP).check_selectable(carga.payload_sintetico(1, 0, "TEST")))
+
+    def test_percentil(self):
+        """Testa o percentil pelo posto mais próximo."""
+        valores = list(range(1, 101))
+        self.assertEqual(carga.percentil(valores, 50), 50)
+        self.assertEqual(carga.percentil(valores, 99), 99)
+        self.assertEqual(carga.percentil([5.0], 95), 5.0)
+        self.assertIsNone(carga.percentil([], 50))
+
+    def test_relatorio_por_endpoint(self):
+        """Testa vazão, percentis, taxa de erros e status no relatório."""
+        teste = carga.TesteCarga("http://integrador", "x", carga.sinteticas(1, 0))
+        teste.decorrido = 2.0
+        teste.resultados = [("/api/enviar_diarios/", 200, float(ms)) for ms in range(1, 10)] + [
+            ("/api/baixar_notas/", 500, 100.0),
+            ("/api/baixar_notas/", "ConnectionRefusedError", 50.0),
+        ]
+
+        relatorio = teste.relatorio()
+
+        self.assertEqual(relatorio["geral"]["requisicoes"], 11)
+        self.assertEqual(relatorio["geral"]["vazao_rps"], 5.5)
+        self.assertEqual(relatorio["geral"]["p50_ms"], 6.0)
+        self.assertEqual(relatorio["geral"]["p99_ms"], 100.0)
+        self.assertEqual(relatorio["geral"]["taxa_erros"], round(2 / 11, 4))
+        self.assertEqual(relatorio["por_endpoint"]["/api/enviar_diarios/"]["taxa_erros"], 0)
+        self.assertEqual(
+            relatorio["por_endpoint"]["/api/baixar_notas/"]["status"], {"500": 1, "ConnectionRefusedError": 1}
+        )
+        self.assertIsNone(relatorio["conexoes_banco"])
+
+    def test_executa_contra_servidor_http(self):
+        """Testa o envio real, em malha aberta, contra o Moodle mock em thread."""
+        import socket
+
+        with socket.socket() as livre:
+            livre.bind(("127.0.0.1", 0))
+            porta = livre.getsockname()[1]
+        start_mock_moodle_server("127.0.0.1", porta)
+        self.addCleanup(stop_mock_moodle_server_in_background)
+        requisicoes = [
+            carga.requisicao("GET", "/local/suap/api/index.php?sync_down_grades&diario_id=1"),
+            carga.requisicao("GET", "/nao/existe"),
+        ]
+        teste = carga.TesteCarga(
+            f"http://127.0.0.1:{porta}", LocalSuapHTTPMock.TEST_TOKEN, requisicoes, concorrencia=3, rps=200, total=10
+        )
 
-    def test_try_solicitacao_with_missing_ambiente(self):
-        """Testa try_solicitacao quando request.ambiente é None (raises 404)."""
-        test_view = try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)(MagicMock())
+        relatorio = teste.executa()
 
-        request = self.factory.post("/test/")
-        request.ambiente = None
-        request.json_recebido = {
-            "campus": {"sigla": "TEST"},
-            "turma": {"codigo": "T1"},
-            "componente": {"sigla": "C1"},
-            "diario": {"id": 123},
+        self.assertEqual(relatorio["geral"]["requisicoes"], 10)
+        self.assertEqual(relatorio["por_endpoint"]["/local/suap/api/index.php"]["status"], {"200": 5})
+        self.assertEqual(relatorio["por_endpoint"]["/nao/existe"]["status"], {"404": 5})
+        # Em malha aberta, 10 requisições a 200/s levam pelo menos 45ms.
+        self.assertGreaterEqual(relatorio["parametros"]["duracao_s"], 0.045)
+
+    def test_executa_para_na_duracao_e_reconecta_apos_erro(self):
+        """Testa o fim por duração em malha fechada e o registro de erros de conexão."""
+        teste = carga.TesteCarga(
+            "http://127.0.0.1:1", "x", carga.sinteticas(2, 0), concorrencia=2, duracao=0.05, timeout=1
+        )
+        with patch.object(teste, "_envia", side_effect=[ConnectionRefusedError(), 200] + [201] * 10000):
+            relatorio = teste.executa()
+
+        self.assertIn("ConnectionRefusedError", relatorio["geral"]["status"])
+        self.assertGreater(relatorio["geral"]["status"]["201"], 0)
+        self.assertLess(relatorio["parametros"]["duracao_s"], 1)
+
+    def test_amostrador_conexoes(self):
+        """Testa a amostragem das conexões do banco pelo pg_stat_activity."""
+        amostrador = carga.AmostradorConexoes(intervalo=0.01)
+        amostrador.start()
+        time.sleep(0.05)
+        amostrador.parar()
+
+        resumo = amostrador.resumo()
+        self.assertGreater(resumo["amostras"], 0)
+        self.assertGreater(resumo["max_connections"], 0)
+        self.assertGreaterEqual(resumo["maximo"], 1)
+
+    def test_sem_requisicoes(self):
+        """Testa que um teste sem requisições é recusado."""
+        with self.assertRaises(ValueError):
+            carga.TesteCarga("http://integrador", "x", [])
+
+    def test_command_exporta(self):
+        """Testa o --exporta, que grava o NDJSON e não envia nada."""
+        import tempfile
+
+        with tempfile.NamedTemporaryFile(suffix=".ndjson") as arquivo:
+            out = io.StringIO()
+            with patch.object(carga.TesteCarga, "executa") as executa:
+                call_command("teste_carga", "--sinteticas", "4", "--alunos", "1", "--exporta", arquivo.name, stdout=out)
+
+            executa.assert_not_called()
+            self.assertIn("4 requisições gravadas", out.getvalue())
+            with open(arquivo.name, encoding="utf-8") as lido:
+                self.assertEqual(len(carga.le_ndjson(lido)), 4)
+
+    def test_no_campus(self):
+        """Testa a troca do campus no body, na unidade do formato genérico, nos diários do lote e na query."""
+        requisicoes = [
+            carga.requisicao("POST", "/api/enviar_diarios/", {"campus": {"id": 1, "sigla": "ZL"}, "diario": {"id": 1}}),
+            carga.requisicao("POST", "/api/enviar_diarios/", {"diarios": [{"unidade": {"sigla": "ZL"}}]}),
+            carga.requisicao("GET", "/api/baixar_notas/?campus_sigla=ZL&diario_id=10"),
+        ]
+
+        trocadas = carga.no_campus(requisicoes)
+
+        self.assertEqual(trocadas[0]["body"], {"campus": {"id": 1, "sigla": "CARGA"}, "diario": {"id": 1}})
+        self.assertEqual(trocadas[1]["body"], {"diarios": [{"unidade": {"sigla": "CARGA"}}]})
+        self.assertEqual(trocadas[2]["path"], "/api/baixar_notas/?campus_sigla=CARGA&diario_id=10")
+        self.assertEqual(requisicoes[0]["body"]["campus"]["sigla"], "ZL")
+
+    def test_command_com_moodle_mock(self):
+        """Testa o Ambiente do Moodle mock: só o campus sintético, antes dos demais, e removido no final."""
+        Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+        relatorio = {
+            "parametros": {"concorrencia": 1, "rps_alvo": None, "duracao_s": 1.0},
+            "geral": carga.TesteCarga._estatisticas([("/api/enviar_diarios/", 200, 10.0)], 1.0),
+            "por_endpoint": {},
+            "conexoes_banco": {"maximo": 3, "media": 2.0, "ativas_maximo": 1, "max_connections": 100},
         }
 
-        with self.assertRaises(SyncError) as context:
-            test_view(request)
-        self.assertEqual(context.exception.code, 404)
+        def executa(teste, amostrador=None):
+            selecionado = Ambiente.objects.seleciona_ambiente(carga.payload_sintetico(1, 0, carga.CAMPUS_CARGA))
+            self.assertEqual(selecionado.nome, "Teste de carga (Moodle mock)")
+            self.assertEqual(selecionado.url, "http://127.0.0.1:18099")
+            self.assertEqual(selecionado.ordem, 0)
+            # O tráfego real continua no seu Ambiente.
+            self.assertEqual(Ambiente.objects.seleciona_ambiente(carga.payload_sintetico(1, 0, "TEST")).ordem, 1)
+            self.assertTrue(all(json.loads(corpo)["campus"]["sigla"] == "CARGA" for _, _, corpo in teste.requisicoes))
+            self.assertEqual(teste.headers["Authentication"], "Token segredo")
+            Solicitacao.objects.create(ambiente=selecionado, recebido=carga.payload_sintetico(1, 0, carga.CAMPUS_CARGA))
+            return relatorio
 
-    def test_try_solicitacao_with_db_creation_failure(self):
-        """Testa try_solicitacao quando a criação de Solicitacao no banco falha (solicitacao is None, raises 500)."""
-        test_view = try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)(MagicMock())
+        out = io.StringIO()
+        with (
+            patch("integrador.management.commands.teste_carga.start_mock_moodle_server") as start,
+            patch("integrador.management.commands.teste_carga.stop_mock_moodle_server_in_background") as stop,
+            patch.object(carga.TesteCarga, "executa", autospec=True, side_effect=executa),
+        ):
+            call_command("teste_carga", "--moodle-mock", "18099", "--token", "segredo", "--sem-banco", stdout=out)
 
-        request = self.factory.post("/test/")
-        request.ambiente = self.ambiente
-        request.json_recebido = {
-            "campus": {"sigla": "TEST"},
-            "turma": {"codigo": "T1"},
-            "componente": {"sigla": "C1"},
-            "diario": {"id": 123},
-        }
+        start.assert_called_once_with("0.0.0.0", 18099)  # noqa: S104
+        stop.assert_called_once()
+        self.assertFalse(Ambiente.objects.filter(nome="Teste de carga (Moodle mock)").exists())
+        self.assertFalse(Solicitacao.objects.exists())
+        self.assertIn("Conexões do banco: máximo 3", out.getvalue())
+        self.assertIn("1 requisições enviadas", out.getvalue())
 
-        with patch("integrador.models.Solicitacao.objects.create", side_effect=Exception("Database failure")):
-            with self.assertRaises(SyncError) as context:
-                test_view(request)
-            self.assertEqual(context.exception.code, 500)
+    def test_command_arquivo_invalido(self):
+        """Testa o erro para um arquivo que não existe."""
+        from django.core.management.base import CommandError
 
+        with self.assertRaisesMessage(CommandError, "Não foi possível ler"):
+            call_command("teste_carga", "--arquivo", "/nao/existe.ndjson")
 
-class CohortSelecaoTestCase(TestCase):
-    """Testes de seleção de coortes para sincronização, com exemplos reais."""
 
-    SYNC_JSON_COM_POLO = {
-        "campus": {"id": 14, "sigla": "ZL", "descricao": "Campus EaD"},
-        "curso": {"id": 1, "codigo": "15056", "nome": "Sistemas Operacionais Abertos"},
-        "turma": {"id": 2, "codigo": "20261.6.15056.1E"},
+class DecoratorsTestCase(TestCase):
+    """Testes para decorators."""
+
+    def setUp(self):
+        """Configura o ambiente de teste."""
+        self.factory = RequestFactory()
+
+    def test_json_response_decorator_with_dict(self):
+        """Testa decorator json_response com dicionário."""
+
+        @json_response
+        def test_view(request):
+            return {"status": "ok"}
+
+        request = self.factory.get("/test/")
+        response = test_view(request)
+
+        self.assertIsInstance(response, JsonResponse)
+
+    def test_json_response_decorator_with_json_response(self):
+        """Testa decorator json_response com JsonResponse."""
+
+        @json_response
+        def test_view(request):
+            return JsonResponse({"status": "ok"})
+
+        request = self.factory.get("/test/")
+        response = test_view(request)
+
+        self.assertIsInstance(response, JsonResponse)
+
+    def test_exception_as_json_decorator_success(self):
+        """Testa decorator exception_as_json com sucesso."""
+
+        @exception_as_json
+        def test_view(request):
+            return JsonResponse({"status": "ok"})
+
+        request = self.factory.get("/test/")
+        response = test_view(request)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_exception_as_json_decorator_with_sync_error(self):
+        """Testa decorator exception_as_json com SyncError."""
+
+        @exception_as_json
+        def test_view(request):
+            raise SyncError("Test error", 400)
+
+        request = self.factory.get("/test/")
+        response = test_view(request)
+
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.content)
+        self.assertIn("error", data)
+
+    def test_exception_as_json_decorator_with_generic_exception(self):
+        """Testa decorator exception_as_json com exceção genérica."""
+
+        @exception_as_json
+        def test_view(request):
+            raise Exception("Generic error")
+
+        request = self.factory.get("/test/")
+        response = test_view(request)
+
+        self.assertEqual(response.status_code, 500)
+
+    def test_exception_as_json_decorator_with_sync_error_and_retorno(self):
+        """Testa decorator exception_as_json com SyncError contendo retorno (supressão de trace)."""
+        error_payload = {"error": {"message": "Erro do Moodle", "code": 527, "trace": "Traceback aqui"}}
+
+        @exception_as_json
+        def test_view(request):
+            raise SyncError("Erro do Moodle", 527, retorno=error_payload)
+
+        request = self.factory.get("/test/")
+        response = test_view(request)
+
+        self.assertEqual(response.status_code, 527)
+        data = json.loads(response.content)
+        self.assertEqual(data["error"]["code"], 527)
+        self.assertEqual(data["error"]["message"], "Erro do Moodle")
+        self.assertNotIn("trace", data["error"])
+        # Garante que o payload original (para salvamento) não foi corrompido/alterado
+        self.assertIn("trace", error_payload["error"])
+
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    def test_valid_token_decorator_success(self):
+        """Testa decorator valid_token com token válido."""
+
+        @valid_token
+        def test_view(request):
+            return {"status": "ok"}
+
+        request = self.factory.get("/test/")
+        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+
+        result = test_view(request)
+        self.assertEqual(result["status"], "ok")
+
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    def test_valid_token_decorator_invalid_token(self):
+        """Testa decorator valid_token com token inválido."""
+
+        @valid_token
+        def test_view(request):
+            return {"status": "ok"}
+
+        # Exibe o sucesso primeiro para cobrir a linha interna da view
+        request_ok = self.factory.get("/test/")
+        request_ok.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+        test_view(request_ok)
+
+        request = self.factory.get("/test/")
+        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN_NOT_OK}"
+
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+
+        self.assertEqual(context.exception.code, 403)
+
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    def test_valid_token_decorator_missing_token(self):
+        """Testa decorator valid_token sem token."""
+
+        @valid_token
+        def test_view(request):
+            return {"status": "ok"}
+
+        # Exibe o sucesso primeiro para cobrir a linha interna da view
+        request_ok = self.factory.get("/test/")
+        request_ok.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+        test_view(request_ok)
+
+        request = self.factory.get("/test/")
+
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+
+        self.assertEqual(context.exception.code, 431)
+
+    def test_check_is_post_decorator_success(self):
+        """Testa decorator check_is_post com POST."""
+
+        @check_is_post
+        def test_view(request):
+            return {"status": "ok"}
+
+        request = self.factory.post("/test/")
+        result = test_view(request)
+
+        self.assertEqual(result["status"], "ok")
+
+    def test_check_is_post_decorator_failure(self):
+        """Testa decorator check_is_post com GET."""
+
+        @check_is_post
+        def test_view(request):
+            return {"status": "ok"}
+
+        # Exibe o sucesso primeiro para cobrir a linha interna da view
+        request_ok = self.factory.post("/test/")
+        test_view(request_ok)
+
+        request = self.factory.get("/test/")
+
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+
+        self.assertEqual(context.exception.code, 501)
+
+    def test_check_is_get_decorator_success(self):
+        """Testa decorator check_is_get com GET."""
+
+        @check_is_get
+        def test_view(request):
+            return {"status": "ok"}
+
+        request = self.factory.get("/test/")
+        result = test_view(request)
+
+        self.assertEqual(result["status"], "ok")
+
+    def test_check_is_get_decorator_failure(self):
+        """Testa decorator check_is_get com POST."""
+
+        @check_is_get
+        def test_view(request):
+            return {"status": "ok"}
+
+        # Exibe o sucesso primeiro para cobrir a linha interna da view
+        request_ok = self.factory.get("/test/")
+        test_view(request_ok)
+
+        request = self.factory.post("/test/")
+
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+
+        self.assertEqual(context.exception.code, 501)
+
+    def test_check_json_decorator_valid_json(self):
+        """Testa decorator check_json com JSON válido."""
+
+        @check_json(Solicitacao.Operacao.SYNC_UP_DIARIO)
+        def test_view(request):
+            return request.json_recebido
+
+        json_data = {"campus": {"sigla": "TEST"}}
+        request = self.factory.post("/test/", data=json.dumps(json_data), content_type="application/json")
+
+        result = test_view(request)
+        self.assertEqual(result, json_data)
+
+    def test_check_json_decorator_invalid_json(self):
+        """Testa decorator check_json com JSON inválido."""
+
+        @check_json(Solicitacao.Operacao.SYNC_UP_DIARIO)
+        def test_view(request):
+            return request.json_recebido
+
+        request = self.factory.post("/test/", data="invalid json {{{", content_type="application/json")
+
+        result = test_view(request)
+        self.assertIn("check_json", result)
+        self.assertIn("error", result.get("check_json", {}))
+
+    def test_detect_ambiente_decorator_found(self):
+        """Testa decorator detect_ambiente encontrando ambiente."""
+        Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+
+        @detect_ambiente
+        def test_view(request):
+            return {"ambiente": request.ambiente.nome}
+
+        request = self.factory.get("/test/?campus_sigla=TEST")
+        request.json_recebido = {"campus": {"sigla": "TEST"}}
+
+        response = test_view(request)
+        data = json.loads(response.content)
+        self.assertEqual(data["ambiente"], "Ambiente Teste")
+
+    def test_detect_ambiente_decorator_not_found(self):
+        """Testa decorator detect_ambiente não encontrando ambiente."""
+
+        @detect_ambiente
+        def test_view(request):
+            return {"status": "ok"}
+
+        # Exibe o sucesso primeiro para cobrir a linha interna da view
+        Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        request_ok = self.factory.get("/test/?campus_sigla=TEST")
+        request_ok.json_recebido = {"campus": {"sigla": "TEST"}}
+        test_view(request_ok)
+
+        # Limpa e executa a falha
+        Ambiente.objects.all().delete()
+        request = self.factory.get("/test/?campus_sigla=INEXISTENTE")
+        request.json_recebido = {"campus": {"sigla": "INEXISTENTE"}}
+
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+
+        self.assertEqual(context.exception.code, 404)
+
+    def test_valid_token_decorator_missing_key_in_settings(self):
+        """Testa decorator valid_token quando a chave SUAP_INTEGRADOR_KEY não está no settings."""
+        test_view = valid_token(MagicMock())
+
+        request = self.factory.get("/test/")
+        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+
+        with patch("integrador.decorators.settings", object()):
+            with self.assertRaises(SyncError) as context:
+                test_view(request)
+            self.assertEqual(context.exception.code, 428)
+
+    def test_check_json_decorator_unicode_decode_error(self):
+        """Testa decorator check_json com erro de decodificação UTF-8."""
+
+        @check_json(Solicitacao.Operacao.SYNC_UP_DIARIO)
+        def test_view(request):
+            return request.json_recebido
+
+        request = self.factory.post("/test/", data=b"\xff", content_type="application/json")
+        result = test_view(request)
+        self.assertIn("error", result)
+        self.assertEqual(result["error"]["code"], 405)
+        self.assertIn("Erro ao decodificar", result["error"]["message"])
+
+    def test_detect_ambiente_decorator_fallback_origin(self):
+        """Testa detect_ambiente com fallback da origem quando campus_sigla é ausente."""
+        test_view = detect_ambiente(MagicMock())
+
+        request = self.factory.get("/test/")
+        request.json_recebido = {
+            "check_json": {"error": {"code": 512, "message": "Foi enviado um JSON mal formado ou nem é JSON."}}
+        }
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+        self.assertEqual(context.exception.code, 404)
+        self.assertIn("Foi enviado um JSON mal formado", context.exception.message)
+
+
+class TrySolicitacaoDecoratorTestCase(TestCase):
+    """Testes para o decorator try_solicitacao."""
+
+    def setUp(self):
+        """Configura o ambiente de teste."""
+        self.factory = RequestFactory()
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+
+    def test_try_solicitacao_success(self):
+        """Testa try_solicitacao com sucesso."""
+
+        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
+        def test_view(request):
+            return {"status": "ok"}
+
+        request = self.factory.post("/test/")
+        request.ambiente = self.ambiente
+        request.json_recebido = {
+            "campus": {"sigla": "TEST"},
+            "turma": {"codigo": "T1"},
+            "componente": {"sigla": "C1"},
+            "diario": {"id": 123},
+        }
+
+        result = test_view(request)
+
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(Solicitacao.objects.count(), 1)
+
+        solicitacao = Solicitacao.objects.first()
+        self.assertEqual(solicitacao.status, Solicitacao.Status.SUCESSO)
+
+    def test_try_solicitacao_with_error(self):
+        """Testa try_solicitacao com erro na view."""
+
+        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
+        def test_view(request):
+            raise Exception("View error")
+
+        request = self.factory.post("/test/")
+        request.ambiente = self.ambiente
+        request.json_recebido = {
+            "campus": {"sigla": "TEST"},
+            "turma": {"codigo": "T1"},
+            "componente": {"sigla": "C1"},
+            "diario": {"id": 123},
+        }
+
+        with self.assertRaises(SyncError):
+            test_view(request)
+
+        solicitacao = Solicitacao.objects.first()
+        self.assertEqual(solicitacao.status, Solicitacao.Status.FALHA)
+
+    def test_try_solicitacao_with_json_error(self):
+        """Testa try_solicitacao com erro no JSON."""
+
+        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
+        def test_view(request):
+            return {"status": "ok"}
+
+        # Exibe o sucesso primeiro para cobrir a linha interna da view
+        request_ok = self.factory.post("/test/")
+        request_ok.ambiente = self.ambiente
+        request_ok.json_recebido = {
+            "campus": {"sigla": "TEST"},
+            "turma": {"codigo": "T1"},
+            "componente": {"sigla": "C1"},
+            "diario": {"id": 123},
+        }
+        test_view(request_ok)
+
+        # Executa a falha
+        request = self.factory.post("/test/")
+        request.ambiente = self.ambiente
+        request.json_recebido = {"error": {"code": 400, "message": "Invalid JSON"}}
+
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+
+        self.assertEqual(context.exception.code, 400)
+
+    def test_try_solicitacao_preserves_trace_on_http_error(self):
+        """Testa que try_solicitacao salva o trace de erro no atributo respondido."""
+        error_payload = {
+            "error": {
+                "message": "Algum erro no Moodle",
+                "code": 527,
+                "source": "local_suap",
+                "trace": "Traceback fake do Moodle aqui...",
+            }
+        }
+
+        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
+        def test_view(request):
+            raise SyncError("Algum erro no Moodle", 527, retorno=error_payload)
+
+        request = self.factory.post("/test/")
+        request.ambiente = self.ambiente
+        request.json_recebido = {
+            "campus": {"sigla": "TEST"},
+            "turma": {"codigo": "T1"},
+            "componente": {"sigla": "C1"},
+            "diario": {"id": 123},
+        }
+
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+
+        self.assertEqual(context.exception.code, 527)
+        self.assertNotIn("Traceback fake do Moodle aqui...", context.exception.message)
+
+        solicitacao = Solicitacao.objects.first()
+        self.assertEqual(solicitacao.status, Solicitacao.Status.FALHA)
+        self.assertEqual(solicitacao.status_code, "527")
+        self.assertEqual(solicitacao.respondido, error_payload)
+
+    def test_try_solicitacao_with_missing_ambiente(self):
+        """Testa try_solicitacao quando request.ambiente é None (raises 404)."""
+        test_view = try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)(MagicMock())
+
+        request = self.factory.post("/test/")
+        request.ambiente = None
+        request.json_recebido = {
+            "campus": {"sigla": "TEST"},
+            "turma": {"codigo": "T1"},
+            "componente": {"sigla": "C1"},
+            "diario": {"id": 123},
+        }
+
+        with self.assertRaises(SyncError) as context:
+            test_view(request)
+        self.assertEqual(context.exception.code, 404)
+
+    def test_try_solicitacao_with_db_creation_failure(self):
+        """Testa try_solicitacao quando a criação de Solicitacao no banco falha (solicitacao is None, raises 500)."""
+        test_view = try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)(MagicMock())
+
+        request = self.factory.post("/test/")
+        request.ambiente = self.ambiente
+        request.json_recebido = {
+            "campus": {"sigla": "TEST"},
+            "turma": {"codigo": "T1"},
+            "componente": {"sigla": "C1"},
+            "diario": {"id": 123},
+        }
+
+        with patch("integrador.models.Solicitacao.objects.create", side_effect=Exception("Database failure")):
+            with self.assertRaises(SyncError) as context:
+                test_view(request)
+            self.assertEqual(context.exception.code, 500)
+
+
+class CohortSelecaoTestCase(TestCase):
+    """Testes de seleção de coortes para sincronização, com exemplos reais."""
+
+    SYNC_JSON_COM_POLO = {
+        "campus": {"id": 14, "sigla": "ZL", "descricao": "Campus EaD"},
+        "curso": {"id": 1, "codigo": "15056", "nome": "Sistemas Operacionais Abertos"},
+        "turma": {"id": 2, "codigo": "20261.6.15056.1E"},
         "componente": {"id": 1, "sigla": "TEC.1023", "descricao": "Bancos de Dados"},
         "diario": {"id": 2, "sigla": "TEC.1023", "situacao": "Aberto"},
         "alunos": [
@@ -1597,731 +3214,1635 @@ class CohortSelecaoTestCase(TestCase):
         self.solicitacao = Solicitacao.objects.create(
             ambiente=self.ambiente,
             operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
-            recebido=self.SYNC_JSON_COM_POLO,
+            recebido=self.SYNC_JSON_COM_POLO,
+        )
+        self.broker = BaseBroker(self.solicitacao)
+
+        self.role_coo_polo = Role.objects.create(name="ZL.CooPolo", shortname="coordenadordepolo", active=True)
+        self.role_coo_curso = Role.objects.create(name="ZL.CooCurso", shortname="coordenadordecurso", active=True)
+        self.role_tut = Role.objects.create(name="ZL.CooTutProg", shortname="tutordeprograma", active=True)
+
+    def _cria_cohort(self, name, idnumber, role, rule_diario, rule_coordenacao, active=True):
+        return Cohort.objects.create(
+            name=name,
+            idnumber=idnumber,
+            role=role,
+            rule_diario=rule_diario,
+            rule_coordenacao=rule_coordenacao,
+            active=active,
+        )
+
+    def _adiciona_colaborador(self, cohort, login, nome, email):
+        user, _ = MoodleUser.objects.get_or_create(
+            login=login, defaults={"fullname": nome, "email": email, "active": True}
+        )
+        Enrolment.objects.create(cohort=cohort, user=user)
+        return user
+
+    def test_regras_compiladas_nos_recursos_do_broker(self):
+        """Testa que as regras dos cohorts são compiladas em create_resources e recompiladas só quando mudam."""
+        cohort = self._cria_cohort("Coorte", "C1", self.role_coo_curso, "campus.sigla == 'ZL'", "false")
+        resources = BaseBroker.create_resources(self.ambiente)
+        broker = BaseBroker(self.solicitacao, resources)
+
+        with patch("integrador.brokers.base.rule_engine.Rule", wraps=rule_engine.Rule) as compila:
+            self.assertEqual(len(broker.get_cohort()), 1)
+            self.assertEqual(len(BaseBroker(self.solicitacao, resources).get_cohort()), 1)
+            self.assertEqual(compila.call_count, 0)
+
+            cohort.rule_coordenacao = "true"
+            cohort.save()
+            self.assertEqual(len(broker.get_cohort()), 2)
+            self.assertEqual(compila.call_count, 1)
+
+    def test_regras_compiladas_limitadas_lru(self):
+        """Testa que o cache de regras compiladas descarta as menos usadas acima de COHORT_RULES_MAX."""
+        from integrador.brokers import base
+
+        primeira = self._cria_cohort("Coorte 1", "C1", self.role_coo_curso, "campus.sigla == 'ZL'", "false")
+        segunda = self._cria_cohort("Coorte 2", "C2", self.role_coo_curso, "campus.sigla == 'CN'", "false")
+        regras = OrderedDict()
+
+        with patch.object(base, "COHORT_RULES_MAX", 2):
+            base._compila(regras, primeira, "rule_diario")
+            base._compila(regras, segunda, "rule_diario")
+            base._compila(regras, primeira, "rule_diario")
+            base._compila(regras, primeira, "rule_coordenacao")
+
+        self.assertEqual(
+            [chave[:2] for chave in regras], [(primeira.id, "rule_diario"), (primeira.id, "rule_coordenacao")]
+        )
+
+        # --- Sem coortes ---
+
+    def test_sem_coortes_cadastradas_retorna_lista_vazia(self):
+        """Sem nenhuma coorte no banco, get_cohort retorna lista vazia."""
+        resultado = self.broker.get_cohort()
+        self.assertEqual(resultado, [])
+
+    def test_sem_coortes_ativas_retorna_lista_vazia(self):
+        """Coorte inativa nunca é incluída, mesmo com regra correspondente."""
+        self._cria_cohort(
+            name="ZL.CooPolo.Natal(RN)",
+            idnumber="ZL.CooPolo.Natal(RN)",
+            role=self.role_coo_polo,
+            rule_diario='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
+            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
+            active=False,
+        )
+        resultado = self.broker.get_cohort()
+        self.assertEqual(resultado, [])
+
+    def test_sem_coorte_correspondente_retorna_lista_vazia(self):
+        """Coorte ativa mas sem regra que corresponda ao JSON retorna lista vazia."""
+        self._cria_cohort(
+            name="ZL.CooPolo.Parelhas",
+            idnumber="ZL.CooPolo.Parelhas",
+            role=self.role_coo_polo,
+            rule_diario='$any([aluno["polo"]["descricao"] == "Parelhas" for aluno in alunos])',
+            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Parelhas" for aluno in alunos])',
+        )
+        self.solicitacao.recebido = self.SYNC_JSON_SEM_POLO
+        resultado = self.broker.get_cohort()
+        self.assertEqual(resultado, [])
+
+    # --- Com coortes por polo ---
+
+    def test_coorte_polo_natal_corresponde_ao_json(self):
+        """Coorte de polo Natal(RN) é selecionada quando há aluno desse polo."""
+        cohort = self._cria_cohort(
+            name="ZL.CooPolo.Natal(RN)",
+            idnumber="ZL.CooPolo.Natal(RN)",
+            role=self.role_coo_polo,
+            rule_diario='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
+            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
+        )
+        self._adiciona_colaborador(cohort, "coord.natal", "Coord Natal", "coord.natal@ifrn.edu.br")
+        resultado = self.broker.get_cohort()
+        idnumbers = [c["idnumber"] for c in resultado]
+        self.assertIn("ZL.CooPolo.Natal(RN)", idnumbers)
+
+    def test_coorte_polo_mossoro_nao_corresponde_sem_aluno_desse_polo(self):
+        """Coorte de Mossoró não é selecionada quando não há aluno desse polo."""
+        self._cria_cohort(
+            name="ZL.CooPolo.Mossoró (RN)",
+            idnumber="ZL.CooPolo.Mossoró (RN)",
+            role=self.role_coo_polo,
+            rule_diario='$any([aluno["polo"]["descricao"] == "Mossoró (RN)" for aluno in alunos])',
+            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Mossoró (RN)" for aluno in alunos])',
+        )
+        self.solicitacao.recebido = self.SYNC_JSON_SEM_POLO
+        resultado = self.broker.get_cohort()
+        self.assertEqual(resultado, [])
+
+    # --- Com coortes por curso ---
+
+    def test_coorte_curso_15056_corresponde_ao_json(self):
+        """Coorte de coordenação do curso 15056 é selecionada pelo código do curso."""
+        cohort = self._cria_cohort(
+            name="ZL.CooCurso.15056",
+            idnumber="ZL.CooCurso.15056",
+            role=self.role_coo_curso,
+            rule_diario='curso["codigo"] == "15056"',
+            rule_coordenacao='curso["codigo"] == "15056"',
+        )
+        self._adiciona_colaborador(cohort, "coo.curso15056", "Coo Curso 15056", "coo@ifrn.edu.br")
+        resultado = self.broker.get_cohort()
+        idnumbers = [c["idnumber"] for c in resultado]
+        self.assertIn("ZL.CooCurso.15056", idnumbers)
+
+    def test_coorte_curso_diferente_nao_corresponde(self):
+        """Coorte com código de curso diferente não é selecionada."""
+        self._cria_cohort(
+            name="ZL.CooCurso.99624",
+            idnumber="ZL.CooCurso.99624",
+            role=self.role_coo_curso,
+            rule_diario='curso["codigo"] == "99624"',
+            rule_coordenacao='curso["codigo"] == "99624"',
+        )
+        resultado = self.broker.get_cohort()
+        self.assertEqual(resultado, [])
+
+    # --- Com coortes por programa ---
+
+    def test_coorte_programa_uab_corresponde_quando_ha_aluno_uab(self):
+        """Coorte UAB é selecionada quando há aluno com programa UAB."""
+        cohort = self._cria_cohort(
+            name="ZL.CooTutProg.UAB",
+            idnumber="ZL.CooTutProg.UAB",
+            role=self.role_tut,
+            rule_diario='$any([aluno["programa"] == "UAB" for aluno in alunos])',
+            rule_coordenacao='$any([aluno["programa"] == "UAB" for aluno in alunos])',
+        )
+        self._adiciona_colaborador(cohort, "tut.uab", "Tutor UAB", "tut.uab@ifrn.edu.br")
+        resultado = self.broker.get_cohort()
+        idnumbers = [c["idnumber"] for c in resultado]
+        self.assertIn("ZL.CooTutProg.UAB", idnumbers)
+
+    # --- Múltiplas coortes simultâneas ---
+
+    def test_multiplas_coortes_correspondentes_todas_incluidas(self):
+        """Quando polo e curso correspondem, ambas as coortes são retornadas."""
+        c1 = self._cria_cohort(
+            name="ZL.CooPolo.Natal(RN)",
+            idnumber="ZL.CooPolo.Natal(RN)",
+            role=self.role_coo_polo,
+            rule_diario='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
+            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
+        )
+        c2 = self._cria_cohort(
+            name="ZL.CooCurso.15056",
+            idnumber="ZL.CooCurso.15056",
+            role=self.role_coo_curso,
+            rule_diario='curso["codigo"] == "15056"',
+            rule_coordenacao='curso["codigo"] == "15056"',
+        )
+        self._adiciona_colaborador(c1, "coord.natal", "Coord Natal", "coord.natal@ifrn.edu.br")
+        self._adiciona_colaborador(c2, "coo.curso", "Coo Curso", "coo.curso@ifrn.edu.br")
+
+        resultado = self.broker.get_cohort()
+        idnumbers = [c["idnumber"] for c in resultado]
+        self.assertIn("ZL.CooPolo.Natal(RN)", idnumbers)
+        self.assertIn("ZL.CooCurso.15056", idnumbers)
+
+    # --- Payload das coortes ---
+
+    def test_payload_da_coorte_inclui_colaboradores(self):
+        """Coorte retornada deve incluir colaboradores com dados corretos."""
+        cohort = self._cria_cohort(
+            name="ZL.CooCurso.15056",
+            idnumber="ZL.CooCurso.15056",
+            role=self.role_coo_curso,
+            rule_diario='curso["codigo"] == "15056"',
+            rule_coordenacao='curso["codigo"] == "15056"',
+        )
+        self._adiciona_colaborador(cohort, "coord.x", "Coord X", "coord.x@ifrn.edu.br")
+
+        resultado = self.broker.get_cohort()
+        coorte = next(c for c in resultado if c["idnumber"] == "ZL.CooCurso.15056")
+        self.assertEqual(coorte["nome"], "ZL.CooCurso.15056")
+        self.assertEqual(coorte["role"], "coordenadordecurso")
+        colaboradores = coorte["colaboradores"]
+        self.assertEqual(len(colaboradores), 1)
+        self.assertEqual(colaboradores[0]["login"], "coord.x")
+        self.assertEqual(colaboradores[0]["email"], "coord.x@ifrn.edu.br")
+
+
+class SolicitacaoModelTestCase(TestCase):
+    """Testes para o modelo Solicitacao."""
+
+    def setUp(self):
+        """Configura o ambiente de teste."""
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+
+        self.recebido_json = {
+            "campus": {"sigla": "TEST"},
+            "turma": {"codigo": "20261.1.132456.123.1M"},
+            "componente": {"sigla": "MAT.001"},
+            "diario": {"id": 12345, "tipo": "regular"},
+        }
+
+        self.solicitacao = Solicitacao.objects.create(
+            ambiente=self.ambiente,
+            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
+            status=Solicitacao.Status.PROCESSANDO,
+            recebido=self.recebido_json,
+        )
+
+    def test_create_solicitacao(self):
+        """Testa criação de solicitação."""
+        solicitacao = Solicitacao.objects.create(
+            ambiente=self.ambiente,
+            operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS,
+            status=Solicitacao.Status.SUCESSO,
+            recebido={"campus": {"sigla": "TEST"}, "diario": {"id": 999}},
+        )
+
+        self.assertIsNotNone(solicitacao.pk)
+        self.assertEqual(solicitacao.operacao, Solicitacao.Operacao.SYNC_DOWN_NOTAS)
+
+    def test_solicitacao_str_representation(self):
+        """Testa representação em string da solicitação."""
+        string_repr = str(self.solicitacao)
+
+        self.assertIn("TEST", string_repr)
+        self.assertIn("12345", string_repr)
+
+    def test_solicitacao_auto_populate_on_save(self):
+        """Testa que save() popula campos automaticamente."""
+        self.assertEqual(self.solicitacao.campus_sigla, "TEST")
+        self.assertEqual(self.solicitacao.diario_id, 12345)
+        self.assertEqual(self.solicitacao.tipo, "regular")
+        # diario_codigo é gerado como turma.codigo#diario.id
+        self.assertIn("20261.1.132456.123.1M", self.solicitacao.diario_codigo)
+        self.assertIn("#12345", self.solicitacao.diario_codigo)
+
+    def test_solicitacao_status_merged_property(self):
+        """Testa propriedade status_merged."""
+        self.solicitacao.status = Solicitacao.Status.SUCESSO
+        self.solicitacao.status_code = "200"
+
+        status_html = self.solicitacao.status_merged
+
+        self.assertIn("Sucesso", status_html)
+        self.assertIn("200", status_html)
+
+    def test_solicitacao_timestamp_auto_created(self):
+        """Testa que timestamp é criado automaticamente."""
+        self.assertIsNotNone(self.solicitacao.timestamp)
+
+    def test_solicitacao_ordering(self):
+        """Testa ordenação de solicitações."""
+        solicitacao2 = Solicitacao.objects.create(
+            ambiente=self.ambiente,
+            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
+            recebido={"campus": {"sigla": "TEST"}, "diario": {"id": 999}},
+        )
+
+        solicitacoes = list(Solicitacao.objects.all())
+        # Ordenação por -timestamp (mais recentes primeiro)
+        self.assertEqual(solicitacoes[0], solicitacao2)
+
+    def test_solicitacao_status_choices(self):
+        """Testa choices de status."""
+        self.solicitacao.status = Solicitacao.Status.SUCESSO
+        self.solicitacao.save()
+
+        solicitacao = Solicitacao.objects.get(pk=self.solicitacao.pk)
+        self.assertEqual(solicitacao.status, Solicitacao.Status.SUCESSO)
+
+    def test_solicitacao_save_accepts_django_keyword_arguments(self):
+        """Testa que save() delega corretamente para o Model.save do Django."""
+        self.solicitacao.status = Solicitacao.Status.SUCESSO
+        self.solicitacao.status_code = "200"
+
+        self.solicitacao.save(update_fields=["status", "status_code"])
+
+        solicitacao = Solicitacao.objects.get(pk=self.solicitacao.pk)
+        self.assertEqual(solicitacao.status, Solicitacao.Status.SUCESSO)
+        self.assertEqual(solicitacao.status_code, "200")
+
+    def test_solicitacao_operacao_choices(self):
+        """Testa choices de operação."""
+        self.assertEqual(self.solicitacao.operacao, Solicitacao.Operacao.SYNC_UP_DIARIO)
+
+    def test_solicitacao_json_fields(self):
+        """Testa campos JSON."""
+        self.solicitacao.enviado = {"test": "data"}
+        self.solicitacao.respondido = {"response": "ok"}
+        self.solicitacao.save()
+
+        solicitacao = Solicitacao.objects.get(pk=self.solicitacao.pk)
+        self.assertEqual(solicitacao.enviado["test"], "data")
+        self.assertEqual(solicitacao.respondido["response"], "ok")
+
+    def test_solicitacao_verbose_names(self):
+        """Testa verbose_name e verbose_name_plural."""
+        self.assertEqual(Solicitacao._meta.verbose_name, "solicitação")
+        self.assertEqual(Solicitacao._meta.verbose_name_plural, "solicitações")
+
+
+class SolicitacaoAdminTestCase(TestCase):
+    """Testes para SolicitacaoAdmin."""
+
+    def setUp(self):
+        """Configura o ambiente de teste."""
+        from django.contrib.admin.sites import AdminSite
+
+        from integrador.admin import SolicitacaoAdmin
+
+        self.admin = SolicitacaoAdmin(Solicitacao, AdminSite())
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        self.solicitacao = Solicitacao.objects.create(
+            ambiente=self.ambiente,
+            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
+            tipo="CRIAR_DIARIO",
+            status=Solicitacao.Status.PROCESSANDO,
+            recebido={"diario": {"id": 123, "codigo": "TEST123"}},
         )
-        self.broker = BaseBroker(self.solicitacao)
 
-        self.role_coo_polo = Role.objects.create(name="ZL.CooPolo", shortname="coordenadordepolo", active=True)
-        self.role_coo_curso = Role.objects.create(name="ZL.CooCurso", shortname="coordenadordecurso", active=True)
-        self.role_tut = Role.objects.create(name="ZL.CooTutProg", shortname="tutordeprograma", active=True)
+    def test_requisicao(self):
+        """Testa requisicao."""
+        result = self.admin.requisicao(self.solicitacao)
+        self.assertIsInstance(result, str)
+        self.assertIn("Processando", result)
+
+    def test_requisicao_without_timestamp_returns_dash(self):
+        """Testa requisicao sem timestamp."""
+        self.solicitacao.timestamp = None
+        result = self.admin.requisicao(self.solicitacao)
+        self.assertIn("-", result)
+        self.assertIn("Processando", result)
+
+    def test_acoes(self):
+        """Testa acoes."""
+        result = self.admin.acoes(self.solicitacao)
+        self.assertIn("Reenviar", result)
+
+    def test_acoes_returns_dash(self):
+        """Testa acoes quando operacao nao eh SYNC_UP_DIARIO."""
+        self.solicitacao.operacao = Solicitacao.Operacao.SYNC_DOWN_NOTAS
+        result = self.admin.acoes(self.solicitacao)
+        self.assertEqual(result, "-")
+
+    def test_origem(self):
+        """Testa origem."""
+        self.solicitacao.campus_sigla = "regular"
+        result = self.admin.origem(self.solicitacao)
+        self.assertIn(self.ambiente.nome, result)
+        self.assertIn("regular", result)
+
+    def test_professores(self):
+        """Testa professores."""
+        self.solicitacao.recebido = {"professores": [{"nome": "Prof Test", "login": "prof123", "tipo": "servidor"}]}
+        result = self.admin.professores(self.solicitacao)
+        self.assertIn("Prof Test", result)
+
+    def test_professores_returns_dash_when_empty(self):
+        """Testa professores sem entradas."""
+        self.solicitacao.recebido = {"professores": []}
+        result = self.admin.professores(self.solicitacao)
+        self.assertEqual(result, "-")
+
+    def test_professores_returns_dash_on_exception(self):
+        """Testa professores retornando '-' em erro inesperado."""
+        self.solicitacao.recebido = {"professores": [{"nome": "Prof Test", "login": object(), "tipo": "servidor"}]}
+        result = self.admin.professores(self.solicitacao)
+        self.assertEqual(result, "-")
+
+    def test_links(self):
+        """Testa links."""
+        self.solicitacao.respondido = {"url": "https://test.com/diario"}
+        result = self.admin.links(self.solicitacao)
+        self.assertIn("https://test.com/diario", result)
+
+    def test_links_returns_dash_on_exception(self):
+        """Testa links retornando '-' em erro inesperado."""
+        result = self.admin.links(None)
+        self.assertEqual(result, "-")
+
+    def test_links_with_sincronizacao_url(self):
+        """Testa links com sincronizacao_url no dicionario respondido."""
+        self.solicitacao.respondido = {"sincronizacao_url": "http://moodle/sync"}
+        result = self.admin.links(self.solicitacao)
+        self.assertIn("http://moodle/sync", result)
+        self.assertIn("Sincronização no Moodle", result)
+
+    def test_links_returns_dash_when_no_items(self):
+        """Testa links retornando '-' quando nao ha nenhum link gerado."""
+        self.solicitacao.respondido = {}
+        self.solicitacao.diario_codigo = None
+        self.solicitacao.diario_id = None
+        result = self.admin.links(self.solicitacao)
+        self.assertEqual(result, "-")
+
+    def test_links_with_list_respondido(self):
+        """Testa links quando respondido é uma lista (ex: legado sync_down_grades)."""
+        self.solicitacao.respondido = [{"matricula": "123", "nota": 10.0}]
+        self.solicitacao.diario_codigo = "T123"
+        self.solicitacao.diario_id = "456"
+        result = self.admin.links(self.solicitacao)
+        self.assertNotIn("https://test.com/diario", result)
+        self.assertIn("Diário no SUAP", result)
+        self.assertIn("456", result)
+        self.assertIn("T123", result)
+
+    def test_links_with_dict_respondido(self):
+        """Testa links quando respondido é um dicionário (ex: novo padrão sync_down_grades)."""
+        self.solicitacao.respondido = {"url": "http://moodle/course", "url_sala_coordenacao": "http://moodle/sala"}
+        self.solicitacao.diario_codigo = "T123"
+        self.solicitacao.diario_id = "456"
+        result = self.admin.links(self.solicitacao)
+        self.assertIn("http://moodle/course", result)
+        self.assertIn("http://moodle/sala", result)
+        self.assertIn("T123", result)
+
+    def test_get_urls_wrap_executes_admin_view_wrapper(self):
+        """Testa wrapper de get_urls delegando para admin_site.admin_view."""
+        with patch.object(
+            self.admin.admin_site, "admin_view", return_value=lambda *args, **kwargs: "ok"
+        ) as mock_admin_view:
+            urls = self.admin.get_urls()
+            callback = urls[0].callback
+            result = callback(Mock(), object_id=str(self.solicitacao.id))
+
+        self.assertEqual(result, "ok")
+        self.assertTrue(mock_admin_view.called)
+        called_views = [call.args[0] for call in mock_admin_view.call_args_list]
+        self.assertIn(self.admin.sync_moodle_view, called_views)
+
+    @patch("integrador.admin.registry.broker_for")
+    def test_sync_moodle_view_success(self, mock_broker):
+        """Testa sync_moodle_view com sucesso."""
+        from django.test import RequestFactory
+
+        factory = RequestFactory()
+        request = factory.get(f"/admin/integrador/solicitacao/{self.solicitacao.id}/sync_moodle/")
+
+        mock_instance = Mock()
+        mock_instance.sync_up_enrolments.return_value = {
+            "url": "https://test.moodle.com/course/view.php?id=1",
+            "url_sala_coordenacao": "https://test.moodle.com/course/view.php?id=2",
+            "roles_not_found": [],
+        }
+        mock_broker.return_value = mock_instance
+
+        response = self.admin.sync_moodle_view(request, self.solicitacao.id)
+        self.assertEqual(response.status_code, 302)  # Redirect
+
+    @patch("integrador.admin.registry.broker_for")
+    def test_sync_moodle_view_error(self, mock_broker):
+        """Testa sync_moodle_view com erro."""
+        from django.test import RequestFactory
+
+        factory = RequestFactory()
+        request = factory.get(f"/admin/integrador/solicitacao/{self.solicitacao.id}/sync_moodle/")
+
+        mock_broker.side_effect = Exception("Test error")
+
+        response = self.admin.sync_moodle_view(request, self.solicitacao.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Test error", response.content.decode())
+
+    @patch("integrador.admin.profiling.Perfilador.salva", side_effect=Exception("disco cheio"))
+    @patch("integrador.admin.registry.broker_for")
+    def test_sync_moodle_view_finaliza_uma_vez_se_o_profile_falha(self, mock_broker, _salva):
+        """Testa que um erro ao gravar o profile não finaliza a solicitação de novo nem a conta duas vezes."""
+        request = RequestFactory().get(f"/admin/integrador/solicitacao/{self.solicitacao.id}/sync_moodle/?profile=1")
+        request.user = Mock(username="admin_prof")
+        mock_broker.return_value.sync_up_enrolments.return_value = {"url": "https://test.moodle.com/course/view.php"}
 
-    def _cria_cohort(self, name, idnumber, role, rule_diario, rule_coordenacao, active=True):
-        return Cohort.objects.create(
-            name=name,
-            idnumber=idnumber,
-            role=role,
-            rule_diario=rule_diario,
-            rule_coordenacao=rule_coordenacao,
-            active=active,
-        )
+        response = self.admin.sync_moodle_view(request, self.solicitacao.id)
 
-    def _adiciona_colaborador(self, cohort, login, nome, email):
-        user, _ = MoodleUser.objects.get_or_create(
-            login=login, defaults={"fullname": nome, "email": email, "active": True}
+        self.assertEqual(response.status_code, 302)
+        reenvio = Solicitacao.objects.latest("id")
+        self.assertEqual(reenvio.status, Solicitacao.Status.SUCESSO)
+        self.assertEqual(
+            list(SolicitacaoRollup.objects.filter(operacao=reenvio.operacao).values_list("status", "total")),
+            [(Solicitacao.Status.SUCESSO, 1)],
         )
-        Enrolment.objects.create(cohort=cohort, user=user)
-        return user
 
-    # --- Sem coortes ---
+    @patch("integrador.admin.registry.broker_for")
+    def test_sync_moodle_view_handles_none_response(self, mock_broker):
+        """Testa sync_moodle_view quando broker retorna None."""
+        from django.test import RequestFactory
 
-    def test_sem_coortes_cadastradas_retorna_lista_vazia(self):
-        """Sem nenhuma coorte no banco, get_cohort retorna lista vazia."""
-        resultado = self.broker.get_cohort()
-        self.assertEqual(resultado, [])
+        factory = RequestFactory()
+        request = factory.get(f"/admin/integrador/solicitacao/{self.solicitacao.id}/sync_moodle/")
 
-    def test_sem_coortes_ativas_retorna_lista_vazia(self):
-        """Coorte inativa nunca é incluída, mesmo com regra correspondente."""
-        self._cria_cohort(
-            name="ZL.CooPolo.Natal(RN)",
-            idnumber="ZL.CooPolo.Natal(RN)",
-            role=self.role_coo_polo,
-            rule_diario='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
-            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
-            active=False,
-        )
-        resultado = self.broker.get_cohort()
-        self.assertEqual(resultado, [])
+        mock_instance = Mock()
+        mock_instance.sync_up_enrolments.return_value = None
+        mock_broker.return_value = mock_instance
 
-    def test_sem_coorte_correspondente_retorna_lista_vazia(self):
-        """Coorte ativa mas sem regra que corresponda ao JSON retorna lista vazia."""
-        self._cria_cohort(
-            name="ZL.CooPolo.Parelhas",
-            idnumber="ZL.CooPolo.Parelhas",
-            role=self.role_coo_polo,
-            rule_diario='$any([aluno["polo"]["descricao"] == "Parelhas" for aluno in alunos])',
-            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Parelhas" for aluno in alunos])',
-        )
-        self.solicitacao.recebido = self.SYNC_JSON_SEM_POLO
-        resultado = self.broker.get_cohort()
-        self.assertEqual(resultado, [])
+        response = self.admin.sync_moodle_view(request, self.solicitacao.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Erro desconhecido", response.content.decode())
 
-    # --- Com coortes por polo ---
+    @patch("base.admin.BaseModelAdmin.get_queryset")
+    def test_get_queryset_select_related_ambiente(self, mock_get_queryset):
+        """Testa que SolicitacaoAdmin.get_queryset aplica select_related em ambiente."""
+        request = RequestFactory().get("/admin/integrador/solicitacao/")
+        request.user = User.objects.create_superuser("admin_sol", "admin_sol@test.com", str(uuid.uuid4()))
 
-    def test_coorte_polo_natal_corresponde_ao_json(self):
-        """Coorte de polo Natal(RN) é selecionada quando há aluno desse polo."""
-        cohort = self._cria_cohort(
-            name="ZL.CooPolo.Natal(RN)",
-            idnumber="ZL.CooPolo.Natal(RN)",
-            role=self.role_coo_polo,
-            rule_diario='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
-            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
-        )
-        self._adiciona_colaborador(cohort, "coord.natal", "Coord Natal", "coord.natal@ifrn.edu.br")
-        resultado = self.broker.get_cohort()
-        idnumbers = [c["idnumber"] for c in resultado]
-        self.assertIn("ZL.CooPolo.Natal(RN)", idnumbers)
+        mock_qs = Mock()
+        mock_qs.select_related.return_value = "SELECT_RELATED_QS"
+        mock_get_queryset.return_value = mock_qs
 
-    def test_coorte_polo_mossoro_nao_corresponde_sem_aluno_desse_polo(self):
-        """Coorte de Mossoró não é selecionada quando não há aluno desse polo."""
-        self._cria_cohort(
-            name="ZL.CooPolo.Mossoró (RN)",
-            idnumber="ZL.CooPolo.Mossoró (RN)",
-            role=self.role_coo_polo,
-            rule_diario='$any([aluno["polo"]["descricao"] == "Mossoró (RN)" for aluno in alunos])',
-            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Mossoró (RN)" for aluno in alunos])',
-        )
-        self.solicitacao.recebido = self.SYNC_JSON_SEM_POLO
-        resultado = self.broker.get_cohort()
-        self.assertEqual(resultado, [])
+        result = self.admin.get_queryset(request)
 
-    # --- Com coortes por curso ---
+        self.assertEqual(result, "SELECT_RELATED_QS")
+        mock_qs.select_related.assert_called_once_with("ambiente")
 
-    def test_coorte_curso_15056_corresponde_ao_json(self):
-        """Coorte de coordenação do curso 15056 é selecionada pelo código do curso."""
-        cohort = self._cria_cohort(
-            name="ZL.CooCurso.15056",
-            idnumber="ZL.CooCurso.15056",
-            role=self.role_coo_curso,
-            rule_diario='curso["codigo"] == "15056"',
-            rule_coordenacao='curso["codigo"] == "15056"',
-        )
-        self._adiciona_colaborador(cohort, "coo.curso15056", "Coo Curso 15056", "coo@ifrn.edu.br")
-        resultado = self.broker.get_cohort()
-        idnumbers = [c["idnumber"] for c in resultado]
-        self.assertIn("ZL.CooCurso.15056", idnumbers)
+    def _changelist_results(self):
+        request = RequestFactory().get("/admin/integrador/solicitacao/")
+        request.user = User.objects.create_superuser("admin_cl", "admin_cl@test.com", str(uuid.uuid4()))
+        changelist = self.admin.get_changelist_instance(request)
+        return list(changelist.get_queryset(request))
+
+    def test_changelist_defers_json_fields(self):
+        """Testa que a listagem não carrega os JSONs completos."""
+        self.solicitacao.recebido = {"professores": [{"nome": "Prof Test", "login": "prof123", "tipo": "Principal"}]}
+        self.solicitacao.respondido = {
+            "url": "http://moodle/course",
+            "url_sala_coordenacao": "http://moodle/sala",
+            "sincronizacao_url": "http://moodle/sync",
+        }
+        self.solicitacao.save()
 
-    def test_coorte_curso_diferente_nao_corresponde(self):
-        """Coorte com código de curso diferente não é selecionada."""
-        self._cria_cohort(
-            name="ZL.CooCurso.99624",
-            idnumber="ZL.CooCurso.99624",
-            role=self.role_coo_curso,
-            rule_diario='curso["codigo"] == "99624"',
-            rule_coordenacao='curso["codigo"] == "99624"',
-        )
-        resultado = self.broker.get_cohort()
-        self.assertEqual(resultado, [])
+        obj = self._changelist_results()[0]
 
-    # --- Com coortes por programa ---
+        self.assertEqual(obj.get_deferred_fields(), {"recebido", "enviado", "respondido"})
+        self.assertEqual(obj.json_url, "http://moodle/course")
+        with self.assertNumQueries(0):
+            professores = self.admin.professores(obj)
+            links = self.admin.links(obj)
+        self.assertIn("Prof Test", professores)
+        self.assertIn("http://moodle/course", links)
+        self.assertIn("http://moodle/sala", links)
+        self.assertIn("http://moodle/sync", links)
 
-    def test_coorte_programa_uab_corresponde_quando_ha_aluno_uab(self):
-        """Coorte UAB é selecionada quando há aluno com programa UAB."""
-        cohort = self._cria_cohort(
-            name="ZL.CooTutProg.UAB",
-            idnumber="ZL.CooTutProg.UAB",
-            role=self.role_tut,
-            rule_diario='$any([aluno["programa"] == "UAB" for aluno in alunos])',
-            rule_coordenacao='$any([aluno["programa"] == "UAB" for aluno in alunos])',
-        )
-        self._adiciona_colaborador(cohort, "tut.uab", "Tutor UAB", "tut.uab@ifrn.edu.br")
-        resultado = self.broker.get_cohort()
-        idnumbers = [c["idnumber"] for c in resultado]
-        self.assertIn("ZL.CooTutProg.UAB", idnumbers)
+    def test_changelist_annotations_with_list_respondido(self):
+        """Testa que respondido em lista resulta em anotações nulas e links de fallback."""
+        self.solicitacao.respondido = [{"matricula": "123", "nota": 10.0}]
+        self.solicitacao.save()
 
-    # --- Múltiplas coortes simultâneas ---
+        obj = self._changelist_results()[0]
 
-    def test_multiplas_coortes_correspondentes_todas_incluidas(self):
-        """Quando polo e curso correspondem, ambas as coortes são retornadas."""
-        c1 = self._cria_cohort(
-            name="ZL.CooPolo.Natal(RN)",
-            idnumber="ZL.CooPolo.Natal(RN)",
-            role=self.role_coo_polo,
-            rule_diario='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
-            rule_coordenacao='$any([aluno["polo"]["descricao"] == "Natal (RN)" for aluno in alunos])',
+        self.assertIsNone(obj.json_url)
+        self.assertIsNone(obj.json_professores)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.admin.professores(obj), "-")
+            self.assertIn("course/management.php?search=", self.admin.links(obj))
+
+    def test_get_object_loads_json_fields(self):
+        """Testa que get_object (usado pelo preview_view) continua carregando os JSONs."""
+        request = RequestFactory().get(f"/admin/integrador/solicitacao/{self.solicitacao.id}/view/")
+        request.user = User.objects.create_superuser("admin_obj", "admin_obj@test.com", str(uuid.uuid4()))
+
+        obj = self.admin.get_object(request, str(self.solicitacao.id))
+
+        self.assertEqual(obj.get_deferred_fields(), set())
+        self.assertEqual(obj.recebido, self.solicitacao.recebido)
+
+    def test_get_data_for_export_undoes_defer(self):
+        """Testa que a exportação recebe o queryset sem campos adiados."""
+        request = RequestFactory().get("/admin/integrador/solicitacao/export/")
+        queryset = Mock()
+        queryset.defer.return_value = "FULL_QS"
+
+        with patch("base.admin.BaseModelAdmin.get_data_for_export", return_value="DATA") as mock_export:
+            result = self.admin.get_data_for_export(request, queryset)
+
+        self.assertEqual(result, "DATA")
+        queryset.defer.assert_called_once_with(None)
+        mock_export.assert_called_once_with(request, "FULL_QS")
+
+
+class BaseBrokerTestCase(TestCase):
+    """Testes para BaseBroker."""
+
+    def setUp(self):
+        """Configura o ambiente de teste."""
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+
+        self.solicitacao = Solicitacao.objects.create(
+            ambiente=self.ambiente, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido={"diario": {"id": 123}}
         )
-        c2 = self._cria_cohort(
-            name="ZL.CooCurso.15056",
-            idnumber="ZL.CooCurso.15056",
-            role=self.role_coo_curso,
-            rule_diario='curso["codigo"] == "15056"',
-            rule_coordenacao='curso["codigo"] == "15056"',
+
+        self.broker = BaseBroker(self.solicitacao)
+
+    def test_base_broker_initialization(self):
+        """Testa inicialização do BaseBroker."""
+        self.assertEqual(self.broker.solicitacao, self.solicitacao)
+        self.assertEqual(self.broker.solicitacao.ambiente, self.ambiente)
+
+    def test_base_broker_credentials_property(self):
+        """Testa propriedade credentials."""
+        credentials = self.broker.credentials
+
+        self.assertIn("Authentication", credentials)
+        self.assertIn(f"Token {TEST_TOKEN}", credentials["Authentication"])
+
+    def test_base_broker_get_cohorts(self):
+        """Testa método get_cohort."""
+        cohorts = self.broker.get_cohort()
+
+        self.assertEqual(cohorts, [])
+
+    def test_base_broker_sync_up_enrolments_not_implemented(self):
+        """Testa que sync_up_enrolments não está implementado."""
+        with self.assertRaises(NotImplementedError):
+            self.broker.sync_up_enrolments()
+
+    def test_base_broker_sync_down_grades_not_implemented(self):
+        """Testa que sync_down_grades não está implementado."""
+        with self.assertRaises(NotImplementedError):
+            self.broker.sync_down_grades()
+
+    def test_base_broker_cast_cohort_maps_expected_payload(self):
+        """Testa cast_cohort com mapeamento completo de dados."""
+        user = Mock(fullname="User Name", email="user@test.com", login="user_login", active=True)
+        role = Mock(name="Coordenador de curso", shortname="coordenadordecurso", active=True)
+        enrolment = Mock(user=user)
+        enrolments = Mock()
+        enrolments.select_related.return_value.all.return_value = [enrolment]
+        cohort = SimpleNamespace(
+            name="Cohort Test",
+            role=role,
+            active=True,
+            idnumber="COHORT-1",
+            description="Desc",
+            enrolments=enrolments,
         )
-        self._adiciona_colaborador(c1, "coord.natal", "Coord Natal", "coord.natal@ifrn.edu.br")
-        self._adiciona_colaborador(c2, "coo.curso", "Coo Curso", "coo.curso@ifrn.edu.br")
 
-        resultado = self.broker.get_cohort()
-        idnumbers = [c["idnumber"] for c in resultado]
-        self.assertIn("ZL.CooPolo.Natal(RN)", idnumbers)
-        self.assertIn("ZL.CooCurso.15056", idnumbers)
+        payload = self.broker.cast_cohort(cohort)
 
-    # --- Payload das coortes ---
+        self.assertEqual(payload["nome"], "Cohort Test")
+        self.assertEqual(payload["role"], "coordenadordecurso")
+        self.assertEqual(payload["idnumber"], "COHORT-1")
+        self.assertEqual(payload["colaboradores"][0]["email"], "user@test.com")
+
+    @patch("integrador.brokers.base.logger.warning")
+    @patch("integrador.brokers.base.rule_engine.Rule")
+    def test_base_broker_cohort_matches_handles_rule_error(self, mock_rule, mock_warning):
+        """Testa cohort_matches quando a avaliação da regra falha."""
+        cohort = Mock(id=10, name="Cohort Error", rule_diario="invalid")
+        mock_rule.side_effect = Exception("invalid rule")
+
+        result = self.broker.cohort_matches(cohort, "rule_diario")
+
+        self.assertFalse(result)
+        mock_warning.assert_called_once()
+
+    @patch("integrador.brokers.base.Cohort.objects.filter")
+    def test_base_broker_get_cohort_combines_diario_and_coordenacao(self, mock_filter):
+        """Testa get_cohort combinando cohorts elegíveis por regras diferentes."""
+        cohort_a = SimpleNamespace(name="A")
+        cohort_b = SimpleNamespace(name="B")
+        mock_filter.return_value = [cohort_a, cohort_b]
+
+        with patch.object(self.broker, "cohort_matches") as mock_matches:
+            mock_matches.side_effect = lambda cohort, field: (cohort is cohort_a and field == "rule_diario") or (
+                cohort is cohort_b and field == "rule_coordenacao"
+            )
+            with patch.object(self.broker, "cast_cohort") as mock_cast:
+                mock_cast.side_effect = lambda cohort: {"nome": cohort.name}
 
-    def test_payload_da_coorte_inclui_colaboradores(self):
-        """Coorte retornada deve incluir colaboradores com dados corretos."""
-        cohort = self._cria_cohort(
-            name="ZL.CooCurso.15056",
-            idnumber="ZL.CooCurso.15056",
-            role=self.role_coo_curso,
-            rule_diario='curso["codigo"] == "15056"',
-            rule_coordenacao='curso["codigo"] == "15056"',
-        )
-        self._adiciona_colaborador(cohort, "coord.x", "Coord X", "coord.x@ifrn.edu.br")
+                cohorts = self.broker.get_cohort()
 
-        resultado = self.broker.get_cohort()
-        coorte = next(c for c in resultado if c["idnumber"] == "ZL.CooCurso.15056")
-        self.assertEqual(coorte["nome"], "ZL.CooCurso.15056")
-        self.assertEqual(coorte["role"], "coordenadordecurso")
-        colaboradores = coorte["colaboradores"]
-        self.assertEqual(len(colaboradores), 1)
-        self.assertEqual(colaboradores[0]["login"], "coord.x")
-        self.assertEqual(colaboradores[0]["email"], "coord.x@ifrn.edu.br")
+        self.assertEqual(cohorts, [{"nome": "A"}, {"nome": "B"}])
 
 
-class SolicitacaoModelTestCase(TestCase):
-    """Testes para o modelo Solicitacao."""
+class Suap2LocalSuapBrokerTestCase(TestCase):
+    """Testes para Suap2LocalSuapBroker."""
 
     def setUp(self):
         """Configura o ambiente de teste."""
         self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
 
-        self.recebido_json = {
-            "campus": {"sigla": "TEST"},
-            "turma": {"codigo": "20261.1.132456.123.1M"},
-            "componente": {"sigla": "MAT.001"},
-            "diario": {"id": 12345, "tipo": "regular"},
-        }
-
         self.solicitacao = Solicitacao.objects.create(
             ambiente=self.ambiente,
             operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
-            status=Solicitacao.Status.PROCESSANDO,
-            recebido=self.recebido_json,
+            diario_id="123",
+            recebido={
+                "campus": {"id": 1, "sigla": "TEST", "descricao": "Campus Teste"},
+                "curso": {"id": 10, "codigo": "15806", "nome": "Sistemas Operacionais Abertos"},
+                "turma": {"id": 2, "codigo": "T1"},
+                "componente": {"id": 5, "sigla": "TEC.1023", "descricao": "Bancos de Dados"},
+                "diario": {"id": 123, "sigla": "TEC.1023", "situacao": "Aberto"},
+            },
         )
 
-    def test_create_solicitacao(self):
-        """Testa criação de solicitação."""
-        solicitacao = Solicitacao.objects.create(
-            ambiente=self.ambiente,
-            operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS,
-            status=Solicitacao.Status.SUCESSO,
-            recebido={"campus": {"sigla": "TEST"}, "diario": {"id": 999}},
-        )
+        self.broker = Suap2LocalSuapBroker(self.solicitacao)
 
-        self.assertIsNotNone(solicitacao.pk)
-        self.assertEqual(solicitacao.operacao, Solicitacao.Operacao.SYNC_DOWN_NOTAS)
+    def test_broker_initialization(self):
+        """Testa inicialização do broker."""
+        self.assertEqual(self.broker.solicitacao, self.solicitacao)
 
-    def test_solicitacao_str_representation(self):
-        """Testa representação em string da solicitação."""
-        string_repr = str(self.solicitacao)
+    def test_broker_moodle_base_api_url_property(self):
+        """Testa propriedade moodle_base_api_url."""
+        self.assertEqual(self.broker.moodle_base_api_url, "https://test.moodle.com/local/suap/api")
 
-        self.assertIn("TEST", string_repr)
-        self.assertIn("12345", string_repr)
+    @patch("integrador.brokers.suap2local_suap.http_post_json")
+    def test_broker_sync_up_enrolments_success(self, mock_http_post_json):
+        """Testa sync_up_enrolments com sucesso."""
+        mock_http_post_json.return_value = {
+            "url": "https://test.moodle.com/course/view.php?id=1",
+            "url_sala_coordenacao": "https://test.moodle.com/course/view.php?id=2",
+            "roles_not_found": [],
+        }
 
-    def test_solicitacao_auto_populate_on_save(self):
-        """Testa que save() popula campos automaticamente."""
-        self.assertEqual(self.solicitacao.campus_sigla, "TEST")
-        self.assertEqual(self.solicitacao.diario_id, 12345)
-        self.assertEqual(self.solicitacao.tipo, "regular")
-        # diario_codigo é gerado como turma.codigo#diario.id
-        self.assertIn("20261.1.132456.123.1M", self.solicitacao.diario_codigo)
-        self.assertIn("#12345", self.solicitacao.diario_codigo)
+        result = self.broker.sync_up_enrolments()
 
-    def test_solicitacao_status_merged_property(self):
-        """Testa propriedade status_merged."""
-        self.solicitacao.status = Solicitacao.Status.SUCESSO
-        self.solicitacao.status_code = "200"
+        self.assertIn("url", result)
+        self.assertIn("url_sala_coordenacao", result)
+        self.assertEqual(result["roles_not_found"], [])
+        self.assertEqual(result["ambiente"], "https://test.moodle.com")
+        mock_http_post_json.assert_called_once()
 
-        status_html = self.solicitacao.status_merged
+    def test_broker_sync_up_enrolments_payload_faltando_campo_obrigatorio(self):
+        """Testa que SyncError é lançado quando o payload não tem campos obrigatórios."""
+        self.solicitacao.recebido = {"diario": {"id": 1}}  # incompleto
+        self.solicitacao.save()
+        with self.assertRaises(SyncError) as ctx:
+            self.broker.sync_up_enrolments()
+        self.assertEqual(ctx.exception.code, 422)
+        self.assertIn("campus", str(ctx.exception))
 
-        self.assertIn("Sucesso", status_html)
-        self.assertIn("200", status_html)
+    @patch("integrador.brokers.suap2local_suap.http_post_json")
+    def test_broker_sync_up_enrolments_raises_sync_error_when_get_cohort_fails(self, mock_http_post_json):
+        """Testa sync_up_enrolments levantando SyncError quando preparação falha."""
+        with patch.object(self.broker, "get_cohort", side_effect=Exception("erro interno")):
+            with self.assertRaises(SyncError):
+                self.broker.sync_up_enrolments()
 
-    def test_solicitacao_timestamp_auto_created(self):
-        """Testa que timestamp é criado automaticamente."""
-        self.assertIsNotNone(self.solicitacao.timestamp)
+        mock_http_post_json.assert_not_called()
 
-    def test_solicitacao_ordering(self):
-        """Testa ordenação de solicitações."""
-        solicitacao2 = Solicitacao.objects.create(
-            ambiente=self.ambiente,
-            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
-            recebido={"campus": {"sigla": "TEST"}, "diario": {"id": 999}},
-        )
+    @patch("integrador.brokers.suap2local_suap.http_get_json")
+    def test_broker_sync_down_grades_success(self, mock_http_get_json):
+        """Testa sync_down_grades com sucesso."""
+        mock_http_get_json.return_value = {"notas": [], "url": "http://", "url_sala_coordenacao": "http://"}
 
-        solicitacoes = list(Solicitacao.objects.all())
-        # Ordenação por -timestamp (mais recentes primeiro)
-        self.assertEqual(solicitacoes[0], solicitacao2)
+        result = self.broker.sync_down_grades()
 
-    def test_solicitacao_status_choices(self):
-        """Testa choices de status."""
-        self.solicitacao.status = Solicitacao.Status.SUCESSO
+        self.assertEqual(result, {"notas": [], "url": "http://", "url_sala_coordenacao": "http://"})
+
+    @patch("integrador.brokers.suap2local_suap.http_post_json")
+    def test_broker_sync_up_enrolments_with_full_autoinscricao(self, mock_post):
+        """Testa sync_up_enrolments com todas as opções de autoinscrição (tipos de usuário, campi, etc.)"""
+        mock_post.return_value = {"status": "ok"}
+
+        self.solicitacao.recebido["autoinscricao"] = {
+            "tecnicos_administrativos": True,
+            "docentes": True,
+            "prestadores": True,
+            "alunos": True,
+            "estrangeiros": True,
+            "campi": ["ZL"],
+            "modalidades": ["EaD"],
+            "niveis_ensino": ["Superior"],
+            "cursos": ["TADS"],
+        }
         self.solicitacao.save()
 
-        solicitacao = Solicitacao.objects.get(pk=self.solicitacao.pk)
-        self.assertEqual(solicitacao.status, Solicitacao.Status.SUCESSO)
+        result = self.broker.sync_up_enrolments()
+        self.assertEqual(result, {"status": "ok", "ambiente": self.ambiente.base_url})
+        self.assertIn("restricoes", self.solicitacao.enviado["turma"])
+        restricoes = self.solicitacao.enviado["turma"]["restricoes"]
+        self.assertIn("Servidor (Técnico-Administrativo)", restricoes)
+        self.assertIn("Servidor (Docente)", restricoes)
+        self.assertIn("Prestador de Serviço", restricoes)
+        self.assertIn("Aluno", restricoes)
+        self.assertIn("m['estrangeiro'] == true", restricoes)
 
-    def test_solicitacao_save_accepts_django_keyword_arguments(self):
-        """Testa que save() delega corretamente para o Model.save do Django."""
-        self.solicitacao.status = Solicitacao.Status.SUCESSO
-        self.solicitacao.status_code = "200"
+    def test_broker_set_restricoes_without_turma(self):
+        """Testa _set_restricoes com payload que não tem chave turma."""
+        payload = {"autoinscricao": {"tecnicos_administrativos": True}}
+        self.broker._set_restricoes(payload)
+        self.assertIn("turma", payload)
+        self.assertIn("Servidor (Técnico-Administrativo)", payload["turma"]["restricoes"])
 
-        self.solicitacao.save(update_fields=["status", "status_code"])
+    @patch("integrador.brokers.suap2local_suap.http_post_json")
+    def test_broker_sync_up_enrolments_raises_sync_error_on_set_restricoes_error(self, mock_post):
+        """Testa sync_up_enrolments quando _set_restricoes falha (raises 526)."""
+        with patch.object(self.broker, "_set_restricoes", side_effect=Exception("erro restricoes")):
+            with self.assertRaises(SyncError) as ctx:
+                self.broker.sync_up_enrolments()
+            self.assertEqual(ctx.exception.code, 526)
 
-        solicitacao = Solicitacao.objects.get(pk=self.solicitacao.pk)
-        self.assertEqual(solicitacao.status, Solicitacao.Status.SUCESSO)
-        self.assertEqual(solicitacao.status_code, "200")
+    @patch("integrador.brokers.suap2local_suap.http_post_json")
+    def test_broker_sync_up_enrolments_raises_sync_error_on_solicitacao_save_error(self, mock_post):
+        """Testa sync_up_enrolments quando save() falha (raises 527)."""
+        with patch.object(self.solicitacao, "save", side_effect=Exception("erro db")):
+            with self.assertRaises(SyncError) as ctx:
+                self.broker.sync_up_enrolments()
+            self.assertEqual(ctx.exception.code, 527)
 
-    def test_solicitacao_operacao_choices(self):
-        """Testa choices de operação."""
-        self.assertEqual(self.solicitacao.operacao, Solicitacao.Operacao.SYNC_UP_DIARIO)
 
-    def test_solicitacao_json_fields(self):
-        """Testa campos JSON."""
-        self.solicitacao.enviado = {"test": "data"}
-        self.solicitacao.respondido = {"response": "ok"}
-        self.solicitacao.save()
+class Suap2ToolSgaBrokerTestCase(TestCase):
+    """Testes para Suap2ToolSgaBroker e a tradução do payload do SUAP para o formato genérico do SGA."""
 
-        solicitacao = Solicitacao.objects.get(pk=self.solicitacao.pk)
-        self.assertEqual(solicitacao.enviado["test"], "data")
-        self.assertEqual(solicitacao.respondido["response"], "ok")
+    def setUp(self):
+        from cohort.examples import JSON_DE_EXEMPLO
 
-    def test_solicitacao_verbose_names(self):
-        """Testa verbose_name e verbose_name_plural."""
-        self.assertEqual(Solicitacao._meta.verbose_name, "solicitação")
-        self.assertEqual(Solicitacao._meta.verbose_name_plural, "solicitações")
+        self.recebido = copy.deepcopy(JSON_DE_EXEMPLO)
+        self.recebido["campus"]["sigla"] = "TEST"
+        self.ambiente = Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"local_suap_active": False}))
+        self.solicitacao = Solicitacao.objects.create(
+            ambiente=self.ambiente, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido=self.recebido
+        )
+        self.mock = ToolSgaHTTPMock()
+        self.addCleanup(set_transport, set_transport(MockMoodleTransport(self.mock)))
+
+    def test_translate(self):
+        """Testa o mapeamento dos campos do diário e das inscrições, sem alterar nem copiar o recebido."""
+        from integrador.brokers.suap2tool_sga.translator import translate
+
+        self.recebido["autoinscricao"] = {"alunos": True}
+        self.recebido["alunos"].append({**self.recebido["alunos"][0], "matricula": "2", "situacao_diario": "Trancado"})
+        self.recebido["equipe"] = [{"username": "equipe1", "nome": "Equipe", "email": "", "ativo": True, "papeis": []}]
+        antes = copy.deepcopy(self.recebido)
+
+        sga = translate(self.recebido, [{"nome": "coorte"}], "https://integrador/solicitacao/1/view/")
+
+        self.assertEqual(self.recebido, antes)
+        self.assertEqual(sga["sga"], "suap")
+        self.assertEqual(sga["unidade"], {"id": 1, "sigla": "TEST", "nome": "CAMPUS CENTRAL"})
+        self.assertEqual(sga["diario"]["codigo"], self.solicitacao.diario_codigo)
+        self.assertEqual(sga["disciplina"]["avaliacoes"], 1)
+        self.assertEqual(sga["polo"], {"id": 3, "nome": "Nome do polo (RN)"})
+        self.assertIs(sga["autoinscricao"], self.recebido["autoinscricao"])
+        self.assertEqual(
+            [(i["papel"], i["login"], i["situacao"]) for i in sga["inscricoes"]],
+            [
+                ("aluno", "20261132456RN0001", "ativo"),
+                ("aluno", "2", "suspenso"),
+                ("professor", "12345611", "ativo"),
+                ("formador", "12345612", "ativo"),
+                ("tutor", "12345613", "ativo"),
+                ("professor", "12345614", "suspenso"),
+                ("equipe", "equipe1", "ativo"),
+            ],
+        )
+        self.assertIs(sga["inscricoes"][0]["polo"], sga["inscricoes"][1]["polo"])
+        self.assertEqual(sga["coortes"], [{"nome": "coorte"}])
 
+    def test_translate_campos_obrigatorios(self):
+        """Testa SyncError 422 para campo obrigatório ausente no diário ou numa inscrição."""
+        from integrador.brokers.suap2tool_sga.translator import translate
 
-class SolicitacaoAdminTestCase(TestCase):
-    """Testes para SolicitacaoAdmin."""
+        with self.assertRaises(SyncError) as ctx:
+            translate({"diario": {"id": 1}})
+        self.assertEqual(ctx.exception.code, 422)
+        self.assertIn("campus.id", ctx.exception.message)
 
-    def setUp(self):
-        """Configura o ambiente de teste."""
-        from django.contrib.admin.sites import AdminSite
+        del self.recebido["alunos"][0]["matricula"]
+        with self.assertRaisesMessage(SyncError, "matricula"):
+            translate(self.recebido)
 
-        from integrador.admin import SolicitacaoAdmin
+    def test_sync_up_enrolments(self):
+        """Testa o envio ao tool_sga: enviado no formato genérico, inscrições criadas e a etapa de tradução."""
+        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
 
-        self.admin = SolicitacaoAdmin(Solicitacao, AdminSite())
-        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        result = Suap2ToolSgaBroker(self.solicitacao).sync_up_enrolments()
+
+        self.assertTrue(result["url"].startswith("https://test.moodle.com/course/view.php?id="))
+        self.assertEqual(result["ambiente"], "https://test.moodle.com")
+        self.assertEqual(result["inscricoes"]["criadas"], 5)
+        self.solicitacao.refresh_from_db()
+        self.assertEqual(self.solicitacao.enviado["unidade"]["sigla"], "TEST")
+        self.assertTrue(self.solicitacao.enviado["solicitacao_url"].endswith(f"/{self.solicitacao.id}/view/"))
+        self.assertIn("traducao", self.solicitacao.etapas.tempos)
+        self.assertIn("moodle", self.solicitacao.etapas.tempos)
+
+    def test_sync_down_grades(self):
+        """Testa o download das notas do diário enviado antes."""
+        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
+
+        Suap2ToolSgaBroker(self.solicitacao).sync_up_enrolments()
+        notas = Suap2ToolSgaBroker(self.solicitacao).sync_down_grades()
+
+        self.assertEqual([n["matricula"] for n in notas["notas"]], ["20261132456RN0001"])
+        self.assertEqual(notas["diario_id"], "123456")
+
+    def test_sync_up_enrolments_erros(self):
+        """Testa payload inválido (422), erro nas coortes (525) e ao salvar o enviado (527), sem chamar o Moodle."""
+        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
+
+        broker = Suap2ToolSgaBroker(self.solicitacao)
+        with patch.object(broker, "get_cohort", side_effect=Exception("erro interno")):
+            with self.assertRaises(SyncError) as ctx:
+                broker.sync_up_enrolments()
+        self.assertEqual(ctx.exception.code, 525)
+        with patch.object(self.solicitacao, "save", side_effect=Exception("erro db")):
+            with self.assertRaises(SyncError) as ctx:
+                broker.sync_up_enrolments()
+        self.assertEqual(ctx.exception.code, 527)
+        self.solicitacao.recebido = {"diario": {"id": 1}}
+        with self.assertRaises(SyncError) as ctx:
+            broker.sync_up_enrolments()
+        self.assertEqual(ctx.exception.code, 422)
+
+        self.assertEqual(self.mock.state.snapshot()["diarios"], 0)
+
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    def test_view_sync_up_enrolments(self):
+        """Testa a view com um Ambiente só com tool_sga, de ponta a ponta."""
+        request = RequestFactory().post(
+            "/api/enviar_diarios/", data=json.dumps(self.recebido), content_type="application/json"
+        )
+        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+
+        response = sync_up_enrolments(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.mock.state.snapshot()["inscricoes"], 5)
+        self.assertIn("traducao;dur=", response["Server-Timing"])
+
+
+class Sga2ToolSgaBrokerTestCase(TestCase):
+    """Testes para Sga2ToolSgaBroker: lotes de inscrições, envio concorrente, batch_key e retentativas."""
+
+    @staticmethod
+    def diario(diario_id: int, inscricoes: int) -> dict:
+        return {
+            "sga": "sigaa",
+            "unidade": {"id": 1, "sigla": "TEST"},
+            "curso": {"id": 10, "codigo": "C10"},
+            "turma": {"id": 20, "codigo": "T20"},
+            "disciplina": {"id": 30, "sigla": "D30", "avaliacoes": 2},
+            "diario": {"id": diario_id, "codigo": f"T20.D30#{diario_id}"},
+            "inscricoes": [
+                {"papel": "aluno", "login": f"a{diario_id}-{i}", "matricula": f"{diario_id}{i:04d}"}
+                for i in range(inscricoes)
+            ],
+        }
+
+    def setUp(self):
+        self.ambiente = Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"local_suap_active": False}))
+        self.recebido = {"sga": "sigaa", "diarios": [self.diario(1, 5), self.diario(2, 1), self.diario(3, 0)]}
         self.solicitacao = Solicitacao.objects.create(
-            ambiente=self.ambiente,
-            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
-            tipo="CRIAR_DIARIO",
-            status=Solicitacao.Status.PROCESSANDO,
-            recebido={"diario": {"id": 123, "codigo": "TEST123"}},
+            ambiente=self.ambiente, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido=self.recebido
+        )
+        self.mock = ToolSgaHTTPMock()
+        self.transporte = MockMoodleTransport(self.mock)
+        self.addCleanup(set_transport, set_transport(self.transporte))
+
+    def broker(self, **kwargs):
+        from integrador.brokers.sga2tool_sga import Sga2ToolSgaBroker
+
+        broker = Sga2ToolSgaBroker(self.solicitacao)
+        for nome, valor in ({"batch_inscricoes": 2, "batch_retry_backoff": 0} | kwargs).items():
+            setattr(broker, nome, valor)
+        return broker
+
+    def test_split(self):
+        """Testa a divisão por inscrições: diário grande em partes, pequenos juntos, coortes na primeira parte."""
+        from integrador.brokers.sga2tool_sga.batching import split
+
+        lotes = list(split(self.recebido["diarios"], 2, [{"nome": "coorte"}]))
+
+        self.assertEqual(
+            [[(p["diario"]["id"], len(p["inscricoes"])) for p in lote] for lote in lotes],
+            [[(1, 2)], [(1, 2)], [(1, 1), (2, 1)], [(3, 0)]],
+        )
+        self.assertEqual([p["coortes"] for p in lotes[0] + lotes[1]], [[{"nome": "coorte"}], []])
+        self.assertIs(lotes[1][0]["inscricoes"][0], self.recebido["diarios"][0]["inscricoes"][2])
+        self.assertIs(lotes[0][0]["curso"], self.recebido["diarios"][0]["curso"])
+        self.assertNotIn("coortes", self.recebido["diarios"][0])
+
+    def test_encode(self):
+        """Testa a batch_key: dos diários e do hash do JSON deles, serializados uma vez, igual para o mesmo conteúdo."""
+        import hashlib
+
+        from integrador.brokers.sga2tool_sga.batching import encode
+
+        lote = [self.diario(1, 2)]
+        batch_key, corpo = encode(lote)
+        body = json.loads(corpo)
+
+        self.assertEqual(body, {"batch_key": batch_key, "diarios": lote})
+        conteudo = hashlib.sha256(json.dumps(lote, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+        self.assertEqual(batch_key, hashlib.sha256(f"1:{conteudo}".encode()).hexdigest())
+        self.assertEqual(encode([self.diario(1, 2)])[0], batch_key)
+        self.assertNotEqual(encode([self.diario(1, 3)])[0], batch_key)
+
+    def test_validate(self):
+        """Testa SyncError 422 para payload sem diários ou com campos obrigatórios ausentes."""
+        from integrador.brokers.sga2tool_sga.batching import diarios_de, validate
+
+        self.assertEqual(diarios_de(self.diario(1, 0)), [self.diario(1, 0)])
+        with self.assertRaisesMessage(SyncError, "não tem diários"):
+            validate({"diarios": []})
+        invalido = self.diario(2, 1)
+        del invalido["diario"]["codigo"]
+        invalido["inscricoes"][0].pop("papel")
+        with self.assertRaises(SyncError) as ctx:
+            validate({"diarios": [self.diario(1, 1), invalido, "x"]})
+        self.assertEqual(ctx.exception.code, 422)
+        self.assertIn("diário 1: diario.codigo, inscricoes[].login/papel", ctx.exception.message)
+        self.assertIn("diário 2: não é um objeto JSON", ctx.exception.message)
+
+    def test_sync_up_enrolments(self):
+        """Testa o envio em lotes: todos os diários e inscrições no Moodle, uma resposta somada por diário."""
+        result = self.broker(batch_workers=3).sync_up_enrolments()
+
+        self.assertEqual(self.transporte.chamadas, 4)
+        self.assertEqual(self.mock.state.snapshot()["diarios"], 3)
+        self.assertEqual(self.mock.state.snapshot()["inscricoes"], 6)
+        self.assertEqual([d["diario_id"] for d in result["diarios"]], ["1", "2", "3"])
+        self.assertEqual(result["diarios"][0]["inscricoes"], {"criadas": 5, "atualizadas": 0, "suspensas": 0})
+        self.assertEqual(len(result["lotes"]), 4)
+        self.assertFalse(any(lote["repetido"] for lote in result["lotes"]))
+        self.assertNotIn("url", result)
+        self.solicitacao.refresh_from_db()
+        self.assertEqual(self.solicitacao.enviado["lotes"][2], {"diarios": ["1", "2"], "inscricoes": 2})
+        self.assertIn("moodle", self.solicitacao.etapas.tempos)
+
+        notas = http_get_json(
+            "https://test.moodle.com/admin/tool/sga/api/index.php?sync_down_grades&diario_id=1",
+            headers={"Authentication": f"Token {TEST_TOKEN}"},
         )
+        self.assertEqual(len(notas["notas"]), 10)
 
-    def test_requisicao(self):
-        """Testa requisicao."""
-        result = self.admin.requisicao(self.solicitacao)
-        self.assertIsInstance(result, str)
-        self.assertIn("Processando", result)
+    def test_sync_up_enrolments_um_diario(self):
+        """Testa um payload com um único diário, com a url do curso na resposta, e o sync_down_grades."""
+        self.solicitacao.recebido = self.diario(7, 3)
 
-    def test_requisicao_without_timestamp_returns_dash(self):
-        """Testa requisicao sem timestamp."""
-        self.solicitacao.timestamp = None
-        result = self.admin.requisicao(self.solicitacao)
-        self.assertIn("-", result)
-        self.assertIn("Processando", result)
+        result = self.broker().sync_up_enrolments()
+        notas = self.broker().sync_down_grades()
 
-    def test_acoes(self):
-        """Testa acoes."""
-        result = self.admin.acoes(self.solicitacao)
-        self.assertIn("Reenviar", result)
+        self.assertTrue(result["url"].startswith("https://test.moodle.com/course/view.php?id="))
+        self.assertIn("url_sala_coordenacao", result)
+        self.assertEqual(len(result["lotes"]), 2)
+        self.assertEqual(notas["diario_id"], "7")
+        self.assertEqual(len(notas["notas"]), 6)
 
-    def test_acoes_returns_dash(self):
-        """Testa acoes quando operacao nao eh SYNC_UP_DIARIO."""
-        self.solicitacao.operacao = Solicitacao.Operacao.SYNC_DOWN_NOTAS
-        result = self.admin.acoes(self.solicitacao)
-        self.assertEqual(result, "-")
+    def test_pool_do_ambiente_fechado_durante_a_solicitacao(self):
+        """Testa que, com o pool do Ambiente fechado por uma mudança na configuração, os lotes vão num pool próprio."""
+        from concurrent.futures import ThreadPoolExecutor
 
-    def test_origem(self):
-        """Testa origem."""
-        self.solicitacao.campus_sigla = "regular"
-        result = self.admin.origem(self.solicitacao)
-        self.assertIn(self.ambiente.nome, result)
-        self.assertIn("regular", result)
+        from integrador.brokers.sga2tool_sga import Sga2ToolSgaBroker
 
-    def test_professores(self):
-        """Testa professores."""
-        self.solicitacao.recebido = {"professores": [{"nome": "Prof Test", "login": "prof123", "tipo": "servidor"}]}
-        result = self.admin.professores(self.solicitacao)
-        self.assertIn("Prof Test", result)
+        fechado = ThreadPoolExecutor(max_workers=1)
+        Sga2ToolSgaBroker.close_resources({"executor": fechado})
+        broker = self.broker()
+        broker.resources = {"executor": fechado}
 
-    def test_professores_returns_dash_when_empty(self):
-        """Testa professores sem entradas."""
-        self.solicitacao.recebido = {"professores": []}
-        result = self.admin.professores(self.solicitacao)
-        self.assertEqual(result, "-")
+        result = broker.sync_up_enrolments()
 
-    def test_professores_returns_dash_on_exception(self):
-        """Testa professores retornando '-' em erro inesperado."""
-        self.solicitacao.recebido = {"professores": [{"nome": "Prof Test", "login": object(), "tipo": "servidor"}]}
-        result = self.admin.professores(self.solicitacao)
-        self.assertEqual(result, "-")
+        self.assertEqual(len(result["lotes"]), 4)
+        self.assertEqual(self.mock.state.snapshot()["inscricoes"], 6)
 
-    def test_links(self):
-        """Testa links."""
-        self.solicitacao.respondido = {"url": "https://test.com/diario"}
-        result = self.admin.links(self.solicitacao)
-        self.assertIn("https://test.com/diario", result)
+    def test_reenvio_nao_reaplica(self):
+        """Testa que o reenvio do mesmo payload numa nova solicitação usa as mesmas batch_keys e não reaplica."""
+        primeiro = self.broker().sync_up_enrolments()
+        # O reenvio do SGA e o "Reenviar" do admin criam uma nova solicitação.
+        self.solicitacao = Solicitacao.objects.create(
+            ambiente=self.ambiente, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido=self.recebido
+        )
+        segundo = self.broker().sync_up_enrolments()
 
-    def test_links_returns_dash_on_exception(self):
-        """Testa links retornando '-' em erro inesperado."""
-        result = self.admin.links(None)
-        self.assertEqual(result, "-")
+        self.assertEqual(
+            [lote["batch_key"] for lote in segundo["lotes"]], [lote["batch_key"] for lote in primeiro["lotes"]]
+        )
+        self.assertTrue(all(lote["repetido"] for lote in segundo["lotes"]))
+        self.assertEqual(self.mock.state.counters["lotes_repetidos"], 4)
+        self.assertEqual(self.mock.state.counters["sync_up"], 5)
+
+    def test_retentativa_com_a_mesma_batch_key(self):
+        """Testa que um lote com erro transitório é reenviado com a mesma batch_key, e um 4xx não é."""
+        falhas = {"restantes": 1}
+        corpos = []
+        urlopen = self.transporte.urlopen
+
+        def instavel(req, timeout):
+            corpos.append(json.loads(req.data)["batch_key"])
+            if falhas["restantes"]:
+                falhas["restantes"] -= 1
+                raise urllib.error.HTTPError(req.full_url, 503, "Service Unavailable", {}, io.BytesIO(b""))
+            return urlopen(req, timeout)
+
+        with patch.object(self.transporte, "urlopen", side_effect=instavel):
+            result = self.broker(batch_workers=1).sync_up_enrolments()
+
+        self.assertEqual(len(corpos), 5)
+        self.assertEqual(corpos[0], corpos[1])
+        self.assertEqual(len(result["lotes"]), 4)
+
+        with patch("integrador.brokers.sga2tool_sga.http_post_json", side_effect=SyncError("inválido", 422)) as post:
+            with self.assertRaises(SyncError):
+                self.broker(batch_workers=1).sync_up_enrolments()
+        self.assertEqual(post.call_count, 1)
 
-    def test_links_with_sincronizacao_url(self):
-        """Testa links com sincronizacao_url no dicionario respondido."""
-        self.solicitacao.respondido = {"sincronizacao_url": "http://moodle/sync"}
-        result = self.admin.links(self.solicitacao)
-        self.assertIn("http://moodle/sync", result)
-        self.assertIn("Sincronização no Moodle", result)
+    def test_falha_cancela_os_lotes_pendentes(self):
+        """Testa que, no lote que falha de vez, os pendentes não são enviados e o erro diz quantos foram aplicados."""
+        urlopen = self.transporte.urlopen
 
-    def test_links_returns_dash_when_no_items(self):
-        """Testa links retornando '-' quando nao ha nenhum link gerado."""
-        self.solicitacao.respondido = {}
-        self.solicitacao.diario_codigo = None
-        self.solicitacao.diario_id = None
-        result = self.admin.links(self.solicitacao)
-        self.assertEqual(result, "-")
+        def falha_no_segundo(req, timeout):
+            if self.transporte.chamadas >= 1:
+                raise urllib.error.URLError("Connection refused")
+            return urlopen(req, timeout)
 
-    def test_links_with_list_respondido(self):
-        """Testa links quando respondido é uma lista (ex: legado sync_down_grades)."""
-        self.solicitacao.respondido = [{"matricula": "123", "nota": 10.0}]
-        self.solicitacao.diario_codigo = "T123"
-        self.solicitacao.diario_id = "456"
-        result = self.admin.links(self.solicitacao)
-        self.assertNotIn("https://test.com/diario", result)
-        self.assertIn("Diário no SUAP", result)
-        self.assertIn("456", result)
-        self.assertIn("T123", result)
+        with patch.object(self.transporte, "urlopen", side_effect=falha_no_segundo) as chamadas:
+            with self.assertRaises(SyncError) as ctx:
+                self.broker(batch_workers=1, batch_retries=1).sync_up_enrolments()
+
+        self.assertEqual(ctx.exception.code, 502)
+        self.assertIn("Erro no lote 2 de 4", ctx.exception.message)
+        self.assertIn("1 lotes foram aplicados", ctx.exception.message)
+        self.assertEqual(chamadas.call_count, 3)
+        self.assertEqual(self.mock.state.counters["lotes"], 1)
+
+    def test_sync_up_enrolments_erros(self):
+        """Testa payload inválido (422), erro nas coortes (525) e ao salvar o enviado (527), sem chamar o Moodle."""
+        broker = self.broker()
+        with patch.object(broker, "get_cohort", side_effect=Exception("erro interno")):
+            with self.assertRaises(SyncError) as ctx:
+                broker.sync_up_enrolments()
+        self.assertEqual(ctx.exception.code, 525)
+        with patch.object(self.solicitacao, "save", side_effect=Exception("erro db")):
+            with self.assertRaises(SyncError) as ctx:
+                broker.sync_up_enrolments()
+        self.assertEqual(ctx.exception.code, 527)
+        self.solicitacao.recebido = {"diarios": [{"diario": {"id": 1}}]}
+        with self.assertRaises(SyncError) as ctx:
+            broker.sync_up_enrolments()
+        self.assertEqual(ctx.exception.code, 422)
 
-    def test_links_with_dict_respondido(self):
-        """Testa links quando respondido é um dicionário (ex: novo padrão sync_down_grades)."""
-        self.solicitacao.respondido = {"url": "http://moodle/course", "url_sala_coordenacao": "http://moodle/sala"}
-        self.solicitacao.diario_codigo = "T123"
-        self.solicitacao.diario_id = "456"
-        result = self.admin.links(self.solicitacao)
-        self.assertIn("http://moodle/course", result)
-        self.assertIn("http://moodle/sala", result)
-        self.assertIn("T123", result)
+        self.assertEqual(self.transporte.chamadas, 0)
 
-    def test_get_urls_wrap_executes_admin_view_wrapper(self):
-        """Testa wrapper de get_urls delegando para admin_site.admin_view."""
-        with patch.object(
-            self.admin.admin_site, "admin_view", return_value=lambda *args, **kwargs: "ok"
-        ) as mock_admin_view:
-            urls = self.admin.get_urls()
-            callback = urls[0].callback
-            result = callback(Mock(), object_id=str(self.solicitacao.id))
+    def test_http_post_com_corpo_serializado(self):
+        """Testa que http_post envia `data` como está, com Content-Type JSON."""
+        transporte = Mock()
+        transporte.urlopen.return_value = cassette.CassetteResponse(b"{}")
+        set_transport(transporte)
 
-        self.assertEqual(result, "ok")
-        self.assertTrue(mock_admin_view.called)
-        called_views = [call.args[0] for call in mock_admin_view.call_args_list]
-        self.assertIn(self.admin.sync_moodle_view, called_views)
+        http_post("https://moodle.test/x", jsonbody={"ignorado": True}, data=b'{"a":1}')
 
-    @patch("integrador.admin.Suap2LocalSuapBroker")
-    def test_sync_moodle_view_success(self, mock_broker):
-        """Testa sync_moodle_view com sucesso."""
-        from django.test import RequestFactory
+        req = transporte.urlopen.call_args[0][0]
+        self.assertEqual(req.data, b'{"a":1}')
+        self.assertEqual(req.get_header("Content-type"), "application/json")
 
-        factory = RequestFactory()
-        request = factory.get(f"/admin/integrador/solicitacao/{self.solicitacao.id}/sync_moodle/")
 
-        mock_instance = Mock()
-        mock_instance.sync_up_enrolments.return_value = {
-            "url": "https://test.moodle.com/course/view.php?id=1",
-            "url_sala_coordenacao": "https://test.moodle.com/course/view.php?id=2",
-            "roles_not_found": [],
-        }
-        mock_broker.return_value = mock_instance
+class BrokerRegistryTestCase(TestCase):
+    """Testes para o registro dos brokers: seleção por formato e plugin, cache por versão da configuração e views."""
 
-        response = self.admin.sync_moodle_view(request, self.solicitacao.id)
-        self.assertEqual(response.status_code, 302)  # Redirect
+    def setUp(self):
+        from integrador.brokers.registry import registry
 
-    @patch("integrador.admin.Suap2LocalSuapBroker")
-    def test_sync_moodle_view_error(self, mock_broker):
-        """Testa sync_moodle_view com erro."""
-        from django.test import RequestFactory
+        self.registry = registry
+        self.addCleanup(registry.clear)
+        self.mock = ToolSgaHTTPMock()
+        self.addCleanup(set_transport, set_transport(MockMoodleTransport(self.mock)))
 
-        factory = RequestFactory()
-        request = factory.get(f"/admin/integrador/solicitacao/{self.solicitacao.id}/sync_moodle/")
+    def test_payload_format(self):
+        """Testa a detecção do formato genérico do SGA pela unidade ou pela lista de diários."""
+        from integrador.brokers.registry import payload_format
 
-        mock_broker.side_effect = Exception("Test error")
+        self.assertEqual(payload_format({"campus": {"sigla": "ZL"}}), "suap")
+        self.assertEqual(payload_format({"unidade": {"sigla": "ZL"}}), "sga")
+        self.assertEqual(payload_format({"sga": "sigaa", "diarios": []}), "sga")
+        self.assertEqual(payload_format(None), "suap")
 
-        response = self.admin.sync_moodle_view(request, self.solicitacao.id)
-        self.assertEqual(response.status_code, 200)
-        self.assertIn("Test error", response.content.decode())
+    def test_broker_class(self):
+        """Testa a escolha do broker pelo plugin, na preferência de which_broker, e pelo formato."""
+        from integrador.brokers.sga2tool_sga import Sga2ToolSgaBroker
+        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
 
-    @patch("integrador.admin.Suap2LocalSuapBroker")
-    def test_sync_moodle_view_handles_none_response(self, mock_broker):
-        """Testa sync_moodle_view quando broker retorna None."""
-        from django.test import RequestFactory
+        ambos = Ambiente(**AMBIENTE_GOOD_SGA)
+        local_suap = Ambiente(**AMBIENTE_GOOD_SUAP)
 
-        factory = RequestFactory()
-        request = factory.get(f"/admin/integrador/solicitacao/{self.solicitacao.id}/sync_moodle/")
+        self.assertIs(self.registry.broker_class(ambos, "suap"), Suap2ToolSgaBroker)
+        self.assertIs(self.registry.broker_class(ambos, "sga"), Sga2ToolSgaBroker)
+        self.assertIs(self.registry.broker_class(local_suap, "suap"), Suap2LocalSuapBroker)
+        with self.assertRaises(SyncError) as ctx:
+            self.registry.broker_class(local_suap, "sga")
+        self.assertIn("não está configurado para enviar dados no formato sga", ctx.exception.message)
 
-        mock_instance = Mock()
-        mock_instance.sync_up_enrolments.return_value = None
-        mock_broker.return_value = mock_instance
+    def test_resolve_uma_vez_por_versao_da_configuracao(self):
+        """Testa que o broker e os recursos são reaproveitados até a configuração do Ambiente mudar."""
+        from integrador.brokers.sga2tool_sga import Sga2ToolSgaBroker
 
-        response = self.admin.sync_moodle_view(request, self.solicitacao.id)
-        self.assertEqual(response.status_code, 200)
-        self.assertIn("Erro desconhecido", response.content.decode())
+        ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        with patch.object(Sga2ToolSgaBroker, "create_resources", return_value={"executor": Mock()}) as criar:
+            primeiro = self.registry.resolve(ambiente, "sga")
+            mesmo = self.registry.resolve(Ambiente.objects.get(pk=ambiente.pk), "sga")
+            ambiente.nome = "Outro nome"
+            ainda = self.registry.resolve(ambiente, "sga")
+            ambiente.url = "https://outro.moodle.com"
+            novo = self.registry.resolve(ambiente, "sga")
+
+        self.assertIs(primeiro, mesmo)
+        self.assertIs(primeiro, ainda)
+        self.assertIsNot(primeiro, novo)
+        self.assertEqual(criar.call_count, 2)
+        # Os recursos da versão anterior são fechados na troca; os da nova, não.
+        primeiro.resources["executor"].shutdown.assert_called_once_with(wait=False)
+        novo.resources["executor"].shutdown.assert_not_called()
+        self.assertIs(primeiro(Solicitacao(ambiente=ambiente)).resources, primeiro.resources)
+        self.assertEqual(self.registry.resolve(ambiente, "suap").broker_class.__name__, "Suap2ToolSgaBroker")
+
+    def test_credenciais_do_plugin_do_broker(self):
+        """Testa que cada broker usa o token do seu plugin, não o de which_broker."""
+        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
 
-    @patch("base.admin.BaseModelAdmin.get_queryset")
-    def test_get_queryset_select_related_ambiente(self, mock_get_queryset):
-        """Testa que SolicitacaoAdmin.get_queryset aplica select_related em ambiente."""
-        request = RequestFactory().get("/admin/integrador/solicitacao/")
-        request.user = User.objects.create_superuser("admin_sol", "admin_sol@test.com", str(uuid.uuid4()))
+        ambiente = Ambiente(**(AMBIENTE_GOOD_SGA | {"local_suap_token": "token-local", "tool_sga_token": "token-sga"}))
+        solicitacao = Solicitacao(ambiente=ambiente)
 
-        mock_qs = Mock()
-        mock_qs.select_related.return_value = "SELECT_RELATED_QS"
-        mock_get_queryset.return_value = mock_qs
+        self.assertEqual(Suap2LocalSuapBroker(solicitacao).credentials, {"Authentication": "Token token-local"})
+        self.assertEqual(Suap2ToolSgaBroker(solicitacao).credentials, {"Authentication": "Token token-sga"})
+        self.assertEqual(BaseBroker(solicitacao).credentials, {"Authentication": "Token token-sga"})
 
-        result = self.admin.get_queryset(request)
+    def test_clear_fecha_os_recursos(self):
+        """Testa que o clear libera o pool de threads do Sga2ToolSgaBroker."""
+        ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        executor = self.registry.resolve(ambiente, "sga").resources["executor"]
 
-        self.assertEqual(result, "SELECT_RELATED_QS")
-        mock_qs.select_related.assert_called_once_with("ambiente")
+        self.registry.clear()
 
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+        self.assertIsNot(self.registry.resolve(ambiente, "sga").resources["executor"], executor)
 
-class BaseBrokerTestCase(TestCase):
-    """Testes para BaseBroker."""
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    def test_views_com_tool_sga(self):
+        """Testa enviar_diarios com os dois formatos e baixar_notas pelo broker do tool_sga, de ponta a ponta."""
+        from integrador.views import sync_down_grades
 
-    def setUp(self):
-        """Configura o ambiente de teste."""
-        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        # O mesmo Moodle, selecionado pela unidade no formato genérico e pelo campus no do SUAP.
+        Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"expressao_seletora": "unidade['sigla'] == 'TEST'"}))
+        Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"ordem": 2}))
+        generico = Sga2ToolSgaBrokerTestCase.diario(77, 3)
+        factory = RequestFactory()
+        auth = {"HTTP_AUTHENTICATION": f"Token {TEST_TOKEN}"}
 
-        self.solicitacao = Solicitacao.objects.create(
-            ambiente=self.ambiente, operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido={"diario": {"id": 123}}
+        enviado = sync_up_enrolments(
+            factory.post("/api/enviar_diarios/", json.dumps(generico), content_type="application/json", **auth)
         )
+        notas = sync_down_grades(factory.get("/api/baixar_notas/?diario_id=77&campus_sigla=TEST", **auth))
 
-        self.broker = BaseBroker(self.solicitacao)
-
-    def test_base_broker_initialization(self):
-        """Testa inicialização do BaseBroker."""
-        self.assertEqual(self.broker.solicitacao, self.solicitacao)
-        self.assertEqual(self.broker.solicitacao.ambiente, self.ambiente)
+        self.assertEqual(enviado.status_code, 200, enviado.content)
+        self.assertEqual(json.loads(enviado.content)["diarios"][0]["diario_id"], "77")
+        self.assertEqual(notas.status_code, 200)
+        self.assertEqual(len(json.loads(b"".join(notas.streaming_content))["notas"]), 6)
+        solicitacao = Solicitacao.objects.get(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO)
+        self.assertEqual((solicitacao.campus_sigla, solicitacao.diario_codigo), ("TEST", "T20.D30#77"))
 
-    def test_base_broker_credentials_property(self):
-        """Testa propriedade credentials."""
-        credentials = self.broker.credentials
 
-        self.assertIn("Authentication", credentials)
-        self.assertIn(f"Token {TEST_TOKEN}", credentials["Authentication"])
+class SyncDownGradesBatchTestCase(TestCase):
+    """Testes para o download de notas em lote: agrupamento por Ambiente, fan-out limitado, lotes e NDJSON."""
 
-    def test_base_broker_get_cohorts(self):
-        """Testa método get_cohort."""
-        cohorts = self.broker.get_cohort()
+    class TransporteContado(MockMoodleTransport):
+        """Conta as chamadas simultâneas ao Moodle."""
 
-        self.assertEqual(cohorts, [])
+        def __init__(self, mock):
+            super().__init__(mock)
+            self.simultaneas = self.maximo = 0
 
-    def test_base_broker_sync_up_enrolments_not_implemented(self):
-        """Testa que sync_up_enrolments não está implementado."""
-        with self.assertRaises(NotImplementedError):
-            self.broker.sync_up_enrolments()
+        def urlopen(self, req, timeout):
+            with self._lock:
+                self.simultaneas += 1
+                self.maximo = max(self.maximo, self.simultaneas)
+            try:
+                time.sleep(0.02)
+                return super().urlopen(req, timeout)
+            finally:
+                with self._lock:
+                    self.simultaneas -= 1
 
-    def test_base_broker_sync_down_grades_not_implemented(self):
-        """Testa que sync_down_grades não está implementado."""
-        with self.assertRaises(NotImplementedError):
-            self.broker.sync_down_grades()
+    def setUp(self):
+        from integrador.brokers.registry import registry
 
-    def test_base_broker_cast_cohort_maps_expected_payload(self):
-        """Testa cast_cohort com mapeamento completo de dados."""
-        user = Mock(fullname="User Name", email="user@test.com", login="user_login", active=True)
-        role = Mock(name="Coordenador de curso", shortname="coordenadordecurso", active=True)
-        enrolment = Mock(user=user)
-        enrolments = Mock()
-        enrolments.select_related.return_value.all.return_value = [enrolment]
-        cohort = SimpleNamespace(
-            name="Cohort Test",
-            role=role,
-            active=True,
-            idnumber="COHORT-1",
-            description="Desc",
-            enrolments=enrolments,
+        self.addCleanup(registry.clear)
+        self.tool_sga = Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"local_suap_active": False}))
+        self.local_suap = Ambiente.objects.create(
+            **(AMBIENTE_GOOD_SUAP | {"url": "https://zl.moodle.com", "expressao_seletora": "campus['sigla'] == 'ZL'"})
+        )
+        self.mock = ToolSgaHTTPMock()
+        for diario_id in (1, 2):
+            self.mock.state.upsert_diario(Sga2ToolSgaBrokerTestCase.diario(diario_id, 2), self.tool_sga.base_url)
+        local_suap = LocalSuapHTTPMock()
+        roteador = SimpleNamespace(
+            request=lambda method, url, **kwargs: (
+                self.mock if ToolSgaHTTPMock.PLUGIN_PATH in url else local_suap
+            ).request(method, url, **kwargs)
         )
+        self.transporte = self.TransporteContado(roteador)
+        self.addCleanup(set_transport, set_transport(self.transporte))
 
-        payload = self.broker.cast_cohort(cohort)
+    @staticmethod
+    def linhas(lote) -> dict:
+        linhas = [json.loads(linha) for linha in b"".join(lote).splitlines()]
+        return {(linha["campus_sigla"], linha["diario_id"]): linha for linha in linhas}
 
-        self.assertEqual(payload["nome"], "Cohort Test")
-        self.assertEqual(payload["role"], "coordenadordecurso")
-        self.assertEqual(payload["idnumber"], "COHORT-1")
-        self.assertEqual(payload["colaboradores"][0]["email"], "user@test.com")
+    def test_parse_pedido(self):
+        """Testa os pares (campus, diário) sem repetições e os erros 422 do pedido."""
+        from integrador.notas import parse_pedido
 
-    @patch("integrador.brokers.base.logger.warning")
-    @patch("integrador.brokers.base.rule_engine.Rule")
-    def test_base_broker_cohort_matches_handles_rule_error(self, mock_rule, mock_warning):
-        """Testa cohort_matches quando a avaliação da regra falha."""
-        cohort = Mock(id=10, name="Cohort Error", rule_diario="invalid")
-        mock_rule.side_effect = Exception("invalid rule")
+        diarios = [{"campus_sigla": "ZL", "diario_id": 1}, {"campus_sigla": "ZL", "diario_id": "1"}]
+        self.assertEqual(
+            parse_pedido({"diarios": diarios + [{"campus_sigla": "TEST", "diario_id": 1}]}),
+            [
+                ("ZL", "1"),
+                ("TEST", "1"),
+            ],
+        )
+        for recebido in (
+            {},
+            {"diarios": []},
+            {"diarios": [{"campus_sigla": "ZL", "diario_id": "x"}]},
+            {"diarios": [1]},
+        ):
+            with self.assertRaises(SyncError) as ctx:
+                parse_pedido(recebido)
+            self.assertEqual(ctx.exception.code, 422)
+        with patch("integrador.notas.BATCH_MAX_DIARIOS", 1), self.assertRaises(SyncError):
+            parse_pedido({"diarios": diarios + [{"campus_sigla": "ZL", "diario_id": 2}]})
 
-        result = self.broker.cohort_matches(cohort, "rule_diario")
+    def test_tool_sga_pelo_servico_em_lote(self):
+        """Testa as fatias do sync_down_grades_batch e o erro por diário devolvido pelo Moodle."""
+        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
+        from integrador.notas import NotasEmLote
 
-        self.assertFalse(result)
-        mock_warning.assert_called_once()
+        with patch.object(Suap2ToolSgaBroker, "grades_batch_size", 2):
+            linhas = self.linhas(NotasEmLote([("TEST", "1"), ("TEST", "2"), ("TEST", "3")]).prepara())
 
-    @patch("integrador.brokers.base.Cohort.objects.filter")
-    def test_base_broker_get_cohort_combines_diario_and_coordenacao(self, mock_filter):
-        """Testa get_cohort combinando cohorts elegíveis por regras diferentes."""
-        cohort_a = SimpleNamespace(name="A")
-        cohort_b = SimpleNamespace(name="B")
-        mock_filter.return_value = [cohort_a, cohort_b]
+        self.assertEqual(self.transporte.chamadas, 2)
+        self.assertEqual(linhas[("TEST", "1")]["code"], 200)
+        self.assertEqual(len(linhas[("TEST", "2")]["resposta"]["notas"]), 4)
+        self.assertEqual(
+            (linhas[("TEST", "3")]["code"], linhas[("TEST", "3")]["error"]), (404, "Diário não encontrado")
+        )
+        solicitacoes = Solicitacao.objects.filter(operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS).order_by("diario_id")
+        self.assertEqual(
+            [(s.diario_id, s.status, s.status_code, s.ambiente_id) for s in solicitacoes],
+            [
+                ("1", Solicitacao.Status.SUCESSO, "200", self.tool_sga.pk),
+                ("2", Solicitacao.Status.SUCESSO, "200", self.tool_sga.pk),
+                ("3", Solicitacao.Status.FALHA, "404", self.tool_sga.pk),
+            ],
+        )
+        self.assertEqual(linhas[("TEST", "1")]["solicitacao"], solicitacoes[0].id)
+        self.assertEqual((solicitacoes[0].campus_sigla, solicitacoes[0].diario_codigo), ("TEST", ".#1"))
+        self.assertIn("moodle", solicitacoes[0].tempos)
+        self.assertEqual(DiarioSyncState.objects.filter(ambiente=self.tool_sga).count(), 3)
+        rollup = SolicitacaoRollup.objects.get(ambiente=self.tool_sga, status=Solicitacao.Status.SUCESSO)
+        self.assertEqual(rollup.total, 2)
+
+    def test_local_suap_um_diario_por_chamada_com_fan_out_limitado(self):
+        """Testa as chamadas por diário, no máximo `workers` simultâneas por Ambiente, e o Ambiente não encontrado."""
+        from integrador.notas import NotasEmLote
+
+        pedidos = [("ZL", str(i)) for i in range(1, 7)] + [("XX", "1")]
+        linhas = self.linhas(NotasEmLote(pedidos, workers=2).prepara())
+
+        self.assertEqual(self.transporte.chamadas, 6)
+        self.assertEqual(self.transporte.maximo, 2)
+        self.assertEqual({linhas[("ZL", str(i))]["code"] for i in range(1, 7)}, {200})
+        self.assertEqual(linhas[("ZL", "4")]["resposta"]["notas"][0]["diario_id"], "4")
+        self.assertEqual((linhas[("XX", "1")]["code"], linhas[("XX", "1")]["solicitacao"]), (404, None))
+        self.assertEqual(
+            Solicitacao.objects.filter(ambiente=self.local_suap, status=Solicitacao.Status.SUCESSO).count(), 6
+        )
 
-        with patch.object(self.broker, "cohort_matches") as mock_matches:
-            mock_matches.side_effect = lambda cohort, field: (cohort is cohort_a and field == "rule_diario") or (
-                cohort is cohort_b and field == "rule_coordenacao"
-            )
-            with patch.object(self.broker, "cast_cohort") as mock_cast:
-                mock_cast.side_effect = lambda cohort: {"nome": cohort.name}
+    def test_falha_do_lote_falha_os_diarios(self):
+        """Testa que uma chamada em lote que falha registra a falha em cada diário dela."""
+        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
+        from integrador.notas import NotasEmLote
+
+        with patch.object(Suap2ToolSgaBroker, "sync_down_grades_batch", side_effect=SyncError("Fora do ar", 503)):
+            linhas = self.linhas(NotasEmLote([("TEST", "1"), ("TEST", "2")]).prepara())
+
+        self.assertEqual({linha["code"] for linha in linhas.values()}, {503})
+        self.assertEqual(
+            set(Solicitacao.objects.values_list("status", "status_code")), {(Solicitacao.Status.FALHA, "503")}
+        )
 
-                cohorts = self.broker.get_cohort()
+    def test_interrompido_falha_os_pendentes(self):
+        """Testa que, se o cliente desconecta, os diários que ainda não ficaram prontos são gravados como falha."""
+        from integrador.notas import NotasEmLote
 
-        self.assertEqual(cohorts, [{"nome": "A"}, {"nome": "B"}])
+        linhas = iter(NotasEmLote([("ZL", str(i)) for i in range(1, 6)], workers=1).prepara())
+        next(linhas)
+        linhas.close()
 
+        self.assertEqual(Solicitacao.objects.filter(status=Solicitacao.Status.SUCESSO).count(), 1)
+        self.assertEqual(Solicitacao.objects.filter(status=Solicitacao.Status.FALHA).count(), 4)
+        self.assertFalse(Solicitacao.objects.filter(status=Solicitacao.Status.PROCESSANDO).exists())
 
-class Suap2LocalSuapBrokerTestCase(TestCase):
-    """Testes para Suap2LocalSuapBroker."""
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    def test_view(self):
+        """Testa baixar_notas_lote: NDJSON em streaming e pedido inválido respondido em JSON."""
+        auth = {"HTTP_AUTHENTICATION": f"Token {TEST_TOKEN}"}
+        url = reverse("integrador:api_sync_down_grades_batch")
+        pedido = {"diarios": [{"campus_sigla": "TEST", "diario_id": 1}, {"campus_sigla": "ZL", "diario_id": 9}]}
 
-    def setUp(self):
-        """Configura o ambiente de teste."""
-        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        response = self.client.post(url, json.dumps(pedido), content_type="application/json", **auth)
+        invalido = self.client.post(url, json.dumps({"diarios": []}), content_type="application/json", **auth)
 
-        self.solicitacao = Solicitacao.objects.create(
-            ambiente=self.ambiente,
-            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
-            diario_id="123",
-            recebido={
-                "campus": {"id": 1, "sigla": "TEST", "descricao": "Campus Teste"},
-                "curso": {"id": 10, "codigo": "15806", "nome": "Sistemas Operacionais Abertos"},
-                "turma": {"id": 2, "codigo": "T1"},
-                "componente": {"id": 5, "sigla": "TEC.1023", "descricao": "Bancos de Dados"},
-                "diario": {"id": 123, "sigla": "TEC.1023", "situacao": "Aberto"},
-            },
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        linhas = self.linhas(response.streaming_content)
+        self.assertEqual(
+            {chave: linha["code"] for chave, linha in linhas.items()}, {("TEST", "1"): 200, ("ZL", "9"): 200}
         )
+        self.assertEqual(invalido.status_code, 422)
+        self.assertEqual(self.client.get(url, **auth).status_code, 501)
 
-        self.broker = Suap2LocalSuapBroker(self.solicitacao)
 
-    def test_broker_initialization(self):
-        """Testa inicialização do broker."""
-        self.assertEqual(self.broker.solicitacao, self.solicitacao)
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, SUAP_INTEGRADOR_KEY=TEST_TOKEN
+)
+class GradesCacheTestCase(TestCase):
+    """Testes para o cache de notas do baixar_notas: TTL, revalidação por ETag e por hash e Solicitações curtas."""
 
-    def test_broker_moodle_base_api_url_property(self):
-        """Testa propriedade moodle_base_api_url."""
-        self.assertEqual(self.broker.moodle_base_api_url, "https://test.moodle.com/local/suap/api")
+    def setUp(self):
+        from django.core.cache import cache
 
-    @patch("integrador.brokers.suap2local_suap.http_post_json")
-    def test_broker_sync_up_enrolments_success(self, mock_http_post_json):
-        """Testa sync_up_enrolments com sucesso."""
-        mock_http_post_json.return_value = {
-            "url": "https://test.moodle.com/course/view.php?id=1",
-            "url_sala_coordenacao": "https://test.moodle.com/course/view.php?id=2",
-            "roles_not_found": [],
-        }
+        from integrador.brokers.registry import registry
 
-        result = self.broker.sync_up_enrolments()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(registry.clear)
+        self.tool_sga = Ambiente.objects.create(**(AMBIENTE_GOOD_SGA | {"local_suap_active": False}))
+        Ambiente.objects.create(
+            **(AMBIENTE_GOOD_SUAP | {"url": "https://zl.moodle.com", "expressao_seletora": "campus['sigla'] == 'ZL'"})
+        )
+        self.mock = ToolSgaHTTPMock()
+        self.mock.state.upsert_diario(Sga2ToolSgaBrokerTestCase.diario(1, 2), self.tool_sga.base_url)
+        local_suap = LocalSuapHTTPMock()
+        self.transporte = MockMoodleTransport(
+            SimpleNamespace(
+                request=lambda method, url, **kwargs: (
+                    self.mock if ToolSgaHTTPMock.PLUGIN_PATH in url else local_suap
+                ).request(method, url, **kwargs)
+            )
+        )
+        self.addCleanup(set_transport, set_transport(self.transporte))
 
-        self.assertIn("url", result)
-        self.assertIn("url_sala_coordenacao", result)
-        self.assertEqual(result["roles_not_found"], [])
-        self.assertEqual(result["ambiente"], "https://test.moodle.com")
-        mock_http_post_json.assert_called_once()
+    def baixa(self, campus_sigla="TEST", diario_id=1):
+        from integrador.views import sync_down_grades
 
-    def test_broker_sync_up_enrolments_payload_faltando_campo_obrigatorio(self):
-        """Testa que SyncError é lançado quando o payload não tem campos obrigatórios."""
-        self.solicitacao.recebido = {"diario": {"id": 1}}  # incompleto
-        self.solicitacao.save()
-        with self.assertRaises(SyncError) as ctx:
-            self.broker.sync_up_enrolments()
-        self.assertEqual(ctx.exception.code, 422)
-        self.assertIn("campus", str(ctx.exception))
+        request = RequestFactory().get(
+            f"/api/baixar_notas/?diario_id={diario_id}&campus_sigla={campus_sigla}",
+            HTTP_AUTHENTICATION=f"Token {TEST_TOKEN}",
+        )
+        response = sync_down_grades(request)
+        corpo = b"".join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, json.loads(corpo)
+
+    def solicitacoes(self):
+        return list(Solicitacao.objects.filter(operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS).order_by("id"))
+
+    def test_dentro_do_ttl_nao_chama_o_moodle(self):
+        """Testa que, dentro do TTL, as notas vêm do cache e a Solicitação aponta a que tem a resposta completa."""
+        primeira = self.baixa()
+        segunda = self.baixa()
+
+        self.assertEqual(self.transporte.chamadas, 1)
+        self.assertEqual(primeira, segunda)
+        self.assertEqual(len(primeira[1]["notas"]), 4)
+        completa, curta = self.solicitacoes()
+        self.assertEqual(completa.respondido, primeira[1])
+        self.assertEqual(curta.respondido, {"cache": {"solicitacao": completa.id, "revalidada": False}})
+        self.assertEqual((curta.status, curta.diario_id, curta.campus_sigla), (Solicitacao.Status.SUCESSO, "1", "TEST"))
+        self.assertEqual(DiarioSyncState.objects.get(diario_id="1").solicitacao_id, completa.id)
+        self.assertEqual(SolicitacaoRollup.objects.get(ambiente=self.tool_sga).total, 2)
+
+    @patch("integrador.notas.CACHE_TTL", 1e-6)
+    def test_revalida_pelo_etag(self):
+        """Testa o If-None-Match depois do TTL: 304 vira Solicitação curta; notas lançadas, Solicitação completa."""
+        primeira = self.baixa()
+        segunda = self.baixa()
+        self.mock.state.set_grades(1, [{"matricula": "1", "etapa": 1, "nota": 9.5}])
+        terceira = self.baixa()
+        quarta = self.baixa()
+
+        self.assertEqual(self.transporte.chamadas, 4)
+        self.assertEqual(primeira, segunda)
+        self.assertEqual(terceira[1]["notas"], [{"matricula": "1", "etapa": 1, "nota": 9.5, "diario_id": "1"}])
+        self.assertEqual(terceira, quarta)
+        completa, curta, nova, outra_curta = self.solicitacoes()
+        self.assertEqual(curta.respondido, {"cache": {"solicitacao": completa.id, "revalidada": True}})
+        self.assertEqual(nova.respondido, terceira[1])
+        self.assertEqual(outra_curta.respondido["cache"]["solicitacao"], nova.id)
+        self.assertIn("moodle", curta.tempos)
+
+    @patch("integrador.notas.CACHE_TTL", 1e-6)
+    def test_revalida_pelo_hash_sem_etag(self):
+        """Testa que, sem ETag (local_suap), a mesma resposta é revalidada pelo hash e vira Solicitação curta."""
+        primeira = self.baixa("ZL", 7)
+        segunda = self.baixa("ZL", 7)
+
+        self.assertEqual(self.transporte.chamadas, 2)
+        self.assertEqual(primeira, segunda)
+        completa, curta = self.solicitacoes()
+        self.assertEqual(curta.respondido, {"cache": {"solicitacao": completa.id, "revalidada": True}})
+
+    def test_erro_do_moodle_nao_vai_para_o_cache(self):
+        """Testa que o erro da revalidação é registrado na Solicitação sem chamar o Moodle de novo."""
+        status, _ = self.baixa(diario_id=404)
+        self.baixa(diario_id=404)
+
+        self.assertEqual(status, 404)
+        self.assertEqual(self.transporte.chamadas, 2)
+        self.assertEqual(
+            [(s.status, s.status_code) for s in self.solicitacoes()], [(Solicitacao.Status.FALHA, "404")] * 2
+        )
 
-    @patch("integrador.brokers.suap2local_suap.http_post_json")
-    def test_broker_sync_up_enrolments_raises_sync_error_when_get_cohort_fails(self, mock_http_post_json):
-        """Testa sync_up_enrolments levantando SyncError quando preparação falha."""
-        with patch.object(self.broker, "get_cohort", side_effect=Exception("erro interno")):
-            with self.assertRaises(SyncError):
-                self.broker.sync_up_enrolments()
+    @patch("integrador.notas.CACHE_TTL", 0)
+    def test_ttl_zero_desliga_o_cache(self):
+        """Testa que, com SYNC_DOWN_CACHE_TTL=0, toda chamada vai ao Moodle e grava a Solicitação completa."""
+        self.baixa()
+        self.baixa()
 
-        mock_http_post_json.assert_not_called()
+        self.assertEqual(self.transporte.chamadas, 2)
+        self.assertEqual([len(s.respondido["notas"]) for s in self.solicitacoes()], [4, 4])
 
-    @patch("integrador.brokers.suap2local_suap.http_get_json")
-    def test_broker_sync_down_grades_success(self, mock_http_get_json):
-        """Testa sync_down_grades com sucesso."""
-        mock_http_get_json.return_value = {"notas": [], "url": "http://", "url_sala_coordenacao": "http://"}
+    def test_http_get_json_if_changed(self):
+        """Testa o GET condicional: o ETag da resposta e (None, etag) no 304."""
+        url = f"{self.tool_sga.base_url}{ToolSgaHTTPMock.PLUGIN_PATH}?sync_down_grades&diario_id=1"
+        headers = {"Authentication": f"Token {TEST_TOKEN}"}
 
-        result = self.broker.sync_down_grades()
+        notas, etag = http_get_json_if_changed(url, headers=headers)
 
-        self.assertEqual(result, {"notas": [], "url": "http://", "url_sala_coordenacao": "http://"})
+        self.assertEqual(notas["diario_id"], "1")
+        self.assertTrue(etag)
+        self.assertEqual(http_get_json_if_changed(url, headers=headers, etag=etag), (None, etag))
+        self.assertEqual(http_get_json_if_changed(url, headers=headers, etag='"0"')[1], etag)
 
-    @patch("integrador.brokers.suap2local_suap.http_post_json")
-    def test_broker_sync_up_enrolments_with_full_autoinscricao(self, mock_post):
-        """Testa sync_up_enrolments com todas as opções de autoinscrição (tipos de usuário, campi, etc.)"""
-        mock_post.return_value = {"status": "ok"}
 
-        self.solicitacao.recebido["autoinscricao"] = {
-            "tecnicos_administrativos": True,
-            "docentes": True,
-            "prestadores": True,
-            "alunos": True,
-            "estrangeiros": True,
-            "campi": ["ZL"],
-            "modalidades": ["EaD"],
-            "niveis_ensino": ["Superior"],
-            "cursos": ["TADS"],
-        }
-        self.solicitacao.save()
+class StreamingGradesTestCase(TestCase):
+    """Testes para a resposta em streaming do baixar_notas e o resumo das notas no respondido."""
 
-        result = self.broker.sync_up_enrolments()
-        self.assertEqual(result, {"status": "ok", "ambiente": self.ambiente.base_url})
-        self.assertIn("restricoes", self.solicitacao.enviado["turma"])
-        restricoes = self.solicitacao.enviado["turma"]["restricoes"]
-        self.assertIn("Servidor (Técnico-Administrativo)", restricoes)
-        self.assertIn("Servidor (Docente)", restricoes)
-        self.assertIn("Prestador de Serviço", restricoes)
-        self.assertIn("Aluno", restricoes)
-        self.assertIn("m['estrangeiro'] == true", restricoes)
+    RESPOSTA = {
+        "url": "https://moodle.test/course/view.php?id=1",
+        "notas": [{"matricula": f"2026{i:04d}", "nota": 7.5, "etapa": 1} for i in range(2000)],
+        "vazia": [],
+        "quando": datetime(2026, 10, 19, 8, 0),
+    }
 
-    def test_broker_set_restricoes_without_turma(self):
-        """Testa _set_restricoes com payload que não tem chave turma."""
-        payload = {"autoinscricao": {"tecnicos_administrativos": True}}
-        self.broker._set_restricoes(payload)
-        self.assertIn("turma", payload)
-        self.assertIn("Servidor (Técnico-Administrativo)", payload["turma"]["restricoes"])
+    def test_json_stream_response_igual_ao_json_response(self):
+        """Testa que o streaming envia, em pedaços limitados, o mesmo corpo do JsonResponse."""
+        from integrador.decorators import _json_chunks
 
-    @patch("integrador.brokers.suap2local_suap.http_post_json")
-    def test_broker_sync_up_enrolments_raises_sync_error_on_set_restricoes_error(self, mock_post):
-        """Testa sync_up_enrolments quando _set_restricoes falha (raises 526)."""
-        with patch.object(self.broker, "_set_restricoes", side_effect=Exception("erro restricoes")):
-            with self.assertRaises(SyncError) as ctx:
-                self.broker.sync_up_enrolments()
-            self.assertEqual(ctx.exception.code, 526)
+        request = RequestFactory().get("/api/baixar_notas/")
+        response = json_stream_response(lambda request: self.RESPOSTA)(request)
+        pedacos = list(_json_chunks(self.RESPOSTA, chunk_size=1024))
 
-    @patch("integrador.brokers.suap2local_suap.http_post_json")
-    def test_broker_sync_up_enrolments_raises_sync_error_on_solicitacao_save_error(self, mock_post):
-        """Testa sync_up_enrolments quando save() falha (raises 527)."""
-        with patch.object(self.solicitacao, "save", side_effect=Exception("erro db")):
-            with self.assertRaises(SyncError) as ctx:
-                self.broker.sync_up_enrolments()
-            self.assertEqual(ctx.exception.code, 527)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b"".join(response.streaming_content), JsonResponse(self.RESPOSTA).content)
+        self.assertEqual(b"".join(pedacos), JsonResponse(self.RESPOSTA).content)
+        self.assertGreater(len(pedacos), 50)
+        self.assertLess(max(len(p) for p in pedacos), 1024 + 100)
+        self.assertEqual(b"".join(_json_chunks([1, "a"])), b'[1, "a"]')
 
+    def test_json_stream_response_repassa_respostas(self):
+        """Testa que uma resposta pronta (ex.: do cache ou de erro) passa pelo streaming e pelo json_response."""
+        request = RequestFactory().get("/api/baixar_notas/")
+        pronta = JsonResponse({"error": "x"}, status=404)
 
-class Suap2ToolSgaBrokerTestCase(TestCase):
-    """Testes para Suap2ToolSgaBroker."""
+        self.assertIs(json_stream_response(lambda request: pronta)(request), pronta)
+        self.assertIs(json_response(json_stream_response(lambda request: pronta))(request), pronta)
 
-    def test_sync_up_enrolments_not_implemented(self):
-        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
+    def test_resumo(self):
+        """Testa o resumo: listas cortadas no limite, tamanho original em `truncado`, os demais campos inteiros."""
+        from integrador.notas import resumo
 
-        broker = Suap2ToolSgaBroker(None)
-        with self.assertRaises(NotImplementedError):
-            broker.sync_up_enrolments()
+        resumida = resumo(self.RESPOSTA, limite=4096)
 
-    def test_sync_down_grades_not_implemented(self):
-        from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
+        self.assertLessEqual(len(json.dumps(resumida["notas"])), 4096)
+        self.assertEqual(resumida["notas"], self.RESPOSTA["notas"][: len(resumida["notas"])])
+        self.assertEqual(resumida["truncado"], {"notas": 2000})
+        self.assertEqual((resumida["url"], resumida["vazia"]), (self.RESPOSTA["url"], []))
+        self.assertIs(resumo(self.RESPOSTA, limite=0), self.RESPOSTA)
+        self.assertIs(resumo(self.RESPOSTA, limite=10**7), self.RESPOSTA)
+        self.assertEqual(resumo([1, 2], limite=1), [1, 2])
 
-        broker = Suap2ToolSgaBroker(None)
-        with self.assertRaises(NotImplementedError):
-            broker.sync_down_grades()
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    @patch("integrador.notas.CACHE_TTL", 0)
+    @patch("integrador.notas.RESPONDIDO_MAX_BYTES", 2048)
+    @patch("integrador.brokers.suap2local_suap.http_get_json")
+    def test_baixar_notas_responde_inteiro_e_guarda_o_resumo(self, mock_get):
+        """Testa que o SUAP recebe todas as notas e o respondido guarda o resumo, com a URL para o estado do diário."""
+        from integrador.views import sync_down_grades
+
+        Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+        resposta = {k: v for k, v in self.RESPOSTA.items() if k != "quando"}
+        mock_get.return_value = resposta
+        request = RequestFactory().get(
+            "/api/baixar_notas/?diario_id=456&campus_sigla=TEST", HTTP_AUTHENTICATION=f"Token {TEST_TOKEN}"
+        )
+
+        response = sync_down_grades(request)
+
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), resposta)
+        self.assertIn("Server-Timing", response)
+        solicitacao = Solicitacao.objects.get()
+        self.assertEqual(solicitacao.respondido["truncado"], {"notas": 2000})
+        self.assertLess(len(solicitacao.respondido["notas"]), 100)
+        self.assertEqual(DiarioSyncState.objects.get(diario_id="456").url, resposta["url"])
 
 
 class ManagementCommandTestCase(TestCase):
@@ -2368,6 +4889,443 @@ class ManagementCommandTestCase(TestCase):
         self.assertIsNotNone(sol.ambiente)
         self.assertIsNotNone(sol.ambiente)
 
+    def _solicitacao_sem_campos(self, recebido, **kwargs):
+        sol = Solicitacao.objects.create(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido=recebido, **kwargs)
+        Solicitacao.objects.filter(pk=sol.pk).update(
+            ambiente=None, campus_sigla=None, diario_id=None, diario_codigo=None, tipo=None
+        )
+        return sol
+
+    def test_atualiza_solicitacoes_derives_fields_like_save(self):
+        """Testa que o UPDATE set-based deriva os mesmos campos que Solicitacao.save()."""
+        recebido = {
+            "campus": {"sigla": "TEST"},
+            "turma": {"codigo": "20261.1.15806.1E"},
+            "diario": {"id": 42, "sigla": "TEC.0001", "tipo": "minicurso"},
+        }
+        sol = self._solicitacao_sem_campos(recebido)
+        sem_turma = self._solicitacao_sem_campos({"diario": {"id": 7}})
+        esperado = Solicitacao(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido=recebido)
+        esperado.save()
+        esperado.refresh_from_db()
+
+        call_command("atualiza_solicitacoes", stdout=io.StringIO())
+
+        sol.refresh_from_db()
+        self.assertEqual(sol.campus_sigla, esperado.campus_sigla)
+        self.assertEqual(sol.diario_id, esperado.diario_id)
+        self.assertEqual(sol.diario_codigo, esperado.diario_codigo)
+        self.assertEqual(sol.tipo, esperado.tipo)
+        self.assertEqual(sol.ambiente, self.ambiente)
+        sem_turma.refresh_from_db()
+        self.assertEqual(sem_turma.diario_codigo, ".#7")
+        self.assertEqual(sem_turma.tipo, "regular")
+        self.assertIsNone(sem_turma.ambiente)
+
+    def test_atualiza_solicitacoes_formato_generico(self):
+        """Testa que, no formato genérico do SGA, o campus vem da unidade e o código do próprio diário."""
+        recebido = {"unidade": {"sigla": "UNI"}, "turma": {"codigo": "T20"}, "diario": {"id": 5, "codigo": "T20.D30#5"}}
+        sol = self._solicitacao_sem_campos(recebido)
+        sem_codigo = self._solicitacao_sem_campos({"unidade": {"sigla": "UNI"}, "diario": {"id": 6, "codigo": ""}})
+
+        call_command("atualiza_solicitacoes", stdout=io.StringIO())
+
+        sol.refresh_from_db()
+        sem_codigo.refresh_from_db()
+        esperado = Solicitacao(operacao=Solicitacao.Operacao.SYNC_UP_DIARIO, recebido=recebido)
+        esperado.preenche_do_recebido()
+        self.assertEqual((sol.campus_sigla, sol.diario_codigo), ("UNI", "T20.D30#5"))
+        self.assertEqual((sol.campus_sigla, sol.diario_codigo), (esperado.campus_sigla, esperado.diario_codigo))
+        self.assertEqual((sem_codigo.campus_sigla, sem_codigo.diario_codigo), ("UNI", ".#6"))
+
+    def test_atualiza_solicitacoes_reselects_ambiente(self):
+        """Testa que, por padrão, o ambiente é selecionado de novo e fica nulo quando nenhum casa."""
+        outro = Ambiente.objects.create(nome="Outro", url="http://outro", expressao_seletora="false")
+        sol = Solicitacao.objects.create(ambiente=outro, recebido={"campus": {"sigla": "TEST"}, "diario": {"id": 1}})
+        orfa = Solicitacao.objects.create(ambiente=outro, recebido={"campus": {"sigla": "XX"}, "diario": {"id": 2}})
+        Solicitacao.objects.filter(pk__in=[sol.pk, orfa.pk]).update(diario_codigo=None)
+
+        call_command("atualiza_solicitacoes", stdout=io.StringIO())
+
+        sol.refresh_from_db()
+        orfa.refresh_from_db()
+        self.assertEqual(sol.ambiente, self.ambiente)
+        self.assertEqual(sol.diario_codigo, ".#1")
+        self.assertIsNone(orfa.ambiente)
+
+    def test_atualiza_solicitacoes_mantem_ambiente(self):
+        """Testa que, com --mantem-ambiente, o ambiente já definido não é reavaliado."""
+        outro = Ambiente.objects.create(nome="Outro", url="http://outro", expressao_seletora="false")
+        sol = Solicitacao.objects.create(ambiente=outro, recebido={"campus": {"sigla": "TEST"}, "diario": {"id": 1}})
+        sem_ambiente = self._solicitacao_sem_campos({"campus": {"sigla": "TEST"}, "diario": {"id": 2}})
+        Solicitacao.objects.filter(pk=sol.pk).update(diario_codigo=None)
+
+        call_command("atualiza_solicitacoes", "--mantem-ambiente", stdout=io.StringIO())
+
+        sol.refresh_from_db()
+        sem_ambiente.refresh_from_db()
+        self.assertEqual(sol.ambiente, outro)
+        self.assertEqual(sol.diario_codigo, ".#1")
+        self.assertEqual(sem_ambiente.ambiente, self.ambiente)
+
+    def test_atualiza_solicitacoes_terminates_without_recebido(self):
+        """Testa que linhas sem JSON recebido não prendem o comando em loop."""
+        Solicitacao.objects.create(recebido=None)
+
+        out = io.StringIO()
+        call_command("atualiza_solicitacoes", "--chunk-size", "1", stdout=out)
+
+        self.assertIn("0 linhas atualizadas", out.getvalue())
+        checkpoint = BackfillCheckpoint.objects.get(tarefa="atualiza_solicitacoes")
+        self.assertIsNotNone(checkpoint.concluido_em)
+        self.assertEqual(checkpoint.progresso, 100.0)
+
+    def test_atualiza_solicitacoes_reports_progress_and_checkpoints(self):
+        """Testa o relatório de progresso e os checkpoints por lote."""
+        for i in range(5):
+            self._solicitacao_sem_campos({"diario": {"id": i}})
+
+        out = io.StringIO()
+        call_command("atualiza_solicitacoes", "--chunk-size", "2", stdout=out)
+
+        self.assertEqual(out.getvalue().count("[atualiza_solicitacoes]"), 3)
+        self.assertIn("5 linhas atualizadas", out.getvalue())
+        checkpoint = BackfillCheckpoint.objects.get(tarefa="atualiza_solicitacoes")
+        self.assertEqual(checkpoint.linhas, 5)
+        self.assertIn("atualiza_solicitacoes", str(checkpoint))
+
+    def test_atualiza_solicitacoes_resumes_from_checkpoint(self):
+        """Testa que uma execução interrompida é retomada do último id processado."""
+        primeira = self._solicitacao_sem_campos({"diario": {"id": 1}})
+        segunda = self._solicitacao_sem_campos({"diario": {"id": 2}})
+        BackfillCheckpoint.objects.create(
+            tarefa="atualiza_solicitacoes", inicio=primeira.id, fim=segunda.id, ultimo_id=primeira.id
+        )
+
+        call_command("atualiza_solicitacoes", stdout=io.StringIO())
+
+        primeira.refresh_from_db()
+        segunda.refresh_from_db()
+        self.assertIsNone(primeira.diario_codigo)
+        self.assertEqual(segunda.diario_codigo, ".#2")
+
+        call_command("atualiza_solicitacoes", "--restart", stdout=io.StringIO())
+        primeira.refresh_from_db()
+        self.assertEqual(primeira.diario_codigo, ".#1")
+
+    @patch("integrador.backfill.time.sleep")
+    def test_atualiza_solicitacoes_throttles(self, mock_sleep):
+        """Testa que o limite de linhas por segundo provoca pausas entre lotes."""
+        for i in range(4):
+            self._solicitacao_sem_campos({"diario": {"id": i}})
+
+        call_command("atualiza_solicitacoes", "--chunk-size", "2", "--rows-per-second", "1", stdout=io.StringIO())
+
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertGreater(mock_sleep.call_args.args[0], 1)
+
+    def test_backfill_task_apply_is_abstract(self):
+        """Testa que BackfillTask.apply precisa ser implementado."""
+        with self.assertRaises(NotImplementedError):
+            BackfillTask().apply(Solicitacao.objects.none())
+        self.assertEqual(BackfillRunner(BackfillTask()).run(), 0)
+
+
+class BackfillParallelTestCase(TransactionTestCase):
+    """Testes do backfill com intervalos de id processados em paralelo."""
+
+    def test_atualiza_solicitacoes_with_workers(self):
+        """Testa que cada worker processa o seu intervalo com checkpoint próprio."""
+        for i in range(6):
+            sol = Solicitacao.objects.create(recebido={"diario": {"id": i}})
+            Solicitacao.objects.filter(pk=sol.pk).update(diario_codigo=None)
+
+        out = io.StringIO()
+        call_command("atualiza_solicitacoes", "--workers", "3", "--chunk-size", "1", stdout=out)
+
+        self.assertFalse(Solicitacao.objects.filter(diario_codigo__isnull=True).exists())
+        self.assertEqual(BackfillCheckpoint.objects.filter(concluido_em__isnull=False).count(), 3)
+        self.assertIn("6 linhas atualizadas", out.getvalue())
+
+
+class DiarioSyncStateTestCase(TestCase):
+    """Testes para o estado mais recente por diário (DiarioSyncState)."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+
+    def _solicitacao(self, diario_id=123, status=Solicitacao.Status.SUCESSO, **kwargs):
+        return Solicitacao.objects.create(
+            ambiente=self.ambiente,
+            operacao=kwargs.pop("operacao", Solicitacao.Operacao.SYNC_UP_DIARIO),
+            status=status,
+            status_code="200",
+            recebido=kwargs.pop("recebido", {"campus": {"sigla": "TEST"}, "diario": {"id": diario_id}}),
+            respondido=kwargs.pop("respondido", {"url": "http://moodle/course/1", "url_sala_coordenacao": "http://s"}),
+            **kwargs,
+        )
+
+    def test_finaliza_creates_state(self):
+        """Testa que finalizar uma solicitação cria o estado do diário."""
+        solicitacao = self._solicitacao(status=Solicitacao.Status.PROCESSANDO)
+        self.assertFalse(DiarioSyncState.objects.exists())
+
+        solicitacao.finaliza(Solicitacao.Status.SUCESSO, 200)
+
+        estado = DiarioSyncState.objects.get()
+        self.assertEqual(estado.solicitacao_id, solicitacao.id)
+        self.assertEqual(estado.diario_id, "123")
+        self.assertEqual(estado.status, Solicitacao.Status.SUCESSO)
+        self.assertEqual(estado.status_code, "200")
+        self.assertEqual(estado.url, "http://moodle/course/1")
+        self.assertEqual(estado.url_sala_coordenacao, "http://s")
+        self.assertEqual(estado.payload_hash, DiarioSyncState.payload_hash_of(solicitacao.recebido))
+
+    def test_registra_upserts_latest(self):
+        """Testa que uma nova solicitação do mesmo diário substitui o estado anterior."""
+        primeira = self._solicitacao()
+        DiarioSyncState.objects.registra(primeira)
+        segunda = self._solicitacao(status=Solicitacao.Status.FALHA, respondido=[{"nota": 1}])
+        DiarioSyncState.objects.registra(segunda)
+
+        estado = DiarioSyncState.objects.get()
+        self.assertEqual(estado.solicitacao_id, segunda.id)
+        self.assertEqual(estado.status, Solicitacao.Status.FALHA)
+        self.assertIsNone(estado.url)
+
+    def test_registra_nao_volta_para_uma_solicitacao_mais_antiga(self):
+        """Testa que uma solicitação mais antiga que termina por último não substitui o estado da mais nova."""
+        antiga = self._solicitacao(status=Solicitacao.Status.FALHA)
+        Solicitacao.objects.filter(pk=antiga.pk).update(timestamp=antiga.timestamp - timedelta(minutes=5))
+        antiga.refresh_from_db()
+        nova = self._solicitacao()
+
+        DiarioSyncState.objects.registra(nova)
+        DiarioSyncState.objects.registra(antiga)
+        self.assertEqual(DiarioSyncState.objects.get().solicitacao_id, nova.id)
+
+        DiarioSyncState.objects.all().delete()
+        DiarioSyncState.objects.registra(nova, antiga)
+        self.assertEqual(DiarioSyncState.objects.get().solicitacao_id, nova.id)
+
+        nova.finaliza(Solicitacao.Status.FALHA, 502)
+        self.assertEqual(DiarioSyncState.objects.get().status, Solicitacao.Status.FALHA)
+
+    def test_registra_keeps_operacoes_apart(self):
+        """Testa que operações diferentes geram estados diferentes."""
+        DiarioSyncState.objects.registra(
+            self._solicitacao(), self._solicitacao(operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS)
+        )
+        self.assertEqual(DiarioSyncState.objects.count(), 2)
+
+    def test_registra_ignores_unfinished_or_without_ambiente(self):
+        """Testa que solicitações não finalizadas ou sem ambiente são ignoradas."""
+        processando = self._solicitacao(status=Solicitacao.Status.PROCESSANDO)
+        sem_ambiente = Solicitacao(status=Solicitacao.Status.SUCESSO, diario_id="1")
+
+        self.assertEqual(DiarioSyncState.objects.registra(processando, sem_ambiente), 0)
+        self.assertFalse(DiarioSyncState.objects.exists())
+
+    def test_payload_hash_is_canonical(self):
+        """Testa que o hash não depende da ordem das chaves."""
+        self.assertEqual(
+            DiarioSyncState.payload_hash_of({"a": 1, "b": 2}), DiarioSyncState.payload_hash_of({"b": 2, "a": 1})
+        )
+        self.assertIsNone(DiarioSyncState.payload_hash_of(None))
+
+    def test_str_and_as_dict(self):
+        """Testa __str__ e as_dict."""
+        DiarioSyncState.objects.registra(self._solicitacao())
+        estado = DiarioSyncState.objects.get()
+
+        self.assertIn("123", str(estado))
+        data = estado.as_dict()
+        self.assertEqual(data["ambiente"], self.ambiente.nome)
+        self.assertEqual(data["status"], Solicitacao.Status.SUCESSO)
+        self.assertIsNotNone(data["timestamp"])
+
+    def test_try_solicitacao_registers_state_on_failure(self):
+        """Testa que try_solicitacao registra o estado também em caso de falha."""
+
+        @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
+        def test_view(request):
+            raise SyncError("falhou", 422)
+
+        request = self.factory.post("/test/")
+        request.ambiente = self.ambiente
+        request.json_recebido = {"campus": {"sigla": "TEST"}, "diario": {"id": 77}}
+
+        with self.assertRaises(SyncError):
+            test_view(request)
+
+        estado = DiarioSyncState.objects.get(diario_id="77")
+        self.assertEqual(estado.status, Solicitacao.Status.FALHA)
+        self.assertEqual(estado.status_code, "422")
+
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    def test_api_returns_states(self):
+        """Testa a API de leitura do estado do diário."""
+        DiarioSyncState.objects.registra(
+            self._solicitacao(), self._solicitacao(operacao=Solicitacao.Operacao.SYNC_DOWN_NOTAS)
+        )
+
+        request = self.factory.get("/api/estado_diario/?diario_id=123&operacao=SUDiario&ambiente=Ambiente Teste")
+        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+        response = diario_sync_state(request)
+
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(response.content)
+        self.assertEqual(len(content), 1)
+        self.assertEqual(content[0]["operacao"], "SUDiario")
+
+    @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
+    def test_api_requires_diario_id(self):
+        """Testa que a API exige o parâmetro diario_id."""
+        request = self.factory.get("/api/estado_diario/")
+        request.META["HTTP_AUTHENTICATION"] = f"Token {TEST_TOKEN}"
+        response = diario_sync_state(request)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_backfill_command(self):
+        """Testa o comando que reconstrói a tabela a partir do histórico."""
+        self._solicitacao(diario_id=1)
+        ultima = self._solicitacao(diario_id=1, status=Solicitacao.Status.FALHA)
+        self._solicitacao(diario_id=2)
+        self._solicitacao(diario_id=3, status=Solicitacao.Status.PROCESSANDO)
+
+        out = io.StringIO()
+        call_command("backfill_diario_sync_state", "--batch-size", "2", stdout=out)
+
+        self.assertEqual(DiarioSyncState.objects.count(), 2)
+        self.assertEqual(DiarioSyncState.objects.get(diario_id="1").solicitacao_id, ultima.id)
+        self.assertIn("estados de diário atualizados", out.getvalue())
+
+    def test_admin_is_read_only(self):
+        """Testa que o admin é somente leitura e renderiza as colunas."""
+        from django.contrib.admin.sites import AdminSite
+
+        from integrador.admin import DiarioSyncStateAdmin
+
+        admin = DiarioSyncStateAdmin(DiarioSyncState, AdminSite())
+        request = self.factory.get("/admin/integrador/diariosyncstate/")
+        DiarioSyncState.objects.registra(self._solicitacao())
+        estado = DiarioSyncState.objects.get()
+
+        self.assertFalse(admin.has_add_permission(request))
+        self.assertFalse(admin.has_change_permission(request, estado))
+        self.assertFalse(admin.has_delete_permission(request, estado))
+        self.assertIn("Sucesso", admin.situacao(estado))
+        self.assertIn(f"#{estado.solicitacao_id}", admin.ultima_solicitacao(estado))
+        self.assertIn("http://moodle/course/1", admin.links(estado))
+
+        estado.solicitacao_id = None
+        estado.url = estado.url_sala_coordenacao = None
+        self.assertEqual(admin.ultima_solicitacao(estado), "-")
+        self.assertEqual(admin.links(estado), "-")
+
+
+class SolicitacaoRollupTestCase(TestCase):
+    """Testes para os agregados horários de solicitações (SolicitacaoRollup)."""
+
+    def setUp(self):
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
+
+    def _solicitacao(self, status=Solicitacao.Status.PROCESSANDO, **kwargs):
+        return Solicitacao.objects.create(
+            ambiente=kwargs.pop("ambiente", self.ambiente),
+            campus_sigla=kwargs.pop("campus_sigla", "TEST"),
+            status=status,
+            **kwargs,
+        )
+
+    @staticmethod
+    def totais() -> list:
+        return list(SolicitacaoRollup.objects.values_list("status", "total"))
+
+    def test_finaliza_increments_bucket(self):
+        """Testa que cada finalização soma 1 ao agregado da hora, ambiente, operação, status e campus."""
+        self._solicitacao().finaliza(Solicitacao.Status.SUCESSO, 200)
+        self._solicitacao().finaliza(Solicitacao.Status.SUCESSO, 200)
+        self._solicitacao().finaliza(Solicitacao.Status.FALHA, 500)
+
+        rollups = {r.status: r for r in SolicitacaoRollup.objects.all()}
+        self.assertEqual(rollups[Solicitacao.Status.SUCESSO].total, 2)
+        self.assertEqual(rollups[Solicitacao.Status.FALHA].total, 1)
+        self.assertEqual(rollups[Solicitacao.Status.SUCESSO].hora.minute, 0)
+        self.assertIn("SUDiario=S", str(rollups[Solicitacao.Status.SUCESSO]))
+
+    def test_incrementa_with_null_key_parts(self):
+        """Testa que ambiente e campus nulos também caem no mesmo agregado."""
+        for _ in range(2):
+            self._solicitacao(ambiente=None, campus_sigla=None).finaliza(Solicitacao.Status.FALHA, 404)
+
+        self.assertEqual(SolicitacaoRollup.objects.get().total, 2)
+
+    def test_incrementa_recovers_from_concurrent_insert(self):
+        """Testa que, se outro processo criar o agregado ao mesmo tempo, o incremento é refeito como UPDATE."""
+        from django.db import IntegrityError
+
+        solicitacao = self._solicitacao(status=Solicitacao.Status.SUCESSO)
+        queryset = Mock()
+        queryset.update.side_effect = [0, 1]
+
+        with patch.object(SolicitacaoRollup.objects, "filter", return_value=queryset):
+            with patch.object(SolicitacaoRollup.objects, "create", side_effect=IntegrityError) as mock_create:
+                SolicitacaoRollup.objects.incrementa(solicitacao)
+
+        mock_create.assert_called_once()
+        self.assertEqual(queryset.update.call_count, 2)
+
+    def test_recompacta_rebuilds_exact_counts(self):
+        """Testa que recompacta substitui os agregados pelas contagens exatas das solicitações finalizadas."""
+        self._solicitacao(status=Solicitacao.Status.SUCESSO)
+        self._solicitacao(status=Solicitacao.Status.PROCESSANDO)
+        SolicitacaoRollup.objects.create(
+            hora=SolicitacaoRollup.objects.hora_de(now()),
+            operacao=Solicitacao.Operacao.SYNC_UP_DIARIO,
+            status=Solicitacao.Status.FALHA,
+            total=99,
+        )
+
+        criados = SolicitacaoRollup.objects.recompacta(now(), now())
+
+        self.assertEqual(criados, 1)
+        self.assertEqual(self.totais(), [(Solicitacao.Status.SUCESSO, 1)])
+
+    def test_processando_nao_e_contada_duas_vezes(self):
+        """Testa que uma solicitação em processamento na recompactação só é contada quando é finalizada."""
+        solicitacao = self._solicitacao()
+        SolicitacaoRollup.objects.recompacta(now(), now())
+        self.assertFalse(SolicitacaoRollup.objects.exists())
+
+        solicitacao.finaliza(Solicitacao.Status.SUCESSO, 200)
+        SolicitacaoRollup.objects.incrementa(self._solicitacao())
+
+        self.assertEqual(self.totais(), [(Solicitacao.Status.SUCESSO, 1)])
+        SolicitacaoRollup.objects.recompacta(now(), now())
+        self.assertEqual(self.totais(), [(Solicitacao.Status.SUCESSO, 1)])
+
+    def test_compacta_rollups_command(self):
+        """Testa o comando de compactação periódica, que não recalcula a hora corrente."""
+        self._solicitacao(status=Solicitacao.Status.SUCESSO)
+        out = io.StringIO()
+
+        call_command("compacta_rollups", stdout=out)
+        self.assertFalse(SolicitacaoRollup.objects.exists())
+        self.assertIn("0 agregados", out.getvalue())
+
+        with patch("integrador.management.commands.compacta_rollups.now", return_value=now() + timedelta(hours=1)):
+            call_command("compacta_rollups", "--tudo", stdout=out)
+        self.assertEqual(SolicitacaoRollup.objects.get().total, 1)
+
+    def test_compacta_rollups_tudo_without_solicitacoes(self):
+        """Testa --tudo sem nenhuma solicitação."""
+        out = io.StringIO()
+        call_command("compacta_rollups", "--tudo", stdout=out)
+        self.assertIn("0 agregados", out.getvalue())
+
 
 class SecurityViewsCoverageTestCase(TestCase):
     """Testes direcionados para ampliar cobertura de security.views."""
@@ -2644,7 +5602,7 @@ class IntegrationTestCase(TestCase):
     def setUp(self):
         """Configura o ambiente de teste."""
         self.factory = RequestFactory()
-        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SGA)
+        self.ambiente = Ambiente.objects.create(**AMBIENTE_GOOD_SUAP)
 
     @override_settings(SUAP_INTEGRADOR_KEY=TEST_TOKEN)
     @patch("integrador.brokers.suap2local_suap.http_post_json")
@@ -2772,8 +5730,9 @@ class IntegrationTestCase(TestCase):
         response = sync_down_grades(request)
 
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
         self.assertEqual(
-            json.loads(response.content),
+            json.loads(b"".join(response.streaming_content)),
             {
                 "url": "https://moodle.integration.test/course/view.php?id=1",
                 "url_sala_coordenacao": "https://moodle.integration.test/course/view.php?id=2",
@@ -2952,3 +5911,222 @@ class MoodleMockTestCase(TestCase):
                 run_with_mock_exception(ValueError("another_exception"))
 
             stop_mock_moodle_server_in_background()
+
+
+class MoodleMockFaultsTestCase(TestCase):
+    """Testes da injeção de latência e falhas no Moodle mock (FaultInjector e manage.py moodle_mock)."""
+
+    SYNC_DOWN = "/local/suap/api/index.php?sync_down_grades&diario_id=1"
+
+    def porta_livre(self) -> int:
+        import socket
+
+        with socket.socket() as livre:
+            livre.bind(("127.0.0.1", 0))
+            return livre.getsockname()[1]
+
+    def inicia(self, faults: dict) -> int:
+        porta = self.porta_livre()
+        start_mock_moodle_server("127.0.0.1", porta, faults=faults, seed=1)
+        self.addCleanup(stop_mock_moodle_server_in_background)
+        return porta
+
+    def envia(self, porta: int, path: str = SYNC_DOWN, method: str = "GET", body: bytes | None = None, **kwargs):
+        import http.client
+
+        conexao = http.client.HTTPConnection("127.0.0.1", porta, timeout=kwargs.pop("timeout", 2))
+        self.addCleanup(conexao.close)
+        headers = {"Authentication": f"Token {LocalSuapHTTPMock.TEST_TOKEN}", **kwargs}
+        conexao.request(method, path, body=body, headers=headers)
+        response = conexao.getresponse()
+        return response, response.read()
+
+    def test_validate(self):
+        """Testa a rejeição de opções desconhecidas, taxas fora de 0..1 e distribuições inválidas."""
+        for config, mensagem in [
+            ([], "objeto JSON"),
+            ({"*": 1}, "objeto JSON"),
+            ({"*": {"lentidao": 1}}, "desconhecidas: lentidao"),
+            ({"*": {"error_rate": 1.5}}, "error_rate deve estar entre 0 e 1"),
+            ({"*": {"error_rate": 0.6, "reset_rate": 0.6}}, "passa de 1"),
+            ({"*": {"latency": {"dist": "gamma"}}}, "gamma"),
+        ]:
+            with self.subTest(config=config), self.assertRaisesMessage(ValueError, mensagem):
+                FaultInjector(config)
+
+    def test_latencias(self):
+        """Testa as distribuições de latência e o teto max_ms."""
+        injector = FaultInjector(seed=3)
+
+        self.assertEqual(injector.latency_s(None), 0)
+        self.assertEqual(injector.latency_s(250), 0.25)
+        self.assertEqual(injector.latency_s({"dist": "fixed", "ms": 100}), 0.1)
+        for _ in range(50):
+            self.assertTrue(0.01 <= injector.latency_s({"dist": "uniform", "min_ms": 10, "max_ms": 20}) <= 0.02)
+            self.assertLessEqual(
+                injector.latency_s({"dist": "lognormal", "median_ms": 100, "sigma": 2, "max_ms": 300}), 0.3
+            )
+            self.assertGreaterEqual(injector.latency_s({"dist": "pareto", "scale_ms": 50, "alpha": 1.5}), 0.05)
+
+    def test_decide(self):
+        """Testa o tipo de falha sorteado e a sobreposição das opções do serviço sobre as de '*'."""
+        injector = FaultInjector(
+            {
+                "*": {"error_rate": 1, "error_status": [503], "latency": 20},
+                "sync_down_grades": {"error_rate": 0, "html_error_rate": 1},
+                "sync_user_preference": {"error_rate": 0, "reset_rate": 1},
+                "sync_up_enrolments": {"error_rate": 0, "timeout_rate": 1, "timeout_s": 5},
+            }
+        )
+
+        self.assertEqual(injector.decide("outro"), ("error", 0.02, 503))
+        self.assertEqual(injector.decide("sync_down_grades"), ("html_error", 0.02, 500))
+        self.assertEqual(injector.decide("sync_user_preference").kind, "reset")
+        self.assertEqual(injector.decide("sync_up_enrolments").kind, "timeout")
+        self.assertEqual(injector.timeout_s("sync_up_enrolments"), 5)
+        self.assertEqual(injector.timeout_s("outro"), 30)
+        self.assertEqual(FaultInjector().decide("sync_down_grades"), (None, 0.0, None))
+
+    def test_taxas_e_semente(self):
+        """Testa que a fração de falhas segue a taxa e que a mesma semente repete a sequência."""
+        config = {"*": {"error_rate": 0.2, "reset_rate": 0.1}}
+        a, b = FaultInjector(config, seed=5), FaultInjector(config, seed=5)
+        sequencia = [a.decide("x").kind for _ in range(2000)]
+
+        self.assertEqual(sequencia[:50], [b.decide("x").kind for _ in range(50)])
+        self.assertAlmostEqual(sequencia.count("error") / 2000, 0.2, delta=0.03)
+        self.assertAlmostEqual(sequencia.count("reset") / 2000, 0.1, delta=0.03)
+        self.assertEqual(a.snapshot()["counters"]["x"]["error"], sequencia.count("error"))
+
+    def test_throttle(self):
+        """Testa o limite de taxa: a rajada passa, o excesso recebe 429 e os tokens voltam com o tempo."""
+        injector = FaultInjector({"sync_down_grades": {"rps": 20, "burst": 2}})
+
+        kinds = [injector.decide("sync_down_grades").kind for _ in range(3)]
+        self.assertEqual(kinds, [None, None, "throttle"])
+        self.assertIsNone(injector.decide("sync_up_enrolments").kind)
+        time.sleep(0.06)
+        self.assertIsNone(injector.decide("sync_down_grades").kind)
+
+    def test_servidor_latencia_e_keep_alive(self):
+        """Testa a latência injetada e duas requisições na mesma conexão."""
+        import http.client
+
+        porta = self.inicia({"*": {"latency": 100}})
+        conexao = http.client.HTTPConnection("127.0.0.1", porta, timeout=2)
+        self.addCleanup(conexao.close)
+        inicio = time.perf_counter()
+        for _ in range(2):
+            conexao.request("GET", self.SYNC_DOWN, headers={"Authentication": f"Token {LocalSuapHTTPMock.TEST_TOKEN}"})
+            response = conexao.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertIn("notas", json.loads(response.read()))
+
+        self.assertGreaterEqual(time.perf_counter() - inicio, 0.2)
+
+    def test_servidor_erros(self):
+        """Testa o erro JSON, o HTML de erro fatal e o 429 com Retry-After."""
+        porta = self.inicia({"sync_down_grades": {"error_rate": 1, "error_status": [502]}})
+        response, conteudo = self.envia(porta)
+        self.assertEqual(response.status, 502)
+        self.assertEqual(json.loads(conteudo)["error"]["code"], 502)
+
+        get_fault_injector().configure({"*": {"html_error_rate": 1}})
+        response, conteudo = self.envia(porta)
+        self.assertEqual(response.status, 500)
+        self.assertTrue(response.getheader("Content-Type").startswith("text/html"))
+        self.assertIn(b"Fatal error", conteudo)
+
+        get_fault_injector().configure({"*": {"rps": 1, "burst": 1}})
+        self.assertEqual(self.envia(porta)[0].status, 200)
+        response, _ = self.envia(porta)
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.getheader("Retry-After"), "1")
+
+    def test_servidor_reset_e_timeout(self):
+        """Testa a conexão fechada sem resposta e a conexão segurada até o timeout do cliente."""
+        porta = self.inicia({"*": {"reset_rate": 1}})
+        with self.assertRaises((ConnectionError, HTTPException)):
+            self.envia(porta)
+
+        get_fault_injector().configure({"*": {"timeout_rate": 1, "timeout_s": 5}})
+        inicio = time.perf_counter()
+        with self.assertRaises(TimeoutError):
+            self.envia(porta, timeout=0.2)
+        self.assertLess(time.perf_counter() - inicio, 2)
+
+    def test_endpoint_de_controle(self):
+        """Testa a leitura, troca e limpeza da configuração com o servidor rodando."""
+        porta = self.inicia({})
+
+        response, _ = self.envia(porta, FAULTS_CONTROL_PATH, Authentication="Token errado")
+        self.assertEqual(response.status, 401)
+
+        config = {"sync_down_grades": {"error_rate": 1}}
+        response, conteudo = self.envia(porta, FAULTS_CONTROL_PATH, "PUT", json.dumps(config).encode())
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(conteudo)["config"], config)
+        self.assertIn(self.envia(porta)[0].status, [500, 502, 503])
+
+        response, conteudo = self.envia(porta, FAULTS_CONTROL_PATH)
+        self.assertEqual(json.loads(conteudo)["counters"], {"sync_down_grades": {"error": 1}})
+
+        response, conteudo = self.envia(porta, FAULTS_CONTROL_PATH, "PUT", b'{"*": {"error_rate": 2}}')
+        self.assertEqual(response.status, 400)
+        self.assertIn("entre 0 e 1", json.loads(conteudo)["error"])
+
+        response, _ = self.envia(porta, FAULTS_CONTROL_PATH, "DELETE")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.envia(porta)[0].status, 200)
+
+    @override_settings(MOODLE_HTTP_MOCK_FAULTS={"*": {"error_rate": 1}})
+    def test_configuracao_pelos_settings(self):
+        """Testa que, sem faults explícitos, vale MOODLE_HTTP_MOCK_FAULTS."""
+        porta = self.porta_livre()
+        start_mock_moodle_server("127.0.0.1", porta)
+        self.addCleanup(stop_mock_moodle_server_in_background)
+
+        self.assertEqual(get_fault_injector().config, {"*": {"error_rate": 1}})
+        self.assertIn(self.envia(porta)[0].status, [500, 502, 503])
+
+    def test_command(self):
+        """Testa o moodle_mock com arquivo de falhas, atalhos, token e duração."""
+        import tempfile
+
+        token = LocalSuapHTTPMock.TEST_TOKEN
+        self.addCleanup(setattr, LocalSuapHTTPMock, "TEST_TOKEN", token)
+        self.addCleanup(setattr, ToolSgaHTTPMock, "TEST_TOKEN", token)
+        saida = io.StringIO()
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as arquivo:
+            json.dump({"*": {"error_rate": 0.1}, "sync_down_grades": {"rps": 5}}, arquivo)
+            arquivo.flush()
+
+            inicio = time.perf_counter()
+            call_command(
+                "moodle_mock",
+                port=self.porta_livre(),
+                token="tk",  # noqa: S106
+                faults=arquivo.name,
+                latency_ms=200,
+                latency_dist="lognormal",
+                reset_rate=0.05,
+                duration=0.1,
+                stdout=saida,
+            )
+
+        self.assertGreaterEqual(time.perf_counter() - inicio, 0.1)
+        self.assertEqual(LocalSuapHTTPMock.TEST_TOKEN, "tk")
+        self.assertIn("Token: tk", saida.getvalue())
+        self.assertIn('"median_ms": 200', saida.getvalue())
+        self.assertIn('"sync_down_grades": {"rps": 5}', saida.getvalue())
+        self.assertIn("Moodle mock encerrado", saida.getvalue())
+        self.assertIsNone(get_fault_injector())
+
+    def test_command_erros(self):
+        """Testa as mensagens para arquivo inexistente e configuração inválida."""
+        from django.core.management.base import CommandError
+
+        with self.assertRaisesMessage(CommandError, "Não foi possível ler"):
+            call_command("moodle_mock", faults="/nao/existe.json")
+        with self.assertRaisesMessage(CommandError, "error_rate deve estar entre 0 e 1"):
+            call_command("moodle_mock", error_rate=3)
@@ -0,0 +1,82 @@
+"""
+Tempos por etapa do pipeline de sincronização.
+
+Cada requisição carrega um `Etapas` (em `request.etapas` e, depois de criada, em `solicitacao.etapas`). Os
+decorators e os brokers medem as suas etapas com `etapas_de(obj).medir(nome)`; ao final os tempos, em milissegundos,
+são gravados em `Solicitacao.tempos` e devolvidos no header `Server-Timing`.
+"""
+
+import time
+import unicodedata
+from contextlib import contextmanager
+
+from django.db.models import Aggregate, FloatField
+from django.db.models.expressions import RawSQL
+
+# Etapas, na ordem em que acontecem, e a descrição usada no admin, no dashboard e no Server-Timing.
+ETAPAS = {
+    "leitura": "Leitura do body",
+    "json": "Parse do JSON",
+    "ambiente": "Seleção do ambiente",
+    "criacao": "Insert da solicitação",
+    "coortes": "Resolução das coortes",
+    "restricoes": "Restrições",
+    "traducao": "Tradução para o SGA",
+    "enviado": "Gravação do enviado",
+    "moodle": "HTTP do Moodle",
+    "finalizacao": "Gravação final",
+}
+
+
+class Etapas:
+    def __init__(self):
+        self.tempos: dict[str, float] = {}
+
+    @contextmanager
+    def medir(self, etapa: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            decorrido = (time.perf_counter() - inicio) * 1000
+            self.tempos[etapa] = round(self.tempos.get(etapa, 0) + decorrido, 1)
+
+    @property
+    def total(self) -> float:
+        return round(sum(self.tempos.values()), 1)
+
+    def server_timing(self) -> str:
+        # Valores de header HTTP são ASCII: a descrição vai sem acentos ("Selecao do ambiente").
+        return ", ".join(
+            f'{etapa};dur={duracao};desc="{_ascii(ETAPAS.get(etapa, etapa))}"' for etapa, duracao in self.tempos.items()
+        )
+
+
+def _ascii(texto: str) -> str:
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+
+
+def etapas_de(obj) -> Etapas:
+    """Retorna as etapas do request ou da solicitação, criando-as na primeira medição."""
+    etapas = getattr(obj, "etapas", None)
+    if etapas is None:
+        etapas = Etapas()
+        obj.etapas = etapas
+    return etapas
+
+
+class PercentileCont(Aggregate):
+    """Percentil contínuo do PostgreSQL: `PERCENTILE_CONT(p) WITHIN GROUP (ORDER BY expressão)`."""
+
+    function = "PERCENTILE_CONT"
+    template = "%(function)s(%(percentil)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, expression, percentil: float, **extra):
+        super().__init__(expression, percentil=float(percentil), **extra)
+
+
+# Soma de todas as etapas gravadas em Solicitacao.tempos
+TEMPO_TOTAL = RawSQL(
+    "(SELECT SUM(value::float) FROM jsonb_each_text(integrador_solicitacao.tempos))", [], output_field=FloatField()
+)
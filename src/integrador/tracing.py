@@ -0,0 +1,198 @@
+"""
+Rastreamento distribuído (OpenTelemetry) do integrador.
+
+O `opentelemetry-sdk` é opcional e o rastreamento vem desligado (`OTEL_ENABLED`): sem ele, ou desligado, `span()`
+não faz nada e o custo é uma checagem de `None`. Ligado, cada sincronização vira um trace com um span por decorator,
+por método do broker, por chamada HTTP ao Moodle, por consulta ao banco e por avaliação de regra. O contexto do trace
+segue para o Moodle nos headers `traceparent`/`tracestate` e, se o SUAP enviar um `traceparent`, o trace continua o
+dele.
+
+A amostragem é feita na origem (`OTEL_TRACES_SAMPLE_RATE`) e respeita a decisão de quem chamou: fora da amostra os
+spans não são gravados e as consultas ao banco nem abrem span.
+"""
+
+import importlib.util
+import logging
+import os
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+
+def _instalado(modulo: str) -> bool:
+    """Se `modulo` está instalado. O `find_spec` de um submódulo levanta ModuleNotFoundError sem o pacote pai."""
+    try:
+        return importlib.util.find_spec(modulo) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+# O SDK, não só a API: o `configure` o importa. Sem o exporter OTLP, o console continua disponível.
+OTEL_AVAILABLE = _instalado("opentelemetry.sdk")
+OTLP_AVAILABLE = OTEL_AVAILABLE and _instalado("opentelemetry.exporter.otlp.proto.http")
+
+# Tracer do integrador; None enquanto o rastreamento não estiver configurado.
+_tracer = None
+
+
+def _exporter():
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    if settings.OTEL_EXPORTER == "otlp":
+        if not OTLP_AVAILABLE:
+            logger.warning("OTEL_EXPORTER=otlp, mas o opentelemetry-exporter-otlp-proto-http não está instalado.")
+            return None
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        # Endpoint, headers e timeout vêm das variáveis padrão OTEL_EXPORTER_OTLP_*.
+        return OTLPSpanExporter()
+    if settings.OTEL_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    if settings.OTEL_EXPORTER == "file":
+        return ConsoleSpanExporter(
+            out=open(settings.OTEL_EXPORTER_FILE, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + os.linesep,
+        )
+    return None
+
+
+def configure() -> bool:
+    """Configura o tracer conforme as settings. Chamado uma vez por processo (worker), no `ready()` do app."""
+    global _tracer
+    if not settings.OTEL_ENABLED or not OTEL_AVAILABLE:
+        return False
+
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    provider = TracerProvider(
+        resource=Resource.create(
+            {"service.name": settings.OTEL_SERVICE_NAME, "service.version": settings.PROJECT_VERSION}
+        ),
+        sampler=ParentBased(TraceIdRatioBased(settings.OTEL_TRACES_SAMPLE_RATE)),
+    )
+    exporter = _exporter()
+    if exporter is not None:
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _tracer = provider.get_tracer("integrador", settings.PROJECT_VERSION)
+
+    connection_created.connect(_on_connection_created, dispatch_uid="integrador.tracing")
+    for conexao in connections.all(initialized_only=True):
+        instrument_connection(conexao)
+    return True
+
+
+def _attributes(attributes: dict | None) -> dict:
+    return {chave: valor for chave, valor in (attributes or {}).items() if valor is not None}
+
+
+def _kind(kind: str | None):
+    from opentelemetry.trace import SpanKind
+
+    return {"server": SpanKind.SERVER, "client": SpanKind.CLIENT}.get(kind, SpanKind.INTERNAL)
+
+
+@contextmanager
+def span(name: str, attributes: dict | None = None, kind: str | None = None):
+    """Abre um span filho do span atual. Exceções que atravessam o span são registradas nele."""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, kind=_kind(kind), attributes=_attributes(attributes)) as current:
+        yield current
+
+
+@contextmanager
+def server_span(request, name: str):
+    """Abre o span raiz de uma requisição recebida, continuando o trace do chamador quando houver `traceparent`."""
+    if _tracer is None:
+        yield None
+        return
+    from opentelemetry import propagate
+
+    with _tracer.start_as_current_span(
+        name,
+        context=propagate.extract(request.headers),
+        kind=_kind("server"),
+        attributes={"http.request.method": request.method, "url.path": request.path},
+    ) as current:
+        yield current
+
+
+def set_attributes(current, attributes: dict) -> None:
+    if current is not None:
+        current.set_attributes(_attributes(attributes))
+
+
+def record_exception(exception: Exception) -> None:
+    """Registra no span atual uma exceção que foi tratada (e por isso não atravessou o span)."""
+    if _tracer is not None:
+        from opentelemetry import trace
+        from opentelemetry.trace import Status, StatusCode
+
+        current = trace.get_current_span()
+        current.record_exception(exception)
+        current.set_status(Status(StatusCode.ERROR, f"{exception}"))
+
+
+def traced(name: str | None = None):
+    """Decorator que executa a função dentro de um span (por padrão com o nome qualificado da função)."""
+
+    def decorator(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with span(name or func.__qualname__):
+                return func(*args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+def inject(headers: dict) -> dict:
+    """Acrescenta aos headers o contexto do trace atual (`traceparent`/`tracestate`)."""
+    if _tracer is not None:
+        from opentelemetry import propagate
+
+        propagate.inject(headers)
+    return headers
+
+
+def _trace_query(execute, sql, params, many, context):
+    if _tracer is None:
+        return execute(sql, params, many, context)
+    from opentelemetry import trace
+
+    if not trace.get_current_span().is_recording():
+        return execute(sql, params, many, context)
+    comando = sql.split(None, 1)[0].upper() if sql else "SQL"
+    with _tracer.start_as_current_span(
+        f"db {comando}",
+        kind=_kind("client"),
+        attributes={
+            "db.system": context["connection"].vendor,
+            "db.operation.name": comando,
+            # Só o SQL com placeholders: os parâmetros podem ter dados pessoais.
+            "db.query.text": sql,
+        },
+    ):
+        return execute(sql, params, many, context)
+
+
+def instrument_connection(conexao) -> None:
+    """Abre um span para cada consulta feita pela conexão, quando o trace atual estiver sendo amostrado."""
+    if _trace_query not in conexao.execute_wrappers:
+        conexao.execute_wrappers.append(_trace_query)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    instrument_connection(connection)
@@ -2,7 +2,7 @@ from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
 
 from .apps import IntegradorConfig
-from .views import sync_down_grades, sync_up_enrolments
+from .views import diario_sync_state, sync_down_grades, sync_down_grades_batch, sync_up_enrolments
 
 app_name = IntegradorConfig.name
 
@@ -11,4 +11,6 @@ app_name = IntegradorConfig.name
 urlpatterns = [
     path("api/enviar_diarios/", csrf_exempt(sync_up_enrolments), name="api_sync_up_enrolments"),
     path("api/baixar_notas/", csrf_exempt(sync_down_grades), name="api_sync_down_grades"),
+    path("api/baixar_notas_lote/", csrf_exempt(sync_down_grades_batch), name="api_sync_down_grades_batch"),
+    path("api/estado_diario/", csrf_exempt(diario_sync_state), name="api_diario_sync_state"),
 ]
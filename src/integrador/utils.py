@@ -1,22 +1,52 @@
+import importlib.util
 import json
 import logging
+import time
 import urllib.error
 import urllib.request
 from http.client import HTTPException
+from urllib.parse import urlsplit
+
+from integrador import metrics, tracing
 
 logger = logging.getLogger(__name__)
 
+# Com o ijson (dependência do projeto), o JSON das respostas dos Moodles é lido do socket aos pedaços.
+IJSON_AVAILABLE = importlib.util.find_spec("ijson") is not None
+if IJSON_AVAILABLE:
+    import ijson
 
 REQUEST_TIMEOUT_SECONDS = 10
 
 
+class UrllibTransport:
+    """Transporte padrão das chamadas aos Moodles: a rede, pelo urllib."""
+
+    def urlopen(self, req, timeout):
+        return urllib.request.urlopen(req, timeout=timeout)  # noqa: S310
+
+
+_transport = UrllibTransport()
+
+
+def get_transport():
+    return _transport
+
+
+def set_transport(transport) -> object:
+    """Troca o transporte das chamadas aos Moodles (ex.: uma `integrador.cassette.Cassette`) e retorna o anterior."""
+    global _transport
+    anterior, _transport = _transport, transport
+    return anterior
+
+
 class SyncError(Exception):
     def __init__(self, message, code, retorno=None, params=None):
         super().__init__(message, code, params)
         self.message = message
         self.code = code
         self.retorno = retorno
-        logger.debug(f"{code}: {message} - {retorno}")
+        logger.debug("%s: %s - %s", code, message, retorno)
 
 
 def _handle_http_request_exception(exc: Exception, url: str, encoding: str = "utf-8"):
@@ -50,41 +80,141 @@ def _handle_http_request_exception(exc: Exception, url: str, encoding: str = "ut
         raise exc_new
 
 
-def _send_request(req, timeout, url, encoding="utf-8", decode=True):
-    try:
-        with urllib.request.urlopen(req, timeout=timeout) as response:  # noqa: S310
-            byte_array_content = response.read()
-    except (urllib.error.HTTPError, urllib.error.URLError) as exc:
-        _handle_http_request_exception(exc, url, encoding)
+class _CorpoContado:
+    """O corpo da resposta, lido aos pedaços por um parser, contando os bytes para as métricas."""
+
+    def __init__(self, response):
+        self.response = response
+        self.lidos = 0
+
+    def read(self, size=None):
+        pedaco = self.response.read() if size is None else self.response.read(size)
+        self.lidos += len(pedaco)
+        return pedaco
 
+
+def load_json(corpo, encoding="utf-8", json_kwargs=None):
+    """
+    O JSON de `corpo`, um arquivo ou o texto já lido. Do arquivo, lê aos pedaços com o ijson, se instalado; senão de
+    uma vez, em bytes, sem a cópia decodificada em str. JSON inválido levanta `json.JSONDecodeError` com os dois.
+    """
+    if hasattr(corpo, "read"):
+        if IJSON_AVAILABLE and not json_kwargs and encoding in ("utf-8", "utf8"):
+            try:
+                valores = ijson.items(corpo, "", use_float=True)
+                valor = next(valores)
+                # Como o json.loads, recusa o que vier depois do primeiro valor.
+                for _ in valores:
+                    raise json.JSONDecodeError("Extra data", "", 0)
+                return valor
+            except (ijson.JSONError, StopIteration) as exc:
+                raise json.JSONDecodeError(f"{exc}", "", 0) from exc
+        corpo = corpo.read()
+    if isinstance(corpo, bytes) and encoding not in (None, "utf-8", "utf8"):
+        corpo = corpo.decode(encoding)
+    return json.loads(corpo, **(json_kwargs or {}))
+
+
+def _send_request(req, timeout, url, encoding="utf-8", decode=True, meta: dict | None = None, parse=None):
+    """
+    O corpo da resposta ou, com `parse`, o que ele retorna ao ler o corpo direto da resposta. Com `meta`, guarda nele o
+    status e os headers (em minúsculas) e aceita o 304.
+    """
+    inicio = time.perf_counter()
+    status = "error"
+    byte_array_content = b""
+    resultado = None
+    recebidos = 0
+    method = req.get_method()
+    with tracing.span(
+        method,
+        {"http.request.method": method, "url.full": url.split("?", 1)[0], "server.address": urlsplit(url).hostname},
+        kind="client",
+    ) as span:
+        for header, valor in tracing.inject({}).items():
+            req.add_header(header, valor)
+        try:
+            with _transport.urlopen(req, timeout) as response:
+                status = getattr(response, "status", 200)
+                if meta is not None:
+                    meta.update(status=status, headers={k.lower(): v for k, v in dict(response.headers or {}).items()})
+                if parse is not None:
+                    corpo = _CorpoContado(response)
+                    try:
+                        resultado = parse(corpo)
+                    finally:
+                        recebidos = corpo.lidos
+                else:
+                    byte_array_content = response.read()
+                    recebidos = len(byte_array_content)
+        except urllib.error.HTTPError as exc:
+            status = exc.code
+            if exc.code != 304 or meta is None:
+                _handle_http_request_exception(exc, url, encoding)
+            meta.update(status=304, headers={k.lower(): v for k, v in dict(exc.headers or {}).items()})
+        except urllib.error.URLError as exc:
+            status = 502
+            _handle_http_request_exception(exc, url, encoding)
+        finally:
+            tracing.set_attributes(span, {"http.response.status_code": status if isinstance(status, int) else None})
+            metrics.observe_moodle_call(
+                method, url, status, time.perf_counter() - inicio, len(req.data or b""), recebidos
+            )
+
+    if parse is not None:
+        return resultado
     return byte_array_content.decode(encoding) if decode and encoding is not None else byte_array_content
 
 
-def http_get(url, headers: dict | None = None, encoding="utf-8", decode=True, **kwargs):
+def http_get(
+    url, headers: dict | None = None, encoding="utf-8", decode=True, meta: dict | None = None, parse=None, **kwargs
+):
     timeout = kwargs.pop("timeout", REQUEST_TIMEOUT_SECONDS)
     req_headers = headers or {}
     req = urllib.request.Request(url, headers=req_headers, method="GET")  # noqa: S310
-    return _send_request(req, timeout, url, encoding, decode)
+    return _send_request(req, timeout, url, encoding, decode, meta, parse)
 
 
-def http_post(url, jsonbody: dict | None = None, headers: dict | None = None, encoding="utf-8", decode=True, **kwargs):
+def http_post(
+    url,
+    jsonbody: dict | None = None,
+    headers: dict | None = None,
+    encoding="utf-8",
+    decode=True,
+    data: bytes | None = None,
+    **kwargs,
+):
+    """POST do `jsonbody` serializado ou, se informado, de `data`: um JSON já serializado, enviado como está."""
     timeout = kwargs.pop("timeout", REQUEST_TIMEOUT_SECONDS)
     req_headers = headers or {}
 
-    if jsonbody is not None:
-        payload = json.dumps(jsonbody).encode(encoding)
-        if "Content-Type" not in req_headers and "content-type" not in req_headers:
-            req_headers["Content-Type"] = "application/json"
-    else:
-        payload = None
+    payload = json.dumps(jsonbody).encode(encoding) if data is None and jsonbody is not None else data
+    if payload is not None and "Content-Type" not in req_headers and "content-type" not in req_headers:
+        req_headers["Content-Type"] = "application/json"
 
     req = urllib.request.Request(url, data=payload, headers=req_headers, method="POST")  # noqa: S310
     return _send_request(req, timeout, url, encoding, decode)
 
 
 def http_get_json(url, headers={}, encoding="utf-8", json_kwargs=None, **kwargs):
-    content = http_get(url, headers=headers, encoding=encoding, **kwargs)
-    return json.loads(content, **(json_kwargs or {}))
+    """O JSON da resposta, lido direto dela por `load_json`, sem o corpo bufferizado e decodificado antes."""
+    # O valor lido vem numa tupla: um `http_get` que devolva o corpo em texto (ex.: um stub) ainda passa pelo parser.
+    resultado = http_get(
+        url, headers=headers, encoding=encoding, parse=lambda fp: (load_json(fp, encoding, json_kwargs),), **kwargs
+    )
+    return resultado[0] if isinstance(resultado, tuple) else load_json(resultado, encoding, json_kwargs)
+
+
+def http_get_json_if_changed(url, headers: dict | None = None, etag: str | None = None, encoding="utf-8", **kwargs):
+    """GET condicional: (JSON, ETag da resposta) ou, se o servidor responder 304 ao `etag`, (None, `etag`)."""
+    req_headers = dict(headers or {})
+    if etag:
+        req_headers["If-None-Match"] = etag
+    meta = {}
+    resultado = http_get(url, headers=req_headers, meta=meta, parse=lambda fp: load_json(fp, encoding), **kwargs)
+    if meta.get("status") == 304:
+        return None, etag
+    return resultado, meta.get("headers", {}).get("etag")
 
 
 def http_post_json(
@@ -94,6 +224,6 @@ def http_post_json(
     try:
         result = json.loads(content, **(json_kwargs or {}))
     except json.JSONDecodeError as exc:
-        logger.error(f"Failed to decode JSON response from {url}: {exc.msg} - Response content: \n{content}\n")
+        logger.error("Failed to decode JSON response from %s: %s - Response content: \n%s\n", url, exc.msg, content)
         raise exc
     return result
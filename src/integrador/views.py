@@ -1,25 +1,34 @@
 import logging
 
 from django.db import transaction
-from django.http import HttpRequest
+from django.http import HttpRequest, StreamingHttpResponse
 
-from integrador.brokers.suap2local_suap import Suap2LocalSuapBroker
-from integrador.brokers.suap2tool_sga import Suap2ToolSgaBroker
+from integrador.brokers.registry import registry
 from integrador.decorators import (
     check_is_get,
     check_is_post,
     check_json,
     detect_ambiente,
     exception_as_json,
+    grades_cache,
     json_response,
+    json_stream_response,
+    observe_metrics,
+    profile_request,
+    trace_request,
     try_solicitacao,
     valid_token,
 )
-from integrador.models import Solicitacao
+from integrador.models import DiarioSyncState, Solicitacao
+from integrador.notas import CONTENT_TYPE, NotasEmLote, parse_pedido, resumo
+from integrador.utils import SyncError
 
 logger = logging.getLogger(__name__)
 
 
+@trace_request
+@observe_metrics
+@profile_request
 @transaction.atomic
 @json_response
 @exception_as_json
@@ -29,24 +38,55 @@ logger = logging.getLogger(__name__)
 @detect_ambiente
 @try_solicitacao(Solicitacao.Operacao.SYNC_UP_DIARIO)
 def sync_up_enrolments(request: HttpRequest = None) -> dict:
-    ambiente = request.solicitacao.ambiente
-    if ambiente.can_send_to_local_suap:
-        return Suap2LocalSuapBroker(request.solicitacao).sync_up_enrolments()
-    elif ambiente.can_send_to_tool_sga:
-        return Suap2ToolSgaBroker(request.solicitacao).sync_up_enrolments()
-    else:
-        raise Exception(
-            f"O ambiente {ambiente.nome} não está configurado "
-            f"para enviar dados para o Local SUAP ou Tool SGA. Contacte um administrador."
-        )
+    return registry.broker_for(request.solicitacao).sync_up_enrolments()
 
 
+@trace_request
+@observe_metrics
+@profile_request
 @transaction.atomic
 @json_response
 @exception_as_json
 @check_is_get
 @valid_token
 @detect_ambiente
-@try_solicitacao(Solicitacao.Operacao.SYNC_DOWN_NOTAS)
+@json_stream_response
+@grades_cache
+@try_solicitacao(Solicitacao.Operacao.SYNC_DOWN_NOTAS, resumo=resumo)
 def sync_down_grades(request: HttpRequest):
-    return Suap2LocalSuapBroker(request.solicitacao).sync_down_grades()
+    # Com o cache de notas ligado, o `grades_cache` já as baixou ao revalidar.
+    baixadas = getattr(request, "notas_moodle", None)
+    if isinstance(baixadas, Exception):
+        raise baixadas
+    return baixadas if baixadas is not None else registry.broker_for(request.solicitacao).sync_down_grades()
+
+
+@trace_request
+@observe_metrics
+@exception_as_json
+@check_is_post
+@valid_token
+@check_json(Solicitacao.Operacao.SYNC_DOWN_NOTAS)
+def sync_down_grades_batch(request: HttpRequest) -> StreamingHttpResponse:
+    # Pedido inválido e erro ao criar as solicitações respondem JSON; daí em diante, uma linha NDJSON por diário.
+    lote = NotasEmLote(parse_pedido(request.json_recebido), request.build_absolute_uri("/")).prepara()
+    return StreamingHttpResponse(lote, content_type=CONTENT_TYPE)
+
+
+@trace_request
+@observe_metrics
+@json_response
+@exception_as_json
+@check_is_get
+@valid_token
+def diario_sync_state(request: HttpRequest) -> list:
+    diario_id = request.GET.get("diario_id")
+    if not diario_id:
+        raise SyncError("Informe o parâmetro 'diario_id'.", 400)
+
+    estados = DiarioSyncState.objects.filter(diario_id=diario_id).select_related("ambiente")
+    if request.GET.get("operacao"):
+        estados = estados.filter(operacao=request.GET["operacao"])
+    if request.GET.get("ambiente"):
+        estados = estados.filter(ambiente__nome=request.GET["ambiente"])
+    return [estado.as_dict() for estado in estados]
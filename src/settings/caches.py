@@ -14,3 +14,12 @@ CACHES = {
 
 DASHBOARD_CACHE_ENABLED = env_as_bool("DASHBOARD_CACHE_ENABLED", True)
 DASHBOARD_CACHE_TIMEOUT = env_as_int("DASHBOARD_CACHE_TIMEOUT", 300)
+DASHBOARD_CACHE_HARD_TIMEOUT = env_as_int("DASHBOARD_CACHE_HARD_TIMEOUT", 3600)
+DASHBOARD_CACHE_LOCK_TIMEOUT = env_as_int("DASHBOARD_CACHE_LOCK_TIMEOUT", 60)
+# Os percentis dos tempos por etapa varrem 24h de solicitações: são recalculados com menos frequência.
+DASHBOARD_TEMPOS_CACHE_TIMEOUT = env_as_int("DASHBOARD_TEMPOS_CACHE_TIMEOUT", 1800)
+
+MOODLE_PROBE_TTL = env_as_int("MOODLE_PROBE_TTL", 60)
+MOODLE_PROBE_CACHE_TIMEOUT = env_as_int("MOODLE_PROBE_CACHE_TIMEOUT", 3600)
+MOODLE_PROBE_TIMEOUT = env_as_int("MOODLE_PROBE_TIMEOUT", 3)
+MOODLE_PROBE_WORKERS = env_as_int("MOODLE_PROBE_WORKERS", 8)
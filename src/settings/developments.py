@@ -4,7 +4,7 @@ import logging
 import os
 import sys
 
-from sc4py.env import env_as_bool
+from sc4py.env import env, env_as_bool, env_from_json
 
 from .apps import INSTALLED_APPS
 from .middlewares import MIDDLEWARE
@@ -29,6 +29,16 @@ DEBUG_TOOLBAR_CONFIG = {
     "SHOW_COLLAPSED": True,
 }
 
+# Latência e falhas do Moodle mock em background, por serviço (veja integrador.moodle_mock.FaultInjector). Ex.:
+# {"*": {"latency": {"dist": "lognormal", "median_ms": 300}}, "sync_up_enrolments": {"error_rate": 0.02}}
+MOODLE_HTTP_MOCK_FAULTS = env_from_json("MOODLE_HTTP_MOCK_FAULTS", "{}")
+
+# Grava ("record") ou reproduz ("replay") as chamadas aos Moodles num cassete (veja integrador.cassette).
+MOODLE_HTTP_CASSETTE = env("MOODLE_HTTP_CASSETTE", None)
+MOODLE_HTTP_CASSETTE_MODE = env("MOODLE_HTTP_CASSETTE_MODE", "replay")
+MOODLE_HTTP_CASSETTE_TIMING = env("MOODLE_HTTP_CASSETTE_TIMING", "fast")
+MOODLE_HTTP_CASSETTE_SPEED = float(env("MOODLE_HTTP_CASSETTE_SPEED", "1"))
+
 extra_middleware = []
 extra_apps = []
 if DEVELOPMENT:
@@ -1,13 +1,27 @@
 # -*- coding: utf-8 -*-
+import logging
 import logging.config
 
-from sc4py.env import env
+from sc4py.env import env, env_as_int, env_as_list
+
+from base import logs
 
 from .apps import INSTALLED_APPS
-from .developments import TESTING
+from .developments import DEVELOPMENT, TESTING
 
 # Get loglevel from env
-LOGLEVEL = env("DJANGO_LOGLEVEL", "DEBUG").upper()
+LOGLEVEL = env("DJANGO_LOGLEVEL", "DEBUG" if DEVELOPMENT else "INFO").upper()
+# json (uma linha por registro, padrão) ou text (padrão em desenvolvimento)
+LOG_FORMAT = env("DJANGO_LOG_FORMAT", "text" if DEVELOPMENT else "json")
+# Mensagens e extras maiores que isso são truncados (ex.: payloads do SUAP e respostas do Moodle)
+LOG_MAX_CHARS = env_as_int("DJANGO_LOG_MAX_CHARS", 4096)
+# Registros que não couberem na fila são descartados, sem bloquear a requisição
+LOG_QUEUE_SIZE = env_as_int("DJANGO_LOG_QUEUE_SIZE", 10000)
+# Amostragem por logger dos registros abaixo de WARNING, em porcentual. Ex.: "integrador.brokers=10,dashboard=50"
+LOG_SAMPLING = {
+    nome.strip(): int(taxa) / 100.0
+    for nome, taxa in (item.split("=", 1) for item in env_as_list("DJANGO_LOG_SAMPLING", "") if "=" in item)
+}
 
 
 class Color:
@@ -28,16 +42,27 @@ logging.config.dictConfig(
         "disable_existing_loggers": False,
         "datefmt": "[%X]",
         "formatters": {
-            "longformat": {"format": "%(message)s"},
+            "text": {"()": "base.logs.TextFormatter", "max_chars": LOG_MAX_CHARS},
+            "json": {"()": "base.logs.JsonFormatter", "max_chars": LOG_MAX_CHARS},
+        },
+        "filters": {
+            "sampling": {"()": "base.logs.SamplingFilter", "taxas": LOG_SAMPLING},
         },
         "handlers": {
             "console": {
                 "class": "logging.StreamHandler",
-                "formatter": "longformat",
+                "formatter": LOG_FORMAT,
+            },
+            "queue": {
+                "class": "base.logs.AsyncQueueHandler",
+                "handlers": ["console"],
+                "queue": {"()": "queue.Queue", "maxsize": LOG_QUEUE_SIZE},
+                "filters": ["sampling"],
+                "respect_handler_level": True,
             },
         },
         "loggers": dict(
-            **{"": {"level": "INFO", "handlers": ["console"]}},
+            **{"": {"level": "INFO", "handlers": ["queue"]}},
             **{app: {"level": LOGLEVEL} for app in INSTALLED_APPS},
             **(
                 {
@@ -52,3 +77,5 @@ logging.config.dictConfig(
         ),
     }
 )
+
+logs.start(logging.getHandlerByName("queue"))
@@ -3,6 +3,7 @@ from sc4py.env import env_as_bool
 
 # Integrador
 MIDDLEWARE = [
+    "integrador.middleware.InternalHostMiddleware",  # Deve vir ANTES do CommonMiddleware
     "integrador.middleware.DisableCSRFForAPIMiddleware",  # Deve vir ANTES do CsrfViewMiddleware
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -15,4 +16,4 @@ MIDDLEWARE = [
 ]
 
 if not env_as_bool("DJANGO_DEBUG", True):
-    MIDDLEWARE.insert(4, "whitenoise.middleware.WhiteNoiseMiddleware")
+    MIDDLEWARE.insert(5, "whitenoise.middleware.WhiteNoiseMiddleware")
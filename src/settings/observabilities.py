@@ -5,8 +5,45 @@ from sc4py.env import env, env_as_bool, env_as_int
 from sentry_sdk.integrations.django import DjangoIntegration
 from sentry_sdk.integrations.redis import RedisIntegration
 
+from integrador import sampling
 from settings.project import PROJECT_VERSION
 
+# Endpoint /metrics (Prometheus). Com METRICS_TOKEN definido, a coleta deve enviar "Authorization: Bearer <token>";
+# sem ele, só responde à coleta direta no pod, e recusa (403) o que chega pelo ingress.
+METRICS_ENABLED = env_as_bool("METRICS_ENABLED", True)
+METRICS_TOKEN = env("METRICS_TOKEN", None)
+
+# Profiling sob demanda (integrador.profiling): header X-Integrador-Profile assinado, staff com ?profile=1 ou
+# "Reenviar com profile" no admin. O token do header (manage.py token_profiling) vale por PROFILING_TOKEN_MAX_AGE s.
+PROFILING_ENABLED = env_as_bool("PROFILING_ENABLED", True)
+PROFILING_TOKEN_MAX_AGE = env_as_int("PROFILING_TOKEN_MAX_AGE", 3600)
+
+# Rastreamento distribuído (OpenTelemetry), opcional: requer o opentelemetry-sdk e, para OTLP, o
+# opentelemetry-exporter-otlp-proto-http. OTEL_EXPORTER: otlp, console, file ou none. O endpoint OTLP é lido das
+# variáveis padrão OTEL_EXPORTER_OTLP_* (ex.: OTEL_EXPORTER_OTLP_ENDPOINT=http://collector:4318).
+OTEL_ENABLED = env_as_bool("OTEL_ENABLED", False)
+OTEL_SERVICE_NAME = env("OTEL_SERVICE_NAME", "integrador")
+OTEL_EXPORTER = env("OTEL_EXPORTER", "otlp")
+OTEL_EXPORTER_FILE = env("OTEL_EXPORTER_FILE", "/tmp/integrador-traces.jsonl")  # noqa: S108
+# Informe em porcentual, ou seja, 5 significa que 5% dos traces iniciados aqui serão gravados. Traces iniciados pelo
+# SUAP (header traceparent) seguem a decisão de amostragem de quem chamou.
+OTEL_TRACES_SAMPLE_RATE = env_as_int("OTEL_TRACES_SAMPLE_RATE", 5) / 100.0
+
+# Amostragem do Sentry (integrador.sampling). Informe em porcentual, ou seja, 10 significa 10%.
+# - SENTRY_TRACES_SAMPLE_RATE: requisições em geral (admin, dashboard...). Health checks e métricas nunca.
+# - SENTRY_SYNC_TRACES_SAMPLE_RATE: sincronizações rastreadas; só das rastreadas as com falha e as lentas vão.
+# - SENTRY_SYNC_HEALTHY_SAMPLE_RATE: sincronizações rápidas e bem-sucedidas enviadas, do total delas (no máximo a
+#   SENTRY_SYNC_TRACES_SAMPLE_RATE).
+# - SENTRY_SLOW_PERCENTILE: percentil do tempo total das últimas 24h, por Ambiente, a partir do qual uma
+#   sincronização é lenta; SENTRY_SLOW_DEFAULT_MS vale para Ambientes ainda sem histórico.
+SENTRY_TRACES_SAMPLE_RATE = env_as_int("SENTRY_TRACES_SAMPLE_RATE", 10) / 100.0
+SENTRY_SYNC_TRACES_SAMPLE_RATE = env_as_int("SENTRY_SYNC_TRACES_SAMPLE_RATE", 25) / 100.0
+SENTRY_SYNC_HEALTHY_SAMPLE_RATE = env_as_int("SENTRY_SYNC_HEALTHY_SAMPLE_RATE", 2) / 100.0
+SENTRY_SLOW_PERCENTILE = env_as_int("SENTRY_SLOW_PERCENTILE", 95)
+SENTRY_SLOW_DEFAULT_MS = env_as_int("SENTRY_SLOW_DEFAULT_MS", 5000)
+# Textos e estruturas maiores que isso (ex.: o recebido de uma solicitação) são truncados nos eventos e breadcrumbs.
+SENTRY_MAX_PAYLOAD_CHARS = env_as_int("SENTRY_MAX_PAYLOAD_CHARS", 2048)
+
 sentry_dsn = env("SENTRY_DSN", env("SENTRY_DNS", None))
 if sentry_dsn:
     sentry_sdk.init(
@@ -15,11 +52,10 @@ if sentry_dsn:
         default_integrations=env_as_bool("SENTRY_DEFAULT_INTEGRATIONS", True),
         # Informe em porcentual, ou seja, 50 significa que 100% de erros serão reportados.
         sample_rate=env_as_int("SENTRY_SAMPLE_RATE", 100) / 100.0,
-        # before_send=,
-        # before_breadcrumb=,
-        # Informe em porcentual, ou seja, 50 significa que 100% de erros serão reportados.
-        traces_sample_rate=env_as_int("SENTRY_TRACES_SAMPLE_RATE", 100) / 100.0,
-        # traces_sampler=
+        before_send=sampling.before_send,
+        before_send_transaction=sampling.before_send_transaction,
+        before_breadcrumb=sampling.before_breadcrumb,
+        traces_sampler=sampling.traces_sampler,
         # If you wish to associate users to errors (assuming you are using django.contrib.auth) you may enable sending
         # PII data.
         send_default_pii=env_as_bool("SENTRY_SEND_DEFAULT_PII", True),
@@ -27,7 +63,8 @@ if sentry_dsn:
         environment=env("SENTRY_ENVIRONMENT", "local"),
         max_breadcrumbs=env_as_int("SENTRY_MAX_BREADCRUMBS", 100),
         ignore_errors=[DisallowedHost],
-        profiles_sample_rate=env_as_int("SENTRY_PROFILES_SAMPLE_RATE", 100) / 100.0,
+        # Informe em porcentual das transações rastreadas.
+        profiles_sample_rate=env_as_int("SENTRY_PROFILES_SAMPLE_RATE", 1) / 100.0,
         release=env("SENTRY_RELEASE", PROJECT_VERSION),
         # attach_stacktrace=env('SENTRY_ATTACH_STACKTRACE', 'off'),
         # server_name=env('SENTRY_SERVER_NAME', 'off'),